@@ -45,6 +45,7 @@ except ImportError as err:
 
 Loader( 'vrml97', 'OpenGLContext.loaders.vrml97.defaultHandler', ['.wrl','.wrz','.vrml','model/vrml','x-world/x-vrml','.wrl.gz'] )
 Loader( 'obj', 'OpenGLContext.loaders.obj.defaultHandler', ['.obj'] )
+Loader( 'mmscene', 'OpenGLContext.loaders.mmscene.defaultHandler', ['.mmscene'] )
 
 Node( 'Anchor', 'vrml.vrml97.basenodes.Anchor' )
 Node( 'Appearance', 'OpenGLContext.scenegraph.appearance.Appearance' )
@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+"""Pre-warm the on-disk compiled-geometry cache for VRML97 files"""
+import optparse, sys, logging
+log = logging.getLogger( "geometrycache" )
+
+def main():
+    usage = """oglc-geometry-cache [options] myscene.wrl [other.wrl ...]
+
+    Loads each file and compiles every IndexedFaceSet into the
+    geometry cache (see OpenGLContext.geometrycache), so later
+    runs can skip tessellation and normal generation.
+    """
+    parser = optparse.OptionParser( usage=usage )
+    parser.add_option(
+        "-d", "--directory", action="store", type="string", dest="directory",
+        default=None, help="cache directory (default in user's app-data)",
+    )
+    parser.add_option(
+        "-m", "--max-bytes", action="store", type="int", dest="maxBytes",
+        default=None, help="maximum size of the cache in bytes",
+    )
+    parser.add_option(
+        "-c", "--clear", action="store_true", dest="clear", default=False,
+        help="remove all entries before warming",
+    )
+    options, filenames = parser.parse_args()
+    logging.basicConfig( level=logging.WARNING )
+    from OpenGLContext import geometrycache
+    from OpenGLContext.loaders.loader import Loader
+    cache = geometrycache.GeometryCache( options.directory, options.maxBytes )
+    if options.clear:
+        cache.clear()
+    if not filenames and not options.clear:
+        parser.print_usage()
+        return 1
+    for filename in filenames:
+        scene = Loader.load( filename )
+        if not scene:
+            log.error( "Unable to load %s", filename )
+            continue
+        meshes, stored = geometrycache.warm( scene, cache )
+        print( "%s: %s meshes, %s newly cached"%( filename, meshes, stored ))
+    print( "Cache %s: %s bytes, %s evictions"%(
+        cache.directory, cache.size(), cache.evictions,
+    ))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+"""Generate reduced LOD levels for heavy meshes of VRML97 files offline"""
+import optparse, sys, logging
+log = logging.getLogger( "simplify" )
+
+def main():
+    usage = """oglc-simplify [options] myscene.wrl [other.wrl ...]
+
+    Loads each file and generates reduced levels (see
+    OpenGLContext.scenegraph.simplify.autoLOD) for every heavy
+    IndexedFaceSet Shape which is not within an authored LOD,
+    storing them in the geometry cache (see OpenGLContext.geometrycache)
+    so that autoLOD at run-time loads rather than calculates them.
+    """
+    parser = optparse.OptionParser( usage=usage )
+    parser.add_option(
+        "-d", "--directory", action="store", type="string", dest="directory",
+        default=None, help="cache directory (default in user's app-data)",
+    )
+    parser.add_option(
+        "-m", "--max-bytes", action="store", type="int", dest="maxBytes",
+        default=None, help="maximum size of the cache in bytes",
+    )
+    parser.add_option(
+        "-t", "--triangles", action="store", type="int", dest="triangles",
+        default=None, help="minimum triangles for a mesh to be reduced",
+    )
+    parser.add_option(
+        "-r", "--ratios", action="store", type="string", dest="ratios",
+        default=None, help="comma-separated fractions of the triangles for each level",
+    )
+    options, filenames = parser.parse_args()
+    logging.basicConfig( level=logging.WARNING )
+    if not filenames:
+        parser.print_usage()
+        return 1
+    from OpenGLContext import geometrycache
+    from OpenGLContext.scenegraph import simplify
+    from OpenGLContext.loaders.loader import Loader
+    cache = geometrycache.GeometryCache( options.directory, options.maxBytes )
+    triangles = options.triangles
+    if triangles is None:
+        triangles = simplify.MIN_TRIANGLES
+    ratios = simplify.RATIOS
+    if options.ratios:
+        ratios = [float( ratio ) for ratio in options.ratios.split( ',' )]
+    for filename in filenames:
+        scene = Loader.load( filename )
+        if not scene:
+            log.error( "Unable to load %s", filename )
+            continue
+        stores = cache.stores
+        meshes = simplify.autoLOD( scene, triangles, ratios, cache=cache )
+        print( "%s: %s meshes reduced, %s levels newly cached"%(
+            filename, meshes, cache.stores - stores,
+        ))
+    print( "Cache %s: %s bytes, %s evictions"%(
+        cache.directory, cache.size(), cache.evictions,
+    ))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
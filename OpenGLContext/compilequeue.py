@@ -0,0 +1,173 @@
+"""Background (worker-thread) compilation of geometry
+
+Compiling large geometry (tessellation, normal generation, array
+packing) inside the render pass freezes the first view of a large
+world.  A CompileScheduler splits compilation into two stages:
+
+    prepare -- CPU-only work (NumPy/GLU tessellation etc.) which
+        runs on a worker thread and returns plain arrays
+    finish -- builds the renderer (array geometry, VBOs) from the
+        prepared arrays, always run on the context thread
+
+While a node is compiling its cache holder holds a PendingRender,
+which draws nothing.  Finished results are installed by the
+PendingRender on the context thread as it is rendered, limited to
+UPLOAD_BUDGET bytes per frame (at least one result is always
+finished per frame) so that a burst of finished compilations does
+not itself produce a frame-time spike.  Each finished worker
+triggers a redraw of the scheduler's contexts.
+
+Worker threads (rather than processes) are used because the
+prepare stage reads the (unpicklable) scenegraph nodes directly;
+the bulk of the work is in NumPy and GLU calls.
+"""
+import threading
+import logging
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+log = logging.getLogger( __name__ )
+
+def byteCount( value ):
+    """Estimate the bytes held in (nested containers of) arrays"""
+    if value is None:
+        return 0
+    nbytes = getattr( value, 'nbytes', None )
+    if nbytes is not None:
+        return nbytes
+    if isinstance( value, dict ):
+        value = value.values()
+    elif not isinstance( value, (list,tuple) ):
+        return 0
+    return sum([byteCount( item ) for item in value])
+
+class PendingRender( object ):
+    """Placeholder renderer cached while a node compiles in the background
+
+    holder -- the cache holder which will receive the renderer
+    future -- the worker's future, whose result is the prepared data
+    finish -- callable( prepared, current ) -> renderer, run on the
+        context thread, see CompileScheduler.submit
+    failed -- set if the worker raised an exception, in which case
+        we draw nothing until the node changes
+    """
+    failed = False
+    def __init__( self, scheduler, holder, future, finish ):
+        self.scheduler = scheduler
+        self.holder = holder
+        self.future = future
+        self.finish = finish
+    def ready( self ):
+        """Is the worker stage complete?"""
+        return self.future.done()
+    def current( self ):
+        """Is our holder still waiting for us (node unchanged since submit)?"""
+        return self.holder.data is self
+    def render( self, *args, **named ):
+        """Render the finished geometry if available, otherwise nothing"""
+        renderer = self.scheduler.complete( self )
+        if renderer is None:
+            return 0
+        return renderer.render( *args, **named )
+
+class CompileScheduler( object ):
+    """Runs the CPU stage of geometry compilation on a thread pool
+
+    WORKERS -- number of worker threads
+    UPLOAD_BUDGET -- bytes of prepared geometry to finish per frame
+
+    contexts -- weak references to the contexts to redraw when a
+        compilation is ready to be finished
+
+    Statistics:
+        submitted -- number of compilations submitted
+        completed -- number of compilations finished
+        frameBytes -- bytes finished in the current frame
+        frameUploads -- compilations finished in the current frame
+    """
+    WORKERS = 2
+    UPLOAD_BUDGET = 4*2**20
+    def __init__( self, contexts=(), workers=None ):
+        self.contexts = list( contexts )
+        if workers is not None:
+            self.WORKERS = workers
+        self.lock = threading.Lock()
+        self.executor = None
+        self.submitted = self.completed = 0
+        self.startFrame()
+    @property
+    def available( self ):
+        """Whether background compilation is possible"""
+        return futures is not None
+    def pool( self ):
+        """Get (creating if necessary) our worker pool"""
+        with self.lock:
+            if self.executor is None:
+                self.executor = futures.ThreadPoolExecutor( self.WORKERS )
+            return self.executor
+    def submit( self, holder, prepare, finish ):
+        """Start compiling in the background
+
+        holder -- cache holder for the node's renderer, receives the
+            PendingRender now and the finished renderer later
+        prepare -- callable() run on a worker thread, returns the
+            prepared (CPU-side) data
+        finish -- callable( prepared, current ) run on the context
+            thread, returns the renderer; current is False if the node
+            changed while compiling, in which case the renderer is not
+            installed and finish must not cache anything derived from
+            the (stale) prepared data either
+
+        returns the PendingRender
+        """
+        future = self.pool().submit( prepare )
+        pending = PendingRender( self, holder, future, finish )
+        holder.data = pending
+        self.submitted += 1
+        future.add_done_callback( self.onReady )
+        return pending
+    def onReady( self, future ):
+        """Worker finished, trigger a redraw so it will be finished"""
+        for reference in self.contexts:
+            context = reference()
+            if context is not None:
+                context.triggerRedraw( 1 )
+    def startFrame( self ):
+        """Reset the per-frame upload budget"""
+        self.frameBytes = 0
+        self.frameUploads = 0
+    def complete( self, pending ):
+        """Finish pending on the context thread if ready and within budget
+
+        returns the renderer or None if it isn't available yet
+        """
+        if pending.failed or not pending.ready():
+            return None
+        if self.frameUploads and self.frameBytes >= self.UPLOAD_BUDGET:
+            # over budget, finish it on a following frame
+            self.onReady( pending.future )
+            return None
+        try:
+            prepared = pending.future.result()
+            current = pending.current()
+            renderer = pending.finish( prepared, current )
+        except Exception as err:
+            log.error(
+                """Failure during background compilation for %s: %s""",
+                pending.holder.client(), err,
+            )
+            pending.failed = True
+            return None
+        self.frameBytes += byteCount( prepared )
+        self.frameUploads += 1
+        self.completed += 1
+        if current:
+            pending.holder.data = renderer
+        return renderer
+    def shutdown( self, wait=True ):
+        """Shut down our worker pool"""
+        with self.lock:
+            executor,self.executor = self.executor,None
+        if executor is not None:
+            executor.shutdown( wait )
@@ -133,6 +133,12 @@ class Context(object):
             rendering of scenegraphs.
             See setupCache
 
+        compileScheduler -- compilequeue.CompileScheduler instance
+            used to compile geometry on worker threads, or None
+            (the default) to compile during rendering, set up
+            if BACKGROUND_COMPILE is true.
+            See setupCache
+
         redrawRequest -- threading Event for triggering a request
 
         scenegraphLock -- threading Lock for blocking rendering
@@ -165,6 +171,8 @@ class Context(object):
     viewportDimensions = (0, 0)
     drawPollTimeout = 0.01
     coreProfile = False
+    BACKGROUND_COMPILE = False
+    compileScheduler = None
 
     ### Node-like attributes
     PROTO = "Context"
@@ -270,6 +278,12 @@ class Context(object):
         """
         self.textureCache = texturecache.TextureCache()
         self.cache = cache.Cache()
+        if self.BACKGROUND_COMPILE:
+            from OpenGLContext import compilequeue
+
+            self.compileScheduler = compilequeue.CompileScheduler(
+                contexts=[weakref.ref(self)],
+            )
 
     def setupExtensionManager(self):
         """Create an extension manager for this context"""
@@ -542,6 +556,8 @@ class Context(object):
             self.unlockScenegraph()
         self.setCurrent()
         self.drawing = 1
+        if self.compileScheduler is not None:
+            self.compileScheduler.startFrame()
         if threading:
             self.redrawRequest.clear()
         try:
@@ -32,6 +32,10 @@ class ContextDefinition( node.Node ):
     debugBBox = field.newField( "debugBBox", "SFBool", 1, False )
     debugSelection = field.newField( "debugSelection", "SFBool", 1, False )
     debug = field.newField( 'debug', 'SFBool', 1, False )
+    # 'sorted' (back-to-front) or 'weighted' (weighted blended
+    # order-independent transparency, see passes.oit, core-profile
+    # flat pass only, falls back to sorted if unsupported)
+    transparencyMode = field.newField( 'transparencyMode', 'SFString', 1, 'sorted' )
     
     # Currently profile is *only* supported by Pyside/PyQt
     profile = field.newField( "profile", "SFString", 1, "compatibility" )
@@ -14,6 +14,8 @@ class FrameCounter( node.Node ):
     totalTime = field.newField( 'totalTime', 'SFFloat', 1, 0.0)
     lastTime = field.newField( 'lastTime', 'SFFloat', 1, 0.0)
     display = field.newField( 'display', 'SFBool', 1, True)
+    renderSets = field.newField( 'renderSets', 'SFInt32', 1, 0)
+    renderSetReuses = field.newField( 'renderSetReuses', 'SFInt32', 1, 0)
     _font = None
     
     def font( self, context ):
@@ -35,6 +37,22 @@ class FrameCounter( node.Node ):
         self.__class__.totalTime.fset( self, self.totalTime + duration, notify=0)
         self.__class__.lastTime.fset( self, duration, notify=0)
         return duration
+    def addRenderSet( self, reused ):
+        """Record a frame's rendering set as reused or rebuilt
+
+        Like addFrame, does *not* send field changed events.
+        """
+        self.__class__.renderSets.fset( self, self.renderSets + 1, notify=0)
+        if reused:
+            self.__class__.renderSetReuses.fset(
+                self, self.renderSetReuses + 1, notify=0
+            )
+        return reused
+    def reuseRate( self ):
+        """Fraction of frames which reused the previous rendering set"""
+        if self.renderSets:
+            return float( self.renderSetReuses )/self.renderSets
+        return 0.0
     def summary( self ):
         """Give a summary of framerates
 
@@ -69,7 +87,9 @@ class FrameCounter( node.Node ):
                     count,avg,last = self.summary()
                     last *= 1000
                     self.font(context).render( 
-                        'fps avg:%0.1f\ncurr ms: %0.0f'%(avg,last)
+                        'fps avg:%0.1f\ncurr ms: %0.0f\nreuse: %0.0f%%'%(
+                            avg,last,self.reuseRate()*100,
+                        )
                     )
                 finally:
                     glEnable( GL_DEPTH_TEST )
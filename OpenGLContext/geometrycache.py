@@ -0,0 +1,217 @@
+"""Persistent on-disk cache of compiled IndexedFaceSet arrays
+
+Tessellating, generating normals for and welding a large world's
+IndexedFaceSets is repeated on every process start even though the
+world rarely changes.  GeometryCache stores the packed arrays
+produced by the ArrayGeometryCompiler (vertex, colour, normal,
+texture-coordinate and index arrays, plus the per-corner coordinate
+indices used for incremental updates) in a directory of .npy files,
+one sub-directory per mesh.
+
+Entries are content-addressed: the key is a hash of the node's
+index and value arrays, the flags which affect compilation (ccw,
+convex, creaseAngle, normalPerVertex, ...) and the compiler's
+configuration, so a changed node simply misses the cache.  Entries
+are loaded memory-mapped (read-only), so the arrays are handed to
+the VBO upload without an intermediate copy (and are replaced
+rather than updated in place if the node's points change).  The cache is bounded
+to maxBytes, least-recently-used entries being evicted.
+
+To use the cache for all IndexedFaceSets call install(), and see
+OpenGLContext.bin.geometrycache for pre-warming the cache for a
+VRML97 file.
+"""
+import os, shutil, tempfile, hashlib
+import logging
+from OpenGLContext.arrays import asarray, load, save
+log = logging.getLogger( __name__ )
+
+FORMAT_VERSION = 1
+
+def defaultDirectory( ):
+    """Default location for the cache, in the user's app-data directory"""
+    from OpenGLContext import context
+    return os.path.join( context.Context.getUserAppDataDirectory(), 'geometry' )
+
+def install( directory=None, maxBytes=None ):
+    """Create a GeometryCache and have IndexedFaceSets compile through it
+
+    returns the GeometryCache
+    """
+    from OpenGLContext.scenegraph import indexedfaceset
+    cache = GeometryCache( directory, maxBytes )
+    indexedfaceset.ArrayGeometryCompiler.GEOMETRY_CACHE = cache
+    return cache
+
+def indexedFaceSets( scene ):
+    """Yield each distinct IndexedFaceSet within scene (depth first)"""
+    from vrml import node, protofunctions
+    from OpenGLContext.scenegraph import indexedfaceset
+    seen = set()
+    stack = [scene]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add( id(current) )
+        if isinstance( current, indexedfaceset.IndexedFaceSet ):
+            yield current
+        for field in protofunctions.getFields( current ):
+            typeName = field.typeName()
+            if typeName == 'SFNode':
+                values = [field.fget( current )]
+            elif typeName == 'MFNode':
+                values = field.fget( current )
+            else:
+                continue
+            stack.extend([
+                value for value in reversed( values )
+                if isinstance( value, node.Node )
+            ])
+
+def warm( scene, cache ):
+    """Compile every IndexedFaceSet in scene into cache
+
+    returns (meshes, newly stored) counts
+    """
+    from OpenGLContext.scenegraph import indexedfaceset
+    meshes = 0
+    stores = cache.stores
+    for ifs in indexedFaceSets( scene ):
+        compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+        compiler.GEOMETRY_CACHE = cache
+        if len(ifs.coordIndex) and ifs.coord and len(ifs.coord.point):
+            compiler.prepare()
+            meshes += 1
+    return meshes, cache.stores - stores
+
+class GeometryCache( object ):
+    """Directory of memory-mappable compiled-geometry arrays
+
+    directory -- root directory of the cache
+    maxBytes -- size limit for the cache, exceeded by store, the
+        least-recently loaded/stored entries are removed
+
+    Statistics:
+        hits, misses, stores, evictions
+    """
+    MAX_BYTES = 512*2**20
+    def __init__( self, directory=None, maxBytes=None ):
+        if directory is None:
+            directory = defaultDirectory()
+        if maxBytes is not None:
+            self.MAX_BYTES = maxBytes
+        self.directory = directory
+        if not os.path.isdir( directory ):
+            os.makedirs( directory )
+        self.hits = self.misses = self.stores = self.evictions = 0
+
+    def key( self, *parts ):
+        """Calculate content-addressed key for parts
+
+        parts -- (name,value) pairs, arrays are hashed by dtype,
+            shape and content, other values by repr
+        """
+        digest = hashlib.sha1( ('v%s'%(FORMAT_VERSION,)).encode( 'ascii' ))
+        for name,value in parts:
+            digest.update( repr( name ).encode( 'utf-8' ))
+            if hasattr( value, 'tobytes' ):
+                digest.update( ('%s%s'%( value.dtype.str, value.shape )).encode( 'ascii' ))
+                digest.update( value.tobytes() )
+            else:
+                digest.update( repr( value ).encode( 'utf-8' ))
+        return digest.hexdigest()
+    def path( self, key ):
+        return os.path.join( self.directory, key )
+
+    def load( self, key ):
+        """Load the arrays stored under key (memory-mapped)
+
+        returns dictionary of name: array (absent arrays are None
+        only if stored as None) or None on a cache miss
+        """
+        path = self.path( key )
+        try:
+            names = os.listdir( path )
+        except OSError:
+            self.misses += 1
+            return None
+        result = {}
+        try:
+            for name in names:
+                if name.endswith( '.npy' ):
+                    # plain (read-only) ndarray view of the mapping, as
+                    # array handlers would copy the memmap sub-class
+                    result[name[:-4]] = asarray(
+                        load( os.path.join( path, name ), mmap_mode='r' )
+                    )
+                elif name.endswith( '.none' ):
+                    result[name[:-5]] = None
+            os.utime( path, None )
+        except (OSError,ValueError) as err:
+            log.warning( 'Discarding unreadable geometry cache entry %s: %s', key, err )
+            self.remove( key )
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+    def store( self, key, arrays ):
+        """Store dictionary of name: array (or None) under key
+
+        The entry is written to a temporary directory and renamed
+        into place, so readers never see partial entries.
+        """
+        if os.path.isdir( self.path( key )):
+            return
+        temporary = tempfile.mkdtemp( prefix='.store-', dir=self.directory )
+        try:
+            for name,value in arrays.items():
+                if value is None:
+                    open( os.path.join( temporary, name+'.none' ), 'w' ).close()
+                else:
+                    save( os.path.join( temporary, name+'.npy' ), asarray( value ))
+            os.rename( temporary, self.path( key ))
+        except OSError:
+            # another process stored it first (or the disk is full)
+            shutil.rmtree( temporary, ignore_errors=True )
+            return
+        self.stores += 1
+        self.evict()
+    def remove( self, key ):
+        shutil.rmtree( self.path( key ), ignore_errors=True )
+
+    def entries( self ):
+        """List (last-used time, bytes, key) for our entries"""
+        result = []
+        for key in os.listdir( self.directory ):
+            path = self.path( key )
+            if key.startswith( '.' ) or not os.path.isdir( path ):
+                continue
+            try:
+                size = sum([
+                    os.path.getsize( os.path.join( path, name ))
+                    for name in os.listdir( path )
+                ])
+                result.append( (os.path.getmtime( path ), size, key) )
+            except OSError:
+                continue
+        return result
+    def size( self ):
+        """Total bytes in the cache"""
+        return sum([size for (used,size,key) in self.entries()])
+    def evict( self, maxBytes=None ):
+        """Remove least-recently-used entries until within maxBytes"""
+        if maxBytes is None:
+            maxBytes = self.MAX_BYTES
+        entries = sorted( self.entries() )
+        total = sum([size for (used,size,key) in entries])
+        for used,size,key in entries:
+            if total <= maxBytes:
+                break
+            self.remove( key )
+            self.evictions += 1
+            total -= size
+        return total
+    def clear( self ):
+        """Remove every entry"""
+        return self.evict( 0 )
@@ -1,9 +1,14 @@
 """Load-manager for downloading multi-value URLs
 
 The Singleton "Loader" should be used for most interactions.
+
+The Singleton "Fetcher" (a FetchService) loads resources in the
+background for nodes (Inline, ImageTexture, shader URLs) using a
+bounded pool of worker threads.
 """
 
-import urllib, os
+import urllib, os, threading, heapq, itertools
+from concurrent import futures
 
 try:
     from urllib.request import pathname2url
@@ -14,14 +19,16 @@ try:
 except ImportError:
     from urllib.parse import urljoin as basejoin
 try:
-    from urllib import urlretrieve
-except ImportError as err:
-    from urllib.request import urlretrieve
+    from urllib2 import Request, urlopen, HTTPError
+except ImportError:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
 try:
     from cStringIO import StringIO
 except ImportError:
     from io import BytesIO as StringIO
 from OpenGL._bytes import bytes, unicode, as_8_bit
+from OpenGLContext.loaders.resourcecache import ResourceCache
 
 
 def as_unicode(u):
@@ -42,15 +49,20 @@ class _Loader(object):
     which follow VRML97 semantics (multiple-URL definitions,
     with chaining to the first successful URL).
 
-    The loader will attempt to use a local cache of files
-    to prevent multiple downloading.
+    The loader uses a local cache of files (a ResourceCache) to
+    prevent multiple downloading, and to keep small, frequently
+    loaded files in memory.
     """
 
-    def __init__(
-        self,
-    ):
-        """Initialize the Loader"""
-        self.cache = {}
+    def __init__(self, cache=None):
+        """Initialize the Loader
+
+        cache -- ResourceCache to use, default uses a cache in
+            the user's app-data directory
+        """
+        if cache is None:
+            cache = ResourceCache()
+        self.cache = cache
 
     def __call__(self, url, baseURL=None):
         """Load the given multi-value url and call callbacks
@@ -92,19 +104,12 @@ class _Loader(object):
         returns (baseURL, file, filename, headers)
         """
         headers = None
-        if url in self.cache:
-            filename = self.cache.get(url)
-            log.debug("cached: %s %s", url, filename)
-            try:
-                file = open(filename, "rb")
-            except (IOError, TypeError, ValueError):
-                pass
         try:
             log.debug("load: %s", url)
             filename = url
             baseURL = pathname2url(filename)
             if os.path.exists(url):
-                file = open(url, "rb")
+                file = self.cache.open(url)
             else:
                 raise ValueError(filename)
         except (IOError, TypeError, ValueError):
@@ -126,20 +131,37 @@ class _Loader(object):
                     log.debug("download: %s", url)
                     filename, headers = self.download(url)
                     log.debug("downloaded to: %s", filename)
-                    file = open(filename, "rb")
+                    file = self.cache.open(filename)
                     baseURL = url
                 except (IOError, TypeError, ValueError):
                     return (None, None, None, None)
-        self.cache[url] = filename
-        self.cache[baseURL] = filename
         return baseURL, file, filename, headers
 
     def download(self, url):
-        """Download the given url to local disk, return local filename"""
-        filename, headers = urlretrieve(
-            url,
-        )
-        return filename, headers
+        """Download the given url to local disk, return (local filename, headers)
+
+        Our cache's copy of the url is used if the server confirms
+        (by its ETag or Last-Modified validators) that it is current.
+        """
+        validators = self.cache.validators(url)
+        try:
+            response = urlopen(Request(url, headers=validators))
+        except HTTPError as err:
+            if err.code != 304 or not validators:
+                raise
+            filename = self.cache.revalidated(url)
+            if filename is None:
+                # our copy disappeared, request it unconditionally
+                response = urlopen(Request(url))
+            else:
+                log.debug("cached: %s %s", url, filename)
+                return filename, err.headers
+        try:
+            data = response.read()
+            headers = response.info()
+        finally:
+            response.close()
+        return self.cache.store(url, data, headers), headers
 
     loadedHandlers = {}
 
@@ -226,3 +248,245 @@ class _Loader(object):
 
 
 Loader = _Loader()
+
+
+PRIORITY_VISIBLE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
+
+
+def priority(level=PRIORITY_DEFAULT, distance=0.0):
+    """Create a fetch priority, lower values are fetched first
+
+    level -- one of the PRIORITY_* levels
+    distance -- distance from the viewer, orders fetches within
+        a level
+    """
+    return (level, distance)
+
+
+def redrawCallback(contexts):
+    """Create a done-callback triggering a redraw of contexts (weakrefs)"""
+
+    def redraw(request):
+        for reference in contexts:
+            context = reference()
+            if context is not None:
+                context.triggerRedraw(1)
+
+    return redraw
+
+
+class FetchRequest(futures.Future):
+    """Future for a (possibly shared) background fetch
+
+    key -- tuple of resolved URLs being fetched
+    priority -- current priority of the fetch (see priority)
+
+    result() is (resolvedURL, filename, data, headers) with data
+    the bytes of the first successfully loaded URL, or raises the
+    loading error (normally IOError).
+
+    The request is shared by all clients fetching the same URLs
+    while it is in flight, so cancelling it cancels it for all.
+    """
+
+    def __init__(self, key, priority):
+        super(FetchRequest, self).__init__()
+        self.key = key
+        self.priority = priority
+
+
+class FetchService(object):
+    """Loads resources in the background on a bounded worker pool
+
+    Requests for the same (resolved) URLs which are queued or
+    loading are shared, so a world using a texture thousands of
+    times downloads it once.  Queued requests are loaded in
+    priority order (see priority), so visible, nearby resources
+    can be loaded before the rest of the world.
+
+    WORKERS -- maximum number of worker threads
+    loader -- the _Loader used to load, default is the Loader
+        singleton
+
+    Statistics:
+        submitted -- number of fetches started
+        shared -- number of fetch calls which joined an existing
+            request
+        completed -- number of fetches finished (including failures)
+    """
+
+    WORKERS = 4
+
+    def __init__(self, loader=None, workers=None):
+        self.loader = loader
+        if workers is not None:
+            self.WORKERS = workers
+        self.lock = threading.Condition()
+        self.queue = []
+        self.pending = {}
+        self.threads = []
+        self.idle = 0
+        self.sequence = itertools.count()
+        self.stopped = False
+        self.submitted = self.shared = self.completed = 0
+
+    def key(self, url, baseURL=None):
+        """Get the tuple of resolved URLs for a multi-value url"""
+        url = as_unicode(url)
+        if isinstance(url, unicode):
+            url = [url]
+        else:
+            url = [as_unicode(u) for u in url]
+        if baseURL:
+            url = [basejoin(baseURL, u) for u in url]
+        return tuple(url)
+
+    def fetch(self, url, baseURL=None, priority=None, callback=None, contexts=()):
+        """Load url in the background
+
+        url -- vrml97-style url (multi-value string)
+        baseURL -- optional base url from which items in url will
+            be resolved
+        priority -- fetch priority (default PRIORITY_DEFAULT), if the
+            url is already queued with a lower priority it is raised to
+            this priority
+        callback -- optional callable( request ) called (on a worker
+            thread) when the fetch completes or fails
+        contexts -- weak references to contexts which are to redraw
+            (after callback) when the fetch completes
+
+        returns the FetchRequest
+        """
+        key = self.key(url, baseURL)
+        if priority is None:
+            priority = (PRIORITY_DEFAULT, 0.0)
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError("""Fetch service has been shut down""")
+            request = self.pending.get(key)
+            if request is not None and request.cancelled():
+                # cancelled, but not yet dropped by a worker
+                self.forget(request)
+                request = None
+            if request is None:
+                request = self.pending[key] = FetchRequest(key, priority)
+                self.submitted += 1
+                self.enqueue(request)
+                if len(self.queue) > self.idle and len(self.threads) < self.WORKERS:
+                    self.startWorker()
+                self.lock.notify()
+            else:
+                self.shared += 1
+                self.reprioritize(request, priority)
+        if callback is not None:
+            request.add_done_callback(callback)
+        if contexts:
+            request.add_done_callback(redrawCallback(contexts))
+        return request
+
+    def prioritize(self, request, priority):
+        """Raise the priority of request if it is still queued"""
+        with self.lock:
+            self.reprioritize(request, priority)
+
+    def reprioritize(self, request, priority):
+        """Raise a queued request's priority (lock held)"""
+        if priority < request.priority and self.pending.get(request.key) is request:
+            if not (request.running() or request.done()):
+                request.priority = priority
+                self.enqueue(request)
+                self.lock.notify()
+
+    def enqueue(self, request):
+        """Add request to our queue at its current priority (lock held)"""
+        heapq.heappush(
+            self.queue, (request.priority, next(self.sequence), request)
+        )
+
+    def startWorker(self):
+        """Start a new worker thread (lock held)"""
+        thread = threading.Thread(
+            name="Fetch worker %s" % (len(self.threads),), target=self.work
+        )
+        thread.daemon = True
+        self.threads.append(thread)
+        thread.start()
+
+    def claim(self):
+        """Wait for and claim the next queued request, None when stopped"""
+        with self.lock:
+            while True:
+                while not self.queue:
+                    if self.stopped:
+                        return None
+                    self.idle += 1
+                    try:
+                        self.lock.wait()
+                    finally:
+                        self.idle -= 1
+                priority, sequence, request = heapq.heappop(self.queue)
+                if request.cancelled():
+                    # cancelled while queued, later fetches load again
+                    self.forget(request)
+                    continue
+                if priority != request.priority or request.running() or request.done():
+                    # stale entry from a reprioritization
+                    continue
+                if request.set_running_or_notify_cancel():
+                    return request
+                self.forget(request)
+
+    def work(self):
+        """Worker thread, load queued requests until stopped"""
+        while True:
+            request = self.claim()
+            if request is None:
+                return
+            try:
+                result = self.load(request.key)
+            except Exception as err:
+                log.info("Unable to fetch %s: %s", request.key, err)
+                self.finish(request)
+                request.set_exception(err)
+            else:
+                self.finish(request)
+                request.set_result(result)
+
+    def finish(self, request):
+        """Stop sharing request, later fetches will load again"""
+        with self.lock:
+            self.forget(request)
+            self.completed += 1
+
+    def forget(self, request):
+        """Stop sharing request (lock held)"""
+        if self.pending.get(request.key) is request:
+            del self.pending[request.key]
+
+    def load(self, urls):
+        """Load the first available of urls (on a worker thread)
+
+        returns (resolvedURL, filename, data, headers)
+        """
+        loader = self.loader or Loader
+        resolvedURL, filename, file, headers = loader(list(urls))
+        try:
+            data = file.read()
+        finally:
+            file.close()
+        return resolvedURL, filename, data, headers
+
+    def shutdown(self, wait=True):
+        """Stop our worker threads once the queue is empty"""
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+            threads, self.threads = self.threads, []
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+Fetcher = FetchService()
@@ -0,0 +1,345 @@
+"""Memory-mapped binary scenegraph format
+
+A faster-starting alternative to gzpickle for pre-processed scenes.
+The file holds:
+
+    MAGIC (8 bytes)
+    header length (little-endian uint64)
+    header -- JSON node/field table (see below)
+    data section -- the large arrays, uncompressed, each aligned to
+        ALIGNMENT bytes
+
+The header describes each node as [class path, {field: value}] in
+post-order (a node's children precede it, so each node can be
+created once its field values are available).  Field values are
+encoded as JSON with tagged objects for:
+
+    {"n": index} -- reference to an earlier node (null index for NULL)
+    {"a": dtype, "s": shape, "v": values} -- small array
+    {"m": index} -- large array, header["arrays"][index] gives
+        [dtype, shape, offset into the data section]
+
+Loading parses only the header, the large arrays are numpy views of a
+copy-on-write np.memmap of the file, so their data is read by the
+operating system when first accessed rather than before the first
+frame.
+
+Only nodes whose classes can be imported by module and name can be
+stored (i.e. not instances of PROTOs declared in a VRML97 file).
+Values loaded at run-time from a node's url (see LOADED_FIELDS) are
+not stored, they are loaded again when the scene is.
+"""
+from OpenGLContext.arrays import asarray, dtype, frombuffer, memmap, ndarray, generic
+from OpenGLContext.loaders import base
+from vrml import field, node, protofunctions
+import json, struct, importlib, os
+import logging
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"OGLCMMS1"
+ALIGNMENT = 64
+# arrays of at least this many bytes are stored in the data section
+HEAVY_BYTES = 4096
+VERSION = 1
+
+filename_extensions = [".mmscene"]
+
+# {field: source field}, fields whose values are loaded (at run-time)
+# from their node's source field, not stored if the source is set
+LOADED_FIELDS = {
+    "image": "url",  # ImageTexture
+    "source": "url",  # GLSLShader
+}
+
+_FIELDS = {}
+
+
+def storageName(nodeField):
+    """Get the key under which nodeField stores its value in a node's __dict__
+
+    (SFNode/MFNode fields override the name attribute with their type name)
+    """
+    descriptor = field.BaseField.__dict__.get("name")
+    if hasattr(descriptor, "__get__"):
+        return descriptor.__get__(nodeField)
+    return nodeField.__dict__.get("name", nodeField.name)
+
+
+def nodeFields(cls):
+    """Get {storage name: (attribute name, field)} for cls's storable fields"""
+    current = _FIELDS.get(cls)
+    if current is None:
+        current = {}
+        for klass in reversed(cls.__mro__):
+            for key, value in klass.__dict__.items():
+                if isinstance(value, field.Field) and not isinstance(
+                    value, field.WeakField
+                ):
+                    current[storageName(value)] = (key, value)
+        _FIELDS[cls] = current
+    return current
+
+
+def classPath(cls):
+    """Get the importable "module:name" path for cls"""
+    path = "%s:%s" % (cls.__module__, cls.__name__)
+    try:
+        found = findClass(path)
+    except (ImportError, AttributeError):
+        found = None
+    if found is not cls:
+        raise ValueError(
+            """Cannot store node of prototype %s, its class is not importable"""
+            % (protofunctions.name(cls),)
+        )
+    return path
+
+
+def findClass(path):
+    """Import the class for a "module:name" path"""
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def align(offset):
+    """Round offset up to our ALIGNMENT"""
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class Writer(object):
+    """Collects a scenegraph's node/field table and large arrays"""
+
+    def __init__(self):
+        self.nodes = []
+        self.indices = {}
+        self.arrays = []
+        self.buffers = []
+        self.size = 0
+
+    def table(self, scene):
+        """Create the header dictionary for scene (and our arrays)"""
+        root = self.add(scene)
+        header = {
+            "version": VERSION,
+            "root": root,
+            "nodes": self.nodes,
+            "arrays": self.arrays,
+        }
+        defNames = getattr(scene, "defNames", None)
+        if defNames:
+            header["defNames"] = dict(
+                [
+                    (name, self.add(value))
+                    for name, value in defNames.items()
+                    if name and value is not None
+                ]
+            )
+        return header
+
+    def add(self, target):
+        """Add target (and the nodes it references), returns its index"""
+        index = self.indices.get(id(target))
+        if index is not None:
+            return index
+        cls = type(target)
+        values = {}
+        for name, (attribute, nodeField) in sorted(nodeFields(cls).items()):
+            source = LOADED_FIELDS.get(attribute)
+            if source is not None and getattr(target, source, None):
+                continue
+            if name in target.__dict__:
+                try:
+                    values[name] = self.encode(target.__dict__[name])
+                except ValueError as err:
+                    raise ValueError(
+                        """Unable to store %s.%s: %s""" % (target, name, err)
+                    )
+        index = self.indices[id(target)] = len(self.nodes)
+        self.nodes.append([classPath(cls), values])
+        return index
+
+    def encode(self, value):
+        """Encode a field value as JSON-compatible data"""
+        if isinstance(value, node.NullNode):
+            return {"n": None}
+        if isinstance(value, node.Node):
+            return {"n": self.add(value)}
+        if isinstance(value, ndarray):
+            if value.dtype.hasobject:
+                return [self.encode(item) for item in value.tolist()]
+            if value.nbytes >= HEAVY_BYTES:
+                return {"m": self.addArray(value)}
+            return {"a": value.dtype.str, "s": value.shape, "v": value.ravel().tolist()}
+        if isinstance(value, generic):
+            return value.item()
+        if isinstance(value, (list, tuple)):
+            return [self.encode(item) for item in value]
+        if value is None or isinstance(value, (str, bool, int, float)):
+            return value
+        raise ValueError("""Unsupported value type %s""" % (type(value).__name__,))
+
+    def addArray(self, value):
+        """Queue value for the data section, returns its index"""
+        value = asarray(value, order="C")
+        offset = align(self.size)
+        self.buffers.append((offset, value))
+        self.size = offset + value.nbytes
+        self.arrays.append([value.dtype.str, value.shape, offset])
+        return len(self.arrays) - 1
+
+    def write(self, scene, file):
+        """Write scene to the (binary) file"""
+        header = json.dumps(self.table(scene), separators=(",", ":")).encode("utf-8")
+        file.write(MAGIC)
+        file.write(struct.pack("<Q", len(header)))
+        file.write(header)
+        position = len(MAGIC) + 8 + len(header)
+        start = align(position)
+        for offset, value in self.buffers:
+            file.write(b"\0" * (start + offset - position))
+            file.write(value.tobytes())
+            position = start + offset + value.nbytes
+
+
+def dump(scene, file):
+    """Write scene to file (a filename or binary file object)"""
+    if isinstance(file, str):
+        with open(file, "wb") as handle:
+            return Writer().write(scene, handle)
+    return Writer().write(scene, file)
+
+
+def dumps(scene):
+    """Get scene as a bytes string"""
+    import io
+
+    file = io.BytesIO()
+    dump(scene, file)
+    return file.getvalue()
+
+
+def readHeader(file):
+    """Read the header from file, returns (header, data section offset)"""
+    magic = file.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("""Not a memory-mapped scene file (magic %r)""" % (magic,))
+    (length,) = struct.unpack("<Q", file.read(8))
+    header = json.loads(file.read(length).decode("utf-8"))
+    if header.get("version") != VERSION:
+        raise ValueError("""Unsupported scene version %r""" % (header.get("version"),))
+    return header, align(len(MAGIC) + 8 + length)
+
+
+class Reader(object):
+    """Builds the scenegraph from a header and its data section
+
+    data -- byte array (normally an np.memmap) holding the data section
+    """
+
+    def __init__(self, header, data):
+        self.header = header
+        self.data = data
+        self.nodes = []
+
+    def array(self, index):
+        """Get the (zero-copy) view of large array index"""
+        typeCode, shape, offset = self.header["arrays"][index]
+        typeCode = dtype(typeCode)
+        count = 1
+        for dimension in shape:
+            count *= dimension
+        view = self.data[offset : offset + count * typeCode.itemsize]
+        return view.view(typeCode).reshape(shape)
+
+    def decode(self, value):
+        """Decode a field value, large arrays are returned as-is"""
+        if isinstance(value, dict):
+            if "n" in value:
+                if value["n"] is None:
+                    return node.NULL
+                return self.nodes[value["n"]]
+            if "a" in value:
+                return asarray(value["v"], dtype(value["a"])).reshape(value["s"])
+            return self.array(value["m"])
+        if isinstance(value, list):
+            return [self.decode(item) for item in value]
+        return value
+
+    def build(self):
+        """Create the nodes, returns the root node"""
+        for path, values in self.header["nodes"]:
+            cls = findClass(path)
+            fields = nodeFields(cls)
+            named, heavy = {}, []
+            for name, value in values.items():
+                attribute, nodeField = fields[name]
+                if isinstance(value, dict) and "m" in value:
+                    heavy.append((name, self.array(value["m"])))
+                else:
+                    named[attribute] = self.decode(value)
+            target = cls(**named)
+            for name, value in heavy:
+                # bypass coercion, which could copy the mapped array
+                target.__dict__[name] = value
+            self.nodes.append(target)
+        root = self.nodes[self.header["root"]]
+        for name, index in self.header.get("defNames", {}).items():
+            root.defNames[name] = self.nodes[index]
+        return root
+
+
+def load(file):
+    """Load a scene from file (a filename or binary file object)
+
+    Files with a name on disk are memory-mapped, otherwise the
+    data is read into memory.
+    """
+    filename = file if isinstance(file, str) else getattr(file, "name", None)
+    if isinstance(file, str):
+        with open(file, "rb") as handle:
+            header, start = readHeader(handle)
+    else:
+        header, start = readHeader(file)
+    if isinstance(filename, str) and os.path.isfile(filename):
+        if os.path.getsize(filename) > start:
+            data = memmap(filename, dtype="B", mode="c", offset=start)
+        else:
+            data = frombuffer(b"", "B")
+    else:
+        file.seek(start)
+        data = frombuffer(bytearray(file.read()), "B")
+    return Reader(header, data).build()
+
+
+def loads(data):
+    """Load a scene from a bytes string"""
+    import io
+
+    return load(io.BytesIO(data))
+
+
+class MMSceneHandler(base.BaseHandler):
+    """Loader handler for memory-mapped scene files
+
+    Local files are mapped directly rather than read into memory.
+    """
+
+    filename_extensions = filename_extensions
+
+    def getData(self, baseURL, filename, file):
+        """Return the filename (to be mapped) if possible, otherwise the data"""
+        if filename and os.path.isfile(filename):
+            return filename
+        return file.read()
+
+    def parse(self, data, baseURL, *args, **named):
+        """Load the scene from data (a filename or bytes)"""
+        if isinstance(data, bytes):
+            return True, loads(data)
+        return True, load(data)
+
+
+def defaultHandler():
+    """Default handler instance used for loading memory-mapped scene files"""
+    return MMSceneHandler()
@@ -67,6 +67,28 @@ import logging
 log = logging.getLogger(__name__)
 from OpenGLContext.loaders import base, loader
 from OpenGLContext.scenegraph import basenodes
+from OpenGLContext.arrays import (
+    add,
+    arange,
+    array,
+    bincount,
+    concatenate,
+    cross,
+    cumsum,
+    flatnonzero,
+    frombuffer,
+    fromstring,
+    full,
+    newaxis,
+    ones,
+    repeat,
+    searchsorted,
+    sqrt,
+    stack,
+    unique,
+    zeros,
+)
+from OpenGL._bytes import as_8_bit
 import urllib
 
 try:
@@ -74,154 +96,472 @@ try:
 except ImportError as err:
     from md5 import md5
 
+# line classifications for bulk parsing
+OTHER, VERTEX, NORMAL, TEXCOORD, FACE, SKIP = range(6)
+# number of components kept for each vertex-data kind
+COMPONENTS = {VERTEX: 3, NORMAL: 3, TEXCOORD: 2}
+SPACE, TAB, NEWLINE, RETURN, HASH, SLASH = 32, 9, 10, 13, 35, 47
+
+
+def readChunks(source, size):
+    """Yield newline-terminated chunks of approximately size bytes
+
+    source -- bytes/str data or a (binary) file-like object
+    """
+    if hasattr(source, "read"):
+        read = source.read
+    else:
+        if not isinstance(source, bytes):
+            source = source.encode("utf-8")
+        source = memoryview(source)
+        position = [0]
+
+        def read(size):
+            result = source[position[0] : position[0] + size].tobytes()
+            position[0] += len(result)
+            return result
+
+    remainder = b""
+    while True:
+        block = read(size)
+        if isinstance(block, str):
+            block = block.encode("utf-8")
+        if not block:
+            break
+        block = remainder + block
+        cut = block.rfind(b"\n") + 1
+        if cut:
+            remainder = block[cut:]
+            yield block[:cut]
+        else:
+            remainder = block
+    if remainder:
+        yield remainder + b"\n"
+
+
+class OBJParser(object):
+    """Incremental (chunked) parser building the scenegraph for an OBJ file
+
+    Each chunk's lines are classified in bulk (numpy operations on
+    the raw bytes), consecutive runs of v, vn, vt and f lines are then
+    converted with a single fromstring call per run.  Any other lines
+    (and runs which do not have a uniform layout, e.g. mixed f index
+    forms) are handled line-by-line.
+
+    Vertex data is kept as a list of float32 blocks and face indices
+    as int32 blocks until the end of the parse (or the end of their
+    shape) to avoid large Python lists.
+    """
+
+    def __init__(self, handler, baseURL):
+        self.handler = handler
+        self.baseURL = baseURL
+        self.sg = basenodes.sceneGraph()
+        # these three are shared among all shapes
+        hash = md5(as_8_bit(baseURL or "")).hexdigest()
+        self.coord = basenodes.Coordinate(DEF="Coord-%s" % (hash,))
+        self.normal = basenodes.Normal(DEF="Norm-%s" % (hash,))
+        self.texCoord = basenodes.TextureCoordinate(DEF="TexCoord-%s" % (hash,))
+        self.mesh = None  # transforms
+        self.group = None  # shape
+        self.material = None  # appearance, material, texture
+        self.materials = {}
+        # indices are 1-based, the first values are never used...
+        self.data = {
+            VERTEX: [zeros((1, 3), "f")],
+            NORMAL: [zeros((1, 3), "f")],
+            TEXCOORD: [zeros((1, 2), "f")],
+        }
+        self.counts = {VERTEX: 0, NORMAL: 0, TEXCOORD: 0}
+        self.indices = []
+        self.slices = []
+
+    def feed(self, chunk):
+        """Parse a chunk of complete (newline-terminated) lines"""
+        size = len(chunk)
+        buf = zeros(size + 2, "B")
+        buf[:size] = frombuffer(chunk, "B")
+        buf[size:] = NEWLINE
+        ends = flatnonzero(buf[:size] == NEWLINE)
+        starts = concatenate(([0], ends[:-1] + 1))
+        first, second, third = buf[starts], buf[starts + 1], buf[starts + 2]
+        spaced = (second == SPACE) | (second == TAB)
+        thirdSpaced = (third == SPACE) | (third == TAB)
+        kinds = full(len(starts), OTHER, "B")
+        kinds[(first == ord("v")) & spaced] = VERTEX
+        kinds[(first == ord("v")) & (second == ord("n")) & thirdSpaced] = NORMAL
+        kinds[(first == ord("v")) & (second == ord("t")) & thirdSpaced] = TEXCOORD
+        kinds[(first == ord("f")) & spaced] = FACE
+        kinds[
+            (first == HASH)
+            | (first == NEWLINE)
+            | ((first == RETURN) & (second == NEWLINE))
+        ] = SKIP
+        # blank out comments so runs can span them
+        skipped = flatnonzero(kinds == SKIP)
+        if len(skipped):
+            lengths = ends[skipped] - starts[skipped]
+            offsets = starts[skipped] - (cumsum(lengths) - lengths)
+            buf[repeat(offsets, lengths) + arange(lengths.sum())] = SPACE
+        # and the line prefixes, leaving only the values
+        prefixed = (kinds == VERTEX) | (kinds == FACE)
+        buf[starts[prefixed]] = SPACE
+        prefixed = (kinds == NORMAL) | (kinds == TEXCOORD)
+        buf[starts[prefixed]] = SPACE
+        buf[starts[prefixed] + 1] = SPACE
+        # whitespace-separated tokens per line
+        space = buf <= SPACE
+        tokenStarts = ~space
+        tokenStarts[1:] &= space[:-1]
+        positions = flatnonzero(tokenStarts)
+        tokens = searchsorted(positions, ends) - searchsorted(positions, starts)
+
+        lines = flatnonzero(kinds != SKIP)
+        if not len(lines):
+            return
+        lineKinds = kinds[lines]
+        breaks = flatnonzero(lineKinds[1:] != lineKinds[:-1]) + 1
+        for low, high in zip(
+            concatenate(([0], breaks)), concatenate((breaks, [len(lines)]))
+        ):
+            run = lines[low:high]
+            kind = lineKinds[low]
+            handled = False
+            if kind == FACE:
+                handled = self.faceRun(buf, starts, ends, run, tokens, positions)
+            elif kind != OTHER:
+                handled = self.dataRun(kind, buf, starts, ends, run, tokens)
+            if not handled:
+                for line in run:
+                    self.line(chunk[starts[line] : ends[line]])
+
+    def dataRun(self, kind, buf, starts, ends, run, tokens):
+        """Convert a run of v/vn/vt lines in one operation
+
+        returns False if the run must be parsed line-by-line
+        """
+        count = tokens[run[0]]
+        if count < COMPONENTS[kind] or (tokens[run] != count).any():
+            return False
+        region = buf[starts[run[0]] : ends[run[-1]] + 1].tobytes()
+        values = fromstring(region, dtype="f", sep=" ")
+        if len(values) != count * len(run):
+            return False
+        values = values.reshape((-1, count))[:, : COMPONENTS[kind]]
+        self.data[kind].append(values)
+        self.counts[kind] += len(values)
+        return True
+
+    def faceRun(self, buf, starts, ends, run, tokens, positions):
+        """Convert a run of f lines in one operation
+
+        All of the run's face vertices must have the same form
+        (v, v/t, v/t/n or v//n).
+
+        returns False if the run must be parsed line-by-line
+        """
+        begin, end = starts[run[0]], ends[run[-1]] + 1
+        first, last = searchsorted(positions, (begin, end))
+        region = buf[begin:end].copy()
+        slashed = region == SLASH
+        if last > first:
+            # slashes (and double slashes) in each of the run's tokens
+            offsets = positions[first:last] - begin
+            slashes = bincount(
+                searchsorted(offsets, flatnonzero(slashed), "right") - 1,
+                minlength=last - first,
+            )
+            doubles = bincount(
+                searchsorted(offsets, flatnonzero(slashed[:-1] & slashed[1:]), "right") - 1,
+                minlength=last - first,
+            )
+            slash, double = slashes[0], doubles[0]
+            if (slashes != slash).any() or (doubles != double).any():
+                return False
+            if slash > 2 or double > (slash == 2):
+                return False
+        else:
+            slash = double = 0
+        region[slashed] = SPACE
+        values = fromstring(region.tobytes(), dtype="i", sep=" ")
+        width = slash + 1 - double
+        if len(values) != width * (last - first):
+            return False
+        values = values.reshape((-1, width))
+        empty = zeros(len(values), "i")
+        columns = [values[:, i] for i in range(width)]
+        if double:
+            columns = [columns[0], empty, columns[1]]
+        columns = (columns + [empty, empty])[:3]
+        self.ensureGroup()
+        counts = tokens[run]
+        separators = cumsum(counts + 1) - 1
+        keep = ones(separators[-1] + 1, bool)
+        keep[separators] = False
+        result = []
+        for column, kind in zip(columns, (VERTEX, TEXCOORD, NORMAL)):
+            column = self.resolve(kind, column)
+            indices = full(len(keep), -1, "i")
+            indices[keep] = column
+            result.append(indices)
+        self.indices.append(result)
+        return True
+
+    def resolve(self, kind, indices):
+        """Convert negative (relative) indices to absolute indices"""
+        negative = indices < 0
+        if negative.any():
+            indices = indices.copy()
+            indices[negative] += self.counts[kind] + 1
+        return indices
+
+    def line(self, line):
+        """Parse a single line (not handled by the bulk operations)"""
+        values = line.decode("utf-8", "replace").split()
+        if not values or values[0].startswith("#"):
+            return
+        if values[0] in ("v", "vn", "vt"):
+            kind = {"v": VERTEX, "vn": NORMAL, "vt": TEXCOORD}[values[0]]
+            components = COMPONENTS[kind]
+            point = [float(x) for x in values[1 : components + 1]]
+            point = (point + [0.0] * components)[:components]
+            self.data[kind].append(array([point], "f"))
+            self.counts[kind] += 1
+        elif values[0] == "mtllib":
+            self.handler.load_material_library(values[1], self.materials, self.baseURL)
+        elif values[0] in ("usemtl", "usemat"):
+            material = self.materials.get(values[1], None)
+            if material is None:
+                log.warning("Unknown material: %s", values[1])
+                material = self.handler.defaultMaterial()
+            self.material = material
+            if self.mesh is not None:
+                self.flush()
+                self.group = self.newShape()
+        elif values[0] == "o":
+            self.flush()
+            self.mesh = basenodes.Transform(DEF=values[1])
+            self.sg.children.append(self.mesh)
+            self.sg.regDefName(values[1], self.mesh)
+            # previous shape is no longer current...
+            self.group = None
+        elif values[0] == "s":
+            # a smoothing-group definition...
+            # not currently supported...
+            pass
+        elif values[0] == "f":
+            # adds a single face
+            self.ensureGroup()
+            face = [self.handler._cleanIndex(v) for v in values[1:]]
+            face = array(face, "i").reshape((-1, 3))
+            result = []
+            for column, kind in zip(face.T, (VERTEX, TEXCOORD, NORMAL)):
+                result.append(concatenate((self.resolve(kind, column), [-1])).astype("i"))
+            self.indices.append(result)
+        else:
+            log.warning("""Unrecognized operation: %r""", values)
+
+    def newShape(self):
+        """Create a new shape (in the current mesh) for the current material"""
+        if self.handler.INDEXED_POLYGONS:
+            geometry = basenodes.IndexedPolygons(
+                coord=self.coord,
+                polygonSides=3,
+                solid=False,
+            )
+        else:
+            geometry = basenodes.IndexedFaceSet(
+                coord=self.coord,
+                normal=self.normal,
+                texCoord=self.texCoord,
+                solid=False,
+            )
+        group = basenodes.Shape(
+            geometry=geometry,
+            appearance=self.material,
+        )
+        self.mesh.children.append(group)
+        return group
+
+    def ensureGroup(self):
+        """Make sure there is a current shape to which to add faces"""
+        if self.mesh is None:
+            # anonymous transform
+            self.mesh = basenodes.Transform()
+            self.sg.children.append(self.mesh)
+        if self.material is None:
+            self.material = self.handler.defaultMaterial()
+        if self.group is None:
+            self.group = self.newShape()
+
+    def flush(self):
+        """Store the accumulated face indices in the current shape"""
+        if self.group and self.indices:
+            coordIndex, texCoordIndex, normalIndex = [
+                concatenate(column) for column in zip(*self.indices)
+            ]
+            if self.handler.INDEXED_POLYGONS:
+                # de-indexed once all of the vertex data is available
+                self.slices.append(
+                    (self.group.geometry, (coordIndex, texCoordIndex, normalIndex))
+                )
+                self.indices = []
+                return
+            self.group.geometry.coordIndex = coordIndex
+            self.group.geometry.texCoordIndex = texCoordIndex
+            self.group.geometry.normalIndex = normalIndex
+        self.indices = []
+
+    def finish(self):
+        """Complete the parse, returns the scenegraph"""
+        self.flush()
+        if self.handler.INDEXED_POLYGONS:
+            self.buildPolygons()
+            return self.sg
+        self.coord.point = concatenate(self.data[VERTEX])
+        self.normal.normal = concatenate(self.data[NORMAL])
+        self.texCoord.texCoord = concatenate(self.data[TEXCOORD])
+        return self.sg
+
+    def buildPolygons(self):
+        """De-index the shapes' faces into IndexedPolygons slices
+
+        Each distinct (vertex, texture, normal) index triple of a
+        shape becomes a single vertex.  The shapes' vertices are
+        stored consecutively in the shared coord, normal and
+        texCoord nodes (so that all of the shapes share one buffer
+        for each attribute) and each shape's index refers to its own
+        range of those vertices.  Normals are generated (smooth,
+        per-vertex) if the file has none.
+        """
+        points = concatenate(self.data[VERTEX])
+        normals = concatenate(self.data[NORMAL])
+        texCoords = concatenate(self.data[TEXCOORD])
+        sizes = [len(points), len(texCoords), len(normals)]
+        vertices = []
+        offset = 0
+        for geometry, columns in self.slices:
+            corners = triangleCorners(*columns)
+            unique, inverse = uniqueCorners(corners, sizes)
+            geometry.index = (inverse + offset).astype("I")
+            vertices.append(unique)
+            offset += len(unique)
+        if vertices:
+            vertices = concatenate(vertices)
+        else:
+            vertices = zeros((0, 3), "i")
+        self.coord.point = points[vertices[:, 0]]
+        if self.counts[NORMAL]:
+            self.normal.vector = normals[vertices[:, 2]]
+        else:
+            self.normal.vector = vertexNormals(
+                self.coord.point,
+                [geometry.index for geometry, columns in self.slices],
+            )
+        if self.counts[TEXCOORD]:
+            self.texCoord.point = texCoords[vertices[:, 1]]
+        for geometry, columns in self.slices:
+            geometry.normal = self.normal
+            if self.counts[TEXCOORD]:
+                geometry.texCoord = self.texCoord
+
+
+def triangleCorners(coordIndex, texCoordIndex, normalIndex):
+    """Fan-triangulate -1 terminated faces into (N*3,3) index triples
+
+    Faces with fewer than 3 vertices are dropped.
+    """
+    separators = flatnonzero(coordIndex < 0)
+    starts = concatenate(([0], separators[:-1] + 1))
+    counts = separators - starts
+    valid = counts >= 3
+    starts, fans = starts[valid], counts[valid] - 2
+    first = repeat(starts, fans)
+    step = arange(fans.sum()) - repeat(cumsum(fans) - fans, fans) + 1
+    triangles = stack((first, first + step, first + step + 1), axis=-1).ravel()
+    return stack(
+        (coordIndex[triangles], texCoordIndex[triangles], normalIndex[triangles]),
+        axis=-1,
+    )
+
+
+def uniqueCorners(corners, sizes):
+    """Find the distinct index triples of corners
+
+    sizes -- number of vertex, texture and normal values (the
+        triples are packed into single integers when they fit)
+
+    returns (unique triples, index of each corner's triple)
+    """
+    if not len(corners):
+        return corners, zeros((0,), "I")
+    if float(sizes[0]) * sizes[1] * sizes[2] < 2**62:
+        key = (corners[:, 0].astype("q") * sizes[1] + corners[:, 1]) * sizes[
+            2
+        ] + corners[:, 2]
+        keys, first, inverse = unique(key, return_index=True, return_inverse=True)
+        return corners[first], inverse
+    return unique(corners, axis=0, return_inverse=True)
+
+
+def vertexNormals(points, indices):
+    """Generate smooth per-vertex normals for triangle index arrays"""
+    normals = zeros((len(points), 3), "f")
+    for index in indices:
+        if not len(index):
+            continue
+        triangles = points[index.reshape((-1, 3))]
+        faces = cross(
+            triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+        )
+        for i in range(3):
+            add.at(normals, index[i::3], faces)
+    lengths = sqrt((normals * normals).sum(-1))
+    lengths[lengths == 0] = 1.0
+    return normals / lengths[:, newaxis]
+
 
 class OBJHandler(base.BaseHandler):
-    """Scenegraph loader which loads individual OBJ files as scenegraphs"""
+    """Scenegraph loader which loads individual OBJ files as scenegraphs
+
+    CHUNK_SIZE -- bytes parsed at a time, the file is read (and parsed)
+        in chunks rather than being loaded into memory all at once
+    INDEXED_POLYGONS -- whether to create an IndexedPolygons node for
+        each material slice rather than an IndexedFaceSet, avoiding
+        IndexedFaceSet tessellation and giving each slice its own
+        (tight) bounding volume
+    """
 
     filename_extensions = [".obj", ".obj.gz"]
+    CHUNK_SIZE = 16 * 1024 * 1024
+    # if True create (triangulated, de-indexed) IndexedPolygons
+    # rather than IndexedFaceSets, see OBJParser.buildPolygons
+    INDEXED_POLYGONS = False
 
     def defaultMaterial(self):
         return basenodes.Appearance(
             material=basenodes.Material(diffuseColor=[0.9, 0.9, 0.9]),
         )
 
+    def getData(self, baseURL, filename, file):
+        """Return the (possibly gunzipped) file, parse reads it in chunks"""
+        if self.isGzip(file):
+            log.debug("gunzip: %s", filename)
+            file = self.gunzip(file)
+        return file
+
     def parse(self, data, baseURL, *args, **named):
         """Parse the loaded data (with the provided meta-information)
 
+        data -- bytes/str data or a file-like object from which to read
+
         This implementation simply creates VRML97 scenegraph nodes out
-        of the .obj format data.
+        of the .obj format data (see OBJParser).
         """
-        sg = basenodes.sceneGraph()
-
-        # these three are shared among all shapes
-        hash = md5(baseURL).hexdigest()
-        coord = basenodes.Coordinate(DEF="Coord-%s" % (hash,))
-        normal = basenodes.Normal(DEF="Norm-%s" % (hash,))
-        texCoord = basenodes.TextureCoordinate(DEF="TexCoord-%s" % (hash,))
-
-        mesh = None  # transforms
-        group = None  # shape
-        material = None  # appearance, material, texture
-
-        materials = {}
-
-        # indices are 1-based, the first values are never used...
-        vertices = [[0.0, 0.0, 0.0]]
-        normals = [[0.0, 0.0, 0.0]]
-        tex_coords = [[0.0, 0.0]]
-
-        current_vertex_indices = []
-        current_normal_indices = []
-        current_texcoord_indices = []
-
-        for line in data.splitlines():
-            if line.startswith("#"):
-                continue
-            values = line.split()
-            if not values:
-                continue
-
-            if values[0] == "v":
-                vertices.append([float(x) for x in values[1:4]])
-            elif values[0] == "vn":
-                normals.append([float(x) for x in values[1:4]])
-            elif values[0] == "vt":
-                tex_coords.append([float(x) for x in values[1:3]])
-            elif values[0] == "mtllib":
-                self.load_material_library(values[1], materials, baseURL)
-            elif values[0] in ("usemtl", "usemat"):
-                material = materials.get(values[1], None)
-                if material is None:
-                    log.warning("Unknown material: %s", values[1])
-                    material = self.defaultMaterial()
-                if mesh is not None:
-                    if group and current_vertex_indices:
-                        group.geometry.coordIndex = current_vertex_indices
-                        group.geometry.texCoordIndex = current_texcoord_indices
-                        group.geometry.normalIndex = current_normal_indices
-                        current_vertex_indices = []
-                        current_texcoord_indices = []
-                        current_normal_indices = []
-                    group = basenodes.Shape(
-                        geometry=basenodes.IndexedFaceSet(
-                            coord=coord,
-                            normal=normal,
-                            texCoord=texCoord,
-                            solid=False,
-                        ),
-                        appearance=material,
-                    )
-                    mesh.children.append(group)
-            elif values[0] == "o":
-                mesh = basenodes.Transform(DEF=values[1])
-                sg.children.append(mesh)
-                sg.regDefName(values[1], mesh)
-                # previous shape is no longer current...
-                group = None
-            elif values[0] == "s":
-                # a smoothing-group definition...
-                # not currently supported...
-                pass
-            elif values[0] == "f":
-                # adds a single face
-                if mesh is None:
-                    # anonymous transform
-                    mesh = basenodes.Transform()
-                    sg.children.append(mesh)
-                if material is None:
-                    material = self.defaultMaterial()
-                if group is None:
-                    group = basenodes.Shape(
-                        geometry=basenodes.IndexedFaceSet(
-                            coord=coord,
-                            normal=normal,
-                            texCoord=texCoord,
-                            solid=False,
-                        ),
-                        appearance=material,
-                    )
-                    mesh.children.append(group)
-
-                for i, v in enumerate(values[1:]):
-                    v_index, t_index, n_index = self._cleanIndex(v)
-                    current_vertex_indices.append(v_index)
-                    current_texcoord_indices.append(t_index)
-                    current_normal_indices.append(n_index)
-                current_vertex_indices.append(-1)
-                current_texcoord_indices.append(-1)
-                current_normal_indices.append(-1)
-            else:
-                log.warning("""Unrecognized operation: %r""", values)
-        if group and current_vertex_indices:
-            group.geometry.coordIndex = current_vertex_indices
-            group.geometry.texCoordIndex = current_texcoord_indices
-            group.geometry.normalIndex = current_normal_indices
-        coord.point = vertices
-        normal.normal = normals
-        texCoord.texCoord = tex_coords
-        return True, sg
-
-        # this creates a pointset-only version of the geometry...
-
-    # sg.children = [
-    # basenodes.Transform(
-    # children = [
-    # basenodes.Shape(
-    # geometry = basenodes.PointSet(
-    # coord=coord,
-    # color = [1,1,1]*len(coord.point)
-    # ),
-    # appearance = basenodes.Appearance(
-    # material = basenodes.Material(
-    # diffuseColor = [1,0,0],
-    # ),
-    # )
-    # ),
-    # ],
-    # ),
-    # basenodes.PointLight( location = [0,0,10 ] ),
-    # basenodes.Background( skyColor=[1,1,1] ),
-    # ]
+        parser = OBJParser(self, baseURL)
+        for chunk in readChunks(data, self.CHUNK_SIZE):
+            parser.feed(chunk)
+        return True, parser.finish()
 
     def _cleanIndex(self, v):
         """Indices are in the format:
@@ -246,9 +586,15 @@ class OBJHandler(base.BaseHandler):
                         url,
                     )
                     return False
+            else:
+                log.warning("""Unable to load material library: %s""", url)
+                return False
 
         material = None
-        for line in file.read().splitlines():
+        data = file.read()
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "replace")
+        for line in data.splitlines():
             if line.startswith("#"):
                 continue
             values = line.split()
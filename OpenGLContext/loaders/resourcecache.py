@@ -0,0 +1,332 @@
+"""Persistent cache of downloaded resources for the Loader
+
+Downloaded resources are stored in a cache directory by content
+(the SHA-1 of their data), so URLs serving the same data share a
+single copy:
+
+    objects/<digest[:2]>/<digest> -- the resource data
+    index.json -- {url: entry} where entry holds the digest and
+        size of the data, the server's ETag and Last-Modified
+        validators and the time of last use
+
+A cached resource is only used once the server has confirmed it
+(a 304 response to a request with If-None-Match/If-Modified-Since
+from validators), so resources without validators are always
+downloaded again.  When the stored data exceeds MAX_BYTES the
+least-recently used objects are removed.
+
+Changes to the index (access times of revalidated resources, newly
+stored resources) are written to disk in batches, every
+SAVE_UPDATES changes or SAVE_INTERVAL seconds, and at exit (see
+flush), rather than rewriting the whole index for every download.
+
+Small files (cached objects and local files alike) are also held
+in memory (see open), validated by their modification time and
+size, so that hot resources such as shader sources are not read
+from disk again.
+"""
+from OpenGLContext.browser import homedirectory
+from io import BytesIO
+import atexit, hashlib, json, os, threading, time, tempfile
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def defaultDirectory():
+    """Get the default cache directory (in the user's app-data directory)"""
+    return os.path.join(homedirectory.appdatadirectory(), "OpenGLContext", "resources")
+
+
+class ResourceCache(object):
+    """Content-addressed on-disk cache with an in-memory tier
+
+    directory -- cache directory, created when first needed,
+        default is defaultDirectory()
+    MAX_BYTES -- cap on the bytes of stored objects
+    MEMORY_BYTES -- cap on the bytes held in memory
+    MEMORY_ITEM_BYTES -- largest file held in memory
+    SAVE_UPDATES -- number of index changes which triggers a save
+    SAVE_INTERVAL -- seconds after which a changed index is saved
+        on the next change
+
+    Statistics:
+        hits -- downloads answered from the cache (validated)
+        misses -- downloads which had to transfer the data
+        memoryHits -- opens answered from memory
+        memoryMisses -- opens which read the file
+        evictions -- objects removed to respect MAX_BYTES
+    """
+
+    MAX_BYTES = 512 * 2 ** 20
+    MEMORY_BYTES = 16 * 2 ** 20
+    MEMORY_ITEM_BYTES = 256 * 2 ** 10
+    SAVE_UPDATES = 64
+    SAVE_INTERVAL = 30.0
+    INDEX = "index.json"
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.index = None
+        # index changes not yet written to disk
+        self.dirty = 0
+        self.saved = time.time()
+        # filename: (mtime, size, data), in least-recently used order
+        self.memory = {}
+        self.memoryUsed = 0
+        self.clock = 0.0
+        self.hits = self.misses = self.evictions = 0
+        self.memoryHits = self.memoryMisses = 0
+
+    def stats(self):
+        """Get our statistics as a dictionary"""
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            memoryHits=self.memoryHits,
+            memoryMisses=self.memoryMisses,
+            evictions=self.evictions,
+            objects=len(self.objects()),
+            bytes=self.storedBytes(),
+            memoryBytes=self.memoryUsed,
+        )
+
+    def now(self):
+        """Get the current time for access records (strictly increasing)"""
+        self.clock = max(time.time(), self.clock + 1e-6)
+        return self.clock
+
+    def path(self, *names):
+        """Get the path of names within our cache directory"""
+        if self.directory is None:
+            self.directory = defaultDirectory()
+        return os.path.join(self.directory, *names)
+
+    def objectPath(self, digest):
+        """Get the filename storing the object with digest"""
+        return self.path("objects", digest[:2], digest)
+
+    def entries(self):
+        """Get our url: entry index, loading it if necessary"""
+        if self.index is None:
+            self.index = {}
+            filename = self.path(self.INDEX)
+            if os.path.isfile(filename):
+                try:
+                    with open(filename) as handle:
+                        self.index = json.load(handle)
+                except (IOError, ValueError) as err:
+                    log.warning(
+                        "Unable to read resource cache index %r: %s", filename, err
+                    )
+        return self.index
+
+    def save(self):
+        """Write our index to disk (atomically)"""
+        directory = self.path()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(handle, "w") as file:
+            json.dump(self.entries(), file)
+        os.replace(filename, self.path(self.INDEX))
+        self.dirty = 0
+        self.saved = time.time()
+
+    def changed(self):
+        """Record a change to our index, saving it once enough accumulate"""
+        with self.lock:
+            if not self.dirty:
+                _unsaved.add(self)
+            self.dirty += 1
+            if (
+                self.dirty >= self.SAVE_UPDATES
+                or time.time() - self.saved >= self.SAVE_INTERVAL
+            ):
+                self.flush()
+
+    def flush(self):
+        """Write our index to disk if it has unsaved changes"""
+        with self.lock:
+            if self.dirty:
+                self.save()
+            _unsaved.discard(self)
+
+    def lookup(self, url):
+        """Get the index entry for url if its object is still available"""
+        with self.lock:
+            entry = self.entries().get(url)
+            if entry is not None and not os.path.isfile(
+                self.objectPath(entry["digest"])
+            ):
+                del self.index[url]
+                self.changed()
+                return None
+            return entry
+
+    def validators(self, url):
+        """Get the request headers validating our copy of url (if any)"""
+        entry = self.lookup(url)
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("lastModified"):
+                headers["If-Modified-Since"] = entry["lastModified"]
+        return headers
+
+    def revalidated(self, url):
+        """Server confirmed our copy of url is current, returns its filename
+
+        returns None if we no longer have the copy
+        """
+        with self.lock:
+            entry = self.lookup(url)
+            if entry is None:
+                return None
+            self.hits += 1
+            entry["accessed"] = self.now()
+            self.changed()
+            return self.objectPath(entry["digest"])
+
+    def store(self, url, data, headers=None):
+        """Store data downloaded from url, returns the stored filename
+
+        headers -- the response headers, from which the ETag and
+            Last-Modified validators are recorded
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        filename = self.objectPath(digest)
+        with self.lock:
+            self.misses += 1
+            if not os.path.isfile(filename):
+                directory = os.path.dirname(filename)
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                handle, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                with os.fdopen(handle, "wb") as file:
+                    file.write(data)
+                os.replace(temporary, filename)
+            headers = headers or {}
+            self.entries()[url] = {
+                "digest": digest,
+                "size": len(data),
+                "etag": headers.get("ETag"),
+                "lastModified": headers.get("Last-Modified"),
+                "accessed": self.now(),
+            }
+            self.evict(keep=digest)
+            self.changed()
+        return filename
+
+    def objects(self):
+        """Get {digest: (last access, size)} for our indexed objects"""
+        objects = {}
+        with self.lock:
+            for entry in self.entries().values():
+                accessed, size = objects.get(entry["digest"], (0, entry["size"]))
+                objects[entry["digest"]] = (max(accessed, entry["accessed"]), size)
+        return objects
+
+    def storedBytes(self):
+        """Get the total size of our indexed objects"""
+        return sum([size for accessed, size in self.objects().values()])
+
+    def evict(self, keep=None):
+        """Remove least-recently used objects until we fit in MAX_BYTES
+
+        keep -- digest of an object never to remove (the newest)
+        """
+        with self.lock:
+            objects = self.objects()
+            total = sum([size for accessed, size in objects.values()])
+            if total <= self.MAX_BYTES:
+                return
+            removed = set()
+            for digest, (accessed, size) in sorted(
+                objects.items(), key=lambda item: item[1][0]
+            ):
+                if total <= self.MAX_BYTES:
+                    break
+                if digest == keep:
+                    continue
+                filename = self.objectPath(digest)
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                self.forget(filename)
+                removed.add(digest)
+                total -= size
+                self.evictions += 1
+            for url, entry in list(self.index.items()):
+                if entry["digest"] in removed:
+                    del self.index[url]
+
+    def open(self, filename):
+        """Open filename for reading, from memory if possible
+
+        Files of up to MEMORY_ITEM_BYTES are kept in memory (up to
+        MEMORY_BYTES in total, least-recently used are dropped) and
+        returned as BytesIO instances while their modification time
+        and size are unchanged.
+        """
+        stat = os.stat(filename)
+        with self.lock:
+            current = self.memory.pop(filename, None)
+            if current is not None:
+                if current[:2] == (stat.st_mtime, stat.st_size):
+                    self.memory[filename] = current
+                    self.memoryHits += 1
+                    return BytesIO(current[2])
+                self.memoryUsed -= len(current[2])
+            self.memoryMisses += 1
+        if stat.st_size > self.MEMORY_ITEM_BYTES:
+            return open(filename, "rb")
+        with open(filename, "rb") as file:
+            data = file.read()
+        with self.lock:
+            self.forget(filename)
+            self.memory[filename] = (stat.st_mtime, stat.st_size, data)
+            self.memoryUsed += len(data)
+            while self.memoryUsed > self.MEMORY_BYTES:
+                oldest = next(iter(self.memory))
+                self.forget(oldest)
+        return BytesIO(data)
+
+    def forget(self, filename):
+        """Drop filename from our memory tier"""
+        with self.lock:
+            current = self.memory.pop(filename, None)
+            if current is not None:
+                self.memoryUsed -= len(current[2])
+
+    def clear(self):
+        """Remove all stored objects and our index"""
+        with self.lock:
+            for digest in self.objects():
+                try:
+                    os.remove(self.objectPath(digest))
+                except OSError:
+                    pass
+            self.index = {}
+            self.memory = {}
+            self.memoryUsed = 0
+            if os.path.isdir(self.path()):
+                self.save()
+            self.dirty = 0
+            _unsaved.discard(self)
+
+
+# caches with unsaved index changes, flushed at exit
+_unsaved = set()
+
+
+@atexit.register
+def _flushAll():
+    for cache in list(_unsaved):
+        try:
+            cache.flush()
+        except (IOError, OSError) as err:
+            log.warning("Unable to save resource cache index: %s", err)
@@ -0,0 +1,42 @@
+"""Convert a VRML97 file to a memory-mapped scene (mmscene) file"""
+
+usage = """vrml2mmscene.py sourcefile destfile
+
+Loads the sourcefile as VRML97 and writes the
+result to destfile as a memory-mapped scene file
+(see OpenGLContext.loaders.mmscene).
+"""
+
+
+def main(arguments=None):
+    import sys
+
+    if arguments is None:
+        arguments = sys.argv[1:]
+    try:
+        source, destination = arguments
+    except ValueError:
+        print(usage)
+        print("Got arguments", arguments)
+        return 1
+    from OpenGLContext.loaders import mmscene
+    from OpenGLContext.loaders.loader import Loader
+
+    print("loading from", source)
+    sg = Loader.load(source)
+    if not sg:
+        print(
+            """Loaded a NULL scenegraph %s from %s, not writing target"""
+            % (sg, source)
+        )
+        return 1
+    print("Loaded", sg)
+    print("Saving to", destination)
+    mmscene.dump(sg, destination)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(main())
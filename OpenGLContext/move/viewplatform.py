@@ -46,8 +46,32 @@ class ViewPlatform(object):
 
         quaternion -- quaternion representing the current
             view-orientation for the viewing platform
+
+        generation -- counter incremented whenever position,
+            quaternion or frustum is set, allowing renderers
+            to detect an unchanged view
     """
 
+    generation = 0
+
+    def _viewProperty(name):
+        """Create a property which increments generation when set"""
+        attribute = "_" + name
+
+        def get(self):
+            return getattr(self, attribute)
+
+        def set(self, value):
+            setattr(self, attribute, value)
+            self.generation += 1
+
+        return property(get, set)
+
+    position = _viewProperty("position")
+    quaternion = _viewProperty("quaternion")
+    frustum = _viewProperty("frustum")
+    del _viewProperty
+
     def __init__(
         self,
         position=(0, 0, 10),
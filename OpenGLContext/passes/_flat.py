@@ -1,14 +1,18 @@
 """Flat rendering passes (base implementation)
 """
-from OpenGLContext.scenegraph import nodepath,switch,boundingvolume
+from OpenGLContext.scenegraph import nodepath,switch,lod,boundingvolume,polygonsort
+from OpenGLContext.passes import aabbtree, renderqueue, softocclusion, instancing
 from OpenGL.GL import *
-from OpenGLContext.arrays import array, dot, allclose
+from OpenGLContext.arrays import array, asarray, dot, matmul, allclose
 from OpenGLContext import frustum
 from OpenGLContext.debug.logs import getTraceback
 from vrml.vrml97 import nodetypes
-from vrml import olist
+from vrml import olist, protofunctions
+from vrml.node import Node
 from OpenGLContext.scenegraph import shaders
-import sys
+from OpenGLContext.loaders import loader
+import sys, weakref
+from math import sqrt
 from pydispatch.dispatcher import connect
 import logging 
 log = logging.getLogger( __name__ )
@@ -29,8 +33,15 @@ class SGObserver( object ):
     Uses dispatcher watches to observe any changes to the (rendering)
     structure of a scenegraph and uses it to update an internal set
     of paths for all renderable objects in the scenegraph.
+
+    generation -- counter incremented whenever the observed scene
+        changes in a way which could alter the rendering set, i.e.
+        structural changes, world-matrix changes (see
+        nodepath.WORLD_MATRIX_CHANGE_SIGNAL) and bounding-volume
+        changes (see boundingvolume.BOUNDING_VOLUME_CHANGE_SIGNAL)
     """
     INTERESTING_TYPES = []
+    generation = 0
     def __init__( self, scene, contexts ):
         """Initialize the FlatPass for this scene and set of contexts
 
@@ -57,8 +68,20 @@ class SGObserver( object ):
             self.onSwitchChange,
             signal = switch.SWITCH_CHANGE_SIGNAL,
         )
+        connect(
+            self.onSceneChange,
+            signal = nodepath.WORLD_MATRIX_CHANGE_SIGNAL,
+        )
+        connect(
+            self.onSceneChange,
+            signal = boundingvolume.BOUNDING_VOLUME_CHANGE_SIGNAL,
+        )
+    def onSceneChange( self, *args, **named ):
+        """Something affecting the rendering set changed"""
+        self.generation += 1
     def integrate( self, node, parentPath=None ):
         """Integrate any children of node which are of interest"""
+        self.generation += 1
         if parentPath is None:
             parentPath = nodepath.NodePath( [] )
         todo = [ (node,parentPath) ]
@@ -76,10 +99,18 @@ class SGObserver( object ):
             for typ in self.INTERESTING_TYPES:
                 if isinstance( next, typ ):
                     self.paths.setdefault( typ, []).append( path )
+                    self.pathAdded( typ, path )
             if hasattr(next, 'renderedChildren'):
                 # watch for next's changes...
-                for child in next.renderedChildren( ):
+                for child in self.renderedChildren( next, path ):
                     todo.append( (child,path) )
+    def renderedChildren( self, node, path ):
+        """Get the rendered children of node at path (hook)"""
+        return node.renderedChildren()
+    def pathAdded( self, typ, path ):
+        """Path of interesting type typ has been integrated (hook)"""
+    def pathRemoved( self, typ, path ):
+        """Path of interesting type typ has been purged (hook)"""
     def npFor( self, node ):
         """For some reason setdefault isn't working for the weakkeydict"""
         current = self.nodePaths.get( id(node) )
@@ -87,11 +118,13 @@ class SGObserver( object ):
             self.nodePaths[id(node)] = current = []
         return current
     def onSwitchChange( self, sender, value ):
+        """Sender (a Switch) now renders value (or nothing)"""
         for path in self.npFor( sender ):
             for childPath in path.iterchildren():
                 if childPath[-1] is not value:
                     childPath.invalidate()
-            self.integrate( value, path )
+            if value is not None:
+                self.integrate( value, path )
         self.purge()
     def onChildAdd( self, sender, value ):
         """Sender has a new child named value"""
@@ -112,12 +145,14 @@ class SGObserver( object ):
                 self.purge()
     def purge( self ):
         """Purge all references to path"""
+        self.generation += 1
         for key,values in self.paths.items():
             filtered = []
             for v in values:
                 if not v.broken:
                     filtered.append( v )
                 else:
+                    self.pathRemoved( key, v )
                     np = self.npFor( v )
                     while v in np:
                         np.remove( v )
@@ -163,6 +198,9 @@ class FlatPass( SGObserver ):
         viewport -- 4-component viewport definition for current context
         frustum -- viewing-frustum definition for current view platform
         MAX_LIGHTS -- queried maximum number of lights
+        sortTransparent -- whether transparent paths and their
+            polygons are sorted back-to-front (False when an
+            order-independent transparency mode is active)
 
 
         passCount -- not used, always set to 0 for code that expects
@@ -172,6 +210,7 @@ class FlatPass( SGObserver ):
     passCount = 0
     visible = True
     transparent = False
+    sortTransparent = True
     transform = True
     lighting = True
     lightingAmbient = True
@@ -237,6 +276,7 @@ class FlatPass( SGObserver ):
         nodetypes.Fog,
         nodetypes.Viewpoint,
         nodetypes.NavigationInfo,
+        lod.LOD,
     ]
     def currentBackground( self ):
         """Find our current background node"""
@@ -250,42 +290,403 @@ class FlatPass( SGObserver ):
             return current
         return None
 
+    USE_CULLING_TREE = True
+    _cullingTree = None
+    def cullingTree( self ):
+        """Retrieve our AABBTree of rendering paths
+
+        The tree is created on first access (populated from our
+        current rendering paths) and is afterward kept up to date
+        by pathAdded/pathRemoved.
+        """
+        if self._cullingTree is None:
+            self._cullingTree = aabbtree.AABBTree()
+            for path in self.paths.get( nodetypes.Rendering, ()):
+                self._cullingTree.add( path )
+        return self._cullingTree
+    def pathAdded( self, typ, path ):
+        """Track new rendering paths in the culling tree"""
+        if typ is nodetypes.Rendering:
+            self.watchRenderState( path[-1] )
+            if self._cullingTree is not None:
+                self._cullingTree.add( path )
+    def pathRemoved( self, typ, path ):
+        """Stop tracking purged rendering paths in the culling tree"""
+        if typ is nodetypes.Rendering and self._cullingTree is not None:
+            self._cullingTree.remove( path )
+        elif typ is lod.LOD and self._lodLevels is not None:
+            self._lodLevels.pop( id(path), None )
+
+    RENDER_STATE_FIELDS = (
+        'appearance','material','texture','transparency',
+        'objects','textures','image','url',
+    )
+    _renderStateWatched = None
+    def watchRenderState( self, node, force=False ):
+        """Increment generation when node's sort-key state changes
+
+        Watches the RENDER_STATE_FIELDS (appearance, material,
+        transparency, textures...) of node and of the nodes they
+        reference, as these determine the sort keys (and so the
+        ordering) of the rendering set.  Nodes are only watched
+        once unless force is true.
+        """
+        if self._renderStateWatched is None:
+            self._renderStateWatched = {}
+        watched = self._renderStateWatched
+        todo = [(node,force)]
+        while todo:
+            node,force = todo.pop()
+            current = watched.get( id(node) )
+            if current is not None and current() is node and not force:
+                continue
+            watched[id(node)] = weakref.ref( node )
+            for name in self.RENDER_STATE_FIELDS:
+                try:
+                    field = protofunctions.getField( node, name )
+                except AttributeError:
+                    continue
+                for signal in ('set','del','route'):
+                    connect(
+                        self.onRenderStateChange,
+                        signal = (signal,field),
+                        sender = node,
+                    )
+                value = getattr( node, name, None )
+                if not isinstance( value, (list,tuple) ):
+                    value = [value]
+                for child in value:
+                    if isinstance( child, Node ):
+                        todo.append( (child,False) )
+    def onRenderStateChange( self, signal=None, sender=None ):
+        """Sort-key state of sender changed"""
+        self.generation += 1
+        self.watchRenderState( sender, force=True )
+
+    USE_LOD_SELECTION = True
+    _levelKey = None
+    _lodLevels = None
+    def pathLevel( self, path ):
+        """Get the index of the level active for the LOD at path
+
+        Levels are kept per path (by id, dropped in pathRemoved) so
+        that a DEF/USE'd LOD seen at several distances keeps a stable
+        level (and hysteresis) for each use.  Paths not yet selected
+        use the LOD's activeLevel.
+        """
+        if self._lodLevels is None:
+            self._lodLevels = {}
+        current = self._lodLevels.get( id(path) )
+        if current is None or current[0] is not path:
+            return path[-1].activeLevel
+        return current[1]
+    def renderedChildren( self, node, path ):
+        """Get the rendered children of node at path, LODs by path level"""
+        if isinstance( node, lod.LOD ):
+            return node.levelChildren( self.pathLevel( path ))
+        return node.renderedChildren()
+    def selectLevels( self ):
+        """Select the active level of each LOD path for the current viewer
+
+        The viewer's position is transformed into the coordinate
+        space of each LOD path and the LOD's levelIndex chooses the
+        path's level, level changes replace the path's child paths
+        (incrementing generation).  Selection is skipped when neither
+        the view nor the scene has changed since the last selection.
+        """
+        if not self.USE_LOD_SELECTION:
+            return
+        paths = self.paths.get( lod.LOD )
+        if not paths:
+            return
+        vp = self.viewPlatform
+        key = (self.generation, id(vp), getattr( vp, 'generation', None ))
+        if key == self._levelKey:
+            return
+        position = asarray( list( vp.position[:3] ) + [1.0], 'd' )
+        changed = False
+        # level changes purge our paths, so iterate over a copy
+        for path in list( paths ):
+            if path.broken:
+                continue
+            node = path[-1]
+            local = dot( position, path.transformMatrix( inverse=True ))
+            delta = [a-b for (a,b) in zip( local[:3], node.center )]
+            current = self.pathLevel( path )
+            index = node.levelIndex( sqrt( sum([d*d for d in delta]) ), current )
+            if index is None:
+                continue
+            self._lodLevels[id(path)] = (path,index)
+            if index != current:
+                children = node.levelChildren( index )
+                for childPath in path.iterchildren():
+                    if childPath[-1] not in children:
+                        childPath.invalidate()
+                for child in children:
+                    self.integrate( child, path )
+                changed = True
+        if changed:
+            self.purge()
+        self._levelKey = (self.generation, id(vp), getattr( vp, 'generation', None ))
+
+    renderSetBuilds = 0
+    renderSetReuses = 0
+    USE_RENDER_SET_REUSE = True
+    _renderSetCache = None
+    def renderSetKey( self ):
+        """Key identifying the scene and view state of a rendering set"""
+        vp = self.viewPlatform
+        return (
+            self.generation,
+            id(vp), getattr( vp, 'generation', None ),
+            tuple( self.viewport ),
+            self.sortTransparent,
+        )
+    def frameRenderSet( self, matrix ):
+        """Get (toRender, maxDepth) for the current frame
+
+        If USE_RENDER_SET_REUSE is True and neither the scene
+        (see generation) nor the view (see renderSetKey) have
+        changed since the last frame, the previous frame's sorted
+        rendering set is reused rather than rebuilt.  The
+        renderSetBuilds/renderSetReuses counters (and the context's
+        frameCounter, if any) report the reuse rate.
+
+        LOD levels are selected (see selectLevels) before the
+        key is calculated, as level changes alter the scene.
+
+        Rebuilt rendering sets promote their pending fetches (see
+        prioritizeFetches).
+        """
+        self.selectLevels()
+        key = self.renderSetKey()
+        cached = self._renderSetCache
+        reused = bool(
+            self.USE_RENDER_SET_REUSE and cached is not None and cached[0] == key
+        )
+        if reused:
+            self.renderSetReuses += 1
+            toRender,maxDepth = cached[1:]
+        else:
+            self.renderSetBuilds += 1
+            toRender = self.renderSet( matrix )
+            maxDepth = self.greatestDepth( toRender )
+            self._renderSetCache = (key,toRender,maxDepth)
+            self.prioritizeFetches( toRender )
+        context = getattr( self, 'context', None )
+        frameCounter = getattr( context, 'frameCounter', None )
+        if frameCounter:
+            frameCounter.addRenderSet( reused )
+        return toRender,maxDepth
+
+    def prioritizeFetches( self, toRender, fetcher=None ):
+        """Fetch the visible shapes' textures first, nearest first
+
+        Raises the loader.Fetcher priority of the pending texture
+        fetches (see ImageTexture.loadBackground) of the shapes in
+        toRender to PRIORITY_VISIBLE, ordered by their distance
+        from the viewer.
+        """
+        fetcher = fetcher or loader.Fetcher
+        if not fetcher.pending:
+            return
+        for key,mvmatrix,tmatrix,bvolume,path in toRender:
+            appearance = getattr( path[-1], 'appearance', None )
+            texture = getattr( appearance, 'texture', None )
+            request = getattr( texture, 'fetchRequest', None )
+            if request is not None and not request.done():
+                distance = float( dot( mvmatrix[3][:3], mvmatrix[3][:3] )) ** .5
+                fetcher.prioritize(
+                    request, loader.priority( loader.PRIORITY_VISIBLE, distance ),
+                )
+
+    USE_SOFTWARE_OCCLUSION = False
+    _softwareOcclusion = None
+    @property
+    def softwareOcclusion( self ):
+        """SoftwareOcclusion culler used by occlusionFilter"""
+        if self._softwareOcclusion is None:
+            self._softwareOcclusion = softocclusion.SoftwareOcclusion()
+        return self._softwareOcclusion
+    def occlusionFilter( self, toRender ):
+        """Remove records hidden by large near occluders
+
+        If USE_SOFTWARE_OCCLUSION is True, runs our (CPU-only)
+        softwareOcclusion culler over toRender, otherwise returns
+        toRender unchanged.
+        """
+        if not self.USE_SOFTWARE_OCCLUSION:
+            return toRender
+        return self.softwareOcclusion.filter(
+            toRender, self.projection, self.viewport
+        )
+
     def renderSet( self, matrix ):
-        """Calculate ordered rendering set to display"""
+        """Calculate ordered rendering set to display
+
+        If USE_CULLING_TREE is True, our cullingTree is used to
+        find the (potentially) visible paths, so that only those
+        paths have render records created, otherwise every
+        rendering path is frustum-tested.
+        """
+        if self.USE_CULLING_TREE:
+            candidates = self.cullingTree().cull( self )
+        else:
+            candidates = [
+                (path,None,False)
+                for path in self.paths.get( nodetypes.Rendering, ())
+            ]
+        if not candidates:
+            return []
+        paths = [candidate[0] for candidate in candidates]
+        tmatrices = [path.transformMatrix() for path in paths]
+        if self.USE_BATCH_SORT_KEYS:
+            mvmatrices = matmul( asarray( tmatrices ), matrix )
+        else:
+            mvmatrices = [dot(tmatrix,matrix) for tmatrix in tmatrices]
+        sortKeys = self.sortKeys( paths, tmatrices )
         # ordered set of things to work with...
         toRender = []
-        for path in self.paths.get( nodetypes.Rendering, ()):
-            tmatrix = path.transformMatrix()
-            mvmatrix = dot(tmatrix,matrix)
-            sortKey = path[-1].sortKey( self, tmatrix )
-            if hasattr( path[-1], 'boundingVolume' ):
+        untested = []
+        for (path,bvolume,tested),tmatrix,mvmatrix,sortKey in zip(
+            candidates, tmatrices, mvmatrices, sortKeys
+        ):
+            if bvolume is None and hasattr( path[-1], 'boundingVolume' ):
                 bvolume = path[-1].boundingVolume( self )
-            else:
-                bvolume = None
-            toRender.append( (sortKey, mvmatrix,tmatrix,bvolume, path ) )
-        toRender = self.frustumVisibilityFilter( toRender )
+            record = (sortKey, mvmatrix,tmatrix,bvolume, path )
+            toRender.append( record )
+            if not tested:
+                untested.append( record )
+        if untested:
+            culled = set([id(record) for record in untested])
+            for record in self.frustumVisibilityFilter( untested ):
+                culled.discard( id(record) )
+            if culled:
+                toRender = [
+                    record for record in toRender
+                    if id(record) not in culled
+                ]
         toRender.sort( key = lambda x: x[0])
         return toRender
 
+    USE_BATCH_SORT_KEYS = True
+    def sortKeys( self, paths, tmatrices ):
+        """Calculate the sort key for each path
+
+        If USE_BATCH_SORT_KEYS is True, the distance for every
+        path is calculated in a single pass and nodes with a
+        staticSortKey method just supply the static (appearance)
+        part of the key, i.e. (transparent, textures, material),
+        otherwise (and for nodes without staticSortKey) each
+        node's sortKey method is called.
+
+        If sortTransparent is False transparent paths are not
+        distance-sorted, just grouped by their static key.
+        """
+        if not self.USE_BATCH_SORT_KEYS:
+            return [
+                path[-1].sortKey( self, tmatrix )
+                for path,tmatrix in zip( paths, tmatrices )
+            ]
+        distances = polygonsort.originDistances(
+            tmatrices,
+            projection = self.getProjection(),
+            viewport = self.getViewport(),
+        ).tolist()
+        keys = []
+        for path,tmatrix,distance in zip( paths, tmatrices, distances ):
+            staticSortKey = getattr( path[-1], 'staticSortKey', None )
+            if staticSortKey is None:
+                keys.append( path[-1].sortKey( self, tmatrix ))
+                continue
+            key = staticSortKey( self )
+            if key[0]:
+                if self.sortTransparent:
+                    distance = -distance
+                else:
+                    distance = 0.0
+            keys.append( key[0:2] + (distance,) + key[1:] )
+        return keys
+
     def greatestDepth( self, toRender ):
+        """Calculate the far-plane distance required to show toRender
+
+        The eye-space z-depth of the farthest bounding-box point,
+        but at least 101 (to allow the 100 unit background to show),
+        plus 1% slack.
+
+        returns 0 if any record is unbounded (use the default far plane)
+        """
         # experimental: adjust our frustum to smaller depth based on
         # the projected z-depth of bbox points...
         maxDepth = 0
+        # group by point-count so each group is one stacked product
+        groups = {}
         for (key,mv,tm,bv,path) in toRender:
             try:
                 points = bv.getPoints()
             except (AttributeError,boundingvolume.UnboundedObject) as err:
                 return 0
             else:
-                translated = dot( points, mv )
-                maxDepth = min((maxDepth, min( translated[:,2] )))
+                group = groups.get( len(points) )
+                if group is None:
+                    group = groups[len(points)] = ([],[])
+                group[0].append( points )
+                group[1].append( mv )
+        for points,matrices in groups.values():
+            translated = matmul( asarray( points ), asarray( matrices ))
+            maxDepth = min((maxDepth, translated[...,2].min()))
         # 101 is to allow the 100 unit background to show... sigh
-        maxDepth = max((maxDepth,101))
+        # (depths in front of the viewer are negative z)
+        maxDepth = min((maxDepth,-101))
         return -(maxDepth*1.01)
 
+    USE_BATCH_CULLING = True
     def frustumVisibilityFilter( self, records ):
         """Filter records for visibility using frustum planes
 
+        Every record with an 8-point (axis-aligned) bounding box
+        is tested in a single vectorised pass using
+        boundingvolume.visibleMask, records with other volume
+        types use their volume's own visible method.
+
+        If USE_BATCH_CULLING is False, uses the per-object
+        frustumVisibilityFilterPerObject instead.
+        """
+        if not self.USE_BATCH_CULLING:
+            return self.frustumVisibilityFilterPerObject( records )
+        keep = [True] * len(records)
+        batched = []
+        points = []
+        matrices = []
+        for index,(key,mv,tm,bv,path) in enumerate( records ):
+            if bv is None:
+                continue
+            if isinstance( bv, boundingvolume.BoundingBox ):
+                bvPoints = bv.getPoints()
+                if len(bvPoints) == 8:
+                    batched.append( index )
+                    points.append( bvPoints )
+                    matrices.append( tm )
+                    continue
+            keep[index] = bv.visible(
+                self.frustum, tm.astype('f'),
+                occlusion=False,
+                mode=self
+            )
+        if batched:
+            mask = boundingvolume.visibleMask( self.frustum, points, matrices )
+            for index,visible in zip( batched, mask.tolist() ):
+                keep[index] = visible
+        return [
+            record
+            for (record,visible) in zip( records, keep )
+            if visible
+        ]
+
+    def frustumVisibilityFilterPerObject( self, records ):
+        """Filter records for visibility using frustum planes
+
         This does per-object culling based on frustum lookups
         rather than object query values.  It should be fast
         *if* the frustcullaccel module is available, if not
@@ -312,11 +713,12 @@ class FlatPass( SGObserver ):
         matrix = self.getModelView()
         self.matrix = matrix
 
-        toRender = self.renderSet( matrix )
-        maxDepth = self.maxDepth = self.greatestDepth( toRender )
+        toRender,maxDepth = self.frameRenderSet( matrix )
+        self.maxDepth = maxDepth
         vp = context.getViewPlatform()
         if maxDepth:
             self.projection = vp.viewMatrix(maxDepth)
+        toRender = self.occlusionFilter( toRender )
         
         # Load our projection matrix for all legacy rendering operations...
         
@@ -404,11 +806,68 @@ class FlatPass( SGObserver ):
         self.renderOpaque( toRender )
         self.renderTransparent( toRender )
 
+    USE_STATE_SORTING = True
+    _renderQueue = None
+    @property
+    def renderQueue( self ):
+        """RenderQueue used to state-sort opaque geometry"""
+        if self._renderQueue is None:
+            self._renderQueue = renderqueue.RenderQueue()
+        return self._renderQueue
+    def opaqueQueue( self, toRender ):
+        """Produce the opaque records of toRender in rendering order
+
+        If USE_STATE_SORTING is True, the records are bucketed by
+        (program, texture set, material) state, front-to-back within
+        each bucket, and renderQueue.counters reports the number of
+        state changes for the frame.  Otherwise the opaque records
+        are returned in the (distance-based) render-set order.
+        """
+        if self.USE_STATE_SORTING:
+            return self.renderQueue.opaque( toRender, self )
+        return [record for record in toRender if not record[0][0]]
+
+    USE_INSTANCING = True
+    _instanceBatcher = None
+    @property
+    def instanceBatcher( self ):
+        """InstanceBatcher used to group repeated (DEF/USE) geometry"""
+        if self._instanceBatcher is None:
+            self._instanceBatcher = instancing.InstanceBatcher()
+        return self._instanceBatcher
+    def renderInstanced( self, toRender ):
+        """Draw instanceable groups of toRender, yield remaining records
+
+        If USE_INSTANCING is True, records whose leaves support
+        RenderInstanced and share the same instanceKey are grouped
+        (see instancing.InstanceBatcher) and each group is drawn
+        with a single RenderInstanced call as it is reached.  The
+        records of groups which could not be drawn, and all
+        ungrouped records, are yielded in order for individual
+        rendering.
+        """
+        if not self.USE_INSTANCING:
+            for record in toRender:
+                yield record
+            return
+        for item in self.instanceBatcher.batch( toRender, self ):
+            if not isinstance( item, instancing.InstanceGroup ):
+                yield item
+                continue
+            key,mvmatrix,tmatrix,bvolume,path = item.records[0]
+            self.matrix = mvmatrix
+            self.renderPath = path
+            if item.node.RenderInstanced( mode=self, matrices=item.matrices() ):
+                continue
+            for record in item.records:
+                yield record
+
     def renderOpaque( self, toRender ):
-        """Render the opaque geometry from toRender (in reverse order)"""
+        """Render the opaque geometry from toRender (in opaqueQueue order)"""
+        toRender = self.opaqueQueue( toRender )
         self.transparent = False
         debugFrustum = self.context.contextDefinition.debugBBox
-        for key,mvmatrix,tmatrix,bvolume,path in toRender:
+        for key,mvmatrix,tmatrix,bvolume,path in self.renderInstanced( toRender ):
             if not key[0]:
                 self.matrix = mvmatrix
                 self.renderPath = path
@@ -0,0 +1,404 @@
+"""Dynamic axis-aligned bounding-box tree for hierarchical culling
+
+The AABBTree holds the world-space bounds of every rendering path
+known to an SGObserver in a balanced binary tree (the insertion
+and balancing scheme is the usual "dynamic AABB tree" approach,
+choosing siblings by surface-area cost and rotating to keep the
+tree height-balanced).  Frustum culling then walks the tree, so
+that a whole subtree which is outside (or entirely inside) the
+frustum is resolved with a single plane test and the work done
+scales with the visible set rather than with the scene size.
+
+The tree is maintained incrementally:
+
+    * paths are added/removed as the observer integrates/purges
+      them (i.e. from onChildAdd, onChildRemove and onSwitchChange)
+    * paths are marked dirty (and refit before the next query)
+      when nodepath.WORLD_MATRIX_CHANGE_SIGNAL reports that their
+      world matrix changed, or when
+      boundingvolume.BOUNDING_VOLUME_CHANGE_SIGNAL reports that
+      their volume was discarded
+
+Paths without an 8-point bounding box (unbounded volumes, nodes
+without boundingVolume methods) are not put in the tree, they are
+returned to the caller for per-object testing.
+"""
+from OpenGLContext.arrays import asarray, dot
+from OpenGLContext.scenegraph import boundingvolume, nodepath
+from pydispatch import dispatcher
+import logging
+log = logging.getLogger( __name__ )
+
+def _union( lower, upper, otherLower, otherUpper ):
+    """Bounds of the union of two (lower,upper) boxes"""
+    return (
+        (
+            min( lower[0], otherLower[0] ),
+            min( lower[1], otherLower[1] ),
+            min( lower[2], otherLower[2] ),
+        ),
+        (
+            max( upper[0], otherUpper[0] ),
+            max( upper[1], otherUpper[1] ),
+            max( upper[2], otherUpper[2] ),
+        ),
+    )
+def _area( lower, upper ):
+    """Surface area of the box (lower,upper)"""
+    dx = upper[0]-lower[0]
+    dy = upper[1]-lower[1]
+    dz = upper[2]-lower[2]
+    return 2.0 * (dx*dy + dy*dz + dz*dx)
+
+class TreeNode( object ):
+    """Node within the AABBTree
+
+    entry -- for leaves, the Entry being bounded, otherwise None
+    lower, upper -- world-space bounds of the node
+    parent, left, right -- tree structure
+    height -- 0 for leaves, otherwise 1 + max(child heights)
+    """
+    __slots__ = ('entry','lower','upper','parent','left','right','height')
+    def __init__( self, entry=None, lower=None, upper=None ):
+        self.entry = entry
+        self.lower = lower
+        self.upper = upper
+        self.parent = None
+        self.left = None
+        self.right = None
+        self.height = 0
+
+class Entry( object ):
+    """Record for a single rendering path
+
+    path -- the NodePath being tracked
+    order -- integration order, used to keep results in path order
+    volume -- the path's current bounding volume (or None)
+    points -- local-space corners of volume (8-point boxes only)
+    matrix -- world matrix for path used to calculate leaf bounds
+    leaf -- TreeNode if the entry is in the tree, otherwise None
+    """
+    __slots__ = ('path','order','volume','points','matrix','leaf')
+    def __init__( self, path, order ):
+        self.path = path
+        self.order = order
+        self.volume = None
+        self.points = None
+        self.matrix = None
+        self.leaf = None
+
+class AABBTree( object ):
+    """Dynamic AABB tree over a set of rendering paths
+
+    Attributes:
+        root -- root TreeNode (or None for an empty tree)
+        entries -- id(path): Entry for all tracked paths
+        untracked -- id(entry): Entry for paths not in the tree
+        dirty -- id(entry): Entry for paths requiring a refit
+        volumes -- id(volume): {id(entry):Entry} for volume changes
+        tested -- number of nodes plane-tested in the last cull
+    """
+    def __init__( self ):
+        self.root = None
+        self.entries = {}
+        self.untracked = {}
+        self.dirty = {}
+        self.volumes = {}
+        self.counter = 0
+        self.tested = 0
+        dispatcher.connect(
+            self.onMatrixChange,
+            signal = nodepath.WORLD_MATRIX_CHANGE_SIGNAL,
+        )
+        dispatcher.connect(
+            self.onVolumeChange,
+            signal = boundingvolume.BOUNDING_VOLUME_CHANGE_SIGNAL,
+        )
+    def __len__( self ):
+        return len(self.entries)
+
+    def add( self, path ):
+        """Start tracking path (bounds are calculated on next cull)"""
+        key = id(path)
+        if key in self.entries:
+            return self.entries[key]
+        self.counter += 1
+        entry = self.entries[key] = Entry( path, self.counter )
+        self.untracked[id(entry)] = entry
+        self.dirty[id(entry)] = entry
+        return entry
+    def remove( self, path ):
+        """Stop tracking path"""
+        entry = self.entries.pop( id(path), None )
+        if entry is None:
+            return None
+        if entry.leaf is not None:
+            self.removeLeaf( entry.leaf )
+            entry.leaf = None
+        self.untracked.pop( id(entry), None )
+        self.dirty.pop( id(entry), None )
+        self.setVolume( entry, None )
+        return entry
+
+    def onMatrixChange( self, value ):
+        """World matrices for paths in value changed, refit on next cull"""
+        for path in value:
+            entry = self.entries.get( id(path) )
+            if entry is not None:
+                self.dirty[id(entry)] = entry
+    def onVolumeChange( self, value ):
+        """Bounding volume value was discarded, refit users on next cull"""
+        users = self.volumes.get( id(value) )
+        if users:
+            self.dirty.update( users )
+    def setVolume( self, entry, volume ):
+        """Update volume-change watching for entry"""
+        if entry.volume is volume:
+            return
+        if entry.volume is not None:
+            users = self.volumes.get( id(entry.volume) )
+            if users is not None:
+                users.pop( id(entry), None )
+                if not users:
+                    del self.volumes[id(entry.volume)]
+        entry.volume = volume
+        if volume is not None:
+            self.volumes.setdefault( id(volume), {})[id(entry)] = entry
+
+    def refit( self, mode ):
+        """Recalculate bounds for all dirty entries"""
+        dirty,self.dirty = self.dirty,{}
+        for entry in dirty.values():
+            path = entry.path
+            volume = None
+            if hasattr( path[-1], 'boundingVolume' ):
+                volume = path[-1].boundingVolume( mode )
+            self.setVolume( entry, volume )
+            points = None
+            if isinstance( volume, boundingvolume.BoundingBox ):
+                points = volume.getPoints()
+                if len(points) != 8:
+                    points = None
+            if points is None:
+                if entry.leaf is not None:
+                    self.removeLeaf( entry.leaf )
+                    entry.leaf = None
+                entry.points = entry.matrix = None
+                self.untracked[id(entry)] = entry
+                continue
+            matrix = path.transformMatrix()
+            corners = dot( asarray( points, 'f' ), asarray( matrix, 'f' ))[:,:3]
+            lower = tuple( corners.min(0).tolist() )
+            upper = tuple( corners.max(0).tolist() )
+            entry.points = points
+            entry.matrix = matrix
+            leaf = entry.leaf
+            if leaf is not None:
+                if leaf.lower == lower and leaf.upper == upper:
+                    continue
+                self.removeLeaf( leaf )
+                leaf.lower,leaf.upper = lower,upper
+            else:
+                self.untracked.pop( id(entry), None )
+                leaf = entry.leaf = TreeNode( entry, lower, upper )
+            self.insertLeaf( leaf )
+
+    def cull( self, mode ):
+        """Find candidate-visible paths for mode's frustum
+
+        returns [(path,volume,tested),...] in integration order,
+        where tested is True for paths already known to be visible,
+        and False for paths the caller must test itself (paths which
+        are not in the tree, or all paths if there is no frustum)
+        """
+        self.refit( mode )
+        frustum = mode.frustum
+        if not frustum:
+            found = list( self.entries.values())
+            found.sort( key = lambda x: x.order )
+            return [(entry.path,entry.volume,False) for entry in found]
+        visible,partial = self.query( frustum.planes )
+        if partial:
+            mask = boundingvolume.visibleMask(
+                frustum,
+                [entry.points for entry in partial],
+                [entry.matrix for entry in partial],
+            )
+            visible.extend([
+                entry for (entry,keep) in zip( partial, mask.tolist())
+                if keep
+            ])
+        result = [(entry.order,entry.path,entry.volume,True) for entry in visible]
+        result.extend([
+            (entry.order,entry.path,entry.volume,False)
+            for entry in self.untracked.values()
+        ])
+        result.sort( key = lambda x: x[0] )
+        return [record[1:] for record in result]
+    def query( self, planes ):
+        """Walk the tree testing node bounds against planes
+
+        planes -- (N,4) array of world-space frustum planes
+
+        returns (inside,partial) lists of entries, where the bounds
+        of inside entries are completely in front of all planes,
+        while partial entries straddle at least one plane.
+        """
+        inside = []
+        partial = []
+        self.tested = 0
+        if self.root is None:
+            return inside,partial
+        planes = [tuple(plane) for plane in asarray( planes, 'd' ).tolist()]
+        stack = [(self.root,tuple(range(len(planes))))]
+        while stack:
+            node,active = stack.pop()
+            self.tested += 1
+            lower,upper = node.lower,node.upper
+            straddled = []
+            for index in active:
+                a,b,c,d = planes[index]
+                # vertex furthest along the plane normal...
+                if a*(upper[0] if a >= 0 else lower[0]) + b*(upper[1] if b >= 0 else lower[1]) + c*(upper[2] if c >= 0 else lower[2]) + d < 0:
+                    break
+                # vertex furthest behind the plane
+                if a*(lower[0] if a >= 0 else upper[0]) + b*(lower[1] if b >= 0 else upper[1]) + c*(lower[2] if c >= 0 else upper[2]) + d < 0:
+                    straddled.append( index )
+            else:
+                if not straddled:
+                    self.collect( node, inside )
+                elif node.entry is not None:
+                    partial.append( node.entry )
+                else:
+                    stack.append( (node.right,straddled) )
+                    stack.append( (node.left,straddled) )
+        return inside,partial
+    def collect( self, node, result ):
+        """Add all entries at/below node to result"""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.entry is not None:
+                result.append( node.entry )
+            else:
+                stack.append( node.right )
+                stack.append( node.left )
+        return result
+
+    def insertLeaf( self, leaf ):
+        """Insert leaf choosing the lowest surface-area-cost sibling"""
+        if self.root is None:
+            self.root = leaf
+            leaf.parent = None
+            return
+        lower,upper = leaf.lower,leaf.upper
+        node = self.root
+        while node.entry is None:
+            area = _area( node.lower, node.upper )
+            combined = _area( *_union( node.lower, node.upper, lower, upper ))
+            cost = 2.0 * combined
+            inheritance = 2.0 * (combined-area)
+            costs = []
+            for child in (node.left,node.right):
+                childCost = _area( *_union( child.lower, child.upper, lower, upper ))
+                if child.entry is None:
+                    childCost -= _area( child.lower, child.upper )
+                costs.append( childCost + inheritance )
+            if cost < costs[0] and cost < costs[1]:
+                break
+            if costs[0] < costs[1]:
+                node = node.left
+            else:
+                node = node.right
+        sibling = node
+        oldParent = sibling.parent
+        parent = TreeNode( None, *_union( sibling.lower, sibling.upper, lower, upper ))
+        parent.parent = oldParent
+        parent.height = sibling.height + 1
+        if oldParent is None:
+            self.root = parent
+        elif oldParent.left is sibling:
+            oldParent.left = parent
+        else:
+            oldParent.right = parent
+        parent.left = sibling
+        parent.right = leaf
+        sibling.parent = parent
+        leaf.parent = parent
+        self.fixUpwards( parent )
+    def removeLeaf( self, leaf ):
+        """Remove leaf from the tree, collapsing its parent"""
+        if leaf is self.root:
+            self.root = None
+            return
+        parent = leaf.parent
+        grandParent = parent.parent
+        if parent.left is leaf:
+            sibling = parent.right
+        else:
+            sibling = parent.left
+        if grandParent is None:
+            self.root = sibling
+            sibling.parent = None
+        else:
+            if grandParent.left is parent:
+                grandParent.left = sibling
+            else:
+                grandParent.right = sibling
+            sibling.parent = grandParent
+            self.fixUpwards( grandParent )
+        leaf.parent = None
+    def fixUpwards( self, node ):
+        """Rebalance and recalculate bounds from node to the root"""
+        while node is not None:
+            node = self.balance( node )
+            left,right = node.left,node.right
+            node.height = 1 + max( left.height, right.height )
+            node.lower,node.upper = _union(
+                left.lower, left.upper, right.lower, right.upper
+            )
+            node = node.parent
+    def balance( self, a ):
+        """Rotate a's taller grandchild up if a is unbalanced
+
+        returns the node now at a's position in the tree
+        """
+        if a.entry is not None or a.height < 2:
+            return a
+        b,c = a.left,a.right
+        difference = c.height - b.height
+        if difference > 1:
+            return self.rotate( a, c, b, 'right' )
+        elif difference < -1:
+            return self.rotate( a, b, c, 'left' )
+        return a
+    def rotate( self, a, up, other, side ):
+        """Promote a's child up (on side) to a's position"""
+        f,g = up.left,up.right
+        up.left = a
+        up.parent = a.parent
+        a.parent = up
+        if up.parent is None:
+            self.root = up
+        elif up.parent.left is a:
+            up.parent.left = up
+        else:
+            up.parent.right = up
+        if f.height > g.height:
+            keep,move = f,g
+        else:
+            keep,move = g,f
+        up.right = keep
+        setattr( a, side, move )
+        move.parent = a
+        a.lower,a.upper = _union( other.lower, other.upper, move.lower, move.upper )
+        up.lower,up.upper = _union( a.lower, a.upper, keep.lower, keep.upper )
+        a.height = 1 + max( other.height, move.height )
+        up.height = 1 + max( a.height, keep.height )
+        return up
+
+    def depth( self ):
+        """Height of the tree (0 for empty or single-leaf trees)"""
+        if self.root is None:
+            return 0
+        return self.root.height
@@ -50,11 +50,12 @@ class FlatPass( _flat.FlatPass ):
         matrix = self.getModelView()
         self.matrix = matrix
 
-        toRender = self.renderSet( matrix )
-        maxDepth = self.maxDepth = self.greatestDepth( toRender )
+        toRender,maxDepth = self.frameRenderSet( matrix )
+        self.maxDepth = maxDepth
         vp = context.getViewPlatform()
         if maxDepth:
             self.projection = vp.viewMatrix(maxDepth)
+        toRender = self.occlusionFilter( toRender )
         
         # Load our projection matrix for all legacy rendering operations...
         glMatrixMode( GL_PROJECTION )
@@ -143,10 +144,11 @@ class FlatPass( _flat.FlatPass ):
         self.matrix = matrix
     
     def renderOpaque( self, toRender ):
-        """Render the opaque geometry from toRender (in reverse order)"""
+        """Render the opaque geometry from toRender (in opaqueQueue order)"""
+        toRender = self.opaqueQueue( toRender )
         self.transparent = False
         debugFrustum = self.context.contextDefinition.debugBBox
-        for key,mvmatrix,tmatrix,bvolume,path in toRender:
+        for key,mvmatrix,tmatrix,bvolume,path in self.renderInstanced( toRender ):
             if not key[0]:
                 self.matrix = mvmatrix
                 self.renderPath = path
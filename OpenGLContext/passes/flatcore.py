@@ -2,7 +2,7 @@
 
 Rewritten version that should be core-profile compatible...
 """
-from . import _flat
+from . import _flat, oit
 from OpenGLContext.scenegraph import nodepath,switch,boundingvolume
 from OpenGL.GL import *
 from OpenGLContext.arrays import array, dot, allclose
@@ -35,6 +35,12 @@ class FlatPass( _flat.FlatPass ):
         viewport -- 4-component viewport definition for current context
         frustum -- viewing-frustum definition for current view platform
         MAX_LIGHTS -- queried maximum number of lights
+        weightedTransparency -- oit.WeightedTransparency used when the
+            context definition's transparencyMode is 'weighted' and the
+            context supports it, otherwise None (back-to-front sorting)
+        transparencyFallback -- transparencyMode which we found we
+            can't use (and so use sorted transparency instead), the
+            context definition itself is left unchanged
 
 
         passCount -- not used, always set to 0 for code that expects
@@ -47,11 +53,12 @@ class FlatPass( _flat.FlatPass ):
         matrix = self.getModelView()
         self.matrix = matrix
 
-        toRender = self.renderSet( matrix )
-        maxDepth = self.maxDepth = self.greatestDepth( toRender )
+        toRender,maxDepth = self.frameRenderSet( matrix )
+        self.maxDepth = maxDepth
         vp = context.getViewPlatform()
         if maxDepth:
             self.projection = vp.viewMatrix(maxDepth)
+        toRender = self.occlusionFilter( toRender )
         
         # Load our projection matrix for all legacy rendering operations...
         
@@ -129,10 +136,11 @@ class FlatPass( _flat.FlatPass ):
         self.matrix = matrix
     
     def renderOpaque( self, toRender ):
-        """Render the opaque geometry from toRender (in reverse order)"""
+        """Render the opaque geometry from toRender (in opaqueQueue order)"""
+        toRender = self.opaqueQueue( toRender )
         self.transparent = False
         debugFrustum = self.context.contextDefinition.debugBBox
-        for key,mvmatrix,tmatrix,bvolume,path in toRender:
+        for key,mvmatrix,tmatrix,bvolume,path in self.renderInstanced( toRender ):
             if not key[0]:
                 self.matrix = mvmatrix
                 self.renderPath = path
@@ -150,7 +158,13 @@ class FlatPass( _flat.FlatPass ):
                     import os 
                     os._exit(1)
     def renderTransparent( self, toRender ):
-        """Render the transparent geometry from toRender (in forward order)"""
+        """Render the transparent geometry from toRender (in forward order)
+
+        Dispatches to renderTransparentWeighted if we are using
+        order-independent transparency.
+        """
+        if self.weightedTransparency is not None:
+            return self.renderTransparentWeighted( toRender )
         self.transparent = True
         setup = False
         debugFrustum = self.context.contextDefinition.debugBBox
@@ -185,6 +199,50 @@ class FlatPass( _flat.FlatPass ):
                 glDepthFunc( GL_LEQUAL )
                 glEnable( GL_DEPTH_TEST )
 
+    def renderTransparentWeighted( self, toRender ):
+        """Render the transparent geometry with weighted blended OIT
+
+        No sorting is needed, the transparent records are rendered
+        in toRender's (state-grouped) order into the accumulation
+        and revealage targets (once for each target if the context
+        lacks per-buffer blending), which are then composited over
+        the opaque image.
+        """
+        records = [record for record in toRender if record[0][0]]
+        if not records:
+            return
+        target = self.weightedTransparency
+        try:
+            passes = target.begin( self.viewport )
+        except RuntimeError as err:
+            # renders this frame's (unsorted) records, following
+            # frames are sorted as sortTransparent is in renderSetKey
+            self.fallbackTransparency( 'weighted', str( err ))
+            return self.renderTransparent( toRender )
+        debugFrustum = self.context.contextDefinition.debugBBox
+        self.transparent = True
+        try:
+            for index in range( passes ):
+                target.selectTarget( index )
+                for key,mvmatrix,tmatrix,bvolume,path in records:
+                    self.matrix = mvmatrix
+                    self.renderPath = path
+                    glLoadMatrixf( mvmatrix )
+                    try:
+                        path[-1].RenderTransparent( mode = self )
+                        if debugFrustum:
+                            bvolume.debugRender( )
+                    except Exception as err:
+                        log.error(
+                            """Failure in %s: %s""",
+                            path[-1].Render,
+                            getTraceback( err ),
+                        )
+        finally:
+            self.transparent = False
+            target.end()
+        target.composite()
+
     def selectRender( self, mode, toRender, events ):
         """Render each path to color buffer
 
@@ -276,6 +334,46 @@ class FlatPass( _flat.FlatPass ):
             glDisable( GL_SCISSOR_TEST )
 
     MAX_LIGHTS = -1
+    weightedTransparency = None
+    transparencyFallback = None
+    def chooseTransparency( self, context ):
+        """Choose our transparency mode from the context's definition
+
+        Sets weightedTransparency (and sortTransparent), falls back
+        to back-to-front sorting if the context can't do
+        order-independent transparency (see fallbackTransparency).
+        """
+        mode = getattr( context.contextDefinition, 'transparencyMode', 'sorted' )
+        if mode == self.transparencyFallback:
+            mode = 'sorted'
+        elif mode == 'weighted':
+            if self.weightedTransparency is None:
+                if oit.WeightedTransparency.available():
+                    self.weightedTransparency = oit.WeightedTransparency()
+                else:
+                    self.fallbackTransparency(
+                        mode, 'unsupported by this context',
+                    )
+        elif mode != 'sorted':
+            self.fallbackTransparency( mode, 'unknown mode' )
+            mode = 'sorted'
+        if mode == 'sorted' and self.weightedTransparency is not None:
+            self.weightedTransparency.deleteTargets()
+            self.weightedTransparency = None
+        self.sortTransparent = self.weightedTransparency is None
+        return self.weightedTransparency
+    def fallbackTransparency( self, mode, reason ):
+        """Use sorted transparency instead of mode from now on"""
+        log.warning(
+            """Transparency mode %r unusable (%s), using sorted transparency""",
+            mode, reason,
+        )
+        self.transparencyFallback = mode
+        if self.weightedTransparency is not None:
+            self.weightedTransparency.deleteTargets()
+            self.weightedTransparency = None
+        self.sortTransparent = True
+
     def __call__( self, context ):
         """Overall rendering pass interface for the context client"""
         vp = context.getViewPlatform()
@@ -287,6 +385,7 @@ class FlatPass( _flat.FlatPass ):
         self.context = context
         self.cache = context.cache
         self.viewport = (0,0) + context.getViewPort()
+        self.chooseTransparency( context )
         
         self.calculateFrustum()
 
@@ -0,0 +1,121 @@
+"""Automatic instancing of repeated (DEF/USE) geometry
+
+VRML worlds reuse geometry heavily via DEF/USE, producing many
+render paths whose leaf draws exactly the same geometry with the
+same appearance, differing only in model-view matrix.  The
+InstanceBatcher collects such opaque records into InstanceGroups so
+that a leaf node which supports it can draw the whole group with a
+single instanced call.
+
+Nodes which can draw a group provide a RenderInstanced( mode,
+matrices ) method which receives the (N,4,4) stacked model-view
+matrices of the instances and returns True if it drew the group,
+and an instanceKey( mode ) method returning a hashable token
+(normally built from id()s of the geometry and appearance) or None
+if they are not instanceable.
+
+    ShaderGeometry uploads the matrices as a per-instance attribute
+    named INSTANCE_ATTRIBUTE and draws the group with one instanced
+    call (where the context supports instanced drawing).
+
+    Shape (fixed-function) sets up its appearance once for the
+    group, then loads each matrix and draws its geometry.
+
+Where a group cannot be drawn after all (no instancing support,
+shader without the per-instance attribute, transparent appearance)
+its records are rendered individually, as before.
+"""
+from OpenGL.GL import glDrawArraysInstanced, glVertexAttribDivisor
+from OpenGLContext.arrays import array
+import logging
+log = logging.getLogger( __name__ )
+
+INSTANCE_ATTRIBUTE = 'instance_modelview'
+
+def instanceKey( path, mode ):
+    """Get the instancing key for a render path (or None)
+
+    Leaves without RenderInstanced are never grouped, as grouping
+    them would reorder the state-sorted records for no saving.
+    """
+    node = path[-1]
+    method = getattr( node, 'instanceKey', None )
+    if method is None or not hasattr( node, 'RenderInstanced' ):
+        return None
+    return method( mode )
+
+def instancingAvailable( ):
+    """Determine whether the current context supports instanced drawing"""
+    try:
+        return bool( glDrawArraysInstanced ) and bool( glVertexAttribDivisor )
+    except Exception:
+        return False
+
+class InstanceGroup( object ):
+    """Set of opaque render records drawing the same geometry/appearance
+
+    key -- the shared instanceKey
+    records -- the FlatPass render records (key,mv,tm,bv,path)
+    """
+    __slots__ = ('key','records')
+    def __init__( self, key, records=None ):
+        self.key = key
+        self.records = records or []
+    @property
+    def node( self ):
+        """The leaf node which will draw the group"""
+        return self.records[0][-1][-1]
+    def matrices( self ):
+        """Stacked (N,4,4) float32 model-view matrices of our instances"""
+        return array( [record[1] for record in self.records], 'f' )
+    def __len__( self ):
+        return len(self.records)
+    def __repr__( self ):
+        return '%s( %s instances )'%( self.__class__.__name__, len(self.records) )
+
+class InstanceBatcher( object ):
+    """Groups opaque render records which can be drawn instanced
+
+    MIN_INSTANCES -- smallest number of records worth grouping
+
+    Statistics for the last batch call:
+        groups -- number of InstanceGroups produced
+        instances -- number of records within those groups
+    """
+    MIN_INSTANCES = 2
+    def __init__( self ):
+        self.groups = self.instances = 0
+    def batch( self, records, mode ):
+        """Produce sequence of records and InstanceGroups from records
+
+        Each group is placed at the position of its first member,
+        so the (state-sorted) order of the incoming records is
+        otherwise retained.  Groups which would have fewer than
+        MIN_INSTANCES members are returned as plain records.
+        Transparent records are never grouped.
+        """
+        groups = {}
+        ordered = []
+        for record in records:
+            key = None
+            if not record[0][0]:
+                key = instanceKey( record[-1], mode )
+            if key is None:
+                ordered.append( record )
+                continue
+            group = groups.get( key )
+            if group is None:
+                group = groups[key] = InstanceGroup( key )
+                ordered.append( group )
+            group.records.append( record )
+        self.groups = self.instances = 0
+        result = []
+        for item in ordered:
+            if isinstance( item, InstanceGroup ):
+                if len(item) < self.MIN_INSTANCES:
+                    result.extend( item.records )
+                    continue
+                self.groups += 1
+                self.instances += len(item)
+            result.append( item )
+        return result
@@ -0,0 +1,309 @@
+"""Weighted blended order-independent transparency
+
+Rather than sorting transparent geometry back-to-front, the
+geometry is rendered (in any order) into two off-screen targets:
+
+    accumulation (RGBA16F) -- sum of alpha-premultiplied colours
+        (rgb) and of the alphas (a)
+    revealage (R16F) -- product of (1-alpha), i.e. how much of the
+        background remains visible
+
+which are then composited over the opaque image:
+
+    colour = accumulation.rgb / accumulation.a
+    result = colour * (1-revealage) + background * revealage
+
+See McGuire and Bavoil, "Weighted Blended Order-Independent
+Transparency", JCGT 2013.  Our geometry is drawn by the
+fixed-function pipeline, which cannot calculate the paper's
+per-fragment depth weight, so all fragments are weighted equally
+(Bavoil and Myers' "weighted average" variant).  Intersecting and
+cyclically overlapping geometry is handled, at the cost of strongly
+differing colours at one pixel blending to their (alpha-weighted)
+average rather than layering.
+
+Writing the two targets with different blend functions in one
+pass needs per-buffer blending (glBlendFuncSeparatei, OpenGL 4.0),
+without it the transparent geometry is rendered once per target.
+
+The opaque pass' depth is copied (blitted) into our framebuffer,
+which needs our depth buffer to have the same format as that of
+the framebuffer being drawn to (see DEPTH_FORMATS), begin raises
+a RuntimeError if the format can't be matched.
+"""
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+from OpenGL.arrays import vbo
+from OpenGLContext.arrays import array
+import logging
+log = logging.getLogger( __name__ )
+
+VERTEX_SHADER = '''#version 130
+in vec2 vertex;
+out vec2 texCoord;
+void main() {
+    texCoord = vertex * 0.5 + 0.5;
+    gl_Position = vec4( vertex, 0.0, 1.0 );
+}'''
+FRAGMENT_SHADER = '''#version 130
+in vec2 texCoord;
+out vec4 fragColor;
+uniform sampler2D accumulation;
+uniform sampler2D revealage;
+void main() {
+    float reveal = texture( revealage, texCoord ).r;
+    if (reveal >= 1.0) {
+        discard;
+    }
+    vec4 accum = texture( accumulation, texCoord );
+    fragColor = vec4( accum.rgb / max( accum.a, 0.00001 ), 1.0 - reveal );
+}'''
+def glVersion():
+    """Parse the context's GL_VERSION into [int(major),int(minor)] ([0,0] if unknown)"""
+    try:
+        version = glGetString( GL_VERSION )
+    except GLError:
+        version = None
+    if not version:
+        return [0,0]
+    try:
+        return [int(x) for x in version.split()[0].split( b'.' )[:2]]
+    except ValueError:
+        return [0,0]
+
+# single triangle covering the whole viewport
+SCREEN_TRIANGLE = array( [(-1,-1),(3,-1),(-1,3)], 'f' )
+
+# (depth bits, stencil bits, depth component type): renderbuffer format
+DEPTH_FORMATS = {
+    (16,0,GL_UNSIGNED_NORMALIZED): GL_DEPTH_COMPONENT16,
+    (24,0,GL_UNSIGNED_NORMALIZED): GL_DEPTH_COMPONENT24,
+    (24,8,GL_UNSIGNED_NORMALIZED): GL_DEPTH24_STENCIL8,
+    (32,0,GL_FLOAT): GL_DEPTH_COMPONENT32F,
+    (32,8,GL_FLOAT): GL_DEPTH32F_STENCIL8,
+}
+STENCIL_FORMATS = (GL_DEPTH24_STENCIL8,GL_DEPTH32F_STENCIL8)
+
+def depthFormat( framebuffer ):
+    """Get the renderbuffer format matching the bound draw framebuffer's depth
+
+    framebuffer -- the (name of the) bound draw framebuffer, 0 for
+        the context's default framebuffer
+
+    returns the format from DEPTH_FORMATS or None if the framebuffer
+    has no depth buffer or it has an unknown format
+    """
+    if framebuffer:
+        depth,stencil = GL_DEPTH_ATTACHMENT,GL_STENCIL_ATTACHMENT
+    else:
+        depth,stencil = GL_DEPTH,GL_STENCIL
+    def query( attachment, name ):
+        return int( glGetFramebufferAttachmentParameteriv(
+            GL_DRAW_FRAMEBUFFER, attachment, name,
+        ))
+    if query( depth, GL_FRAMEBUFFER_ATTACHMENT_OBJECT_TYPE ) == GL_NONE:
+        return None
+    stencilBits = 0
+    if query( stencil, GL_FRAMEBUFFER_ATTACHMENT_OBJECT_TYPE ) != GL_NONE:
+        stencilBits = query( stencil, GL_FRAMEBUFFER_ATTACHMENT_STENCIL_SIZE )
+    return DEPTH_FORMATS.get( (
+        query( depth, GL_FRAMEBUFFER_ATTACHMENT_DEPTH_SIZE ),
+        stencilBits,
+        query( depth, GL_FRAMEBUFFER_ATTACHMENT_COMPONENT_TYPE ),
+    ))
+
+class WeightedTransparency( object ):
+    """Render targets and compositing for weighted blended transparency
+
+    Usage (see flatcore.FlatPass.renderTransparentWeighted):
+
+        for target in range( oit.begin( viewport )):
+            oit.selectTarget( target )
+            ... render the transparent geometry ...
+        oit.end()
+        oit.composite()
+    """
+    framebuffer = None
+    size = None
+    depthFormat = None
+    program = None
+    previous = None
+    @staticmethod
+    def available():
+        """Whether the current context supports the required features
+
+        Needs framebuffer objects, float textures, vertex-array
+        objects and GLSL 1.30, i.e. OpenGL 3.0
+        """
+        return glVersion() >= [3,0]
+    @staticmethod
+    def singlePass():
+        """Whether both targets can be written in a single pass (OpenGL 4.0)"""
+        return glVersion() >= [4,0]
+    def createTargets( self, size, depthFormat=GL_DEPTH24_STENCIL8 ):
+        """Create (or re-create) our framebuffer for viewport size (width,height)
+
+        depthFormat -- renderbuffer format of our depth buffer, must
+            match the opaque pass' depth buffer (see DEPTH_FORMATS)
+
+        Leaves our framebuffer bound.
+        """
+        self.deleteTargets()
+        width,height = size
+        self.framebuffer = glGenFramebuffers( 1 )
+        glBindFramebuffer( GL_FRAMEBUFFER, self.framebuffer )
+        self.textures = glGenTextures( 2 )
+        for attachment,texture,(internal,format) in zip(
+            (GL_COLOR_ATTACHMENT0,GL_COLOR_ATTACHMENT1),
+            self.textures,
+            ((GL_RGBA16F,GL_RGBA),(GL_R16F,GL_RED)),
+        ):
+            glBindTexture( GL_TEXTURE_2D, texture )
+            glTexImage2D( GL_TEXTURE_2D, 0, internal, width, height, 0, format, GL_FLOAT, None )
+            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST )
+            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST )
+            glFramebufferTexture2D( GL_FRAMEBUFFER, attachment, GL_TEXTURE_2D, texture, 0 )
+        glBindTexture( GL_TEXTURE_2D, 0 )
+        # depth is copied from the opaque pass so opaque geometry occludes
+        self.depth = glGenRenderbuffers( 1 )
+        glBindRenderbuffer( GL_RENDERBUFFER, self.depth )
+        glRenderbufferStorage( GL_RENDERBUFFER, depthFormat, width, height )
+        if depthFormat in STENCIL_FORMATS:
+            attachment = GL_DEPTH_STENCIL_ATTACHMENT
+        else:
+            attachment = GL_DEPTH_ATTACHMENT
+        glFramebufferRenderbuffer(
+            GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, self.depth,
+        )
+        glBindRenderbuffer( GL_RENDERBUFFER, 0 )
+        status = glCheckFramebufferStatus( GL_FRAMEBUFFER )
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            self.deleteTargets()
+            raise RuntimeError( """Transparency framebuffer incomplete: %s"""%( status, ))
+        self.size = tuple( size )
+        self.depthFormat = depthFormat
+    def deleteTargets( self ):
+        """Release our framebuffer (if any)"""
+        if self.framebuffer is not None:
+            glDeleteFramebuffers( 1, [self.framebuffer] )
+            glDeleteTextures( self.textures )
+            glDeleteRenderbuffers( 1, [self.depth] )
+            self.framebuffer = None
+            self.size = None
+            self.depthFormat = None
+    def begin( self, viewport ):
+        """Bind and clear our targets for the viewport
+
+        Records the current framebuffer bindings and draw buffer
+        (restored by end), copies the opaque pass' depth buffer (from
+        the current draw framebuffer) into our framebuffer, leaves
+        depth-testing on with depth-writes off.
+
+        raises RuntimeError (with the previous state restored) if
+        the opaque pass' depth can't be copied to our framebuffer
+
+        returns the number of passes (targets to select) required
+        """
+        x,y,width,height = self.viewport = [int(value) for value in viewport]
+        self.previous = [
+            int( glGetIntegerv( name ))
+            for name in (
+                GL_READ_FRAMEBUFFER_BINDING,
+                GL_DRAW_FRAMEBUFFER_BINDING,
+                GL_DRAW_BUFFER,
+            )
+        ]
+        source = self.previous[1]
+        required = depthFormat( source )
+        if required is None:
+            raise RuntimeError(
+                """Unsupported depth buffer format for weighted transparency"""
+            )
+        if self.size != (width,height) or self.depthFormat != required:
+            try:
+                self.createTargets( (width,height), required )
+            finally:
+                self.restore()
+        glBindFramebuffer( GL_READ_FRAMEBUFFER, source )
+        glBindFramebuffer( GL_DRAW_FRAMEBUFFER, self.framebuffer )
+        glBlitFramebuffer(
+            x,y,x+width,y+height, 0,0,width,height,
+            GL_DEPTH_BUFFER_BIT, GL_NEAREST,
+        )
+        glBindFramebuffer( GL_FRAMEBUFFER, self.framebuffer )
+        glViewport( 0,0,width,height )
+        glClearBufferfv( GL_COLOR, 0, (0.0,0.0,0.0,0.0) )
+        glClearBufferfv( GL_COLOR, 1, (1.0,1.0,1.0,1.0) )
+        glEnable( GL_DEPTH_TEST )
+        glDepthFunc( GL_LEQUAL )
+        glDepthMask( 0 )
+        glEnable( GL_BLEND )
+        self.single = self.singlePass()
+        if self.single:
+            return 1
+        return 2
+    def selectTarget( self, target ):
+        """Set up drawing/blending for target (pass) number target"""
+        if self.single:
+            glDrawBuffers( 2, (GL_COLOR_ATTACHMENT0,GL_COLOR_ATTACHMENT1) )
+            glBlendFuncSeparatei( 0, GL_SRC_ALPHA, GL_ONE, GL_ONE, GL_ONE )
+            glBlendFunci( 1, GL_ZERO, GL_ONE_MINUS_SRC_ALPHA )
+        elif target == 0:
+            glDrawBuffer( GL_COLOR_ATTACHMENT0 )
+            glBlendFuncSeparate( GL_SRC_ALPHA, GL_ONE, GL_ONE, GL_ONE )
+        else:
+            glDrawBuffer( GL_COLOR_ATTACHMENT1 )
+            glBlendFunc( GL_ZERO, GL_ONE_MINUS_SRC_ALPHA )
+    def restore( self ):
+        """Restore the framebuffer bindings and draw buffer recorded by begin"""
+        read,draw,drawBuffer = self.previous
+        glBindFramebuffer( GL_READ_FRAMEBUFFER, read )
+        glBindFramebuffer( GL_DRAW_FRAMEBUFFER, draw )
+        glDrawBuffer( drawBuffer )
+    def end( self ):
+        """Return to rendering to the framebuffer in use before begin"""
+        self.restore()
+        glViewport( *self.viewport )
+        glDepthMask( 1 )
+        glDisable( GL_BLEND )
+    def compile( self ):
+        """Compile our compositing program and screen triangle"""
+        self.program = shaders.compileProgram(
+            shaders.compileShader( VERTEX_SHADER, GL_VERTEX_SHADER ),
+            shaders.compileShader( FRAGMENT_SHADER, GL_FRAGMENT_SHADER ),
+        )
+        self.vertices = vbo.VBO( SCREEN_TRIANGLE )
+        self.vao = glGenVertexArrays( 1 )
+        glBindVertexArray( self.vao )
+        self.vertices.bind()
+        location = glGetAttribLocation( self.program, 'vertex' )
+        glEnableVertexAttribArray( location )
+        glVertexAttribPointer( location, 2, GL_FLOAT, GL_FALSE, 0, None )
+        glBindVertexArray( 0 )
+        self.vertices.unbind()
+        glUseProgram( self.program )
+        glUniform1i( glGetUniformLocation( self.program, 'accumulation' ), 0 )
+        glUniform1i( glGetUniformLocation( self.program, 'revealage' ), 1 )
+        glUseProgram( 0 )
+    def composite( self ):
+        """Blend the accumulated transparency over the current framebuffer"""
+        if self.program is None:
+            self.compile()
+        glPushAttrib( GL_ENABLE_BIT|GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT )
+        try:
+            glDisable( GL_DEPTH_TEST )
+            glEnable( GL_BLEND )
+            glBlendFunc( GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA )
+            glUseProgram( self.program )
+            for unit,texture in enumerate( self.textures ):
+                glActiveTexture( GL_TEXTURE0 + unit )
+                glBindTexture( GL_TEXTURE_2D, texture )
+            glBindVertexArray( self.vao )
+            glDrawArrays( GL_TRIANGLES, 0, 3 )
+        finally:
+            glBindVertexArray( 0 )
+            for unit in (1,0):
+                glActiveTexture( GL_TEXTURE0 + unit )
+                glBindTexture( GL_TEXTURE_2D, 0 )
+            glUseProgram( 0 )
+            glPopAttrib()
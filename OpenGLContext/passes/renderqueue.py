@@ -0,0 +1,112 @@
+"""State-sorted render queue for opaque geometry
+
+The flat passes' render set is ordered by Shape.sortKey, which for
+opaque geometry is essentially a distance sort.  That order rebinds
+shader programs, textures and materials over and over.  The
+RenderQueue re-orders the opaque records into buckets which share
+(program, texture set, material) state, ordered front-to-back within
+each bucket, so each state change happens once per bucket.
+
+Rendering nodes describe their state via a stateKey( mode ) method
+returning (program, textures, material) where each element is a
+hashable token (normally an id() or OpenGL object name), nodes
+without the method are treated as using no program, textures or
+material.
+
+Transparent records are not touched, they must remain in their
+back-to-front order.
+"""
+import logging
+log = logging.getLogger( __name__ )
+
+NULL_STATE = (None,(),None)
+
+def stateKey( path, mode ):
+    """Get the (program,textures,material) state key for a render path"""
+    method = getattr( path[-1], 'stateKey', None )
+    if method is None:
+        return NULL_STATE
+    return method( mode )
+
+class StateCounters( object ):
+    """Counts of render-state changes for a sequence of state keys
+
+    programSwitches -- number of times the program changed
+    textureBinds -- number of texture units whose texture changed
+    materialChanges -- number of times the material changed
+    """
+    def __init__( self, keys=() ):
+        self.programSwitches = 0
+        self.textureBinds = 0
+        self.materialChanges = 0
+        self.count( keys )
+    def count( self, keys ):
+        """Add the state changes required to render keys in order"""
+        program,textures,material = NULL_STATE
+        for (newProgram,newTextures,newMaterial) in keys:
+            if newProgram != program:
+                self.programSwitches += 1
+                program = newProgram
+            if newTextures != textures:
+                for index,texture in enumerate( newTextures ):
+                    if index >= len(textures) or textures[index] != texture:
+                        self.textureBinds += 1
+                textures = newTextures
+            if newMaterial != material:
+                self.materialChanges += 1
+                material = newMaterial
+        return self
+    def total( self ):
+        return self.programSwitches + self.textureBinds + self.materialChanges
+    def __repr__( self ):
+        return '%s( programSwitches=%s, textureBinds=%s, materialChanges=%s )'%(
+            self.__class__.__name__,
+            self.programSwitches, self.textureBinds, self.materialChanges,
+        )
+
+class RenderQueue( object ):
+    """Orders opaque render records to minimise state changes
+
+    Buckets are nested (program, then texture set, then material)
+    so that the most expensive changes are the least frequent,
+    and at each level the bucket holding the nearest geometry is
+    rendered first to preserve as much of the front-to-back
+    (early depth-rejection) benefit as possible.
+
+    Attributes (for the last queued frame):
+        counters -- StateCounters for the state-sorted order
+        unsortedCounters -- StateCounters for the incoming order
+    """
+    def __init__( self ):
+        self.counters = StateCounters()
+        self.unsortedCounters = StateCounters()
+    def opaque( self, records, mode ):
+        """Produce state-sorted list of the opaque records
+
+        records -- FlatPass render records, (key,mv,tm,bv,path),
+            where key[0] is the transparency flag and key[2] is
+            the distance (front-to-back) for opaque records
+        """
+        opaque = [record for record in records if not record[0][0]]
+        keyed = [
+            (stateKey( record[-1], mode ),record)
+            for record in opaque
+        ]
+        self.unsortedCounters = StateCounters( [key for key,record in keyed] )
+        # front-to-back, so first-seen ranks reflect nearest members
+        keyed.sort( key = lambda x: x[1][0][2] )
+        ranks = {}
+        ordered = []
+        for key,record in keyed:
+            program,textures,material = key
+            rank = []
+            for level in ((program,),(program,textures),key):
+                current = ranks.get( level )
+                if current is None:
+                    current = ranks[level] = len(ranks)
+                rank.append( current )
+            ordered.append( (rank,key,record) )
+        # stable, so front-to-back is retained within buckets
+        ordered.sort( key = lambda x: x[0] )
+        self.counters = StateCounters( [key for rank,key,record in ordered] )
+        return [record for rank,key,record in ordered]
@@ -0,0 +1,290 @@
+"""CPU (software) occlusion culling for the flat rendering passes
+
+Hardware occlusion queries (see AABoundingBox.occlusionVisible) stall
+the pipeline and are unavailable on some software-GL deployments.
+SoftwareOcclusion instead works entirely with NumPy:
+
+    * the largest, nearest opaque "occluders" (geometry which can
+      provide exact convex polygons via occluderPolygons( mode ),
+      such as Box) are rasterized into a low-resolution depth buffer
+    * a hierarchical max-depth pyramid is built from the buffer
+    * every other record's (world-space) bounding box is projected
+      to a screen-space rectangle and minimum depth, the rectangle
+      is looked up in the pyramid level at which it covers at most
+      4x4 texels, and the record is culled if the box is
+      behind the farthest occluder depth over the whole rectangle
+
+The culler is conservative.  Occluder pixels are only written if
+the pixel is entirely covered by an occluder polygon, using the
+polygon's greatest depth over the pixel.  Boxes which cross the
+near plane are always considered visible, as are records without
+an 8-point bounding box.
+
+Depths are window-space depths (0 at the near plane, 1 at the far).
+"""
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph import boundingvolume
+import logging
+log = logging.getLogger( __name__ )
+
+class SoftwareOcclusion( object ):
+    """NumPy depth-buffer/depth-pyramid occlusion culler
+
+    WIDTH -- width of the depth buffer in pixels (the height is
+        chosen from the viewport's aspect ratio)
+    MAX_OCCLUDERS -- maximum number of occluders rasterized per frame
+    MIN_OCCLUDER_AREA -- fraction of the screen which a record's
+        projected bounds must cover for it to be an occluder
+
+    Statistics for the last filter call:
+        occluders -- number of occluders rasterized
+        tested -- number of records tested against the pyramid
+        culled -- number of records culled
+    """
+    WIDTH = 128
+    MAX_OCCLUDERS = 32
+    MIN_OCCLUDER_AREA = 0.002
+    NEAR_W = 1e-6
+    def __init__( self, width=None ):
+        if width is not None:
+            self.WIDTH = width
+        self.occluders = self.tested = self.culled = 0
+        self.depth = None
+        self.pyramid = []
+
+    def filter( self, records, projection, viewport ):
+        """Remove records hidden behind occluders
+
+        records -- FlatPass render records (key,mv,tm,bv,path)
+        projection -- projection matrix for the frame
+        viewport -- (x,y,width,height) viewport for the frame
+
+        returns the visible records in their original order
+        """
+        self.occluders = self.tested = self.culled = 0
+        width = int(self.WIDTH)
+        height = max( (1,int(round( width * float(viewport[3])/max((viewport[2],1)) ))))
+        self.depth = ones( (height,width), 'f' )
+        self.pyramid = []
+        boxed = []
+        points = []
+        modelViews = []
+        for index,(key,mv,tm,bv,path) in enumerate( records ):
+            if isinstance( bv, boundingvolume.BoundingBox ):
+                bvPoints = bv.getPoints()
+                if len(bvPoints) == 8:
+                    boxed.append( index )
+                    points.append( bvPoints )
+                    modelViews.append( mv )
+        if not boxed:
+            return records
+        matrices = matmul( asarray( modelViews, 'f' ), asarray( projection, 'f' ))
+        rects,nearest,clipped = self.screenBounds(
+            matrices, asarray( points, 'f' ), width, height
+        )
+        occluders = set()
+        for position in self.selectOccluders(
+            records, boxed, rects, clipped, width, height
+        ):
+            if occluders and not self.rectVisible(
+                rects[position], nearest[position], [self.depth]
+            ):
+                # already hidden by a larger occluder, test it normally
+                continue
+            key,mv,tm,bv,path = records[boxed[position]]
+            polygons = path[-1].occluderPolygons( self )
+            if polygons and self.rasterize( polygons, matrices[position], width, height ):
+                occluders.add( position )
+                if len(occluders) >= self.MAX_OCCLUDERS:
+                    break
+        self.occluders = len(occluders)
+        if not occluders:
+            return records
+        self.pyramid = self.buildPyramid( self.depth )
+        culled = set()
+        for position,index in enumerate( boxed ):
+            if position in occluders or clipped[position]:
+                continue
+            self.tested += 1
+            if not self.rectVisible( rects[position], nearest[position] ):
+                culled.add( index )
+        self.culled = len(culled)
+        if not culled:
+            return records
+        return [
+            record for (index,record) in enumerate( records )
+            if index not in culled
+        ]
+
+    def project( self, points, matrices, width, height ):
+        """Project stacked homogeneous points into buffer coordinates
+
+        points -- (N,M,4) local-space points
+        matrices -- (N,4,4) local-to-clip matrices
+
+        returns ((N,M,3) pixel x, pixel y, window depth, (N,) clipped)
+        where clipped is True if any point is at/behind the near plane
+        """
+        transformed = matmul( points, matrices )
+        w = transformed[...,3]
+        clipped = (w <= self.NEAR_W).any( axis=-1 )
+        w = where( w <= self.NEAR_W, self.NEAR_W, w )
+        ndc = transformed[...,:3] / w[...,newaxis]
+        clipped |= (ndc[...,2] < -1.0).any( axis=-1 )
+        result = empty( ndc.shape, 'f' )
+        result[...,0] = (ndc[...,0]+1.0) * (width/2.0)
+        result[...,1] = (ndc[...,1]+1.0) * (height/2.0)
+        result[...,2] = (ndc[...,2]+1.0) / 2.0
+        return result,clipped
+    def screenBounds( self, matrices, points, width, height ):
+        """Calculate screen rectangles and nearest depths for boxes
+
+        returns ((N,4) float (x0,y0,x1,y1) rects, (N,) nearest depth,
+        (N,) clipped flags)
+        """
+        projected,clipped = self.project( points, matrices, width, height )
+        lower = projected.min( axis=1 )
+        upper = projected.max( axis=1 )
+        rects = concatenate( (lower[:,:2],upper[:,:2]), axis=1 )
+        return rects,lower[:,2],clipped
+    def selectOccluders( self, records, boxed, rects, clipped, width, height ):
+        """Find potential occluder records, largest first
+
+        Candidates are opaque, do not cross the near plane, cover
+        at least MIN_OCCLUDER_AREA of the screen and have an
+        occluderPolygons method.
+
+        returns list of positions (in boxed) of the candidates
+        """
+        widths = clip( rects[:,2], 0, width ) - clip( rects[:,0], 0, width )
+        heights = clip( rects[:,3], 0, height ) - clip( rects[:,1], 0, height )
+        areas = (widths * heights).tolist()
+        candidates = []
+        minimum = self.MIN_OCCLUDER_AREA * width * height
+        for position,index in enumerate( boxed ):
+            if clipped[position] or areas[position] < minimum:
+                continue
+            key,mv,tm,bv,path = records[index]
+            if key[0] or not hasattr( path[-1], 'occluderPolygons' ):
+                continue
+            candidates.append( (-areas[position],position) )
+        candidates.sort()
+        return [position for (area,position) in candidates]
+
+    def rasterize( self, polygons, matrix, width, height ):
+        """Rasterize convex polygons into our depth buffer
+
+        polygons -- sequence of (K,3) local-space convex polygons
+        matrix -- local-to-clip matrix for the polygons
+
+        Only pixels completely covered by a polygon are written, each
+        with the polygon's greatest depth over the pixel, so the
+        buffer never claims more occlusion than really exists.
+
+        returns number of polygons rasterized
+        """
+        count = 0
+        depth = self.depth
+        for polygon in polygons or ():
+            polygon = asarray( polygon, 'f' )
+            homogeneous = ones( (len(polygon),4), 'f' )
+            homogeneous[:,:3] = polygon[:,:3]
+            projected,clipped = self.project(
+                homogeneous[newaxis], matrix[newaxis], width, height
+            )
+            if clipped[0]:
+                continue
+            projected = projected[0].astype('d')
+            xs,ys,zs = projected[:,0],projected[:,1],projected[:,2]
+            x0 = max( (int(floor(xs.min())),0) )
+            x1 = min( (int(ceil(xs.max())),width) )
+            y0 = max( (int(floor(ys.min())),0) )
+            y1 = min( (int(ceil(ys.max())),height) )
+            if x1 <= x0 or y1 <= y0:
+                continue
+            # signed area gives the winding...
+            area = (
+                dot( xs, roll( ys, -1 )) - dot( ys, roll( xs, -1 ))
+            )
+            if abs( area ) < 1e-9:
+                continue
+            sign = 1.0 if area > 0 else -1.0
+            # depth plane z = a*x + b*y + c from the projected points
+            plane = self.depthPlane( projected )
+            if plane is None:
+                continue
+            cornerY,cornerX = mgrid[y0:y1+1,x0:x1+1].astype('d')
+            inside = ones( cornerX.shape, 'bool' )
+            for i in range( len(projected) ):
+                ax,ay = xs[i],ys[i]
+                bx,by = xs[(i+1)%len(xs)],ys[(i+1)%len(ys)]
+                inside &= (
+                    sign*((bx-ax)*(cornerY-ay) - (by-ay)*(cornerX-ax)) >= 0
+                )
+            covered = inside[:-1,:-1] & inside[1:,:-1] & inside[:-1,1:] & inside[1:,1:]
+            if not covered.any():
+                continue
+            cornerZ = plane[0]*cornerX + plane[1]*cornerY + plane[2]
+            pixelZ = maximum(
+                maximum( cornerZ[:-1,:-1], cornerZ[1:,:-1] ),
+                maximum( cornerZ[:-1,1:], cornerZ[1:,1:] ),
+            )
+            region = depth[y0:y1,x0:x1]
+            region[...] = where(
+                covered, minimum( region, pixelZ.astype('f') ), region
+            )
+            count += 1
+        return count
+    def depthPlane( self, projected ):
+        """Calculate (a,b,c) for z = a*x + b*y + c or None if degenerate"""
+        p0 = projected[0]
+        for i in range( 1, len(projected)-1 ):
+            e1 = projected[i] - p0
+            e2 = projected[i+1] - p0
+            normal = cross( e1, e2 )
+            if abs( normal[2] ) > 1e-9:
+                a = -normal[0]/normal[2]
+                b = -normal[1]/normal[2]
+                return a, b, p0[2] - a*p0[0] - b*p0[1]
+        return None
+
+    def buildPyramid( self, depth ):
+        """Build max-depth mip-pyramid, level 0 is depth itself
+
+        Odd dimensions are padded with the far depth (1.0), which
+        can only make the pyramid more conservative.
+        """
+        pyramid = [depth]
+        while depth.shape[0] > 1 or depth.shape[1] > 1:
+            height,width = depth.shape
+            if height % 2 or width % 2:
+                padded = ones( (height + height%2, width + width%2), 'f' )
+                padded[:height,:width] = depth
+                depth = padded
+            depth = maximum(
+                maximum( depth[0::2,0::2], depth[1::2,0::2] ),
+                maximum( depth[0::2,1::2], depth[1::2,1::2] ),
+            )
+            pyramid.append( depth )
+        return pyramid
+    def rectVisible( self, rect, nearest, pyramid=None ):
+        """Test whether screen rect at depth nearest might be visible
+
+        pyramid -- depth pyramid to use, by default self.pyramid
+        """
+        if pyramid is None:
+            pyramid = self.pyramid
+        height,width = self.depth.shape
+        x0 = max( (int(floor(rect[0])),0) )
+        y0 = max( (int(floor(rect[1])),0) )
+        x1 = min( (int(ceil(rect[2])),width) ) - 1
+        y1 = min( (int(ceil(rect[3])),height) ) - 1
+        if x1 < x0 or y1 < y0:
+            # off-screen, leave it to the frustum culling
+            return True
+        level = 0
+        while level < len(pyramid)-1 and max( (x1-x0,y1-y0) ) > 3:
+            x0,y0,x1,y1 = x0 >> 1, y0 >> 1, x1 >> 1, y1 >> 1
+            level += 1
+        farthest = pyramid[level][y0:y1+1,x0:x1+1].max()
+        return nearest <= farthest
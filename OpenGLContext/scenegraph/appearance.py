@@ -65,6 +65,20 @@ class Appearance(basenodes.Appearance):
                 self.textureTransform.renderPost(textureToken,mode=mode)
             self.texture.renderPost(mode=mode)
 
+    def stateKey( self, mode ):
+        """Produce the (program, textures, material) render-state key
+
+        Used by the render queue to bucket opaque geometry which
+        shares texture and material state, legacy appearances have
+        no shader program.
+        """
+        textures = ()
+        if self.texture:
+            textures = (id(self.texture),)
+        material = None
+        if self.material:
+            material = id(self.material)
+        return (None, textures, material)
     def sortKey( self, mode, matrix ):
         """Produce the sorting key for this shape's appearance/shaders/etc
         
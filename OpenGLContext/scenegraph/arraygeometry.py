@@ -1,7 +1,7 @@
 """Vertex-array-based geometry node for faces, lines and points"""
 from OpenGL.GL import *
 from ..arrays import *
-from . import polygonsort
+from . import polygonsort, vertexformat
 from .. import triangleutilities
 from OpenGL.arrays import vbo
 import logging
@@ -42,7 +42,11 @@ class ArrayGeometry(object):
     cached using the cache module, and regenerated if
     the holding object changes field values or is
     deleted.
+
+    sorter -- polygonsort.IncrementalSorter for transparent
+        rendering, created on first use
     """
+    sorter = None
     def __init__ (
         self,
         vertexArray,# array of vertex coordinates to draw
@@ -57,6 +61,7 @@ class ArrayGeometry(object):
         count = -1, # by default, render the whole array (len(vertexArray)), see glDrawArrays
         ccw = 1, # determines winding direction
         solid = 1, # whether backspace culling may be enabled
+        vertexFormat = None, # optional vertexformat.VertexFormat
     ):
         """Initialize the ArrayGeometry
 
@@ -81,17 +86,29 @@ class ArrayGeometry(object):
             see glFrontFace
         solid = 1 -- whether backspace culling should be enabled
             see glEnable( GL_CULL_FACE )
+        vertexFormat = None -- vertexformat.VertexFormat with which
+            to pack (quantize) the arrays, by default all arrays are
+            uploaded as float32.  The float32 vertices are retained
+            as vertexData (e.g. for transparent sorting).
         """
         log.debug( 'New array geometry node' )
         if FORCE_CONTIGUOUS:
             if vertexArray is not None and len(vertexArray):
-                vertexArray = contiguous( vertexArray )
+                vertexArray = self.contiguous( vertexArray )
             if colorArray  is not None and len(colorArray):
-                colorArray = contiguous( colorArray )
+                colorArray = self.contiguous( colorArray )
             if normalArray is not None and len(normalArray):
-                normalArray = contiguous( normalArray )
+                normalArray = self.contiguous( normalArray )
             if textureCoordinateArray is not None and len(textureCoordinateArray):
-                textureCoordinateArray = contiguous( textureCoordinateArray )
+                textureCoordinateArray = self.contiguous( textureCoordinateArray )
+        self.vertexData = vertexArray
+        self.vertexFormat = vertexFormat
+        self.formats = {}
+        if vertexFormat is not None:
+            vertexArray = self._pack( 'vertices', vertexArray )
+            colorArray = self._pack( 'colours', colorArray )
+            normalArray = self._pack( 'normals', normalArray )
+            textureCoordinateArray = self._pack( 'textures', textureCoordinateArray )
         if vbo.get_implementation():
             log.debug( "VBO implementation available" )
             if vertexArray is not None and len(vertexArray):
@@ -115,6 +132,79 @@ class ArrayGeometry(object):
         else:
             self.ccw = GL_CW
         self.solid = solid
+    def contiguous( self, source ):
+        """Get a contiguous copy of source for rendering"""
+        return contiguous( source )
+    PACKERS = {
+        'vertices': 'packPositions',
+        'colours': 'packColours',
+        'normals': 'packNormals',
+        'textures': 'packTextures',
+    }
+    def _pack( self, name, values ):
+        """Pack values for attribute name with our vertexFormat
+
+        Records the vertexformat.PackedArray in formats[name],
+        returns the array to upload (values if not packed)
+        """
+        if values is None or not len(values):
+            return values
+        packed = getattr( self.vertexFormat, self.PACKERS[name] )( values )
+        if packed is None:
+            return values
+        self.formats[name] = packed
+        return packed.data
+    def _repack( self, name, values ):
+        """Pack updated values the same way as the current array (or None)"""
+        current = self.formats.get( name )
+        if current is None:
+            return values
+        packed = getattr( self.vertexFormat, self.PACKERS[name] )( values )
+        if packed is None or packed.glType != current.glType or packed.offset is not None:
+            return None
+        return packed.data
+    def memoryUsage( self ):
+        """Bytes (of GPU memory) used by each of our arrays"""
+        return dict([
+            (name, vertexformat.arrayBytes( getattr( self, name )))
+            for name in ('vertices','colours','normals','textures')
+        ])
+    def updateArrays( self, vertexArray, normalArray=None ):
+        """Replace vertex (and optionally normal) data in-place
+
+        Used when only the coordinates of the source geometry
+        have changed.  The arrays must match the current arrays'
+        shapes, VBO-backed arrays are re-uploaded with
+        glBufferSubData on their next bind.
+
+        returns True if updated, False if the geometry must be
+        rebuilt instead
+        """
+        vertexArray = asarray( vertexArray, 'f' )
+        if not self._assign( self.vertices, self._repack( 'vertices', vertexArray )):
+            return False
+        if normalArray is not None and not self._assign(
+            self.normals, self._repack( 'normals', normalArray )
+        ):
+            return False
+        self.vertexData = vertexArray
+        if self.sorter is not None:
+            # topology is unchanged, the previous order is a good start
+            self.sorter.setCenters( self.polygonCenters() )
+        return True
+    def _assign( self, target, source ):
+        """Copy source into (possibly VBO) array target if shapes match"""
+        if target is None or source is None:
+            return False
+        current = getattr( target, 'data', target )
+        if not current.flags.writeable:
+            # e.g. memory-mapped from the geometry cache
+            return False
+        source = asarray( source, typeCode( current ) )
+        if source.shape != current.shape:
+            return False
+        target[:] = source
+        return True
     def callBound( self, function, array ):
         if hasattr( array, 'bind' ):
             array.bind()
@@ -124,6 +214,24 @@ class ArrayGeometry(object):
                 array.unbind()
         else:
             return function(array)
+    def setPointer( self, name, floatFunction, function ):
+        """Set the array pointer for attribute name
+
+        Float arrays use floatFunction (e.g. glVertexPointerf),
+        packed arrays (see formats) use function with the packed
+        size, type and stride.
+        """
+        array = getattr( self, name )
+        packed = self.formats.get( name )
+        if packed is None:
+            return self.callBound( floatFunction, array )
+        if function is glNormalPointer:
+            arguments = (packed.glType, packed.stride)
+        else:
+            arguments = (packed.size, packed.glType, packed.stride)
+        return self.callBound(
+            lambda array: function( *(arguments + (array,)) ), array
+        )
     def render (
             self,
             visible = 1, # can skip normals and textures if not
@@ -140,22 +248,23 @@ class ArrayGeometry(object):
         if not len(self.vertices):
             return 1 # we are already finished
         vboAvailable = bool(vbo.get_implementation())
+        decoded = False
         glPushClientAttrib(GL_CLIENT_ALL_ATTRIB_BITS)
         glPushAttrib(GL_ALL_ATTRIB_BITS)
         try:
             glEnableClientState( GL_VERTEX_ARRAY )
-            self.callBound( glVertexPointerf, self.vertices)
+            self.setPointer( 'vertices', glVertexPointerf, glVertexPointer )
             if visible and self.colours is not None:
                 # make the color field alter the diffuse color, should instead be aware of current material/lighting...
                 glColorMaterial( GL_FRONT_AND_BACK, GL_DIFFUSE)
                 glEnable( GL_COLOR_MATERIAL )
                 glEnableClientState( GL_COLOR_ARRAY )
-                self.callBound( glColorPointerf, self.colours)
+                self.setPointer( 'colours', glColorPointerf, glColorPointer )
 #			else:
 #				glDisableClientState( GL_COLOR_ARRAY )
             if lit and self.normals is not None:
                 glEnableClientState( GL_NORMAL_ARRAY )
-                self.callBound( glNormalPointerf, self.normals)
+                self.setPointer( 'normals', glNormalPointerf, glNormalPointer )
                 glEnable(GL_NORMALIZE); # should do this explicitly eventually
             else:
                 glDisable( GL_LIGHTING )
@@ -163,7 +272,9 @@ class ArrayGeometry(object):
                 
             if visible and textured and self.textures is not None:
                 glEnableClientState( GL_TEXTURE_COORD_ARRAY )
-                self.callBound( glTexCoordPointerf, self.textures )
+                self.setPointer( 'textures', glTexCoordPointerf, glTexCoordPointer )
+                if 'textures' in self.formats:
+                    decoded = self.formats['textures'].decode()
 #			else:
 #				glDisableClientState( GL_TEXTURE_COORD_ARRAY )
             glFrontFace( self.ccw)
@@ -172,12 +283,14 @@ class ArrayGeometry(object):
             else:
                 glDisable( GL_CULL_FACE )
             # do the actual rendering
-            if visible and transparent:
+            if visible and transparent and getattr( mode, 'sortTransparent', True ):
                 self.drawTransparent( mode = mode )
             else:
                 self.draw()
             # cleanup the environment
         finally:
+            if decoded:
+                vertexformat.PackedArray.undecode()
             glPopAttrib()
             glPopClientAttrib()
         return 1
@@ -189,6 +302,9 @@ class ArrayGeometry(object):
 #		log.debug( 'Drawing array geometry: %s, %s', self.arguments, len(self.vertices) )
         glDrawArrays( *self.arguments )
 #		log.debug( 'Finished array geometry' )
+    def polygonCenters( self ):
+        """Centers of our triangles (for sorting)"""
+        return triangleutilities.centers( self.vertexData )
     def drawTransparent( self, mode ):
         """Same as draw, but called when a transparent render is required
 
@@ -198,21 +314,176 @@ class ArrayGeometry(object):
         It does not provide for automatically tesselating
         intersecting transparent polygons, so there will
         be potential rendering artifacts.
+
+        The order is kept by a polygonsort.IncrementalSorter, so
+        it is only repaired (rather than re-calculated) as the
+        view changes.
         """
-        if not hasattr( self, 'centers'):
-            self.centers = triangleutilities.centers( self.vertices )
-        indices = polygonsort.indices(
-            polygonsort.distances(
-                self.centers, 
-                modelView = mode.getModelView(),
-                projection = mode.getProjection(),
-                viewport = mode.getViewport(),
+        objectType = self.arguments[0]
+        assert objectType == GL_TRIANGLES, """Only triangles are sortable, a non-triangle mesh was told to be transparent!"""
+        if self.sorter is None:
+            self.sorter = polygonsort.IncrementalSorter(
+                self.polygonCenters(), arange( len(self.vertexData) ),
             )
-        ).astype( 'I' )
+        self.sorter.draw(
+            objectType,
+            mode.getModelView(),
+            mode.getProjection(),
+            mode.getViewport(),
+        )
+
+
+def weldVertices( *arrays ):
+    """Merge identical vertices of expanded (per-corner) arrays
+
+    arrays -- equal-length per-corner arrays (e.g. vertex, normal,
+        colour, texture-coordinate), None entries are ignored
+
+    Corners are identical if all of their (float32) values are
+    identical, so two uses of a coordinate with different generated
+    normals (i.e. across a crease) remain separate vertices.
+
+    returns (indices, compact) where compact is the list of arrays
+    (None entries retained) holding each distinct vertex once, in
+    order of first use, and compact[i][indices] == arrays[i]
+    """
+    present = [
+        reshape( asarray( a, 'f' ), (len(a),-1) )
+        for a in arrays if a is not None
+    ]
+    if not present or not len(present[0]):
+        return zeros( (0,), 'I' ), list( arrays )
+    widths = [a.shape[1] for a in present]
+    stacked = ascontiguousarray( concatenate( present, axis=1 ))
+    rows = stacked.view( dtype( (void, stacked.dtype.itemsize * stacked.shape[1]) ) ).ravel()
+    distinct,first,inverse = unique( rows, return_index=True, return_inverse=True )
+    # re-number the vertices in order of first use
+    order = argsort( first )
+    rank = empty( (len(order),), 'I' )
+    rank[order] = arange( len(order), dtype='I' )
+    indices = rank[ravel(inverse)]
+    compactRows = stacked[first[order]]
+    compact = []
+    offset = 0
+    widths = iter( widths )
+    for a in arrays:
+        if a is None:
+            compact.append( None )
+            continue
+        width = next( widths )
+        compact.append( ascontiguousarray( compactRows[:,offset:offset+width] ))
+        offset += width
+    return indices, compact
+
+class IndexedArrayGeometry( ArrayGeometry ):
+    """ArrayGeometry drawing a compact vertex set via an index array
+
+    The IndexedFaceSet ArrayGeometryCompiler welds identical triangle
+    corners (see weldVertices) so that smooth meshes carry each
+    vertex once, with a 16-bit (if there are fewer than 65536
+    vertices) or 32-bit index array drawn with glDrawElements.
+
+    expandedBytes -- bytes the expanded (per-corner) arrays required
+    compactBytes -- bytes of the compact arrays plus index array
+    """
+    expandedBytes = compactBytes = 0
+    def __init__ (
+            self,
+            vertexArray,
+            colorArray= None,
+            normalArray= None,
+            textureCoordinateArray= None,
+            indices = None, # per-corner indices into the arrays
+            objectType= GL_TRIANGLES,
+            ccw = 1,
+            solid = 1,
+            expandedBytes = 0,
+            vertexFormat = None,
+        ):
+        """Initialize the IndexedArrayGeometry
+
+        indices -- per-corner indices into the (compact) arrays,
+            stored as unsigned short or unsigned int depending on
+            the number of vertices
+
+        see ArrayGeometry for the other arguments
+        """
+        indices,self.indexType = vertexformat.indexArray( indices, len(vertexArray) )
+        self.indexData = indices
+        self.expandedBytes = expandedBytes
+        super( IndexedArrayGeometry, self ).__init__(
+            vertexArray, colorArray, normalArray, textureCoordinateArray,
+            objectType = objectType, count = len(indices), ccw=ccw, solid=solid,
+            vertexFormat = vertexFormat,
+        )
+        if vbo.get_implementation():
+            indices = vbo.VBO( indices, target = GL_ELEMENT_ARRAY_BUFFER )
+        self.indices = indices
+        self.compactBytes = sum( list( self.memoryUsage().values() ))
+    def memoryUsage( self ):
+        """Bytes (of GPU memory) used by each of our arrays, including indices"""
+        usage = super( IndexedArrayGeometry, self ).memoryUsage()
+        usage['indices'] = vertexformat.arrayBytes( self.indexData )
+        return usage
+    def updateArrays( self, vertexArray, normalArray=None ):
+        """Update from new expanded (per-corner) vertex/normal arrays
+
+        The new values are gathered at the first corner of each
+        welded vertex.  If the corners of a welded vertex no longer
+        agree (e.g. coincident points have moved apart, or a crease
+        has appeared) the vertices must be re-welded, so False is
+        returned.
+        """
+        corners = self.firstCorners()
+        compact = [asarray( vertexArray, 'f' )[corners]]
+        expanded = [vertexArray]
+        if normalArray is not None:
+            compact.append( asarray( normalArray, 'f' )[corners] )
+            expanded.append( normalArray )
+        for values,full in zip( compact, expanded ):
+            if len(full) != len(self.indexData) or not (values[self.indexData] == full).all():
+                return False
+        return super( IndexedArrayGeometry, self ).updateArrays( *compact )
+    def firstCorners( self ):
+        """Index of the first (expanded) corner using each vertex"""
+        corners = getattr( self, '_firstCorners', None )
+        if corners is None:
+            corners = zeros( (len(self.vertexData),), 'I' )
+            reverse = arange( len(self.indexData)-1, -1, -1, dtype='I' )
+            corners[self.indexData[::-1]] = reverse
+            self._firstCorners = corners
+        return corners
+    def contiguous( self, source ):
+        """Use source directly if possible (our arrays are never shared)
+
+        Avoids copying arrays memory-mapped from the geometry cache.
+        """
+        return ascontiguousarray( source )
+    @property
+    def savedBytes( self ):
+        """Bytes saved by indexing rather than expanding the arrays"""
+        return self.expandedBytes - self.compactBytes
+    def draw( self ):
+        """Draw our triangles with glDrawElements"""
+        objectType,startIndex,count = self.arguments
+        self.callBound(
+            lambda indices: glDrawElements( objectType, count, self.indexType, indices ),
+            self.indices,
+        )
+    def polygonCenters( self ):
+        """Centers of our triangles (for sorting)"""
+        return triangleutilities.centers( self.vertexData[self.indexData] )
+    def drawTransparent( self, mode ):
+        """Draw our triangles sorted back-to-front (see ArrayGeometry)"""
         objectType = self.arguments[0]
         assert objectType == GL_TRIANGLES, """Only triangles are sortable, a non-triangle mesh was told to be transparent!"""
-        glDrawElementsui(
+        if self.sorter is None:
+            self.sorter = polygonsort.IncrementalSorter(
+                self.polygonCenters(), self.indexData,
+            )
+        self.sorter.draw(
             objectType,
-            indices
+            mode.getModelView(),
+            mode.getProjection(),
+            mode.getViewport(),
         )
-        
@@ -1,14 +1,22 @@
 """VRML97 Billboard-node stub"""
 from vrml.vrml97 import basenodes, nodetypes
+from vrml import cache
 from OpenGLContext.scenegraph import grouping
 
 class Billboard(grouping.Grouping, basenodes.Billboard):
     """Billboard node based on VRML 97 LOD
 
     (This is just a stub-node!)
-    
+
     Reference:
         http://www.web3d.org/x3d/specifications/vrml/ISO-IEC-14772-IS-VRML97WithAmendment1/part1/nodesRef.html#Billboard
     """
     def transform( self, mode=None, translate=1, scale=1, rotate=1 ):
-        pass
\ No newline at end of file
+        pass
+    def localMatrices( self, translate=True,scale=True,rotate=True ):
+        """Stub has no local transform, so (forward,inverse) are both None"""
+        key=('local_matrices',translate,scale,rotate)
+        holder = cache.CACHE.getHolder( self, key=key )
+        if holder is None:
+            holder = cache.CACHE.holder( self, (None,None), key=key )
+        return holder
@@ -32,7 +32,8 @@ from vrml.vrml97 import nodetypes
 from vrml import node, field, protofunctions, cache
 from OpenGLContext import frustum, utilities, doinchildmatrix
 from OpenGL.extensions import alternate
-import logging
+from pydispatch import dispatcher
+import logging, weakref
 
 log = logging.getLogger(__name__)
 
@@ -369,6 +370,47 @@ class AABoundingBox(BoundingBox):
         )
 
 
+def visibleMask(frust, points, matrices):
+    """Test many point-based bounding boxes against frustum at once
+
+    This is the batched equivalent of BoundingBox.visible,
+    all of the boxes are transformed with a single stacked
+    matrix multiply and all clipping planes are tested with a few array
+    operations, so no C extension (frustcullaccel) is needed
+    to get acceptable performance on large scenes.
+
+    frust -- Frustum object holding the clipping planes
+        for the view
+    points -- (N,M,4) array (or sequence of N (M,4) arrays)
+        of homogeneous box points, normally the 8 corners
+        returned by AABoundingBox.getPoints()
+    matrices -- (N,4,4) array (or sequence of N 4x4 matrices)
+        which transform each box's local coordinates to the
+        coordinate system in which the frustum is defined.
+
+    returns (N,) boolean array, True for each box which is
+    (potentially) visible, i.e. which is not entirely on the
+    far side of any single clipping plane.
+    """
+    points = asarray(points, "f")
+    if not len(points):
+        return zeros((0,), "bool")
+    if not frust:
+        log.warning(
+            """visibleMask called with Null frustum""",
+        )
+        return ones((len(points),), "bool")
+    matrices = asarray(matrices, "f")
+    # stacked (N,M,4)x(N,4,4) product, i.e. einsum("nmi,nij->nmj")
+    transformed = matmul(points, matrices)
+    transformed[..., 3] = 1.0
+    planes = asarray(frust.planes, "f")
+    # (N,M,P) signed distances of every point from every plane
+    distances = dot(transformed, planes.T)
+    # a plane eliminates a box iff no point is in front of it...
+    return (distances >= 0).any(axis=1).all(axis=1)
+
+
 def volumeFromCoordinate(node):
     """Calculate a bounding volume for a coordinate node
 
@@ -401,6 +443,8 @@ def volumeFromCoordinate(node):
         bounding volume optimization at all, as it will take
         rebounding volume of each piece of geometry to be the
         bounding volume of the entire world.
+        (Geometry which knows which points it uses can avoid this
+        with volumeFromIndexedCoordinate.)
     """
     current = getCachedVolume(node)
     if current:
@@ -418,6 +462,80 @@ def volumeFromCoordinate(node):
     return cacheVolume(node, volume, dependencies)
 
 
+def volumeFromIndexedCoordinate(node, coord, index):
+    """Calculate a bounding volume for the points of coord used by index
+
+    node -- the geometry node (with coord and index fields) with
+        which the volume is cached
+    coord -- the node's Coordinate node
+    index -- the node's index array, -1 values are ignored
+
+    Unlike volumeFromCoordinate the volume includes only the
+    points which are actually used, so geometry sharing a single
+    Coordinate node still gets a tight volume.
+    """
+    current = getCachedVolume(node)
+    if current:
+        return current
+    index = asarray(index).ravel()
+    if len(index):
+        index = index[index >= 0]
+    if (not coord) or (not len(coord.point)) or (not len(index)):
+        volume = BoundingVolume()
+    else:
+        volume = AABoundingBox.fromPoints(take(asarray(coord.point), index, 0))
+    dependencies = [(node, "index"), (node, "coord")]
+    if coord:
+        dependencies.append((coord, "point"))
+    return cacheVolume(node, volume, dependencies)
+
+
+BOUNDING_VOLUME_CHANGE_SIGNAL = "boundingVolumeChange"
+# volume: [weakref(VolumeHolder),...] for holders whose volume includes volume
+_DEPENDENT_HOLDERS = weakref.WeakKeyDictionary()
+
+
+class VolumeHolder(cache.CacheHolder):
+    """CacheHolder for bounding volumes which reports invalidation
+
+    A volume which depends on another volume (e.g. a Shape's or
+    Group's volume, which includes its geometry's or children's
+    volumes) is cleared along with the volume on which it depends.
+    Whenever a held volume is discarded we send
+    BOUNDING_VOLUME_CHANGE_SIGNAL with the client node as sender
+    and the discarded volume as value.
+    """
+
+    def clear(self, signal=None, sender=None):
+        """Clear held volume and notify watchers"""
+        volume = self.data
+        super(VolumeHolder, self).clear(signal=signal, sender=sender)
+        self.notify(volume)
+
+    def __call__(self, signal=None, sender=None):
+        """Delete the cached volume and notify watchers"""
+        volume = self.data
+        result = super(VolumeHolder, self).__call__(signal=signal, sender=sender)
+        self.notify(volume)
+        return result
+
+    def notify(self, volume):
+        """Clear dependent volumes and send the change signal"""
+        if volume is None:
+            return
+        for ref in _DEPENDENT_HOLDERS.pop(volume, ()):
+            holder = ref()
+            if holder is not None:
+                holder.clear()
+        client = self.client()
+        if client is not None:
+            dispatcher.send(
+                signal=BOUNDING_VOLUME_CHANGE_SIGNAL,
+                sender=client,
+                value=volume,
+            )
+
+
 ### Abstraction/indirection for caching bounding volumes
 ##  Because the code to cache bounding volumes is generally
 ##  identical, we provide this set of two utility methods
@@ -433,13 +551,15 @@ def cacheVolume(node, volume, nodeFieldPairs=()):
         include the node itself. If fieldName is None
         a dependency is created on the node itself.
     """
-    holder = cache.CACHE.holder(node, key="boundingVolume", data=volume)
+    holder = VolumeHolder(node, volume, "boundingVolume", cache.CACHE)
     for n, attr in nodeFieldPairs:
         if n:
             if attr is not None:
                 holder.depend(n, protofunctions.getField(n, attr))
             else:
                 holder.depend(n, None)
+                if isinstance(n, BoundingVolume):
+                    _DEPENDENT_HOLDERS.setdefault(n, []).append(weakref.ref(holder))
     return volume
 
 
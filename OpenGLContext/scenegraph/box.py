@@ -74,6 +74,20 @@ class Box( basenodes.Box ):
         if vb:
             vb(textured=textured,lit=lit)
         return 1
+    def occluderPolygons( self, mode=None ):
+        """Give our six faces as convex polygons for occlusion culling"""
+        x,y,z = [float(v)/2.0 for v in self.size]
+        corners = [
+            (sx*x,sy*y,sz*z)
+            for sx in (-1,1) for sy in (-1,1) for sz in (-1,1)
+        ]
+        faces = (
+            (0,1,3,2),(4,6,7,5),(0,4,5,1),(2,3,7,6),(0,2,6,4),(1,5,7,3),
+        )
+        return [
+            array( [corners[i] for i in face], 'f' )
+            for face in faces
+        ]
     def boundingVolume( self, mode ):
         """Create a bounding-volume object for this node"""
         from OpenGLContext.scenegraph import boundingvolume
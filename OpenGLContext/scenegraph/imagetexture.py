@@ -8,6 +8,7 @@ from OpenGLContext import texture, context
 from vrml.vrml97 import basenodes, nodetypes
 from vrml import node, field, protofunctions, fieldtypes
 from io import BytesIO
+from concurrent.futures import CancelledError
 import logging
 
 log = logging.getLogger(__name__)
@@ -187,16 +188,8 @@ else:
         def __set__(self, client, value, notify=True):
             """Set the client's URL, then try to load the image"""
             value = super(ImageURLField, self).fset(client, value, notify=True)
-            import threading
-
-            threading.Thread(
-                name="Background load of %s" % (value),
-                target=client.loadBackground,
-                args=(
-                    value,
-                    context.Context.allContexts,
-                ),
-            ).start()
+            if value:
+                client.loadBackground(value, context.Context.allContexts)
             return value
 
         fset = __set__
@@ -215,48 +208,63 @@ else:
         image = PILImage(" image", 1, None)
         url = ImageURLField("url", 1, list)
 
+        fetchRequest = None
+
         def loadBackground(self, url, contexts=()):
             """Load an image from the given url in the background
 
             url -- SF or MFString URL to load relative to the
                 node's root's baseURL
 
-            On success:
+            The url is fetched by the shared loader.Fetcher, on success:
                 Sets the resulting PIL image to the
                 client's image property (triggering an un-caching
                 and re-compile if there was a previous image).
 
                 if contexts, iterate through the list calling
                 context.triggerRedraw(1)
+
+            returns the loader.FetchRequest (also stored as fetchRequest)
             """
-            from OpenGLContext.loaders.loader import Loader
+            from OpenGLContext.loaders.loader import Fetcher
 
-            try:
-                baseNode = protofunctions.root(self)
-                if baseNode:
-                    baseURI = baseNode.baseURI
-                else:
-                    baseURI = None
-                result = Loader(url, baseURL=baseURI)
-            except IOError:
-                pass
+            baseNode = protofunctions.root(self)
+            if baseNode:
+                baseURI = baseNode.baseURI
             else:
-                if result:
-                    baseURL, filename, file, headers = result
-                    image = Image.open(file)
-                    image.info["url"] = baseURL
-                    image.info["filename"] = filename
+                baseURI = None
+            request = self.fetchRequest = Fetcher.fetch(url, baseURL=baseURI)
+            # registered once fetchRequest is set, as onFetched checks it
+            request.add_done_callback(
+                lambda request: self.onFetched(request, contexts)
+            )
+            return request
 
-                    if image:
-                        return self.setImage(image, contexts)
+        def onFetched(self, request, contexts=()):
+            """Open the fetched image (on a fetch worker thread)
 
-            # should set client.image to something here to indicate
-            # failure to the user.
-            log.warning(
-                """Unable to load any image from the url %s for the node %s""",
-                url,
-                str(self),
-            )
+            Ignores requests which are no longer our fetchRequest (our
+            url has changed since) and cancelled requests.
+            """
+            if request is not self.fetchRequest:
+                return
+            try:
+                baseURL, filename, data, headers = request.result()
+                image = Image.open(BytesIO(data))
+            except CancelledError:
+                return
+            except (IOError, ValueError):
+                # should set client.image to something here to indicate
+                # failure to the user.
+                log.warning(
+                    """Unable to load any image from the url %s for the node %s""",
+                    request.key,
+                    str(self),
+                )
+            else:
+                image.info["url"] = baseURL
+                image.info["filename"] = filename
+                return self.setImage(image, contexts)
 
         def setImage(self, image, contexts=()):
             """Set PIL image as our new image
@@ -220,6 +220,20 @@ COMPILER_CLASSES = []
 
 
 class IFSCompiler(object):
+    """Base class for IndexedFaceSet compilers
+
+    USE_ARRAY_TESSELLATION -- if True, triangleArrays uses NumPy
+        operations to split, fan-triangulate and gather the IFS,
+        only concave or non-planar polygons are sent to the GLU
+        tessellator.  If False (or the indices are malformed) the
+        per-vertex tessellate path is used.
+    PLANAR_TOLERANCE -- maximum distance of a polygon's vertices
+        from its plane, as a fraction of the polygon's extent, for
+        the polygon to be considered planar
+    """
+
+    USE_ARRAY_TESSELLATION = True
+    PLANAR_TOLERANCE = 1e-5
     _indexedSourceNodes = None
 
     def __init__(self, target):
@@ -239,9 +253,15 @@ class IFSCompiler(object):
             or not len(self.target.coord.point)
         ):
             return None
-        holder = self.buildCacheHolder(mode=named["mode"])
+        mode = named["mode"]
+        holder = self.buildCacheHolder(mode=mode)
+        scheduler = getattr(getattr(mode, "context", None), "compileScheduler", None)
         try:
-            compiler = self.compile(*args, **named)
+            compiler = None
+            if scheduler is not None and scheduler.available:
+                compiler = self.compileBackground(scheduler, holder, mode)
+            if compiler is None:
+                compiler = self.compile(*args, **named)
         except Exception as err:
             log.error(
                 """Failure during compilation of IndexedFaceSet: %s""",
@@ -262,6 +282,15 @@ class IFSCompiler(object):
         """Compile a renderer to represent the IFS at run-time"""
         raise NotImplemented
 
+    def compileBackground(self, scheduler, holder, mode):
+        """Compile using a compilequeue.CompileScheduler
+
+        returns the (pending) renderer or None if this compiler
+        can't split its work into a worker stage, in which case
+        compile is used
+        """
+        return None
+
     def buildCacheHolder(self, key="", mode=None):
         """Get a cache holder with all dependencies set"""
         holder = mode.cache.holder(self.target, None, key=key)
@@ -306,6 +335,190 @@ class IFSCompiler(object):
             vertices.extend(poly)
         return vertices
 
+    def triangleArrays(self, sources=None):
+        """Tessellate the IFS into expanded triangle arrays using NumPy
+
+        coordIndex is split on -1 with array operations, triangles,
+        non-planar quads and planar convex polygons are fan-
+        triangulated, and the color, normal and texCoord values are
+        gathered by fancy-indexing.  Only planar concave polygons and
+        non-planar polygons of more than 4 vertices go through
+        Polygon.normalise (i.e. the GLU tessellator).  The result
+        matches that of tessellate, which also retains collinear
+        triangles.
+
+        returns dictionary with point, color, normal, textureCoordinate
+        and coordIndex arrays (color, normal and textureCoordinate
+        being None if not defined for the node) with 3 entries per
+        triangle, or None if the node's indices are out of range for
+        its values, in which case the caller should use tessellate
+        """
+        coordIndex = asarray(self.target.coordIndex, "i")
+        points = asarray(getXNull(self.target.coord, "point"), "f")
+        if not len(coordIndex) or not len(points):
+            return None
+        if sources is None:
+            sources = self.buildIndexedSources()
+        negative = coordIndex < 0
+        # polygon index of each meta-index (number of -1s before it)
+        polygonIds = cumsum(negative) - negative
+        metas = nonzero(~negative)[0]
+        coordIndices = coordIndex[metas]
+        if (coordIndices >= len(points)).any():
+            return None
+        polygonIds = polygonIds[metas]
+        gathered = {"point": points[coordIndices]}
+        for source in sources[1:]:
+            values = source.values
+            if not len(values):
+                gathered[source.vertexAttribute] = None
+                continue
+            indices = asarray(source.indices, "i")
+            if source.perFace:
+                positions = polygonIds
+            else:
+                positions = metas
+            if not len(indices) or (
+                len(positions) and positions.max() >= len(indices)
+            ):
+                return None
+            final = indices[positions]
+            if (final < 0).any():
+                return None
+            beyond = final >= len(values)
+            if beyond.any():
+                last = source.lastNonNullIndex()
+                if last is None or last >= len(values):
+                    return None
+                final[beyond] = last
+            gathered[source.vertexAttribute] = asarray(values, "f")[final]
+
+        # per-polygon runs of vertices in the meta arrays
+        if not len(metas):
+            return None
+        starts = concatenate(([0], nonzero(polygonIds[1:] != polygonIds[:-1])[0] + 1))
+        counts = diff(concatenate((starts, [len(metas)])))
+        triangleSets = []
+        tessellated = []
+        for count in unique(counts):
+            if count < 3:
+                continue
+            offsets = starts[counts == count]
+            if count == 3:
+                fanned = ones(len(offsets), "bool")
+            else:
+                fanned = self.fannable(
+                    gathered["point"][offsets[:, newaxis] + arange(count)]
+                )
+                for offset in offsets[~fanned]:
+                    tessellated.append((offset, count))
+                offsets = offsets[fanned]
+            if not len(offsets):
+                continue
+            # fan triangulation (0,j,j+1) for each polygon
+            corners = arange(1, count - 1)
+            triangles = empty((len(offsets), count - 2, 3), "i")
+            triangles[:, :, 0] = offsets[:, newaxis]
+            triangles[:, :, 1] = offsets[:, newaxis] + corners
+            triangles[:, :, 2] = offsets[:, newaxis] + corners + 1
+            triangleSets.append(reshape(triangles, (-1, 3)))
+        if triangleSets:
+            triangles = concatenate(triangleSets)
+        else:
+            triangles = zeros((0, 3), "i")
+        order = polygonIds[triangles[:, 0]]
+        metaIndices = reshape(triangles, (-1,))
+        result = {
+            "coordIndex": coordIndices[metaIndices],
+        }
+        for key, values in gathered.items():
+            result[key] = values[metaIndices] if values is not None else None
+        if tessellated:
+            order, result = self.tessellateRuns(
+                tessellated, gathered, coordIndices, polygonIds, order, result
+            )
+        # restore the polygon order of the IFS (stable within polygons)
+        sort = argsort(order, kind="stable")
+        vertexSort = reshape(sort[:, newaxis] * 3 + arange(3), (-1,))
+        for key, values in result.items():
+            if values is not None:
+                result[key] = values[vertexSort]
+        return result
+
+    def fannable(self, polygons):
+        """Determine which (P,N,3) polygons can be fan-triangulated
+
+        Planar, convex polygons can be fanned, as can non-planar
+        quads (which Polygon.normalise always splits a,b,c/a,c,d).
+        """
+        polygons = asarray(polygons, "d")
+        following = roll(polygons, -1, axis=1)
+        # Newell's method for the polygon normal
+        normals = sum(cross(polygons, following), axis=1)
+        lengths = sqrt(sum(normals**2, axis=-1))
+        degenerate = lengths == 0
+        normals = normals / where(degenerate, 1.0, lengths)[:, newaxis]
+        extent = (polygons.max(axis=1) - polygons.min(axis=1)).max(axis=-1)
+        centers = polygons.mean(axis=1)
+        offsets = abs(
+            sum((polygons - centers[:, newaxis]) * normals[:, newaxis], axis=-1)
+        ).max(axis=-1)
+        planar = offsets <= extent * self.PLANAR_TOLERANCE
+        edges = following - polygons
+        turns = sum(
+            cross(roll(edges, 1, axis=1), edges) * normals[:, newaxis], axis=-1
+        )
+        convex = (turns >= -(1e-6 * extent**2)[:, newaxis]).all(axis=-1)
+        fannable = (planar & convex) | degenerate
+        if polygons.shape[1] == 4:
+            fannable |= ~planar
+        return fannable
+
+    def tessellateRuns(self, runs, gathered, coordIndices, polygonIds, order, result):
+        """Tessellate (offset,count) runs of the meta arrays with GLU
+
+        Builds Vertex objects for just these polygons and normalises
+        them with the polygon tessellator, appending the results to
+        the order and result arrays.
+        """
+        tessellate = polygontessellator.PolygonTessellator().tessellate
+        attributes = [
+            key for key in ("color", "normal", "textureCoordinate")
+            if gathered[key] is not None
+        ]
+        vertices = []
+        polygonOrder = []
+        for offset, count in runs:
+            poly = polygon.Polygon(
+                polygonIds[offset],
+                self.target,
+                [
+                    vertex.Vertex(
+                        point=gathered["point"][index],
+                        metaIndex=index,
+                        coordIndex=coordIndices[index],
+                        **dict([(key, gathered[key][index]) for key in attributes])
+                    )
+                    for index in range(offset, offset + count)
+                ],
+                ccw=self.target.ccw,
+            )
+            poly.normalise(tessellate)
+            vertices.extend(poly)
+            polygonOrder.extend([polygonIds[offset]] * (len(poly) // 3))
+        if not vertices:
+            return order, result
+        extra = {
+            "point": array([v.point for v in vertices], "f"),
+            "coordIndex": array([v.coordIndex for v in vertices], "i"),
+        }
+        for key in attributes:
+            extra[key] = array([getattr(v, key) for v in vertices], "f")
+        for key, values in result.items():
+            if values is not None:
+                result[key] = concatenate((values, extra[key]))
+        return concatenate((order, polygonOrder)), result
+
     def buildIndexedSources(self):
         """Build the set of IndexedValueSource objects for this node
 
@@ -428,8 +641,85 @@ class IFSCompiler(object):
             )
 
 
+class TriangleTopology(object):
+    """Cached tessellation of an IFS, independent of its coordinates
+
+    Stored by ArrayGeometryCompiler under TOPOLOGY_KEY in the render
+    mode's cache, depending on every field except coord.point, so
+    it survives point-only changes (e.g. a CoordinateInterpolator).
+
+    arrays -- the triangle arrays (see IFSCompiler.triangleArrays)
+        from which the renderer was built
+    coordIndex -- (N,) "i" coordinate index of each triangle corner
+    pointCount -- number of coordinates when tessellated
+    gatherable -- whether every corner is an original coordinate,
+        rather than a vertex created by the GLU tessellator
+    renderer -- the (Indexed)ArrayGeometry last built/updated
+    """
+
+    def __init__(self, arrays, pointCount, renderer):
+        self.arrays = arrays
+        self.pointCount = pointCount
+        self.renderer = renderer
+        coordIndex = asarray(arrays["coordIndex"], "i")
+        self.coordIndex = coordIndex
+        self.gatherable = bool(
+            len(coordIndex)
+            and coordIndex.min() >= 0
+            and coordIndex.max() < pointCount
+        )
+
+    def update(self, compiler):
+        """Update our renderer for compiler.target's current points
+
+        Re-gathers the corner positions (and regenerates calculated
+        normals), then has the renderer re-upload just those arrays,
+        or builds a new renderer from the cached arrays if it can't.
+
+        returns the renderer or None if a full compile is required
+        """
+        points = asarray(getXNull(compiler.target.coord, "point"), "f")
+        if not self.gatherable or len(points) != self.pointCount:
+            return None
+        arrays = dict(self.arrays)
+        arrays["point"] = points[self.coordIndex]
+        normalArray = None
+        if compiler.calculatesNormals():
+            normalArray = compiler.buildNormals(arrays)
+        if not self.renderer.updateArrays(arrays["point"], normalArray):
+            log.debug("%s: re-welding updated geometry", compiler.target)
+            self.renderer = compiler.geometry(arrays)
+        self.arrays = arrays
+        return self.renderer
+
+
 class ArrayGeometryCompiler(IFSCompiler):
-    """Compiles to an ArrayGeometry instance for rendering uniform arrays of data"""
+    """Compiles to an ArrayGeometry instance for rendering uniform arrays of data
+
+    USE_INDEXED_ARRAYS -- if True, identical triangle corners are
+        welded and the result is an IndexedArrayGeometry drawn with
+        glDrawElements, otherwise the expanded arrays are drawn with
+        glDrawArrays
+    USE_INCREMENTAL_UPDATES -- if True, the tessellation is cached
+        (see TriangleTopology) and a change to coord.point alone
+        re-uploads only the position and normal arrays
+    TOPOLOGY_KEY -- cache key for the TriangleTopology
+    GEOMETRY_CACHE -- geometrycache.GeometryCache in which prepared
+        arrays are persisted between runs, or None, see
+        geometrycache.install
+    OPTIMIZE_MESH -- if True (and USE_INDEXED_ARRAYS) the welded
+        triangles and vertices are re-ordered for the vertex cache,
+        overdraw and vertex fetch, see meshoptimizer
+    VERTEX_FORMAT -- vertexformat.VertexFormat with which to pack
+        (quantize) the uploaded arrays, or None for float32 arrays
+    """
+
+    USE_INDEXED_ARRAYS = True
+    USE_INCREMENTAL_UPDATES = True
+    TOPOLOGY_KEY = "topology"
+    GEOMETRY_CACHE = None
+    OPTIMIZE_MESH = False
+    VERTEX_FORMAT = None
 
     def compile(
         self,
@@ -441,85 +731,342 @@ class ArrayGeometryCompiler(IFSCompiler):
     ):
         """Compile the rendering structures for an ArrayGeometry version of IFS
 
-        XXX Should redo to cache like so...
-        cache tessellated triangle indices
-            if any indices change, need to re-calculate everything
-            coord -> [ pointIndices ], [ calcualtedNormals ]
-            normal -> [ normalIndices ]
-
-            when points change, just re-calculate:
-                expanded-normals (if we are calculating normals)
+        The tessellated triangle arrays are cached as a
+        TriangleTopology which depends on every field except
+        coord.point:
+            if any indices (or colours, normals, texture
+            coordinates) change, everything is re-calculated
+            when only points change, just re-calculate:
                 expanded-points
-            when normals change (explicit normal/indices)
-                expanded-normals
-
-            fully-expanded normal, texCooord, and color
+                expanded-normals (if we are calculating normals)
+            and update the existing renderer's buffers in place
         """
         ### XXX should store normals regardless of "lit" field and discard lit
-        # XXX check to see if we are all using the same indices,
-        # if so, we can possibly use IndexedPolygons instead
-        # of IndexedFaceSet for rendering...
-        vertices = self.tessellate()
+        renderer = self.updateTopology(mode)
+        if renderer is not None:
+            return renderer
+        return self.finish(self.prepare(), mode)
 
-        # vertices is now a list of vertices such that
-        # every three vertices represents a single triangle
-        # good time to build normals if required...
-        vertexArray = array([vertex.point for vertex in vertices], "f")
-        if len(vertexArray) == 0:
-            return DUMMY_RENDER
-        else:
-            if (not self.target.normal) or (not len(self.target.normal.vector)):
-                # need to calculate normals
-                if self.target.normalPerVertex:
-                    normalArray = build_normalPerVertex(
-                        vertices, self.target.creaseAngle, vertexArray
-                    )
-                else:
-                    normalArray = triangleutilities.normalPerFace(vertexArray)
-                    normalArray = repeat(normalArray, [3] * len(normalArray), 0)
-            else:
-                normalArray = []
-                for vertex in vertices:
-                    if vertex.normal is not None:
-                        normalArray.append(vertex.normal)
-                    elif normalArray:
-                        normalArray.append(normalArray[-1])
-                    else:
-                        normalArray.append((0, 0, 1))
-                normalArray = array(normalArray, "f")
+    def compileBackground(self, scheduler, holder, mode):
+        """Prepare the arrays on a worker, finish on the context thread
 
-            if self.target.color and len(self.target.color.color):
-                try:
-                    colorArray = array([vertex.color for vertex in vertices], "f")
-                except TypeError:
-                    colorArray = None
-                    log.warning(
-                        """%s tessellation appears to have created invalid color for tesselated vertex""",
-                        self.target,
-                    )
-            else:
-                colorArray = None
-            if self.target.texCoord and len(self.target.texCoord.point):
-                textureCoordinateArray = array(
-                    [vertex.textureCoordinate for vertex in vertices], "f"
-                )
-            else:
-                textureCoordinateArray = None
+        Point-only updates of existing geometry are done immediately,
+        as they modify the renderer currently being drawn.
+        """
+        renderer = self.updateTopology(mode)
+        if renderer is not None:
+            return renderer
+        return scheduler.submit(
+            holder,
+            self.prepare,
+            # a stale result must not be cached as our topology
+            lambda prepared, current: self.finish(
+                prepared, mode if current else None
+            ),
+        )
+
+    def updateTopology(self, mode):
+        """Update from our cached TriangleTopology if possible
+
+        returns the updated renderer or None
+        """
+        if mode is None or not self.USE_INCREMENTAL_UPDATES:
+            return None
+        topology = mode.cache.getData(self.target, key=self.TOPOLOGY_KEY)
+        if topology is None:
+            return None
+        return topology.update(self)
+
+    def prepare(self):
+        """Tessellate, generate normals and pack the arrays (CPU only)
+
+        returns (arrays, packed) or None if there is nothing to draw,
+        see triangleArrays and packArrays.  With a GEOMETRY_CACHE the
+        result is loaded from or stored into the cache.
+        """
+        cache = self.GEOMETRY_CACHE
+        if cache is not None:
+            key = self.cacheKey(cache)
+            stored = cache.load(key)
+            if stored is not None:
+                return self.unpackStored(stored)
+        arrays = None
+        if self.USE_ARRAY_TESSELLATION:
+            arrays = self.triangleArrays()
+        if arrays is None:
+            arrays = self.vertexArrays(self.tessellate())
+
+        # arrays now hold three vertices for each triangle
+        if len(arrays["point"]) == 0:
+            return None
+        packed = self.packArrays(arrays)
+        if self.OPTIMIZE_MESH and packed["indices"] is not None:
+            arrays, packed = self.optimizeMesh(arrays, packed)
+        if cache is not None:
+            stored = dict(packed)
+            stored["coordIndex"] = asarray(arrays["coordIndex"], "i")
+            if "expandedBytes" in stored:
+                stored["expandedBytes"] = array(stored["expandedBytes"], "q")
+            cache.store(key, stored)
+        return arrays, packed
+
+    def optimizeMesh(self, arrays, packed):
+        """Re-order packed (welded) arrays with meshoptimizer.optimize
+
+        The expanded arrays are re-ordered to match the new triangle
+        order, so that incremental updates still line up.
+        """
+        from OpenGLContext.scenegraph import meshoptimizer
+
+        names = ("vertexArray", "colorArray", "normalArray", "textureCoordinateArray")
+        indices, reordered, order = meshoptimizer.optimize(
+            packed["indices"], *[packed[name] for name in names]
+        )
+        if log.isEnabledFor(logging.DEBUG):
             log.debug(
-                "Arrays: \nvertex -- %s\nnormal -- %s",
-                vertexArray,
-                normalArray,
+                "%s: ACMR %0.3f -> %0.3f",
+                self.target,
+                meshoptimizer.acmr(packed["indices"]),
+                meshoptimizer.acmr(indices),
             )
-            ag = arraygeometry.ArrayGeometry(
+        packed = dict(packed)
+        packed["indices"] = indices
+        packed.update(zip(names, reordered))
+        corners = reshape(order[:, newaxis] * 3 + arange(3), (-1,))
+        arrays = dict(
+            [
+                (key, None if value is None else asarray(value)[corners])
+                for key, value in arrays.items()
+            ]
+        )
+        return arrays, packed
+
+    def cacheKey(self, cache):
+        """Calculate our GEOMETRY_CACHE key
+
+        Covers every value which affects the prepared arrays: the
+        index and value arrays, compilation flags and our
+        configuration.
+        """
+        target = self.target
+        parts = [
+            ("compiler", self.__class__.__name__),
+            ("indexed", self.USE_INDEXED_ARRAYS),
+            ("arrayTessellation", self.USE_ARRAY_TESSELLATION),
+            ("planarTolerance", self.PLANAR_TOLERANCE),
+            ("optimize", self.OPTIMIZE_MESH),
+        ]
+        for name in ("ccw", "convex", "creaseAngle", "normalPerVertex", "colorPerVertex"):
+            parts.append((name, getattr(target, name)))
+        for name in ("coordIndex", "colorIndex", "normalIndex", "texCoordIndex"):
+            parts.append((name, asarray(getattr(target, name), "i")))
+        for name, attr in (
+            ("coord", "point"),
+            ("color", "color"),
+            ("normal", "vector"),
+            ("texCoord", "point"),
+        ):
+            parts.append((name, asarray(getXNull(getattr(target, name), attr), "f")))
+        return cache.key(*parts)
+
+    def unpackStored(self, stored):
+        """Convert GEOMETRY_CACHE arrays to prepare's (arrays, packed)
+
+        The expanded triangle arrays (needed only for incremental
+        updates) are re-created by indexing the stored arrays.
+        """
+        packed = dict(
+            [
+                (key, stored.get(key))
+                for key in (
+                    "vertexArray",
+                    "colorArray",
+                    "normalArray",
+                    "textureCoordinateArray",
+                    "indices",
+                )
+            ]
+        )
+        if "expandedBytes" in stored:
+            packed["expandedBytes"] = int(stored["expandedBytes"])
+        indices = packed["indices"]
+
+        def expand(values):
+            if values is None or indices is None:
+                return values
+            return values[indices]
+
+        arrays = {
+            "point": expand(packed["vertexArray"]),
+            "coordIndex": stored["coordIndex"],
+            "color": expand(packed["colorArray"]),
+            "normal": None,
+            "textureCoordinate": expand(packed["textureCoordinateArray"]),
+        }
+        if not self.calculatesNormals():
+            arrays["normal"] = expand(packed["normalArray"])
+        return arrays, packed
+
+    def finish(self, prepared, mode):
+        """Build the renderer from prepare's result
+
+        mode -- if not None (and USE_INCREMENTAL_UPDATES) the prepared
+            arrays are cached as our TriangleTopology in mode's cache
+        """
+        if prepared is None:
+            return DUMMY_RENDER
+        arrays, packed = prepared
+        renderer = self.renderer(packed)
+        if mode is not None and self.USE_INCREMENTAL_UPDATES:
+            holder = self.buildTopologyHolder(mode)
+            holder.data = TriangleTopology(
+                arrays, len(self.target.coord.point), renderer
+            )
+        return renderer
+
+    def buildTopologyHolder(self, mode):
+        """Get a TOPOLOGY_KEY cache holder depending on all but coord.point"""
+        holder = mode.cache.holder(self.target, None, key=self.TOPOLOGY_KEY)
+        for field in protofunctions.getFields(self.target):
+            holder.depend(self.target, field)
+        for n, attr in [
+            (self.target.color, "color"),
+            (self.target.texCoord, "point"),
+            (self.target.normal, "vector"),
+        ]:
+            if n:
+                holder.depend(n, protofunctions.getField(n, attr))
+        return holder
+
+    def calculatesNormals(self):
+        """Determine whether our normals are generated from the points"""
+        return (not self.target.normal) or (not len(self.target.normal.vector))
+
+    def buildNormals(self, arrays):
+        """Generate per-vertex or per-face normals for triangle arrays"""
+        vertexArray = arrays["point"]
+        if self.target.normalPerVertex:
+            return build_normalPerVertex(
+                None,
+                self.target.creaseAngle,
                 vertexArray,
-                colorArray,
-                normalArray,
-                textureCoordinateArray,
+                arrays["coordIndex"],
+            )
+        normalArray = triangleutilities.normalPerFace(vertexArray)
+        return repeat(normalArray, [3] * len(normalArray), 0)
+
+    def geometry(self, arrays):
+        """Build the (Indexed)ArrayGeometry for triangle arrays"""
+        return self.renderer(self.packArrays(arrays))
+
+    def packArrays(self, arrays):
+        """Select the arrays to draw, generating normals and welding
+
+        returns dictionary of ArrayGeometry arguments, with indices
+        and expandedBytes set if USE_INDEXED_ARRAYS
+        """
+        vertexArray = arrays["point"]
+        # good time to build normals if required...
+        if self.calculatesNormals():
+            normalArray = self.buildNormals(arrays)
+        else:
+            normalArray = arrays["normal"]
+        if self.target.color and len(self.target.color.color):
+            colorArray = arrays["color"]
+        else:
+            colorArray = None
+        if self.target.texCoord and len(self.target.texCoord.point):
+            textureCoordinateArray = arrays["textureCoordinate"]
+        else:
+            textureCoordinateArray = None
+        log.debug(
+            "Arrays: \nvertex -- %s\nnormal -- %s",
+            vertexArray,
+            normalArray,
+        )
+        expanded = (vertexArray, colorArray, normalArray, textureCoordinateArray)
+        packed = {"indices": None}
+        if self.USE_INDEXED_ARRAYS:
+            packed["indices"], expanded = arraygeometry.weldVertices(*expanded)
+            packed["expandedBytes"] = sum(
+                [asarray(a).nbytes for a in (
+                    vertexArray, colorArray, normalArray, textureCoordinateArray
+                ) if a is not None]
+            )
+        for key, value in zip(
+            ("vertexArray", "colorArray", "normalArray", "textureCoordinateArray"),
+            expanded,
+        ):
+            packed[key] = value
+        return packed
+
+    def renderer(self, packed):
+        """Create the (Indexed)ArrayGeometry for packArrays' result
+
+        Welded geometry logs the memory saved, also available as the
+        result's savedBytes.
+        """
+        named = dict(packed)
+        named["vertexFormat"] = self.VERTEX_FORMAT
+        indices = named.pop("indices")
+        if indices is None:
+            return arraygeometry.ArrayGeometry(
                 objectType=GL_TRIANGLES,
                 ccw=self.target.ccw,
                 solid=self.target.solid,
+                **named
             )
-            return ag
+        ag = arraygeometry.IndexedArrayGeometry(
+            indices=indices,
+            objectType=GL_TRIANGLES,
+            ccw=self.target.ccw,
+            solid=self.target.solid,
+            **named
+        )
+        log.info(
+            "%s: welded %s corners to %s vertices, %s of %s bytes saved",
+            self.target,
+            len(indices),
+            len(packed["vertexArray"]),
+            ag.savedBytes,
+            ag.expandedBytes,
+        )
+        return ag
+
+    def vertexArrays(self, vertices):
+        """Convert tessellated Vertex objects to triangleArrays-style arrays"""
+        arrays = {
+            "point": array([vertex.point for vertex in vertices], "f"),
+            "coordIndex": [vertex.coordIndex for vertex in vertices],
+            "normal": None,
+            "color": None,
+            "textureCoordinate": None,
+        }
+        if not vertices:
+            return arrays
+        if self.target.normal and len(self.target.normal.vector):
+            normalArray = []
+            for vertex in vertices:
+                if vertex.normal is not None:
+                    normalArray.append(vertex.normal)
+                elif normalArray:
+                    normalArray.append(normalArray[-1])
+                else:
+                    normalArray.append((0, 0, 1))
+            arrays["normal"] = array(normalArray, "f")
+        if self.target.color and len(self.target.color.color):
+            try:
+                arrays["color"] = array([vertex.color for vertex in vertices], "f")
+            except TypeError:
+                log.warning(
+                    """%s tessellation appears to have created invalid color for tesselated vertex""",
+                    self.target,
+                )
+        if self.target.texCoord and len(self.target.texCoord.point):
+            arrays["textureCoordinate"] = array(
+                [vertex.textureCoordinate for vertex in vertices], "f"
+            )
+        return arrays
 
 
 COMPILER_CLASSES.append(ArrayGeometryCompiler)
@@ -734,7 +1281,13 @@ def getXNull(node, attr):
     return []
 
 
-def build_normalPerVertex(vertices, creaseAngle, vertexArray=None):
+NORMAL_CHUNK = 2**22
+# corners of a vertex whose normals are equal at this resolution are
+# compared (and averaged) as a single weighted normal
+NORMAL_RESOLUTION = 2**16
+
+
+def build_normalPerVertex(vertices, creaseAngle, vertexArray=None, coordIndices=None):
     """Create a normal vector using creaseAngle to determine smoothing
 
     Note: the semantics of normalPerVertex requires using expanded
@@ -743,63 +1296,112 @@ def build_normalPerVertex(vertices, creaseAngle, vertexArray=None):
     *use* of each vertex (i.e. each triangle's ref to the vertex
     has a potentially different normal)
 
+    Each corner's normal is the average of its own face normal and
+    the face normals of all other corners sharing its coordIndex
+    whose angle to its face normal is less than creaseAngle.
+
+    The corners of each vertex whose face normals are equal (to
+    NORMAL_RESOLUTION, e.g. the fan of a tessellated polygon) are
+    merged into a single weighted normal, so the pairwise cosine
+    comparisons (against cos(creaseAngle)) grow with the number of
+    *distinct* normals at a vertex rather than its valence.  Merged
+    normals are compared in batches of vertices with equal numbers
+    of them, and where every corner must smooth (creaseAngle > pi)
+    they are summed with add.reduceat.
+
+    Degenerate (zero-area, or non-finite) faces have zero normals,
+    which are never averaged into other corners' normals.
+
     vertices -- list of vertex objects in rendering order (triangles)
     creaseAngle -- radian angle above which faces do not smooth.
     vertexArray -- x*3*3 array of coordinates expanded into a flat
         data-array, if not provided, generated from vertices
+    coordIndices -- coordIndex of each entry in vertexArray, if not
+        provided, taken from vertices
     """
     if vertexArray is None:
         vertexArray = array([vertex.point for vertex in vertices], "f")
+    if coordIndices is None:
+        coordIndices = [vertex.coordIndex for vertex in vertices]
     faceNormals = triangleutilities.normalPerFace(vertexArray)
-    vertexNormals = repeat(faceNormals, [3] * len(faceNormals), 0)
-    faceNormals = array(vertexNormals[:])
-    items = {}
-    for index in range(len(vertices)):
-        try:
-            items.setdefault(vertices[index].coordIndex, []).append(index)
-        except TypeError as err:
-            print(vertices[index])
-            print(type(vertices[index].coordIndex), vertices[index].coordIndex)
-            raise
-    #   verticies. We use ones instead of zeros because each face
-    #   contributes to its own corner.  Note: will be promoted to float
-    #   during the final division
-    counts = ones((len(vertexNormals),), "f")
-    for vertexSet in items.values():
-        # For each primary user (triangle corner)
-        for index in range(len(vertexSet)):
-            primaryNormal = faceNormals[vertexSet[index]]
-            # check to see if any of the remaining triangles should
-            # be blended with this one
-            for innerindex in range(index + 1, len(vertexSet)):
-                secondaryNormal = faceNormals[vertexSet[innerindex]]
-                # if angle < creaseAngle... should calculate
-                # cos(creaseAngle) instead of using arccos each time
-                try:
-                    angle = arccos(dot(primaryNormal, secondaryNormal))
-                except ValueError as err:  # arccos of equal vectors goes kablooie
-                    angle = 0
-                if angle < creaseAngle:
-                    # add to each other's cummulative total (in place)
-                    add(
-                        vertexNormals[vertexSet[index]],
-                        secondaryNormal,
-                        vertexNormals[vertexSet[index]],
-                    )  # add in place
-                    add(
-                        vertexNormals[vertexSet[innerindex]],
-                        primaryNormal,
-                        vertexNormals[vertexSet[innerindex]],
-                    )  # add in place
-                    # and increment the element counts
-                    counts[vertexSet[index]] = counts[vertexSet[index]] + 1
-                    counts[vertexSet[innerindex]] = counts[vertexSet[innerindex]] + 1
-    # reshape counts to allow for in-place division...
-    counts.shape = (-1, 1)
-    # divide in place, completing the averaging (and thereby hopefully
-    # re-normalising the Normal vectors)
-    divide(vertexNormals, counts, vertexNormals)
-    return vertexNormals
+    cornerNormals = repeat(faceNormals, [3] * len(faceNormals), 0)
+    if creaseAngle <= 0 or not len(cornerNormals):
+        # angle < creaseAngle is never true, no smoothing
+        return cornerNormals
+    valid = isfinite(cornerNormals).all(axis=-1) & (
+        absolute(cornerNormals).sum(axis=-1) > 0
+    )
+    cornerNormals = where(valid[:, newaxis], cornerNormals, 0).astype(
+        cornerNormals.dtype
+    )
+    # merge each vertex's corners with equal normals, result is
+    # sorted by coordIndex
+    keys = empty((len(cornerNormals), 4), "int64")
+    keys[:, 0] = coordIndices
+    keys[:, 1:] = around(cornerNormals * NORMAL_RESOLUTION)
+    keys, first, inverse = unique(
+        keys, axis=0, return_index=True, return_inverse=True
+    )
+    inverse = inverse.ravel()
+    normals = cornerNormals[first]
+    sums = stack(
+        [
+            bincount(inverse, cornerNormals[:, axis], minlength=len(keys))
+            for axis in range(3)
+        ],
+        axis=-1,
+    )
+    weights = bincount(inverse, valid, minlength=len(keys))
+    starts = concatenate(([0], nonzero(diff(keys[:, 0]))[0] + 1))
+    sizes = diff(concatenate((starts, [len(keys)])))
+    merged = empty(sums.shape, sums.dtype)
+    if creaseAngle > pi:
+        # every pair of corners smooths, straight average per vertex
+        averages = add.reduceat(sums, starts, axis=0) / maximum(
+            add.reduceat(weights, starts), 1
+        )[:, newaxis]
+        merged[:] = repeat(averages, sizes, 0)
+    else:
+        threshold = cos(creaseAngle)
+        for size in unique(sizes):
+            groupStarts = starts[sizes == size]
+            step = max((1, NORMAL_CHUNK // (size * size)))
+            for offset in range(0, len(groupStarts), step):
+                members = groupStarts[offset : offset + step, newaxis] + arange(size)
+                merged[members] = _smoothGroups(
+                    normals[members], sums[members], weights[members], threshold
+                )
+    # degenerate corners keep their (zero) normals
+    merged[weights == 0] = 0
+    return merged[inverse].astype(cornerNormals.dtype)
+
+
+def _smoothGroups(normals, sums, weights, threshold):
+    """Average the merged normals of G vertices with K merged normals each
+
+    normals -- (G,K,3) representative normal of each merged normal
+    sums -- (G,K,3) sum of the corner normals merged into each
+    weights -- (G,K) number of (non-degenerate) corners merged
+
+    Each merged normal averages the corners of those (including
+    itself) whose cosine to its own normal exceeds threshold.
+    """
+    size = normals.shape[1]
+    result = empty(sums.shape, sums.dtype)
+    weights = weights[..., newaxis]
+    rows = max((1, NORMAL_CHUNK // (len(normals) * size)))
+    for first in range(0, size, rows):
+        primary = normals[:, first : first + rows]
+        cosines = matmul(primary, normals.transpose((0, 2, 1)))
+        smooth = clip(cosines, -1.0, 1.0) > threshold
+        # each corner always contributes to its own normal
+        own = arange(primary.shape[1])
+        smooth[:, own, own + first] = True
+        smooth = smooth.astype(sums.dtype)
+        result[:, first : first + rows] = matmul(smooth, sums) / maximum(
+            matmul(smooth, weights), 1
+        )
+    return result
 
 
 class IndexedValueSource(object):
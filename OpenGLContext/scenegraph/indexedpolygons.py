@@ -2,9 +2,9 @@
 
 from vrml.vrml97 import nodetypes
 from vrml import node, field, protofunctions
-from OpenGLContext.scenegraph import coordinatebounded
+from OpenGLContext.scenegraph import coordinatebounded, boundingvolume
 from OpenGLContext import triangleutilities
-from OpenGLContext.scenegraph import polygonsort
+from OpenGLContext.scenegraph import polygonsort, vertexformat, streambuffer
 from OpenGL.arrays import vbo
 
 from OpenGL.GL import *
@@ -16,12 +16,50 @@ from math import pi
 
 
 class Holder(object):
-    """Substitutes as object to hold vbo values"""
+    """Substitutes as object to hold vbo values
+
+    formats -- vertexformat.PackedArray for each packed attribute
+    sources -- the node from which each attribute's buffer came
+    indices -- index VBO (and indexType) if the indices are uploaded
+    """
 
     coord = None
     normal = None
     color = None
     texCoord = None
+    formats = {}
+    sources = {}
+    indices = None
+    indexType = None
+
+    def _pointer(self, function, name, size, value):
+        """Set the array pointer for attribute name (float or packed)"""
+        packed = self.formats.get(name)
+        if packed is None:
+            arguments = (size, GL_FLOAT, 0)
+        else:
+            arguments = (packed.size, packed.glType, packed.stride)
+        if function is glNormalPointer:
+            arguments = arguments[1:]
+        if isinstance(value, streambuffer.StreamBuffer):
+            value = value.pointer()
+        function(*(arguments + (value,)))
+
+    def _decodeTextures(self):
+        """Push the texture-matrix decode for packed texture coordinates"""
+        packed = self.formats.get("texCoord")
+        return packed is not None and packed.decode()
+
+    def memoryUsage(self):
+        """Bytes (of GPU memory) used by each of our arrays"""
+        usage = dict(
+            [
+                (name, vertexformat.arrayBytes(getattr(self, name)))
+                for name in ("coord", "normal", "color", "texCoord")
+            ]
+        )
+        usage["indices"] = vertexformat.arrayBytes(self.indices)
+        return usage
 
     def _enableColors(self, node):
         """Enable the colour array if possible"""
@@ -30,7 +68,7 @@ class Holder(object):
             # make the color field alter the diffuse color
             glColorMaterial(GL_FRONT_AND_BACK, GL_DIFFUSE)
             glEnable(GL_COLOR_MATERIAL)
-            glColorPointer(3, GL_FLOAT, 0, color)
+            self._pointer(glColorPointer, "color", 3, color)
             glEnableClientState(GL_COLOR_ARRAY)
             return 1
         else:
@@ -41,7 +79,7 @@ class Holder(object):
         normal = self.normal
         if normal is not None:
             # make the color field alter the diffuse color
-            glNormalPointer(GL_FLOAT, 0, normal)
+            self._pointer(glNormalPointer, "normal", 3, normal)
             glEnableClientState(GL_NORMAL_ARRAY)
             glEnable(GL_NORMALIZE)  # should do this explicitly eventually
             return 1
@@ -57,7 +95,7 @@ class Holder(object):
         """Enable the normal array if possible"""
         tex = self.texCoord
         if tex is not None:
-            glTexCoordPointer(2, GL_FLOAT, 0, tex)
+            self._pointer(glTexCoordPointer, "texCoord", 2, tex)
             glEnableClientState(GL_TEXTURE_COORD_ARRAY)
             return 1
         else:
@@ -67,7 +105,7 @@ class Holder(object):
         """Enable the point array if possible"""
         coord = self.coord
         if coord is not None:
-            glVertexPointer(3, GL_FLOAT, 0, coord)
+            self._pointer(glVertexPointer, "coord", 3, coord)
             glEnableClientState(GL_VERTEX_ARRAY)
             return 1
         else:
@@ -87,7 +125,7 @@ class VBOHolder(Holder):
             glEnableClientState(GL_COLOR_ARRAY)
             color.bind()
             try:
-                glColorPointer(3, GL_FLOAT, 0, color)
+                self._pointer(glColorPointer, "color", 3, color)
             finally:
                 color.unbind()
             return 1
@@ -101,7 +139,7 @@ class VBOHolder(Holder):
             # make the color field alter the diffuse color
             normal.bind()
             try:
-                glNormalPointer(GL_FLOAT, 0, normal)
+                self._pointer(glNormalPointer, "normal", 3, normal)
             finally:
                 normal.unbind()
             glEnableClientState(GL_NORMAL_ARRAY)
@@ -121,7 +159,7 @@ class VBOHolder(Holder):
         if tex is not None:
             tex.bind()
             try:
-                glTexCoordPointer(2, GL_FLOAT, 0, tex)
+                self._pointer(glTexCoordPointer, "texCoord", 2, tex)
             finally:
                 tex.unbind()
             glEnableClientState(GL_TEXTURE_COORD_ARRAY)
@@ -135,7 +173,7 @@ class VBOHolder(Holder):
         if coord is not None:
             coord.bind()
             try:
-                glVertexPointer(3, GL_FLOAT, 0, coord)
+                self._pointer(glVertexPointer, "coord", 3, coord)
             finally:
                 coord.unbind()
             glEnableClientState(GL_VERTEX_ARRAY)
@@ -188,6 +226,18 @@ class IndexedPolygons(
     color = field.newField("color", "SFNode", 1, node.NULL)
     coord = field.newField("coord", "SFNode", 1, node.NULL)
 
+    # vertexformat.VertexFormat for the VBOs, or None for float32
+    VERTEX_FORMAT = None
+
+    def boundingVolume(self, mode):
+        """Create a bounding-volume object for this node
+
+        Only the points used by our index are included, so nodes
+        sharing a single Coordinate (e.g. the OBJ loader's
+        per-material slices) each get their own volume.
+        """
+        return boundingvolume.volumeFromIndexedCoordinate(self, self.coord, self.index)
+
     def render(
         self,
         visible=1,  # can skip normals and textures if not
@@ -205,6 +255,7 @@ class IndexedPolygons(
         """
         if not len(self.index):
             return 1
+        decoded = False
         glPushClientAttrib(GL_CLIENT_ALL_ATTRIB_BITS)
         glPushAttrib(GL_ALL_ATTRIB_BITS)
         try:
@@ -216,7 +267,8 @@ class IndexedPolygons(
                 # do we have a colour-array to enable
                 vbos._enableColors(self)
             if textured:
-                vbos._enableTextures(self)
+                if vbos._enableTextures(self):
+                    decoded = vbos._decodeTextures()
             if lit:
                 vbos._enableNormals(self)
 
@@ -243,25 +295,36 @@ class IndexedPolygons(
                 glDisable(GL_CULL_FACE)
 
             # do the actual rendering
-            if visible and transparent:
+            if visible and transparent and getattr(mode, "sortTransparent", True):
                 self.drawTransparent(constant, mode=mode)
+            elif vbos.indices is not None:
+                self.callBound(
+                    lambda indices: glDrawElements(
+                        constant, len(self.index), vbos.indexType, indices.pointer()
+                    ),
+                    vbos.indices,
+                )
             else:
                 glDrawElementsui(
                     constant,
                     self.index,
                 )
         finally:
+            if decoded:
+                vertexformat.PackedArray.undecode()
             glPopAttrib()
             glPopClientAttrib()
         return 1
 
     def drawTransparent(self, constant, mode=None):
-        """Fairly complex mechanism for drawing sorted polygons"""
-        # we have to create a temporary array of centres for
-        # each polygon, that requires taking the centres and then
-        # creating an index-set that re-orders the polygons...
-        centers = mode.cache.getData(self, key="centers")
-        if centers is None:
+        """Draw the polygons sorted back-to-front
+
+        Uses a polygonsort.IncrementalSorter (cached for each
+        mode) so the order is repaired rather than re-calculated
+        as the view changes.
+        """
+        sorter = mode.cache.getData(self, key="sorter")
+        if sorter is None:
             ## cache centers for future rendering passes...
             ordered_points = take(self.coord.point, self.index.astype("i"), 0)
             centers = triangleutilities.centers(
@@ -269,7 +332,10 @@ class IndexedPolygons(
                 vertexCount=self.polygonSides,
                 components=3,
             )
-            holder = mode.cache.holder(self, key="centers", data=centers)
+            sorter = polygonsort.IncrementalSorter(
+                centers, self.index, vertexCount=self.polygonSides
+            )
+            holder = mode.cache.holder(self, key="sorter", data=sorter)
             for name in ("polygonSides", "index", "coord"):
                 field = protofunctions.getField(self, name)
                 holder.depend(self, field)
@@ -278,25 +344,11 @@ class IndexedPolygons(
             ]:
                 if n:
                     holder.depend(n, protofunctions.getField(n, attr))
-        assert centers is not None
-
-        # get distances to the viewer
-        centers = polygonsort.distances(
-            centers,
-            modelView=mode.getModelView(),
-            projection=mode.getProjection(),
-            viewport=mode.getViewport(),
-        )
-        assert len(centers) == len(self.index) // self.polygonSides
-        # get the center indices in sorted order
-        indices = argsort(centers)
-        sortedIndices = self.index[:]
-        sortedIndices = reshape(sortedIndices, (-1, self.polygonSides))
-        sortedIndices = take(sortedIndices, indices, 0)
-        # okay, now we can render...
-        glDrawElementsui(
+        sorter.draw(
             constant,
-            sortedIndices,
+            mode.getModelView(),
+            mode.getProjection(),
+            mode.getViewport(),
         )
 
     NODE_FIELDS = [
@@ -306,25 +358,42 @@ class IndexedPolygons(
         ("texCoord", "point"),
     ]
 
+    PACKERS = {
+        "coord": "packPositions",
+        "normal": "packNormals",
+        "color": "packColours",
+        "texCoord": "packTextures",
+    }
+
     def get_vbos(self, mode):
-        """Retrieve vertex buffer object source if we support them or None if not"""
+        """Retrieve vertex buffer object source if we support them or None if not
+
+        With VBO support each attribute's buffer is cached separately
+        (see updateAttribute), so changing e.g. coord.point re-uploads
+        only the position buffer, into the existing (ring of) buffers
+        (see streambuffer.StreamBuffer).
+
+        With a VERTEX_FORMAT the VBO arrays are packed (see
+        vertexformat) and the indices uploaded as 16-bit (fewer
+        than 65536 vertices) or 32-bit values.
+        """
         if vbo.get_implementation():
             vbos = mode.cache.getData(self, key="vbos")
             if vbos is None:
                 vbos = VBOHolder()
-                # compile our data to a set of vbos
-                holder = mode.cache.holder(self, key="vbos", data=vbos)
-                for field, attr in self.NODE_FIELDS:
-                    node = getattr(self, field)
-                    value = getattr(node, attr, None)
-                    if value is not None:
-                        setattr(vbos, field, vbo.VBO(value))
-                        # TODO: this is *way* too general, as it will
-                        # cause the *entire* set of VBOs to be discarded
-                        # and recreated whenever *anything* changes!
-                        holder.depend(node, attr)
-                        holder.depend(self, field)
-                holder.depend(self, "index")
+                vbos.formats = {}
+                vbos.sources = {}
+                mode.cache.holder(self, key="vbos", data=vbos)
+            for field, attr in self.NODE_FIELDS:
+                if mode.cache.getData(self, key="vbo-" + field) is None:
+                    self.updateAttribute(mode, vbos, field, attr)
+            if self.VERTEX_FORMAT is not None and vbos.coord is not None:
+                indexType = vertexformat.indexArray((), len(vbos.coord))[1]
+                if (
+                    mode.cache.getData(self, key="vbo-index") is None
+                    or indexType != vbos.indexType
+                ):
+                    self.updateIndices(mode, vbos)
         else:
             vbos = Holder()
             for field, attr in self.NODE_FIELDS:
@@ -335,6 +404,81 @@ class IndexedPolygons(
 
         return vbos
 
+    def updateAttribute(self, mode, vbos, field, attr):
+        """Update (or create) the buffer for field on vbos
+
+        The update is cached on its own, depending only on the field
+        and the node's attr, so that other attributes' changes
+        leave this buffer untouched.
+
+        The buffer itself is cached on the attribute's node, so
+        that IndexedPolygons sharing e.g. a Coordinate node share a
+        single buffer (see sharedBuffer).
+        """
+        node = getattr(self, field)
+        value = getattr(node, attr, None)
+        if value is not None and len(value):
+            current, packed = self.sharedBuffer(mode, vbos, field, node, attr, value)
+        else:
+            current = packed = None
+        setattr(vbos, field, current)
+        vbos.sources[field] = node
+        if packed is None:
+            vbos.formats.pop(field, None)
+        else:
+            vbos.formats[field] = packed
+        if current is None:
+            # cache the absence of the array, too
+            holder = mode.cache.holder(self, key="vbo-" + field, data=False)
+        else:
+            holder = mode.cache.holder(self, key="vbo-" + field, data=current)
+        holder.depend(self, field)
+        if node:
+            holder.depend(node, attr)
+        return current
+
+    def sharedBuffer(self, mode, vbos, field, node, attr, value):
+        """Get the (StreamBuffer, PackedArray or None) for node's attr
+
+        Cached on node (for our VERTEX_FORMAT), if node's data has
+        changed our previous buffer for the same node is updated in
+        place (re-using its GL buffers) rather than replaced.
+        """
+        key = "vbo-%s" % (attr,)
+        if self.VERTEX_FORMAT is not None:
+            key = "%s-%x" % (key, id(self.VERTEX_FORMAT))
+        shared = mode.cache.getData(node, key=key)
+        if shared is None:
+            packed = None
+            if self.VERTEX_FORMAT is not None:
+                packed = getattr(self.VERTEX_FORMAT, self.PACKERS[field])(value)
+                if packed is not None:
+                    value = packed.data
+            current = getattr(vbos, field)
+            if current is None or vbos.sources.get(field) is not node:
+                current = streambuffer.StreamBuffer(value)
+            else:
+                current.update(value)
+            shared = (current, packed)
+            holder = mode.cache.holder(node, key=key, data=shared)
+            holder.depend(node, attr)
+        return shared
+
+    def updateIndices(self, mode, vbos):
+        """Update (or create) the index buffer for vbos"""
+        indices, vbos.indexType = vertexformat.indexArray(
+            self.index, len(vbos.coord)
+        )
+        if vbos.indices is None:
+            vbos.indices = streambuffer.StreamBuffer(
+                indices, target=GL_ELEMENT_ARRAY_BUFFER
+            )
+        else:
+            vbos.indices.update(indices)
+        holder = mode.cache.holder(self, key="vbo-index", data=vbos.indices)
+        holder.depend(self, "index")
+        return vbos.indices
+
     def callBound(self, function, array):
         if hasattr(array, "bind"):
             array.bind()
@@ -3,6 +3,10 @@ from __future__ import print_function
 from vrml.vrml97 import basenodes, nodetypes
 from vrml import field, protofunctions, fieldtypes
 from OpenGLContext import context
+from io import BytesIO
+from concurrent.futures import CancelledError
+import logging
+log = logging.getLogger( __name__ )
 
 class InlineURLField( fieldtypes.MFString ):
     """Field for managing interactions with an Inline's URL value"""
@@ -10,12 +14,8 @@ class InlineURLField( fieldtypes.MFString ):
     def fset( self, client, value, notify=1 ):
         """Set the client's URL, then try to load the scene"""
         value = super(InlineURLField, self).fset( client, value, notify )
-        import threading
-        threading.Thread(
-            name = "Background load of %s"%(value),
-            target = client.loadBackground,
-            args = ( value, context.Context.allContexts,),
-        ).start()
+        if value:
+            client.loadBackground( value, context.Context.allContexts )
         return value
     def fdel( self, client, notify=1 ):
         """Delete the client's URL, which should delete the scene as well"""
@@ -38,43 +38,51 @@ class Inline(basenodes.Inline):
     url = InlineURLField(
         'url', 1, list
     )
+    fetchRequest = None
     def loadBackground( self, url, contexts=() ):
-        """Load an image from the given url in the background
+        """Load a scene from the given url in the background
 
         url -- SF or MFString URL to load relative to the
             node's root's baseURL
 
-        On success:
-            Sets the resulting PIL image to the
-            client's image property (triggering an un-caching
-            and re-compile if there was a previous image).
+        The url is fetched by the shared loader.Fetcher, on success
+        the scene is parsed and set as our scenegraph, then, if
+        contexts, iterate through the list calling
+        context.triggerRedraw(1)
 
-            if contexts, iterate through the list calling
-            context.triggerRedraw(1)
+        returns the loader.FetchRequest (also stored as fetchRequest)
         """
-        try:
-            from OpenGLContext.loaders.loader import Loader
-        except ImportError:
-            pass
+        from OpenGLContext.loaders.loader import Fetcher, redrawCallback
+        baseNode = protofunctions.root(self)
+        if baseNode:
+            baseURI = baseNode.baseURI
         else:
-            for u in url:
-                try:
-                    baseNode = protofunctions.root(self)
-                    if baseNode:
-                        baseURI = baseNode.baseURI
-                    else:
-                        baseURI = None
-                    
-                    result = Loader.load( u, baseURL = baseURI )
-                except IOError:
-                    pass
-                else:
-                    print('loaded', u)
-                    self.scenegraph = result
-                    for context in contexts:
-                        c = context()
-                        if c:
-                            c.triggerRedraw(1)
-                    return
-        warnings.warn( """Unable to load any scene from the url %s for the node %s"""%( url, str(self)))
-        
+            baseURI = None
+        request = self.fetchRequest = Fetcher.fetch( url, baseURL = baseURI )
+        # registered once fetchRequest is set, as onFetched checks it
+        request.add_done_callback( self.onFetched )
+        if contexts:
+            request.add_done_callback( redrawCallback( contexts ))
+        return request
+    def onFetched( self, request ):
+        """Parse the fetched scene (on a fetch worker thread)
+
+        Ignores requests which are no longer our fetchRequest (our
+        url has changed since) and cancelled requests.
+        """
+        from OpenGLContext.loaders.loader import Loader
+        if request is not self.fetchRequest:
+            return
+        try:
+            baseURL, filename, data, headers = request.result()
+            handler = Loader.findHandler( baseURL )
+            if not handler:
+                raise ValueError( """No registered handler for url %r"""%( baseURL, ))
+            self.scenegraph = handler( baseURL, filename, BytesIO( data ), headers )
+        except CancelledError:
+            return
+        except (IOError, ValueError) as err:
+            log.warning(
+                """Unable to load any scene from the url %s for the node %s: %s""",
+                request.key, self, err,
+            )
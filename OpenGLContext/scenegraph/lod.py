@@ -1,22 +1,54 @@
 """VRML97 Level-of-Detail node"""
 from vrml.vrml97 import basenodes, nodetypes
+from bisect import bisect_right
 
 class LOD(basenodes.LOD):
     """Level-of-Detail node based on VRML 97 LOD
     Reference:
         http://www.web3d.org/x3d/specifications/vrml/ISO-IEC-14772-IS-VRML97WithAmendment1/part1/nodesRef.html#LOD
+
+    The rendering passes don't give nodes access to the viewer, so
+    the level is chosen from the viewer's position in the LOD's
+    coordinate space by the pass.  As a DEF/USE'd LOD may be seen
+    from several distances at once, the flat rendering pass keeps
+    the active level for each of the LOD's paths and chooses it with
+    levelIndex (see passes._flat.FlatPass.selectLevels).
+
+    levelIndex and levelChildren are the whole selection interface,
+    the node itself does not track the viewer.
+
+    activeLevel -- index of the level rendered by renderedChildren
+        (for passes without per-path levels) and the initial level
+        of each flat-pass path, default is the finest level
+    HYSTERESIS -- fraction of a range by which the viewer must move
+        back inside the range before a finer level is re-selected,
+        avoids flickering between levels at a range boundary
     """
+    activeLevel = 0
+    HYSTERESIS = 0.05
+    def levelIndex( self, distance, current=None ):
+        """Choose level index for viewer at distance from our center
+
+        current -- index of the currently-rendered level, for the
+            hysteresis, default is activeLevel
+        """
+        if not self.level:
+            return None
+        ranges = list( self.range )
+        index = bisect_right( ranges, distance )
+        if current is None:
+            current = self.activeLevel
+        if index < current and self.HYSTERESIS:
+            scaled = [r*(1.0-self.HYSTERESIS) for r in ranges]
+            index = min( (current, bisect_right( scaled, distance )) )
+        return min( (index, len(self.level)-1) )
+    def levelChildren( self, index, types= (nodetypes.Children, nodetypes.Rendering,) ):
+        """Get the rendered children when level index is active"""
+        if self.level:
+            node = self.level[min( (index, len(self.level)-1) )]
+            if isinstance( node, types ):
+                return [ node ]
+        return []
     def renderedChildren( self, types= (nodetypes.Children, nodetypes.Rendering,) ):
         """Choose child from level that is at appropriate range"""
-        # We don't have a pointer to the visitor, that's
-        # a serious shortcoming of the rendervisitor approach :(
-        
-        # What we really want is a set of two paths from
-        # this node to the root and from the root to the
-        # current viewpoint position (which is currently
-        # just stored in the viewplatform).
-        
-        # That's pretty heavy for such a minimally useful LOD
-        # interface IMO.
-        if self.level:
-            return [ self.level[0] ]
\ No newline at end of file
+        return self.levelChildren( self.activeLevel, types )
@@ -0,0 +1,255 @@
+"""Triangle/vertex re-ordering of indexed meshes for faster rendering
+
+The compiled triangle order of an IndexedFaceSet follows its
+coordIndex, which is often poor for the GPU's post-transform vertex
+cache and arbitrary with respect to overdraw.  optimize runs three
+stages over an indexed triangle list:
+
+    optimizeVertexCache -- Forsyth's "linear-speed vertex cache
+        optimisation", greedily emitting the triangle whose
+        vertices score highest given an LRU cache model
+    optimizeOverdraw -- splits the cache-ordered triangles into
+        clusters (at cache "restarts" or wherever the cluster's cache
+        efficiency is close to the mesh's) and sorts the clusters so that
+        outward-facing clusters (likely occluders) are drawn first
+        (after Sander, Nehab and Barczak, "Fast Triangle Reordering
+        for Vertex Locality and Reduced Overdraw")
+    optimizeVertexFetch -- re-numbers the vertices in order of
+        first use so vertex fetches are (mostly) sequential
+
+acmr reports the average cache misses per triangle of an index
+array for a FIFO post-transform cache, the usual metric for
+comparing orderings (3.0 is the worst case, 0.5 the ideal for large
+regular meshes).
+"""
+from OpenGLContext.arrays import *
+import logging
+log = logging.getLogger( __name__ )
+
+CACHE_SIZE = 32
+# Forsyth scoring parameters
+CACHE_DECAY_POWER = 1.5
+LAST_TRIANGLE_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+# overdraw clustering, see clusters
+OVERDRAW_THRESHOLD = 1.05
+MIN_CLUSTER = 128
+
+def acmr( indices, cacheSize=16 ):
+    """Average FIFO vertex-cache misses per triangle for indices"""
+    indices = asarray( indices ).ravel()
+    if not len(indices):
+        return 0.0
+    cache = [-1]*cacheSize
+    cached = set()
+    position = 0
+    misses = 0
+    for index in indices.tolist():
+        if index not in cached:
+            misses += 1
+            cached.discard( cache[position] )
+            cache[position] = index
+            cached.add( index )
+            position = (position + 1) % cacheSize
+    return misses / (len(indices)/3.0)
+
+def _vertexScore( cachePosition, remaining, cacheSize ):
+    """Forsyth's score for a vertex in cachePosition with remaining triangles"""
+    if not remaining:
+        return -1.0
+    score = 0.0
+    if cachePosition >= 0:
+        if cachePosition < 3:
+            score = LAST_TRIANGLE_SCORE
+        else:
+            scale = 1.0 / (cacheSize - 3)
+            score = (1.0 - (cachePosition - 3) * scale) ** CACHE_DECAY_POWER
+    return score + VALENCE_BOOST_SCALE * remaining ** -VALENCE_BOOST_POWER
+
+def optimizeVertexCache( indices, vertexCount=None, cacheSize=CACHE_SIZE ):
+    """Re-order triangles for the post-transform vertex cache
+
+    indices -- (3*T,) triangle index array
+    vertexCount -- number of vertices (default max(indices)+1)
+
+    returns (3*T,) re-ordered index array (winding is retained)
+    and the (T,) order of the original triangles
+    """
+    triangles = reshape( asarray( indices ), (-1,3) )
+    count = len(triangles)
+    if not count:
+        return asarray( indices ), zeros( (0,), 'i' )
+    if vertexCount is None:
+        vertexCount = int( triangles.max() ) + 1
+    # vertex -> triangle adjacency (CSR)
+    flat = triangles.ravel()
+    order = argsort( flat, kind='stable' )
+    starts = concatenate( ([0], cumsum( bincount( flat, minlength=vertexCount ))) ).tolist()
+    adjacency = (order // 3).tolist()
+    remaining = [starts[v+1]-starts[v] for v in range( vertexCount )]
+    vertexTriangles = [adjacency[starts[v]:starts[v+1]] for v in range( vertexCount )]
+    corners = triangles.tolist()
+    # pre-compute score tables
+    cacheScores = [
+        [_vertexScore( position, valence, cacheSize ) for valence in range( 64 )]
+        for position in range( -1, cacheSize )
+    ]
+    def score( position, valence ):
+        if valence < 64:
+            return cacheScores[position+1][valence]
+        return _vertexScore( position, valence, cacheSize )
+    vertexScores = [score( -1, remaining[v] ) for v in range( vertexCount )]
+    triangleScores = [
+        vertexScores[a]+vertexScores[b]+vertexScores[c] for (a,b,c) in corners
+    ]
+    emitted = [False]*count
+    result = []
+    cache = []
+    best = max( range( count ), key=triangleScores.__getitem__ )
+    fallback = 0
+    while best is not None:
+        emitted[best] = True
+        result.append( best )
+        triangle = corners[best]
+        for vertex in triangle:
+            remaining[vertex] -= 1
+            vertexTriangles[vertex].remove( best )
+        # move the triangle's vertices to the front of the LRU cache
+        newCache = list( triangle )
+        newCache.extend([v for v in cache if v not in triangle])
+        evicted = newCache[cacheSize:]
+        cache = newCache[:cacheSize]
+        touched = set()
+        for position,vertex in enumerate( cache ):
+            vertexScores[vertex] = score( position, remaining[vertex] )
+            touched.update( vertexTriangles[vertex] )
+        for vertex in evicted:
+            vertexScores[vertex] = score( -1, remaining[vertex] )
+            touched.update( vertexTriangles[vertex] )
+        best = None
+        bestScore = -1.0
+        for t in touched:
+            a,b,c = corners[t]
+            value = vertexScores[a]+vertexScores[b]+vertexScores[c]
+            triangleScores[t] = value
+            if value > bestScore:
+                best,bestScore = t,value
+        if best is None:
+            # nothing adjacent to the cache, continue with first unemitted
+            while fallback < count and emitted[fallback]:
+                fallback += 1
+            if fallback < count:
+                best = fallback
+    order = array( result, 'i' )
+    return triangles[order].ravel(), order
+
+def clusters( indices, cacheSize=16, threshold=OVERDRAW_THRESHOLD, minimum=MIN_CLUSTER ):
+    """Split a cache-ordered index array into clusters
+
+    A new cluster starts wherever a triangle misses on all three
+    of its vertices (i.e. the cache ordering has restarted), or
+    once the current cluster has at least minimum triangles and
+    its cache misses per triangle are within threshold times the
+    whole mesh's acmr, so re-ordering whole clusters keeps most of
+    the cache efficiency.
+
+    returns (C+1,) array of cluster start triangles (with the end)
+    """
+    indices = asarray( indices ).ravel()
+    target = acmr( indices, cacheSize ) * threshold
+    cache = [-1]*cacheSize
+    cached = set()
+    position = 0
+    starts = [0]
+    clusterMisses = clusterSize = 0
+    for triangle in range( len(indices)//3 ):
+        misses = 0
+        for index in indices[triangle*3:triangle*3+3].tolist():
+            if index not in cached:
+                misses += 1
+                cached.discard( cache[position] )
+                cache[position] = index
+                cached.add( index )
+                position = (position + 1) % cacheSize
+        if misses == 3 and clusterSize:
+            starts.append( triangle )
+            clusterMisses = clusterSize = 0
+        clusterMisses += misses
+        clusterSize += 1
+        if clusterSize >= minimum and clusterMisses <= target * clusterSize:
+            starts.append( triangle+1 )
+            clusterMisses = clusterSize = 0
+    if starts[-1] != len(indices)//3:
+        starts.append( len(indices)//3 )
+    return array( starts, 'i' )
+
+def optimizeOverdraw( indices, vertices, cacheSize=16, threshold=OVERDRAW_THRESHOLD ):
+    """Sort clusters of a cache-ordered mesh to reduce overdraw
+
+    Clusters (see clusters) are sorted by the dot product of their
+    (area-weighted) normal with their centroid's offset from the
+    mesh centroid, so clusters on the outside of the mesh facing
+    away from its centre, which tend to occlude the rest, are drawn
+    first.  Order within clusters is retained.
+
+    returns (re-ordered indices, (T,) order of the input triangles)
+    """
+    triangles = reshape( asarray( indices ), (-1,3) )
+    starts = clusters( indices, cacheSize, threshold )
+    if len(starts) <= 2:
+        return asarray( indices ), arange( len(triangles), dtype='i' )
+    points = asarray( vertices, 'f' )[triangles]
+    normals = cross( points[:,1]-points[:,0], points[:,2]-points[:,0] )
+    areas = sqrt( sum( normals**2, axis=-1 ))
+    centers = points.mean( axis=1 )
+    meshCenter = (centers * areas[:,newaxis]).sum( axis=0 ) / max( (areas.sum(), 1e-30) )
+    clusterNormals = add.reduceat( normals, starts[:-1], axis=0 )
+    clusterAreas = add.reduceat( areas, starts[:-1] )
+    clusterCenters = add.reduceat(
+        centers * areas[:,newaxis], starts[:-1], axis=0
+    ) / maximum( clusterAreas, 1e-30 )[:,newaxis]
+    lengths = sqrt( sum( clusterNormals**2, axis=-1 ))
+    clusterNormals /= maximum( lengths, 1e-30 )[:,newaxis]
+    keys = sum( (clusterCenters - meshCenter) * clusterNormals, axis=-1 )
+    clusterOrder = argsort( -keys, kind='stable' )
+    order = concatenate([
+        arange( starts[c], starts[c+1], dtype='i' ) for c in clusterOrder
+    ])
+    return triangles[order].ravel(), order
+
+def optimizeVertexFetch( indices, *arrays ):
+    """Re-number vertices in order of first use
+
+    arrays -- per-vertex arrays (None entries are passed through)
+
+    returns (new indices, list of re-ordered arrays), unused
+    vertices are dropped
+    """
+    indices = asarray( indices ).ravel()
+    unique_,first = unique( indices, return_index=True )
+    used = unique_[argsort( first, kind='stable' )]
+    remap = zeros( (int(indices.max())+1 if len(indices) else 0,), indices.dtype )
+    remap[used] = arange( len(used), dtype=indices.dtype )
+    return remap[indices], [
+        (None if a is None else ascontiguousarray( asarray( a )[used] ))
+        for a in arrays
+    ]
+
+def optimize( indices, vertices, *arrays, **named ):
+    """Run the vertex-cache, overdraw and vertex-fetch stages
+
+    indices -- (3*T,) triangle index array
+    vertices -- (V,3) vertex positions (included in arrays result)
+    arrays -- other per-vertex arrays to re-order with vertices
+    cacheSize -- LRU cache size to optimize for (named only)
+
+    returns (indices, [vertices]+arrays re-ordered, (T,) triangle
+    order relative to the input triangles)
+    """
+    cacheSize = named.get( 'cacheSize', CACHE_SIZE )
+    indices,order = optimizeVertexCache( indices, len(vertices), cacheSize )
+    indices,overdraw = optimizeOverdraw( indices, vertices )
+    order = order[overdraw]
+    indices,arrays = optimizeVertexFetch( indices, vertices, *arrays )
+    return indices, arrays, order
@@ -2,16 +2,127 @@
 """
 from vrml.vrml97 import nodepath, nodetypes
 from vrml.cache import CACHE
+from vrml import protofunctions
 from OpenGLContext import quaternion
+from OpenGLContext.arrays import dot, identity
 from OpenGL.GL import glMultMatrixf
+from pydispatch import dispatcher
+import weakref
+
+WORLD_MATRIX_CHANGE_SIGNAL = 'worldMatrixChange'
+
+class WorldMatrixCache( object ):
+    """Hierarchical cache of path world-matrices with dirty propagation
+
+    Each path stores its own world matrices (one per variation of
+    the transformMatrix arguments), calculated from its parent
+    path's (cached) world matrix and the local matrix of its
+    final node.  The cache watches the transform-affecting fields
+    of every Transforming node (Transform, Billboard) which ends a
+    cached path.  When one of those fields changes, the matrices
+    for all paths through the node (and only those paths) are
+    discarded, so the next request recomputes just the affected
+    subtrees.  WORLD_MATRIX_CHANGE_SIGNAL is sent (with the list
+    of invalidated paths) after each such change.
+
+    Attributes:
+        hits -- number of transformMatrix requests served from cache
+        misses -- number of requests which required matrix calculation
+        invalidations -- number of path matrix-sets discarded
+    """
+    WATCHED_FIELDS = (
+        'translation','rotation','scale','scaleOrientation','center',
+        'axisOfRotation',
+    )
+    def __init__( self ):
+        self.watched = {}
+        self.reset()
+    def reset( self ):
+        """Reset the hit/miss/invalidation counters"""
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    def summary( self ):
+        """Give a summary of cache effectiveness
+
+        returns (hits, misses, invalidations)
+        """
+        return self.hits, self.misses, self.invalidations
+    def watch( self, path ):
+        """Invalidate path when its final node's transform changes"""
+        node = path[-1]
+        key = id(node)
+        current = self.watched.get( key )
+        if current is None:
+            def cleanup( weak, key=key, watched=self.watched ):
+                try:
+                    del watched[key]
+                except KeyError:
+                    pass
+            current = self.watched[key] = (weakref.ref( node, cleanup ), [])
+            for name in self.WATCHED_FIELDS:
+                try:
+                    field = protofunctions.getField( node, name )
+                except AttributeError:
+                    continue
+                for signal in ('set','del','route'):
+                    dispatcher.connect(
+                        self.onChange,
+                        signal = (signal,field),
+                        sender = node,
+                    )
+        refs = current[1]
+        refs.append( weakref.ref( path ))
+        if not len(refs) % 64:
+            refs[:] = [ref for ref in refs if ref() is not None]
+    def onChange( self, signal=None, sender=None ):
+        """Transform-field of sender changed, invalidate paths through it"""
+        current = self.watched.get( id(sender) )
+        if current is None:
+            return
+        refs = current[1]
+        invalidated = []
+        for ref in refs[:]:
+            path = ref()
+            if path is None:
+                refs.remove( ref )
+            else:
+                invalidated.extend( self.invalidate( path ))
+        if invalidated:
+            dispatcher.send(
+                signal = WORLD_MATRIX_CHANGE_SIGNAL,
+                sender = sender,
+                value = invalidated,
+            )
+    def invalidate( self, path ):
+        """Discard cached world-matrices for path and all descendents
+
+        Descendents can only have cached matrices if their parent
+        does, so we stop descending at the first empty path.
+
+        returns list of paths whose matrices were discarded
+        """
+        invalidated = []
+        todo = [path]
+        while todo:
+            path = todo.pop()
+            matrices = path.__dict__.get( 'worldMatrices' )
+            if matrices:
+                matrices.clear()
+                self.invalidations += 1
+                invalidated.append( path )
+                todo.extend( path.iterchildren() )
+        return invalidated
+
+WORLD_MATRICES = WorldMatrixCache()
 
 class _NodePath( object ):
     """OpenGLContext-specific node-path class
 
-    At the moment this only adds a single method,
-    transform() which traverses the path, calling
-    transform() for each Transforming node which
-    has a transform method.
+    Adds the transform() method, which traverses the path,
+    calling transform() for each Transforming node which
+    has a transform method, and a hierarchical world-matrix
+    cache for transformMatrix (see WorldMatrixCache).
     """
     __slots__ = ()
     def transform( self, mode=None, translate=1, scale=1, rotate=1 ):
@@ -24,12 +135,82 @@ class _NodePath( object ):
         transform down to the node, without needing a full
         traversal of the scenegraph.
         """
-        matrix = self.transformMatrix( 
+        matrix = self.transformMatrix(
             translate=translate, scale=scale, rotate=rotate
         )
-        glMultMatrixf( 
+        glMultMatrixf(
             matrix
         )
+    def parentPath( self ):
+        """Get the path to our parent node (or None for roots)
+
+        Paths created with + already know their parent, for
+        paths created directly we create (and remember) the
+        parent path so that the world-matrix can be cached
+        hierarchically.
+        """
+        parent = self.parent
+        if parent is None and len(self) > 1:
+            parent = self.__class__( list(self)[:-1] )
+            parent.children = [weakref.ref( self )]
+            self.parent = parent
+        return parent
+    def transformMatrix( self, translate=True, scale=True, rotate=True, matrixHolder=False, inverse=False ):
+        """Calculate (and cache) a transform matrix for this path
+
+        The matrix is calculated from our parent path's (cached)
+        matrix and the local matrix of our final node, the result
+        is cached until a transform field on the path changes.
+
+        translate -- if true, include translations in the matrix
+        scale -- if true, include scales in the matrix
+        rotate -- if true, include rotations in the matrix
+        inverse -- if true, calculate the inverse matrix
+
+        Note: to apply these matrices to a particular coordinate,
+        you would do the following:
+
+            p = ones( 4 )
+            p[:3] = coordinate
+            return dot( p, matrix)
+        """
+        key = (bool(inverse),bool(translate),bool(scale),bool(rotate))
+        matrices = self.__dict__.get( 'worldMatrices' )
+        if matrices is None:
+            self.worldMatrices = matrices = {}
+        else:
+            matrix = matrices.get( key )
+            if matrix is not None:
+                WORLD_MATRICES.hits += 1
+                return matrix
+        WORLD_MATRICES.misses += 1
+        parent = self.parentPath()
+        if parent is not None:
+            matrix = parent.transformMatrix(
+                translate=translate, scale=scale, rotate=rotate,
+                inverse=inverse,
+            )
+        else:
+            matrix = None
+        if len(self) and self.isTransform( self[-1] ):
+            if not self.__dict__.get( 'worldWatched' ):
+                WORLD_MATRICES.watch( self )
+                self.worldWatched = True
+            local = self[-1].localMatrices(
+                translate=translate,scale=scale,rotate=rotate
+            ).data[bool(inverse)]
+            if local is None:
+                pass
+            elif matrix is None:
+                matrix = local
+            elif inverse:
+                matrix = dot( matrix, local )
+            else:
+                matrix = dot( local, matrix )
+        if matrix is None:
+            matrix = identity(4, dtype='f')
+        matrices[key] = matrix
+        return matrix
     def quaternion( self ):
         """Get summary quaternion for all rotations in stack"""
         nodes = [
@@ -44,7 +225,7 @@ class _NodePath( object ):
         for node in nodes:
             q = q * quaternion.fromXYZR( *node.orientation )
         return q
-        
+
 
 class NodePath( _NodePath, nodepath.NodePath ):
     pass
@@ -30,6 +30,8 @@ from __future__ import print_function
 from OpenGLContext.arrays import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
+from OpenGL.arrays import vbo
+from OpenGLContext.scenegraph import streambuffer, vertexformat
 
 def project( points, modelView=None, projection=None, viewport=None, astype='f' ):
     """Do the equivalent of a gluProject on all points (transform to eye coords)"""
@@ -75,7 +77,25 @@ def distances( points, modelView=None, projection=None, viewport=None, astype='f
     # now convert to normalized eye coordinates...
     v /= v[:,3].reshape( (-1,1))
     return ((v[:,2]+1.0)/2.0).astype(astype)
-    
+
+def originDistances( modelViews, projection=None, viewport=None, astype='f' ):
+    """Get distances() of the local origin for each of a stack of matrices
+
+    modelViews -- (N,4,4) array (or sequence) of model-view matrices
+
+    Equivalent to calling distances( [[0,0,0,1]], modelView, ... )[0]
+    for each matrix in modelViews, but done in a single pass.  As
+    the origin's projection is just the last row of the combined
+    matrix we only need to calculate that row for each matrix.
+    """
+    if projection is None:
+        projection = glGetFloatv( GL_PROJECTION_MATRIX )
+    modelViews = asarray( modelViews )
+    if not len(modelViews):
+        return zeros( (0,), astype )
+    v = dot( modelViews[:,3,:], projection )
+    return ((v[:,2]/v[:,3]+1.0)/2.0).astype(astype)
+
 
 def indices( zFloats ):
     """Calculate rendering indices from center-distance-floats
@@ -96,6 +116,110 @@ def indices( zFloats ):
     result[2::3] = result[2::3] + 2
     return result
 
+class IncrementalSorter( object ):
+    """Polygon draw order for transparent geometry, reused between frames
+
+    Polygons are ordered by the eye-space depth of their centers.
+    Projected depth (see distances) increases with eye-space depth
+    for perspective and orthographic projections alike, so the order
+    is the same, but needs only a single dot product per polygon and
+    doesn't depend on the projection (which the flat pass changes
+    whenever the scene's depth range does).
+
+    From frame to frame the view generally changes only slightly, so
+    the previous frame's order is nearly sorted for the new view:
+
+        * if the model-view matrix has changed by less than THRESHOLD
+          (relative to its largest element) the previous order is
+          re-used without any work
+        * otherwise the depths are taken in the previous order and
+          re-sorted with a stable sort (timsort, an adaptive merge sort
+          which finds the sorted runs, so a nearly-sorted order is
+          repaired in close to linear time)
+        * if the order is unchanged nothing is uploaded
+
+    The sorted indices are uploaded to an element buffer
+    (see streambuffer) when VBOs are available.
+
+    centers -- (N,3) polygon centers
+    elements -- (N*vertexCount,) indices drawn for the polygons
+    vertexCount -- vertices per polygon
+    skips, repairs -- count of frames skipped/re-sorted
+    """
+    THRESHOLD = 1e-5
+    skips = repairs = 0
+    def __init__( self, centers, elements, vertexCount=3 ):
+        self.vertexCount = vertexCount
+        elements = asarray( elements )
+        elements,self.indexType = vertexformat.indexArray(
+            elements, (elements.max()+1) if len(elements) else 0,
+        )
+        self.elements = reshape( elements, (-1,vertexCount) )
+        self.setCenters( centers )
+        self.order = None
+        self.indices = None
+        self.buffer = None
+    def setCenters( self, centers ):
+        """Replace the polygon centers (e.g. the points moved), forcing a re-sort"""
+        assert len(centers) == len(self.elements), """Need a center for each polygon"""
+        self.centers = centers
+        points = ones( (len(centers),4), 'f' )
+        points[:,:3] = centers
+        self.points = points
+        self.matrix = None
+    def depths( self, modelView ):
+        """Sort keys (negated eye-space depth) of our polygons for modelView"""
+        return -dot( self.points, asarray( modelView, 'f' )[:,2] )
+    def sort( self, modelView, projection=None, viewport=None ):
+        """Update the order for the given matrices
+
+        projection, viewport -- unused, the order is the same for
+            any projection (see depths)
+
+        returns True if the draw order changed
+        """
+        matrix = asarray( modelView, 'f' )
+        if self.matrix is not None:
+            scale = abs( self.matrix ).max()
+            if abs( matrix - self.matrix ).max() <= self.THRESHOLD * scale:
+                self.skips += 1
+                return False
+        self.matrix = matrix
+        keys = self.depths( matrix )
+        if self.order is None:
+            order = argsort( keys, kind='stable' )
+        else:
+            keys = keys[self.order]
+            if (keys[1:] >= keys[:-1]).all():
+                return False
+            self.repairs += 1
+            order = self.order[argsort( keys, kind='stable' )]
+        self.order = order
+        self.indices = self.elements[order].ravel()
+        if self.buffer is not None:
+            self.buffer.update( self.indices )
+        return True
+    def draw( self, objectType, modelView, projection=None, viewport=None ):
+        """Sort for the matrices and draw the polygons (back to front)"""
+        self.sort( modelView, projection, viewport )
+        if self.buffer is None and vbo.get_implementation():
+            self.buffer = streambuffer.StreamBuffer(
+                self.indices, target=GL_ELEMENT_ARRAY_BUFFER,
+            )
+        if self.buffer is not None:
+            self.buffer.bind()
+            try:
+                glDrawElements(
+                    objectType, len(self.indices), self.indexType,
+                    self.buffer.pointer(),
+                )
+            finally:
+                self.buffer.unbind()
+        else:
+            glDrawElements(
+                objectType, len(self.indices), self.indexType, self.indices,
+            )
+
 if __name__ == "__main__":
     def test2( v ):
         c = centers( v )
@@ -7,9 +7,10 @@ from OpenGL.GL import *
 from vrml import field, protofunctions, node
 from vrml.vrml97 import basenodes, nodetypes
 from vrml import cache
-from OpenGLContext.scenegraph import boundingvolume
+from OpenGLContext.scenegraph import boundingvolume, vertexformat
 from OpenGLContext.arrays import (
     zeros, arange, sin, cos, pi, concatenate, allclose, copy,
+    ascontiguousarray,
 )
 from OpenGLContext import vectorutilities
 from OpenGL.arrays import vbo
@@ -26,8 +27,34 @@ def mesh_indices( zstep,ystep, xstep=1 ):
     indices += (yoffsets * ystep)
     return indices
 
+class VertexLayout( object ):
+    """Layout of the interleaved vertices of a Quadric's coordinate VBO
+
+    stride -- bytes per vertex
+    attributes -- {name: (size, glType, byte offset)} for 'coord',
+        'texCoord' and 'normal'
+    indexType -- GL type of the index VBO
+    textures -- vertexformat.PackedArray for packed texture
+        coordinates (for its decode), or None
+    """
+    def __init__( self, stride, attributes, indexType=GL_UNSIGNED_SHORT, textures=None ):
+        self.stride = stride
+        self.attributes = attributes
+        self.indexType = indexType
+        self.textures = textures
+FLOAT_LAYOUT = VertexLayout( 32, {
+    'coord': (3,GL_FLOAT,0),
+    'texCoord': (2,GL_FLOAT,12),
+    'normal': (3,GL_FLOAT,20),
+})
+
 class Quadric( nodetypes.Geometry, node.Node ):
-    """Base-class for the various quadratic-type geometry classes"""
+    """Base-class for the various quadratic-type geometry classes
+
+    VERTEX_FORMAT -- vertexformat.VertexFormat with which to pack
+        the interleaved vertices, None for float32 (8 floats per vertex)
+    """
+    VERTEX_FORMAT = None
     def render (
             self,
             visible = 1, # can skip normals and textures if not
@@ -42,29 +69,38 @@ class Quadric( nodetypes.Geometry, node.Node ):
             vbos = self.compile( mode = mode )
         if vbos is None:
             return 1
-        coords,indices,count = vbos
+        coords,indices,count,layout = vbos
+        stride = layout.stride
+        decoded = False
         glPushClientAttrib(GL_CLIENT_ALL_ATTRIB_BITS)
         glPushAttrib(GL_ALL_ATTRIB_BITS)
         try:
             coords.bind()
             glEnableClientState(GL_VERTEX_ARRAY)
-            glVertexPointer( 3, GL_FLOAT,32,coords)
+            size,glType,offset = layout.attributes['coord']
+            glVertexPointer( size, glType,stride,coords+offset)
             if visible:
                 if textured:
                     glEnableClientState(GL_TEXTURE_COORD_ARRAY)
-                    glTexCoordPointer( 2, GL_FLOAT,32,coords+12)
+                    size,glType,offset = layout.attributes['texCoord']
+                    glTexCoordPointer( size, glType,stride,coords+offset)
+                    if layout.textures is not None:
+                        decoded = layout.textures.decode()
                 if lit:
                     glEnableClientState(GL_NORMAL_ARRAY)
-                    glNormalPointer( GL_FLOAT,32,coords+20 )
+                    size,glType,offset = layout.attributes['normal']
+                    glNormalPointer( glType,stride,coords+offset )
             # TODO: sort for transparent geometry...
             indices.bind()
             # Can loop loading matrix and calling just this function 
             # for each sphere you want to render...
             # include both scale and position in the matrix...
             glDrawElements( 
-                GL_TRIANGLES, count, GL_UNSIGNED_SHORT, indices
+                GL_TRIANGLES, count, layout.indexType, indices
             )
         finally:
+            if decoded:
+                vertexformat.PackedArray.undecode()
             glPopAttrib()
             glPopClientAttrib()
             indices.unbind()
@@ -72,6 +108,55 @@ class Quadric( nodetypes.Geometry, node.Node ):
     def compile( self, mode=None ):
         """Compile this sphere for use on mode"""
         raise NotImplementedError( """Haven't implemented %s compilation yet"""%(self.__class__.__name__,))
+    def buildVBOs( self, coords, indices ):
+        """Create VBOs for (N,8) coords (position,texCoord,normal) and indices
+
+        Packs the vertices with VERTEX_FORMAT if set.
+
+        returns coordvbo,indexvbo,count,layout
+        """
+        layout = FLOAT_LAYOUT
+        if self.VERTEX_FORMAT is not None:
+            coords,layout = self.packVertices( coords )
+            indices,layout.indexType = vertexformat.indexArray( indices, len(coords) )
+        return (
+            vbo.VBO(coords),
+            vbo.VBO(indices,target = 'GL_ELEMENT_ARRAY_BUFFER' ),
+            len(indices),
+            layout,
+        )
+    def packVertices( self, coords ):
+        """Interleave coords packed with VERTEX_FORMAT
+
+        returns (N,stride) byte array, VertexLayout
+        """
+        format = self.VERTEX_FORMAT
+        columns = []
+        for name,packer,start,size in (
+            ('coord',format.packPositions,0,3),
+            ('texCoord',format.packTextures,3,2),
+            ('normal',format.packNormals,5,3),
+        ):
+            values = ascontiguousarray( coords[:,start:start+size] )
+            packed = packer( values )
+            if packed is None:
+                packed = vertexformat.PackedArray( values, size, GL_FLOAT )
+            columns.append( (name,packed) )
+        stride = 0
+        for name,packed in columns:
+            stride += packed.stride
+        result = zeros( (len(coords),stride), 'B' )
+        attributes = {}
+        textures = None
+        offset = 0
+        for name,packed in columns:
+            width = packed.stride
+            result[:,offset:offset+width] = packed.data.view( 'B' ).reshape( (len(coords),width) )
+            attributes[name] = (packed.size,packed.glType,offset)
+            if packed.offset is not None:
+                textures = packed
+            offset += width
+        return result, VertexLayout( stride, attributes, textures=textures )
 
 class Sphere( basenodes.Sphere, Quadric ):
     """Sphere geometry rendered with GLU quadratic calls"""
@@ -80,10 +165,10 @@ class Sphere( basenodes.Sphere, Quadric ):
     def compile( self, mode=None ):
         """Compile this sphere for use on mode
         
-        returns coordvbo,indexvbo,count
+        returns coordvbo,indexvbo,count,layout
         """
         coords, indices = self.compileArrays( )
-        vbos = vbo.VBO(coords), vbo.VBO(indices,target = 'GL_ELEMENT_ARRAY_BUFFER' ), len(indices)
+        vbos = self.buildVBOs( coords, indices )
         if hasattr(mode,'cache'):
             holder = mode.cache.holder( self, vbos )
             holder.depend( self, 'radius' )
@@ -181,7 +266,7 @@ class Cone( basenodes.Cone, Quadric ):
     def compile( self, mode=None ):
         """Compile this sphere for use on mode"""
         coords,indices = self.cone( self.height, self.bottomRadius, self.bottom, self.side )
-        vbos = vbo.VBO(coords), vbo.VBO(indices,target = 'GL_ELEMENT_ARRAY_BUFFER' ), len(indices)
+        vbos = self.buildVBOs( coords, indices )
         holder = mode.cache.holder( self, vbos )
         holder.depend( self, 'bottomRadius' )
         holder.depend( self, 'height' )
@@ -300,7 +385,7 @@ class Cylinder( basenodes.Cylinder, Quadric ):
             self.height, self.radius, self.bottom, self.side,
             top=self.top, cylinder=True,
         )
-        vbos = vbo.VBO(coords), vbo.VBO(indices,target = 'GL_ELEMENT_ARRAY_BUFFER' ), len(indices)
+        vbos = self.buildVBOs( coords, indices )
         holder = mode.cache.holder( self, vbos )
         holder.depend( self, 'radius' )
         holder.depend( self, 'height' )
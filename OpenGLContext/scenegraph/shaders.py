@@ -10,7 +10,8 @@ from OpenGL.arrays import vbo
 from OpenGLContext.arrays import array, reshape
 from OpenGLContext import context
 from vrml.vrml97 import shaders
-import operator
+import operator, threading
+from concurrent.futures import CancelledError
 from vrml import field, node, fieldtypes, protofunctions
 
 try:
@@ -18,6 +19,7 @@ try:
 except ImportError:
     pass
 from OpenGLContext.scenegraph import polygonsort, boundingvolume
+from OpenGLContext.passes import instancing
 
 LOCAL_ORIGIN = array([[0, 0, 0, 1.0]], "f")
 
@@ -371,82 +373,83 @@ class ShaderURLField(fieldtypes.MFString):
         """Set the client's URL, then try to load the image"""
         value = super(ShaderURLField, self).fset(client, value, notify)
         if value:
-            import threading
-
-            threading.Thread(
-                name="Background load of %s" % (value),
-                target=self.loadBackground,
-                args=(
-                    client,
-                    value,
-                    context.Context.allContexts,
-                ),
-            ).start()
+            self.loadBackground(client, value, context.Context.allContexts)
         return value
 
     def loadBackground(self, client, url, contexts):
-        overall = [None] * len(url)
-        threads = []
-        for i, value in enumerate(url):
-            import threading
-
-            t = threading.Thread(
-                name="Background load of %s" % (value),
-                target=self.subLoad,
-                args=(client, value, i, overall),
+        """Load and concatenate each of url's fragments in the background
+
+        Each fragment is fetched by the shared loader.Fetcher, when all
+        have loaded the client's source is set to their concatenation.
+        Contexts are redrawn as each fragment completes (see
+        loader.FetchService.fetch).  Completions after the client's
+        url has changed (its fetchRequests replaced) are ignored.
+
+        returns the list of loader.FetchRequests (also stored as the
+        client's fetchRequests)
+        """
+        from OpenGLContext.loaders.loader import Fetcher
+
+        baseNode = protofunctions.root(client)
+        if baseNode:
+            baseURI = getattr(baseNode, "baseURI", None)
+        else:
+            baseURI = None
+        # a fetch may complete before it returns, so the callbacks
+        # collect the requests rather than using fetch's results
+        requests = client.fetchRequests = []
+        fetched = [None] * len(url)
+        lock = threading.Lock()
+        remaining = [len(url)]
+
+        def onFetched(index, request):
+            with lock:
+                fetched[index] = request
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            if client.fetchRequests is requests:
+                self.setSource(client, fetched)
+
+        for index, fragment in enumerate(url):
+            requests.append(
+                Fetcher.fetch(
+                    fragment,
+                    baseURL=baseURI,
+                    callback=lambda request, index=index: onFetched(index, request),
+                    contexts=contexts,
+                )
             )
-            t.start()
-            threads.append(t)
-        for t in threads:
-            t.join()
-        result = [x for x in overall if x is not None]
-        if len(result) == len(overall):
-            client.source = "\n".join([as_str(r) for r in result])
-            # TODO: make this an observation that causes the
-            # contexts to redraw, *not* something the node does
-            # explicitly...
-            for c_holder in contexts:
-                c = c_holder()
-                if c:
-                    c.triggerRedraw(1)
-            return
-
-    def subLoad(self, client, urlFragment, i, overall):
-        from OpenGLContext.loaders.loader import Loader
+        return requests
+
+    def setSource(self, client, requests):
+        """Set client's source from (completed) fragment requests
 
+        returns whether the source was set
+        """
         try:
-            baseNode = protofunctions.root(client)
-            if baseNode:
-                baseURI = getattr(baseNode, "baseURI", None)
-            else:
-                baseURI = None
-            result = Loader(urlFragment, baseURL=baseURI)
-        except IOError:
-            pass
-        else:
-            if result:
-                baseURL, filename, file, headers = result
-                overall[i] = file.read()
-                return True
-        # should set client.image to something here to indicate
-        # failure to the user.
-        log.warning(
-            """Unable to load any shader from the url %s for the node %s""",
-            urlFragment,
-            str(client),
-        )
+            result = [request.result()[2] for request in requests]
+        except CancelledError:
+            return False
+        except (IOError, ValueError) as err:
+            log.warning("""Unable to load shader source for %s: %s""", client, err)
+            return False
+        client.source = "\n".join([as_str(r) for r in result])
+        return True
 
 
 class GLSLImport(shaders.GLSLImport):
     """GLSL-based importable code library"""
 
     url = ShaderURLField("url", "MFString", list)
+    fetchRequests = None
 
 
 class GLSLShader(shaders.GLSLShader):
     """GLSL-based shader node"""
 
     url = ShaderURLField("url", "MFString", list)
+    fetchRequests = None
     version = field.newField("version", "SFString", "")
     compileLog = field.newField(" compileLog", "SFString", "")
 
@@ -669,6 +672,13 @@ class GLSLObject(shaders.GLSLObject):
                     "Attempting to get attribute/uniform from failed compile"
                 )
 
+    def stateKey(self, mode):
+        """Produce the (program, textures, material) render-state key"""
+        textures = tuple(
+            [id(texture.value) for texture in self.textures if texture.value]
+        )
+        return (id(self), textures, None)
+
     def sortKey(self, mode, matrix):
         """Produce the sorting key for this shape's appearance/shaders/etc"""
         # TODO: figure out how to handle
@@ -703,6 +713,13 @@ class Shader(shaders.Shader):
         if self.current:
             return self.current.renderPost(textureToken, mode)
 
+    def stateKey(self, mode):
+        """Produce the (program, textures, material) render-state key"""
+        current = self.currentImplementation()
+        if current:
+            return current.stateKey(mode)
+        return (None, (), None)
+
     def sortKey(self, mode, matrix):
         """Produce the sorting key for this shape's appearance/shaders/etc"""
         current = self.currentImplementation()
@@ -717,6 +734,50 @@ class ShaderGeometry(shaders.ShaderGeometry):
 
     def Render(self, mode=None):
         """Do run-time rendering of the Shape for the given mode"""
+        return self.renderArrays(mode)
+
+    def RenderInstanced(self, mode=None, matrices=None):
+        """Draw one instance of our geometry per model-view matrix
+
+        matrices -- (N,4,4) model-view matrices, uploaded to a VBO and
+            fed to the shader as the per-instance mat4 attribute named
+            instancing.INSTANCE_ATTRIBUTE (in place of mat_modelview)
+
+        returns True if drawn, False if the context cannot draw
+        instanced or our shader does not declare the per-instance
+        attribute, in which case the caller must render each
+        instance individually
+        """
+        if not self.attributes or not self.appearance:
+            return False
+        if not instancing.instancingAvailable():
+            return False
+        current = self.appearance.currentImplementation()
+        if not current:
+            return False
+        try:
+            location = current.getLocation(
+                mode, instancing.INSTANCE_ATTRIBUTE, uniform=False
+            )
+        except RuntimeError:
+            return False
+        if location is None or location == -1:
+            return False
+        buffer = mode.cache.getData(self, "instances")
+        if buffer is None:
+            buffer = vbo.VBO(matrices, usage=GL_STREAM_DRAW)
+            mode.cache.holder(self, buffer, "instances")
+        else:
+            buffer.set_array(matrices)
+        self.renderArrays(mode, instances=(location, buffer, len(matrices)))
+        return True
+
+    def renderArrays(self, mode, instances=None):
+        """Bind our appearance and attributes and draw our slices
+
+        instances -- if specified, (location, vbo, count) for a
+            per-instance mat4 attribute, drawn with instanced calls
+        """
         if not self.attributes or not self.appearance:
             return None
         _, _, _, token = self.appearance.render(mode)
@@ -729,6 +790,21 @@ class ShaderGeometry(shaders.ShaderGeometry):
                 for attribute in self.attributes:
                     sub_token = attribute.render(current, mode)
                     tokens.append((attribute, sub_token))
+                if instances is not None:
+                    location, buffer, count = instances
+                    buffer.bind()
+                    for column in range(4):
+                        glVertexAttribPointer(
+                            location + column,
+                            4,
+                            GL_FLOAT,
+                            False,
+                            64,
+                            buffer + (column * 16),
+                        )
+                        glEnableVertexAttribArray(location + column)
+                        glVertexAttribDivisor(location + column, 1)
+                    buffer.unbind()
                 try:
                     if self.uniforms:
                         for uniform in self.uniforms:
@@ -738,18 +814,53 @@ class ShaderGeometry(shaders.ShaderGeometry):
                         for slice in self.slices:
                             for uniform in slice.uniforms:
                                 uniform.render(current, mode)
-                            glDrawArrays(GL_TRIANGLES, slice.offset, slice.count)
+                            self.drawArrays(slice.offset, slice.count, instances)
                     else:
                         # TODO: don't currently have a good way to get
                         # the proper dimension for the arrays...
-                        glDrawArrays(GL_TRIANGLES, 0, len(self.indices))
+                        self.drawArrays(0, len(self.indices), instances)
                 finally:
+                    if instances is not None:
+                        for column in range(4):
+                            glVertexAttribDivisor(location + column, 0)
+                            glDisableVertexAttribArray(location + column)
                     for attribute, token in tokens:
                         attribute.renderPost(mode, token)
             finally:
                 self.appearance.renderPost(token, mode)
                 glBindBuffer(GL_ARRAY_BUFFER, 0)
 
+    def drawArrays(self, offset, count, instances=None):
+        """Draw count vertices, once per instance if instances specified"""
+        if instances is not None:
+            glDrawArraysInstanced(GL_TRIANGLES, offset, count, instances[2])
+        else:
+            glDrawArrays(GL_TRIANGLES, offset, count)
+
+    def instanceKey(self, mode):
+        """Produce our instancing key, geometries with equal keys draw identically"""
+        if not self.attributes or not self.appearance:
+            return None
+        return (
+            id(self.appearance),
+            tuple([id(attribute) for attribute in self.attributes]),
+            tuple([id(slice) for slice in self.slices]),
+            tuple([id(uniform) for uniform in self.uniforms]),
+            len(self.indices),
+        )
+
+    def stateKey(self, mode):
+        """Produce the (program, textures, material) render-state key"""
+        if self.appearance:
+            return self.appearance.stateKey(mode)
+        return (None, (), None)
+
+    def staticSortKey(self, mode):
+        """Produce the view-independent part of our sorting key"""
+        if self.appearance:
+            return self.appearance.sortKey(mode, None)
+        return (False, [], None)
+
     def sortKey(self, mode, matrix):
         """Produce the sorting key for this shape's appearance/shaders/etc"""
         # distance calculation...
@@ -759,10 +870,7 @@ class ShaderGeometry(shaders.ShaderGeometry):
             projection=mode.getProjection(),
             viewport=mode.getViewport(),
         )[0]
-        if self.appearance:
-            key = self.appearance.sortKey(mode, matrix)
-        else:
-            key = (False, [], None)
+        key = self.staticSortKey(mode)
         if key[0]:
             distance = -distance
         return key[0:2] + (distance,) + key[1:]
@@ -75,6 +75,47 @@ class Shape(basenodes.Shape):
                 mode=mode,
             )
 
+    def RenderInstanced(self, mode=None, matrices=None):
+        """Draw our geometry once per model-view matrix
+
+        matrices -- (N,4,4) model-view matrices of the instances
+
+        The appearance is set up once for the whole group, then
+        each matrix is loaded and the geometry drawn.
+
+        returns True if drawn, False for non-visible passes and
+        transparent appearances, in which case the caller must
+        render each instance individually
+        """
+        if not self.geometry or not mode.visible:
+            return False
+        glPushAttrib(GL_LIGHTING_BIT)
+        try:
+            if self.appearance:
+                lit, textured, alpha, textureToken = self.appearance.render(mode=mode)
+                if alpha < 1.0:
+                    if textured:
+                        self.appearance.renderPost(textureToken, mode=mode)
+                    return False
+            else:
+                lit = 0
+                textured = 0
+                glColor3f(1, 1, 1)
+            if lit and mode.lighting:
+                glEnable(GL_LIGHTING)
+            else:
+                glDisable(GL_LIGHTING)
+            glMatrixMode(GL_MODELVIEW)
+            for matrix in matrices:
+                mode.matrix = matrix
+                glLoadMatrixf(matrix)
+                self.geometry.render(lit=lit, textured=textured, mode=mode)
+            if textured:
+                self.appearance.renderPost(textureToken, mode=mode)
+        finally:
+            glPopAttrib()
+        return True
+
     def RenderTransparent(self, mode):
         if not self.geometry:
             return False
@@ -98,6 +139,29 @@ class Shape(basenodes.Shape):
         finally:
             glPopAttrib()
 
+    def stateKey(self, mode):
+        """Produce the (program, textures, material) render-state key"""
+        if self.appearance and hasattr(self.appearance, "stateKey"):
+            return self.appearance.stateKey(mode)
+        return (None, (), None)
+
+    def instanceKey(self, mode):
+        """Produce our instancing key, shapes with equal keys draw identically"""
+        if not self.geometry:
+            return None
+        return (id(self.geometry), id(self.appearance))
+
+    def staticSortKey(self, mode):
+        """Produce the view-independent part of our sorting key
+
+        This is our appearance's (transparent, textures, material)
+        key, the flat passes combine it with distances calculated
+        for all shapes at once.
+        """
+        if self.appearance:
+            return self.appearance.sortKey(mode, None)
+        return (False, [], None)
+
     def sortKey(self, mode, matrix):
         """Produce the sorting key for this shape's appearance/shaders/etc"""
         # distance calculation...
@@ -107,14 +171,21 @@ class Shape(basenodes.Shape):
             projection=mode.getProjection(),
             viewport=mode.getViewport(),
         )[0]
-        if self.appearance:
-            key = self.appearance.sortKey(mode, matrix)
-        else:
-            key = (False, [], None)
+        key = self.staticSortKey(mode)
         if key[0]:
             distance = -distance
         return key[0:2] + (distance,) + key[1:]
 
+    def occluderPolygons(self, mode=None):
+        """Get our geometry's convex occluder polygons (or None)
+
+        Only geometry which can supply exact polygons (via its
+        own occluderPolygons method) is usable as an occluder.
+        """
+        if self.geometry and hasattr(self.geometry, "occluderPolygons"):
+            return self.geometry.occluderPolygons(mode)
+        return None
+
     def boundingVolume(self, mode):
         """Create a bounding-volume object for this node
 
@@ -0,0 +1,477 @@
+"""Quadric-error-metric mesh simplification and automatic LOD generation
+
+simplify reduces an indexed triangle mesh by repeated edge
+collapse, always collapsing the edge whose quadric error (the sum
+of squared distances from the collapsed vertex to the planes of
+the original faces around it, after Garland and Heckbert, "Surface
+Simplification Using Quadric Error Metrics") is smallest.  Open
+boundaries (including seams between differently coloured or
+textured corners, which are not welded) get perpendicular penalty
+planes so that the silhouette of the mesh is retained.  Collapses
+which would fold a face over or make the mesh non-manifold are
+skipped.
+
+The remaining functions produce reduced IndexedFaceSets from
+existing nodes:
+
+    simplifiedFaceSet -- a reduced copy of an IndexedFaceSet
+    buildLOD -- an LOD node with reduced levels for a Shape, with
+        ranges chosen so that each level's error stays below
+        PIXEL_ERROR pixels on screen
+    autoLOD -- replaces each heavy Shape of a scenegraph which is
+        not already within an (authored) LOD with a generated LOD
+
+autoLOD can be used at run-time (e.g. after loading a world), the
+reduced arrays are stored in the installed geometry cache (see
+OpenGLContext.geometrycache) if there is one, so the levels can be
+generated offline with OpenGLContext.bin.simplify and simply
+loaded at run-time.
+"""
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph import arraygeometry, meshoptimizer, indexedfaceset
+from OpenGLContext.scenegraph import basenodes
+from vrml.vrml97 import basenodes as vrmlnodes
+from vrml import node, protofunctions
+import heapq, math
+import logging
+log = logging.getLogger( __name__ )
+
+BORDER_WEIGHT = 10.0
+# levels generated for heavy meshes, as fractions of the original triangles
+RATIOS = (.5,.25,.1)
+MIN_TRIANGLES = 5000
+# screen-space error tolerance used to choose LOD ranges
+PIXEL_ERROR = 1.0
+SCREEN_HEIGHT = 1000
+FIELD_OF_VIEW = math.pi/2
+
+def quadrics( triangles, vertices, borderWeight=BORDER_WEIGHT ):
+    """Calculate the error quadric for each vertex
+
+    triangles -- (T,3) vertex-index array
+    vertices -- (V,3) vertex positions
+
+    Each face contributes the quadric of its plane to its three
+    vertices, each boundary edge (used by only one face) contributes
+    borderWeight times the quadric of the plane through the edge
+    perpendicular to its face to its two vertices.
+
+    returns (V,4,4) array of quadrics
+    """
+    vertices = asarray( vertices, 'd' )
+    triangles = asarray( triangles, 'i' )
+    result = zeros( (len(vertices),4,4), 'd' )
+    if not len(triangles):
+        return result
+    points = vertices[triangles]
+    normals = cross( points[:,1]-points[:,0], points[:,2]-points[:,0] )
+    lengths = sqrt( sum( normals**2, axis=-1 ))
+    normals = normals / maximum( lengths, 1e-30 )[:,newaxis]
+    planes = concatenate(
+        (normals, -sum( normals*points[:,0], axis=-1 )[:,newaxis]), axis=-1
+    )
+    faceQuadrics = planes[:,:,newaxis] * planes[:,newaxis,:]
+    for corner in range( 3 ):
+        add.at( result, triangles[:,corner], faceQuadrics )
+    if borderWeight:
+        # directed edges whose reverse is not present are boundaries
+        edges = concatenate([triangles[:,[i,(i+1)%3]] for i in range( 3 )])
+        faces = concatenate([arange( len(triangles) )]*3)
+        forward = edges[:,0].astype('int64')*len(vertices) + edges[:,1]
+        reverse = edges[:,1].astype('int64')*len(vertices) + edges[:,0]
+        border = ~in1d( forward, reverse )
+        if border.any():
+            edges,faces = edges[border],faces[border]
+            a,b = vertices[edges[:,0]],vertices[edges[:,1]]
+            perpendicular = cross( b-a, normals[faces] )
+            perpendicular /= maximum(
+                sqrt( sum( perpendicular**2, axis=-1 )), 1e-30
+            )[:,newaxis]
+            planes = concatenate(
+                (perpendicular, -sum( perpendicular*a, axis=-1 )[:,newaxis]),
+                axis=-1,
+            )
+            edgeQuadrics = planes[:,:,newaxis] * planes[:,newaxis,:] * borderWeight
+            add.at( result, edges[:,0], edgeQuadrics )
+            add.at( result, edges[:,1], edgeQuadrics )
+    return result
+
+def _error( q, x, y, z ):
+    """Evaluate quadric q (10 upper-triangle values) at x,y,z"""
+    return (
+        q[0]*x*x + 2*q[1]*x*y + 2*q[2]*x*z + 2*q[3]*x +
+        q[4]*y*y + 2*q[5]*y*z + 2*q[6]*y +
+        q[7]*z*z + 2*q[8]*z + q[9]
+    )
+
+def _collapse( q, a, b ):
+    """Find the best position for collapsing edge a-b with quadric q
+
+    Uses the position minimising q if the quadric is well
+    conditioned, otherwise the best of the end- and mid-points.
+
+    returns (error, position, t) where t is the fraction of the
+    way from a to b of the position (used to interpolate attributes)
+    """
+    (q0,q1,q2,q3,q4,q5,q6,q7,q8,q9) = q
+    det = (
+        q0*(q4*q7-q5*q5) - q1*(q1*q7-q5*q2) + q2*(q1*q5-q4*q2)
+    )
+    scale = max( (abs(q0),abs(q4),abs(q7)) )
+    candidates = [a,b,((a[0]+b[0])*.5,(a[1]+b[1])*.5,(a[2]+b[2])*.5)]
+    if abs(det) > 1e-9 * scale**3:
+        x = -(q3*(q4*q7-q5*q5) - q1*(q6*q7-q5*q8) + q2*(q6*q5-q4*q8))/det
+        y = -(q0*(q6*q7-q8*q5) - q3*(q1*q7-q5*q2) + q2*(q1*q8-q6*q2))/det
+        z = -(q0*(q4*q8-q5*q6) - q1*(q1*q8-q6*q2) + q3*(q1*q5-q4*q2))/det
+        candidates.insert( 0, (x,y,z) )
+    best = None
+    for position in candidates:
+        error = _error( q, *position )
+        if best is None or error < best[0]:
+            best = (error,position)
+    error,position = best
+    ex,ey,ez = b[0]-a[0],b[1]-a[1],b[2]-a[2]
+    length = ex*ex + ey*ey + ez*ez
+    if length:
+        t = (
+            (position[0]-a[0])*ex + (position[1]-a[1])*ey + (position[2]-a[2])*ez
+        )/length
+        t = min( (max( (t,0.0) ),1.0) )
+    else:
+        t = 0.0
+    return max( (error,0.0) ), position, t
+
+def _normal( a, b, c ):
+    abx,aby,abz = b[0]-a[0],b[1]-a[1],b[2]-a[2]
+    acx,acy,acz = c[0]-a[0],c[1]-a[1],c[2]-a[2]
+    return (aby*acz-abz*acy, abz*acx-abx*acz, abx*acy-aby*acx)
+
+def simplify( indices, vertices, *arrays, **named ):
+    """Reduce an indexed triangle mesh by quadric-error edge collapse
+
+    indices -- (3*T,) triangle index array
+    vertices -- (V,3) vertex positions
+    arrays -- other per-vertex arrays (e.g. colours, texture
+        coordinates), interpolated along collapsed edges, None
+        entries are passed through
+    targetCount -- number of triangles to reduce to (named only,
+        default half of the triangles)
+    maxError -- if specified, stop before collapsing an edge which
+        would move a vertex more than (approximately) this distance
+        from the original surface (named only)
+    borderWeight -- weight of boundary-edge penalty planes (named)
+
+    returns (indices, [vertices]+arrays, error) where error is the
+    (approximate) distance of the worst collapse performed, the
+    unused vertices (and triangles with repeated vertices) are dropped
+    """
+    triangles = reshape( asarray( indices, 'i' ), (-1,3) )
+    # triangles with repeated vertices have no plane (or area)
+    triangles = triangles[
+        (triangles[:,0] != triangles[:,1]) &
+        (triangles[:,1] != triangles[:,2]) &
+        (triangles[:,2] != triangles[:,0])
+    ]
+    targetCount = named.get( 'targetCount', len(triangles)//2 )
+    maxError = named.get( 'maxError' )
+    if maxError is not None:
+        maxError = maxError**2
+    vertexQuadrics = quadrics(
+        triangles, vertices, named.get( 'borderWeight', BORDER_WEIGHT )
+    )
+    upper = [(0,0),(0,1),(0,2),(0,3),(1,1),(1,2),(1,3),(2,2),(2,3),(3,3)]
+    Q = vertexQuadrics[:,[u[0] for u in upper],[u[1] for u in upper]].tolist()
+    positions = [tuple(p) for p in asarray( vertices, 'd' ).tolist()]
+    attributes = [
+        (None if a is None else asarray( a, 'd' ).reshape( (len(positions),-1) ).tolist())
+        for a in arrays
+    ]
+    faces = triangles.tolist()
+    alive = [True]*len(faces)
+    remaining = len(faces)
+    vertexFaces = [set() for i in range( len(positions) )]
+    for index,face in enumerate( faces ):
+        for vertex in face:
+            vertexFaces[vertex].add( index )
+    version = [0]*len(positions)
+    removed = [False]*len(positions)
+
+    def neighbours( vertex ):
+        result = set()
+        for face in vertexFaces[vertex]:
+            result.update( faces[face] )
+        result.discard( vertex )
+        return result
+    def evaluate( a, b ):
+        q = [i+j for (i,j) in zip( Q[a],Q[b] )]
+        error,position,t = _collapse( q, positions[a], positions[b] )
+        return (error, a, b, version[a], version[b], position, t)
+    heap = []
+    for a in range( len(positions) ):
+        for b in neighbours( a ):
+            if a < b:
+                heap.append( evaluate( a,b ) )
+    heapq.heapify( heap )
+    worst = 0.0
+    while heap and remaining > targetCount:
+        error,a,b,va,vb,position,t = heapq.heappop( heap )
+        if removed[a] or removed[b] or va != version[a] or vb != version[b]:
+            continue
+        if maxError is not None and error > maxError:
+            break
+        shared = vertexFaces[a] & vertexFaces[b]
+        # link condition, the only common neighbours are the
+        # vertices opposite the edge, otherwise the mesh pinches
+        if len( neighbours( a ) & neighbours( b )) != len(shared):
+            continue
+        # reject collapses which flip (or degenerate) a face
+        flipped = False
+        for face in (vertexFaces[a] | vertexFaces[b]) - shared:
+            corners = [positions[v] for v in faces[face]]
+            before = _normal( *corners )
+            corners = [
+                (position if v in (a,b) else positions[v]) for v in faces[face]
+            ]
+            after = _normal( *corners )
+            if before[0]*after[0] + before[1]*after[1] + before[2]*after[2] <= 0:
+                flipped = True
+                break
+        if flipped:
+            continue
+        # collapse b into a
+        for face in shared:
+            alive[face] = False
+            remaining -= 1
+            for vertex in faces[face]:
+                vertexFaces[vertex].discard( face )
+        for face in vertexFaces[b]:
+            faces[face] = [(a if v == b else v) for v in faces[face]]
+            vertexFaces[a].add( face )
+        vertexFaces[b] = set()
+        removed[b] = True
+        positions[a] = position
+        Q[a] = [i+j for (i,j) in zip( Q[a],Q[b] )]
+        for values in attributes:
+            if values is not None:
+                values[a] = [i+(j-i)*t for (i,j) in zip( values[a],values[b] )]
+        version[a] += 1
+        worst = max( (worst,error) )
+        for other in neighbours( a ):
+            heapq.heappush( heap, evaluate( a, other ))
+    kept = array( [face for (face,live) in zip( faces,alive ) if live], 'I' )
+    result = [array( positions, 'f' )] + [
+        (None if values is None else array( values, 'f' ))
+        for values in attributes
+    ]
+    if not len(kept):
+        result = [(None if a is None else a[:0]) for a in result]
+        return zeros( (0,), 'I' ), result, math.sqrt( worst )
+    indices,result = meshoptimizer.optimizeVertexFetch( kept.ravel(), *result )
+    for original,value in zip( arrays, result[1:] ):
+        if value is not None and len(asarray( original ).shape) == 1:
+            value.shape = (-1,)
+    return indices, result, math.sqrt( worst )
+
+def triangleCount( ifs ):
+    """Number of triangles the (fan-triangulated) ifs will produce"""
+    coordIndex = asarray( ifs.coordIndex, 'i' )
+    if not len(coordIndex):
+        return 0
+    polygons = int( (coordIndex < 0).sum() ) + int( coordIndex[-1] >= 0 )
+    return max( (int( (coordIndex >= 0).sum() ) - 2*polygons, 0) )
+
+def faceSetMesh( ifs ):
+    """Get welded (indices, [points,colors,normals,textureCoordinates]) for ifs
+
+    Normals are only included if the node defines them (otherwise
+    they are generated from the reduced mesh when it is compiled).
+
+    returns None if ifs can't be tessellated with
+    IFSCompiler.triangleArrays
+    """
+    arrays = indexedfaceset.ArrayGeometryCompiler( ifs ).triangleArrays()
+    if arrays is None or not len(arrays['point']):
+        return None
+    normals = arrays['normal'] if ifs.normal else None
+    return arraygeometry.weldVertices(
+        arrays['point'], arrays['color'], normals, arrays['textureCoordinate'],
+    )
+
+def reducedArrays( ifs, ratio=.5, maxError=None ):
+    """Simplify ifs' welded mesh (see faceSetMesh and simplify)
+
+    returns dictionary of coordIndex, point, color, normal,
+    texCoord (None where ifs does not define the values) and error
+    arrays, or None if ifs can't be reduced
+    """
+    mesh = faceSetMesh( ifs )
+    if mesh is None:
+        return None
+    indices,(points,colors,normals,textures) = mesh
+    indices,(points,colors,normals,textures),error = simplify(
+        indices, points, colors, normals, textures,
+        targetCount = int( len(indices)//3 * ratio ),
+        maxError = maxError,
+    )
+    triangles = reshape( indices.astype( 'i' ), (-1,3) )
+    if normals is not None:
+        normals /= maximum( sqrt( sum( normals**2, axis=-1 )), 1e-30 )[:,newaxis]
+    return {
+        'coordIndex': concatenate(
+            (triangles, -ones( (len(triangles),1), 'i' )), axis=1,
+        ).ravel(),
+        'point': points,
+        'color': colors,
+        'normal': normals,
+        'texCoord': textures,
+        'error': array( [error], 'd' ),
+    }
+
+def simplifiedFaceSet( ifs, ratio=.5, maxError=None, cache=None ):
+    """Create a reduced copy of IndexedFaceSet ifs
+
+    ratio -- fraction of ifs' triangles to retain
+    maxError -- see simplify
+    cache -- geometrycache.GeometryCache in which reduced arrays
+        are looked up and stored, default is the cache installed
+        for IndexedFaceSet compilation (see geometrycache.install),
+        so reductions generated offline are re-used at run-time
+
+    The copy is a convex, triangle-only IndexedFaceSet with per-vertex
+    colours, normals and texture coordinates (where ifs has them)
+    indexed by coordIndex.
+
+    returns (IndexedFaceSet, error) or None if ifs can't be reduced
+    """
+    if cache is None:
+        cache = indexedfaceset.ArrayGeometryCompiler.GEOMETRY_CACHE
+    arrays = None
+    if cache is not None:
+        key = cache.key(
+            ('simplify', indexedfaceset.ArrayGeometryCompiler( ifs ).cacheKey( cache )),
+            ('ratio', ratio),
+            ('maxError', maxError),
+            ('borderWeight', BORDER_WEIGHT),
+        )
+        arrays = cache.load( key )
+    if arrays is None:
+        arrays = reducedArrays( ifs, ratio, maxError )
+        if arrays is None:
+            return None
+        if cache is not None:
+            cache.store( key, arrays )
+    fields = dict(
+        coord = basenodes.Coordinate( point = arrays['point'] ),
+        coordIndex = arrays['coordIndex'],
+        ccw = ifs.ccw,
+        solid = ifs.solid,
+        convex = True,
+        creaseAngle = ifs.creaseAngle,
+    )
+    if arrays['color'] is not None:
+        fields['color'] = basenodes.Color( color = arrays['color'] )
+    if arrays['normal'] is not None:
+        fields['normal'] = basenodes.Normal( vector = arrays['normal'] )
+    if arrays['texCoord'] is not None:
+        fields['texCoord'] = basenodes.TextureCoordinate( point = arrays['texCoord'] )
+    return basenodes.IndexedFaceSet( **fields ), float( arrays['error'][0] )
+
+def levelRange( error ):
+    """Distance beyond which error is less than PIXEL_ERROR pixels on screen"""
+    return error * SCREEN_HEIGHT / (2*math.tan( FIELD_OF_VIEW/2 ) * PIXEL_ERROR)
+
+def buildLOD( shape, ratios=RATIOS, ranges=None, cache=None ):
+    """Create an LOD node with shape and reduced copies of it as levels
+
+    shape -- Shape node with an IndexedFaceSet geometry
+    ratios -- fractions of the original triangle count for each
+        reduced level, each level is reduced from the previous one
+    ranges -- LOD ranges for the levels, by default the distance
+        at which the (accumulated) simplification error of each
+        level drops below PIXEL_ERROR pixels (see levelRange)
+    cache -- see simplifiedFaceSet
+
+    The reduced levels share shape's appearance.
+
+    returns LOD node or None if shape's geometry can't be reduced
+    """
+    geometry = shape.geometry
+    points = asarray( getattr( geometry.coord, 'point', () ), 'f' )
+    if not len(points):
+        return None
+    levels = [shape]
+    distances = []
+    error = 0.0
+    previous = 1.0
+    for ratio in ratios:
+        reduced = simplifiedFaceSet( geometry, ratio/previous, cache=cache )
+        if reduced is None:
+            break
+        geometry,stepError = reduced
+        error += stepError
+        previous = ratio
+        levels.append( basenodes.Shape(
+            appearance = shape.appearance,
+            geometry = geometry,
+        ))
+        distances.append( max( [levelRange( error )] + distances[-1:] ))
+    if len(levels) < 2:
+        return None
+    if ranges is None:
+        ranges = distances
+    center = (points.min( axis=0 ) + points.max( axis=0 ))/2.0
+    return basenodes.LOD(
+        level = levels,
+        range = ranges[:len(levels)-1],
+        center = center,
+    )
+
+def heavyShapes( scene, minimumTriangles=MIN_TRIANGLES ):
+    """Yield (children, index) for each heavy Shape in scene without LODs
+
+    children -- MFNode value (list) holding the Shape at index
+    Shapes below LOD nodes are not considered, as the content
+    already defines its levels.
+    """
+    seen = set()
+    stack = [scene]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance( current, vrmlnodes.LOD ):
+            continue
+        seen.add( id(current) )
+        for field in protofunctions.getFields( current ):
+            if field.typeName() != 'MFNode':
+                continue
+            values = field.fget( current )
+            for index,value in enumerate( values ):
+                if (
+                    isinstance( value, vrmlnodes.Shape ) and
+                    isinstance( value.geometry, vrmlnodes.IndexedFaceSet ) and
+                    triangleCount( value.geometry ) >= minimumTriangles
+                ):
+                    yield values, index
+                elif isinstance( value, node.Node ):
+                    stack.append( value )
+
+def autoLOD( scene, minimumTriangles=MIN_TRIANGLES, ratios=RATIOS, cache=None ):
+    """Replace heavy Shapes of scene (without authored LODs) with LODs
+
+    Each Shape with an IndexedFaceSet of at least minimumTriangles
+    triangles which is not already within an LOD is replaced (in
+    place) by the result of buildLOD, a Shape used in multiple
+    places (DEF/USE) is replaced with the same LOD node.  With a
+    cache (see simplifiedFaceSet) the levels generated by an earlier
+    (e.g. offline) run are loaded rather than re-calculated.
+
+    returns number of Shapes replaced
+    """
+    replacements = {}
+    for children,index in list( heavyShapes( scene, minimumTriangles )):
+        shape = children[index]
+        if id(shape) not in replacements:
+            replacements[id(shape)] = buildLOD( shape, ratios, cache=cache )
+        replacement = replacements[id(shape)]
+        if replacement is not None:
+            children[index] = replacement
+    return len([r for r in replacements.values() if r is not None])
@@ -0,0 +1,110 @@
+"""Streaming (frequently updated) vertex buffers
+
+A StreamBuffer holds the data of a single vertex attribute in a
+ring of GL buffer objects.  Each update is written to the next
+buffer of the ring, so that the GL can still be drawing from the
+previous buffers without the upload having to wait for it to
+finish (a synchronization stall).
+
+A buffer's storage is only (re-)allocated when the data has grown
+beyond it, otherwise the storage is orphaned (glBufferData with no
+data, letting the driver hand out fresh memory if the old is in
+use) and refilled with glBufferSubData.
+
+Most buffers are never updated (static geometry), so storage is
+allocated with a static usage hint until the first update, after
+which the stream usage hint is used.
+"""
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+from OpenGLContext.arrays import ascontiguousarray
+import ctypes, weakref
+
+class StreamBuffer( object ):
+    """Ring of GL buffers holding one (frequently updated) array
+
+    data -- the current (contiguous) array, which has been or will
+        be (on the next bind) uploaded to buffers[current]
+    RING_SIZE -- number of GL buffers in the ring
+    uploads, allocations -- counts of uploads and of those which had
+        to (re-)allocate the buffer's storage
+    usage -- usage hint for the buffers' storage, initially the
+        (static) usage passed in, streamUsage after the first update
+
+    Used like a vbo.VBO: bind, set the array pointers with pointer()
+    and unbind.
+    """
+    RING_SIZE = 3
+    uploads = allocations = 0
+    def __init__(
+        self, data, target=GL_ARRAY_BUFFER,
+        usage=GL_STATIC_DRAW, streamUsage=GL_STREAM_DRAW,
+    ):
+        self.target = target
+        self.usage = usage
+        self.streamUsage = streamUsage
+        self.buffers = []
+        self.capacities = [0] * self.RING_SIZE
+        self.current = 0
+        self.setData( data )
+    def update( self, data ):
+        """Replace our data, uploaded to the next buffer on bind
+
+        If the current data has not yet been uploaded it is simply
+        replaced, as no draw can be using its buffer.  From now on
+        storage is (re-)allocated with our streamUsage.
+        """
+        if not self.dirty and self.buffers:
+            self.current = (self.current + 1) % self.RING_SIZE
+        self.usage = self.streamUsage
+        self.setData( data )
+    def setData( self, data ):
+        """Store data for upload on the next bind"""
+        self.data = ascontiguousarray( data )
+        self.dirty = True
+    def __len__( self ):
+        return len(self.data)
+    @property
+    def nbytes( self ):
+        """Bytes of (GPU) memory used by the current data"""
+        return self.data.nbytes
+    def bind( self ):
+        """Bind the current buffer, uploading updated data"""
+        if not self.buffers:
+            self.createBuffers()
+        glBindBuffer( self.target, self.buffers[self.current] )
+        if self.dirty:
+            self.upload()
+    def unbind( self ):
+        glBindBuffer( self.target, 0 )
+    def pointer( self, offset=0 ):
+        """Pointer (offset into the bound buffer) for gl*Pointer calls"""
+        return ctypes.c_void_p( offset )
+    def createBuffers( self ):
+        """Create the ring of GL buffers, deleted with this object"""
+        implementation = vbo.get_implementation()
+        buffers = glGenBuffers( self.RING_SIZE )
+        if self.RING_SIZE == 1:
+            buffers = [buffers]
+        self.buffers = [int( buffer ) for buffer in buffers]
+        implementation._DELETERS_[id(self)] = weakref.ref(
+            self, implementation.deleter( self.buffers, id(self) )
+        )
+        return self.buffers
+    def upload( self ):
+        """Upload data to the (bound) current buffer
+
+        returns True if the buffer storage was (re-)allocated
+        """
+        nbytes = self.data.nbytes
+        capacity = self.capacities[self.current]
+        self.uploads += 1
+        self.dirty = False
+        if nbytes > capacity:
+            glBufferData( self.target, nbytes, self.data, self.usage )
+            self.capacities[self.current] = nbytes
+            self.allocations += 1
+            return True
+        glBufferData( self.target, capacity, None, self.usage )
+        glBufferSubData( self.target, 0, nbytes, self.data )
+        return False
@@ -0,0 +1,279 @@
+"""Compact (quantized) vertex formats for VBO-backed geometry
+
+By default every vertex attribute is uploaded as float32, 12 bytes
+per position or normal, 8 per texture coordinate and 12 per colour.
+A VertexFormat describes a compact storage for each attribute:
+
+    positions -- 'float' or 'half' (float16, padded to 4 components
+        for alignment), half is only used if the rounding error is
+        within POSITION_TOLERANCE of the mesh's extent, as half
+        floats have just 11 bits of precision
+    normals -- 'float', 'int2101010' (normalized signed 10:10:10:2,
+        4 bytes) or 'byte' (normalized signed bytes, padded to 4)
+    textures -- 'float' or 'short' (shorts normalized over the
+        coordinates' range, decoded with the texture matrix, see
+        PackedArray.decode)
+    colours -- 'float' or 'ubyte' (normalized RGBA unsigned bytes)
+
+The formats are opt-in, see the VERTEX_FORMAT attributes of
+ArrayGeometryCompiler, IndexedPolygons and Quadric.  Indices are
+16-bit whenever fewer than 65536 vertices are drawn.
+
+memoryReport reports the (GPU) bytes of each node's compiled arrays.
+"""
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+from OpenGLContext.arrays import *
+from vrml import node, protofunctions
+import logging
+log = logging.getLogger( __name__ )
+
+def unitNormals( normals ):
+    """Normalize (N,3) normals (zero-length normals are left as zero)"""
+    normals = asarray( normals, 'f' )
+    lengths = sqrt( sum( normals**2, axis=-1 ))
+    return normals / where( lengths > 0, lengths, 1.0 )[:,newaxis]
+
+def packNormals2101010( normals ):
+    """Pack (N,3) normals to (N,) GL_INT_2_10_10_10_REV words"""
+    values = rint( clip( unitNormals( normals ), -1.0, 1.0 ) * 511 ).astype( 'i' )
+    values &= 0x3ff
+    return (values[:,0] | (values[:,1] << 10) | (values[:,2] << 20)).astype( 'I' )
+
+def unpackNormals2101010( packed ):
+    """Unpack GL_INT_2_10_10_10_REV words to (N,3) floats"""
+    packed = asarray( packed, 'I' ).astype( 'i' )
+    result = empty( (len(packed),3), 'f' )
+    for component in range( 3 ):
+        value = (packed >> (10*component)) & 0x3ff
+        value = where( value >= 512, value - 1024, value )
+        result[:,component] = maximum( value / 511.0, -1.0 )
+    return result
+
+def packNormalsByte( normals ):
+    """Pack (N,3) normals to (N,4) normalized signed bytes"""
+    result = zeros( (len(normals),4), 'b' )
+    result[:,:3] = rint( clip( unitNormals( normals ), -1.0, 1.0 ) * 127 )
+    return result
+
+def packColours( colours ):
+    """Pack (N,3) or (N,4) [0,1] colours to (N,4) normalized unsigned bytes"""
+    colours = asarray( colours, 'f' )
+    result = empty( (len(colours),4), 'B' )
+    result[:,3] = 255
+    result[:,:colours.shape[1]] = rint( clip( colours, 0.0, 1.0 ) * 255 )
+    return result
+
+def packTextures( coordinates ):
+    """Quantize (N,2) texture coordinates to normalized shorts
+
+    The shorts span the range of the coordinates, so tiled (>1)
+    coordinates keep their precision relative to the mesh.
+
+    returns (shorts, offset, scale) where
+    coordinates ~= offset + shorts * scale
+    """
+    coordinates = asarray( coordinates, 'd' )
+    low,high = coordinates.min( axis=0 ), coordinates.max( axis=0 )
+    offset = (low + high) / 2.0
+    scale = (high - low) / 65534.0
+    scale = where( scale > 0, scale, 1.0 )
+    shorts = rint( (coordinates - offset) / scale ).astype( 'h' )
+    return shorts, offset, scale
+
+def packPositions( positions, tolerance ):
+    """Convert (N,3) positions to (N,4) half floats if within tolerance
+
+    tolerance -- maximum rounding error as a fraction of the
+        positions' extent
+
+    returns half-float array or None if the error is too large
+    """
+    positions = asarray( positions, 'f' )
+    if not len(positions):
+        return None
+    extent = (positions.max( axis=0 ) - positions.min( axis=0 )).max()
+    half = ones( (len(positions),4), 'e' )
+    half[:,:3] = positions
+    if not isfinite( half ).all():
+        return None
+    error = abs( half[:,:3].astype( 'f' ) - positions ).max()
+    if error > tolerance * max( (extent, 1e-30) ):
+        return None
+    return half
+
+def indexArray( indices, vertexCount ):
+    """Get indices as 'H' (fewer than 65536 vertices) or 'I' array, and the GL type"""
+    if vertexCount < 65536:
+        return ascontiguousarray( indices, 'H' ), GL_UNSIGNED_SHORT
+    return ascontiguousarray( indices, 'I' ), GL_UNSIGNED_INT
+
+class PackedArray( object ):
+    """Packed attribute data with the information needed to draw it
+
+    data -- the packed (numpy) array (replaced by a VBO by the
+        renderers when VBOs are available)
+    size -- components per vertex
+    glType -- GL data-type constant of the components
+    stride -- bytes per vertex (components may be padded for alignment)
+    offset, scale -- for texture coordinates, the decode applied
+        with the texture matrix, see decode
+    """
+    offset = scale = None
+    def __init__( self, data, size, glType, offset=None, scale=None ):
+        self.data = data
+        self.size = size
+        self.glType = glType
+        self.stride = data.strides[0]
+        if offset is not None:
+            self.offset = offset
+            self.scale = scale
+    def decode( self ):
+        """Multiply the texture matrix by our decoding transform
+
+        Must be undone with glPopMatrix on the texture matrix stack,
+        returns whether a decode was pushed
+        """
+        if self.offset is None:
+            return False
+        glMatrixMode( GL_TEXTURE )
+        try:
+            glPushMatrix()
+            glTranslatef( self.offset[0], self.offset[1], 0.0 )
+            glScalef( self.scale[0], self.scale[1], 1.0 )
+        finally:
+            glMatrixMode( GL_MODELVIEW )
+        return True
+    @staticmethod
+    def undecode():
+        glMatrixMode( GL_TEXTURE )
+        try:
+            glPopMatrix()
+        finally:
+            glMatrixMode( GL_MODELVIEW )
+
+class VertexFormat( object ):
+    """Storage format for each vertex attribute (see module docstring)
+
+    POSITION_TOLERANCE -- maximum half-float position error as a
+        fraction of the mesh extent
+    """
+    POSITION_TOLERANCE = 1e-3
+    def __init__( self, positions='float', normals='int2101010', textures='short', colours='ubyte' ):
+        for name,value,allowed in (
+            ('positions',positions,('float','half')),
+            ('normals',normals,('float','int2101010','byte')),
+            ('textures',textures,('float','short')),
+            ('colours',colours,('float','ubyte')),
+        ):
+            if value not in allowed:
+                raise ValueError( """%s format %r is not one of %s"""%( name, value, allowed ))
+        self.positions = positions
+        self.normals = normals
+        self.textures = textures
+        self.colours = colours
+    def __repr__( self ):
+        return '%s( positions=%r, normals=%r, textures=%r, colours=%r )'%(
+            self.__class__.__name__,
+            self.positions, self.normals, self.textures, self.colours,
+        )
+
+    def packPositions( self, positions ):
+        """PackedArray for (N,3) positions or None to use float32"""
+        if self.positions == 'half':
+            half = packPositions( positions, self.POSITION_TOLERANCE )
+            if half is not None:
+                return PackedArray( half, 4, GL_HALF_FLOAT )
+        return None
+    def packNormals( self, normals ):
+        """PackedArray for (N,3) normals or None to use float32"""
+        if self.normals == 'int2101010':
+            return PackedArray( packNormals2101010( normals ), 4, GL_INT_2_10_10_10_REV )
+        elif self.normals == 'byte':
+            return PackedArray( packNormalsByte( normals ), 3, GL_BYTE )
+        return None
+    def packTextures( self, coordinates ):
+        """PackedArray for (N,2) texture coordinates or None to use float32"""
+        if self.textures == 'short':
+            shorts,offset,scale = packTextures( coordinates )
+            return PackedArray( shorts, 2, GL_SHORT, offset, scale )
+        return None
+    def packColours( self, colours ):
+        """PackedArray for (N,3|4) colours or None to use float32"""
+        if self.colours == 'ubyte':
+            return PackedArray( packColours( colours ), 4, GL_UNSIGNED_BYTE )
+        return None
+
+def arrayBytes( value ):
+    """Bytes of (VBO or numpy) array value"""
+    if value is None:
+        return 0
+    if isinstance( value, vbo.VBO ):
+        value = value.data
+    return getattr( value, 'nbytes', 0 )
+
+def memoryReport( scene, cache ):
+    """Report the compiled-array bytes of each node in scene
+
+    cache -- the (context's) vrml cache holding the nodes' renderers
+
+    Nodes whose renderer has a memoryUsage method (or is a
+    Quadric's VBO tuple) are reported.
+
+    returns list of (node, {attribute: bytes}) in traversal order
+    """
+    result = []
+    seen = set()
+    stack = [scene]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add( id(current) )
+        usage = nodeMemory( current, cache )
+        if usage:
+            result.append( (current, usage) )
+        for field in protofunctions.getFields( current ):
+            typeName = field.typeName()
+            if typeName == 'SFNode':
+                values = [field.fget( current )]
+            elif typeName == 'MFNode':
+                values = field.fget( current )
+            else:
+                continue
+            stack.extend([
+                value for value in reversed( values )
+                if isinstance( value, node.Node )
+            ])
+    return result
+
+def nodeMemory( target, cache ):
+    """Get {attribute: bytes} for target's cached renderer (or None)"""
+    for key in ('','vbos'):
+        renderer = cache.getData( target, key=key )
+        if renderer is None:
+            continue
+        usage = getattr( renderer, 'memoryUsage', None )
+        if usage is not None:
+            return usage()
+        if isinstance( renderer, tuple ) and len(renderer) == 4:
+            coords,indices,count,layout = renderer
+            return {'vertices': arrayBytes( coords ), 'indices': arrayBytes( indices )}
+    return None
+
+def formatReport( report ):
+    """Format memoryReport's result as text lines, largest first"""
+    lines = []
+    total = 0
+    for target,usage in sorted(
+        report, key=lambda record: -sum( list( record[1].values() ))
+    ):
+        size = sum( list( usage.values() ))
+        total += size
+        lines.append( '%10d %s %s %s'%(
+            size, target.__class__.__name__, getattr( target, 'DEF', '' ) or '', ' '.join([
+                '%s=%s'%(name,value) for (name,value) in sorted( usage.items() ) if value
+            ]),
+        ))
+    lines.append( '%10d total'%( total, ))
+    return lines
@@ -0,0 +1,63 @@
+"""Scenes, passes and stand-ins shared by the test modules"""
+from OpenGLContext.arrays import sin, cos
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.passes import _flat
+from OpenGLContext.move import viewplatform
+import random, time
+
+def buildScene( count=500, spread=60.0, seed=1 ):
+    """Create a scene with count randomly-placed/rotated boxes"""
+    rng = random.Random( seed )
+    children = []
+    for i in range( count ):
+        children.append( Transform(
+            translation = [rng.uniform(-spread,spread) for j in range(3)],
+            rotation = (0,1,0,rng.uniform(0,6.28)),
+            children = [
+                Shape( geometry = Box(
+                    size = [rng.uniform(.1,4) for j in range(3)],
+                )),
+            ],
+        ))
+    return sceneGraph( children = children )
+
+def setupPass( scene, position=(0,0,10) ):
+    """Create a FlatPass viewing scene without a rendering context"""
+    vp = viewplatform.ViewPlatform()
+    vp.setPosition( position )
+    flat = _flat.FlatPass( scene, [] )
+    flat.setViewPlatform( vp )
+    flat.viewport = (0,0,300,300)
+    flat.calculateFrustum()
+    return flat
+
+def grid( side=10 ):
+    """Smooth height-field quad grid, (points, coordIndex)"""
+    points = [
+        (x,sin(x*.3)*cos(z*.3),z)
+        for z in range( side+1 ) for x in range( side+1 )
+    ]
+    indices = []
+    for row in range( side ):
+        for column in range( side ):
+            a = row*(side+1)+column
+            indices.extend( (a,a+side+1,a+side+2,a+1,-1) )
+    return points, indices
+
+class CacheMode( object ):
+    """Minimal render-mode stand-in providing a node cache"""
+    def __init__( self ):
+        from vrml import cache
+        self.cache = cache.Cache()
+
+class Context( object ):
+    """Minimal rendering-context stand-in"""
+    frameCounter = None
+
+def wait( condition ):
+    """Wait for done-callbacks, which may run just after the result is available"""
+    for i in range( 100 ):
+        if condition():
+            return True
+        time.sleep( .01 )
+    return False
@@ -0,0 +1,80 @@
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.passes import aabbtree
+from OpenGLContext.tests.support import buildScene, setupPass
+from vrml.vrml97 import nodetypes
+import unittest
+
+class TestAABBTree( unittest.TestCase ):
+    """Tests for the dynamic AABB tree used for hierarchical culling"""
+    def setUp( self ):
+        self.scene = buildScene( 300 )
+        self.flat = setupPass( self.scene )
+    def _visible( self, useTree ):
+        self.flat.USE_CULLING_TREE = useTree
+        return [
+            record[-1]
+            for record in self.flat.renderSet( self.flat.getModelView() )
+        ]
+    def _check( self ):
+        found = self._visible( True )
+        expected = self._visible( False )
+        assert found == expected, (len(found),len(expected))
+        self._checkStructure( self.flat.cullingTree() )
+        return found
+    def _checkStructure( self, tree ):
+        leaves = 0
+        todo = [tree.root] if tree.root is not None else []
+        while todo:
+            node = todo.pop()
+            if node.entry is not None:
+                leaves += 1
+                assert node.height == 0
+                continue
+            for child in (node.left,node.right):
+                assert child.parent is node
+                for i in range(3):
+                    assert node.lower[i] <= child.lower[i]
+                    assert node.upper[i] >= child.upper[i]
+                todo.append( child )
+            assert abs( node.left.height - node.right.height ) <= 1
+        assert leaves == len(tree) - len(tree.untracked), (leaves, len(tree))
+    def test_matches_flat( self ):
+        visible = self._check()
+        assert 0 < len(visible) < 300, len(visible)
+        tree = self.flat.cullingTree()
+        assert tree.depth() < 20, tree.depth()
+        assert tree.tested < 300, tree.tested
+    def test_transform_change( self ):
+        self._check()
+        for child in self.scene.children[:100]:
+            child.translation = (0,0,-5)
+        visible = self._check()
+        assert len(visible) >= 100
+    def test_volume_change( self ):
+        self._check()
+        for child in self.scene.children[:100]:
+            child.children[0].geometry.size = (200,200,200)
+        visible = self._check()
+        assert len(visible) >= 100
+    def test_structure_change( self ):
+        self._check()
+        for child in self.scene.children[:150]:
+            self.scene.children.remove( child )
+        assert len(self.flat.cullingTree()) == 150
+        self._check()
+        self.scene.children.append( Transform(
+            translation = (0,0,-5),
+            children = [Shape( geometry=Box() )],
+        ))
+        visible = self._check()
+        assert len(self.flat.cullingTree()) == 151
+        added = self.scene.children[-1].children[0]
+        assert [path for path in visible if path[-1] is added]
+    def test_unbounded( self ):
+        """Paths without 8-point boxes are left to per-object tests"""
+        self.scene.children.append( Shape( geometry=PointSet() ))
+        self._check()
+        assert len(self.flat.cullingTree().untracked) == 1
+
+if __name__ == "__main__":
+    unittest.main()
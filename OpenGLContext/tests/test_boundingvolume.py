@@ -0,0 +1,50 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph import boundingvolume
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.move import viewplatform
+from OpenGLContext import frustum
+from OpenGLContext.tests.support import buildScene, setupPass
+from vrml.vrml97 import transformmatrix
+import random
+import unittest
+
+class TestBoundingVolume( unittest.TestCase ):
+    """Tests for bounding-volume culling operations"""
+    def setUp( self ):
+        vp = viewplatform.ViewPlatform()
+        vp.setPosition( (0,0,10) )
+        self.frustum = frustum.Frustum.fromViewingMatrix(
+            dot( vp.modelMatrix(), vp.viewMatrix() ),
+            normalize = 1,
+        )
+    def test_visibleMask_matches( self ):
+        """Batched culling gives the same results as BoundingBox.visible"""
+        rng = random.Random( 2 )
+        points,matrices,expected = [],[],[]
+        for i in range( 300 ):
+            box = boundingvolume.AABoundingBox(
+                center = [rng.uniform(-3,3) for j in range(3)],
+                size = [rng.uniform(.1,3) for j in range(3)],
+            )
+            matrix = transformmatrix.transformMatrix(
+                translation = [rng.uniform(-40,40) for j in range(3)],
+                rotation = (1,0,0,rng.uniform(0,6.28)),
+            ).astype('f')
+            points.append( box.getPoints() )
+            matrices.append( matrix )
+            expected.append( bool(box.visible( self.frustum, matrix )) )
+        mask = boundingvolume.visibleMask( self.frustum, points, matrices )
+        assert mask.tolist() == expected, (mask, expected)
+        assert 0 < sum(expected) < len(expected), sum(expected)
+    def test_visibleMask_empty( self ):
+        assert len(boundingvolume.visibleMask( self.frustum, [], [] )) == 0
+
+    def test_flat_filter( self ):
+        """FlatPass batched filter matches per-object filter"""
+        flat = setupPass( buildScene() )
+        flat.USE_CULLING_TREE = False
+        records = flat.renderSet( flat.getModelView() )
+        flat.USE_BATCH_CULLING = False
+        expected = flat.renderSet( flat.getModelView() )
+        assert [r[-1] for r in records] == [r[-1] for r in expected]
+        assert 0 < len(records) < 500, len(records)
@@ -0,0 +1,113 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import indexedfaceset, arraygeometry
+from OpenGLContext import compilequeue
+from OpenGLContext.tests.support import grid
+from vrml import cache
+import weakref, time
+import unittest
+
+class Context( object ):
+    """Context stand-in counting redraw requests"""
+    def __init__( self ):
+        self.redraws = 0
+        self.compileScheduler = compilequeue.CompileScheduler(
+            contexts=[weakref.ref( self )],
+        )
+    def triggerRedraw( self, force=0 ):
+        self.redraws += 1
+
+class Mode( object ):
+    def __init__( self, context ):
+        self.context = context
+        self.cache = cache.Cache()
+
+class TestCompileScheduler( unittest.TestCase ):
+    """Background compilation of IndexedFaceSets"""
+    def setUp( self ):
+        self.context = Context()
+        self.scheduler = self.context.compileScheduler
+        self.mode = Mode( self.context )
+    def tearDown( self ):
+        self.scheduler.shutdown()
+    def _ifs( self, side=10 ):
+        points,indices = grid( side )
+        return IndexedFaceSet(
+            coord=Coordinate( point=points ), coordIndex=indices, creaseAngle=1.5,
+        )
+    def _submit( self, ifs ):
+        pending = indexedfaceset.ArrayGeometryCompiler( ifs )( mode=self.mode )
+        assert isinstance( pending, compilequeue.PendingRender )
+        assert self.mode.cache.getData( ifs ) is pending
+        pending.future.result()
+        # done-callbacks may run just after the result is available
+        for i in range( 100 ):
+            if self.context.redraws >= self.scheduler.submitted:
+                break
+            time.sleep( .01 )
+        return pending
+    def test_compile( self ):
+        ifs = self._ifs()
+        pending = self._submit( ifs )
+        assert self.context.redraws == 1
+        renderer = self.scheduler.complete( pending )
+        assert isinstance( renderer, arraygeometry.IndexedArrayGeometry )
+        assert self.mode.cache.getData( ifs ) is renderer
+        assert self.mode.cache.getData( ifs, key='topology' ).renderer is renderer
+        expected = indexedfaceset.ArrayGeometryCompiler( ifs ).compile()
+        assert allclose( renderer.vertexData, expected.vertexData )
+        assert (renderer.indexData == expected.indexData).all()
+        assert self.scheduler.frameUploads == 1
+        assert self.scheduler.frameBytes > renderer.compactBytes
+    def test_point_update( self ):
+        """Point-only changes update in place without a worker"""
+        ifs = self._ifs()
+        renderer = self.scheduler.complete( self._submit( ifs ))
+        ifs.coord.point = asarray( ifs.coord.point ) * 2.0
+        updated = indexedfaceset.ArrayGeometryCompiler( ifs )( mode=self.mode )
+        assert updated is renderer
+        assert self.scheduler.submitted == 1
+    def test_budget( self ):
+        self.scheduler.UPLOAD_BUDGET = 1
+        first,second = [self._submit( self._ifs() ) for i in range(2)]
+        assert self.scheduler.complete( first ) is not None
+        redraws = self.context.redraws
+        assert self.scheduler.complete( second ) is None
+        assert self.context.redraws == redraws + 1
+        self.scheduler.startFrame()
+        assert self.scheduler.complete( second ) is not None
+    def test_stale( self ):
+        """Results for since-changed nodes aren't installed"""
+        ifs = self._ifs()
+        pending = self._submit( ifs )
+        ifs.creaseAngle = 0.0
+        assert self.mode.cache.getData( ifs ) is None
+        assert self.scheduler.complete( pending ) is not None
+        assert self.mode.cache.getData( ifs ) is None
+        assert self.mode.cache.getData( ifs, key='topology' ) is None
+    def test_stale_topology( self ):
+        """A stale result doesn't become the topology for later updates"""
+        ifs = self._ifs()
+        pending = self._submit( ifs )
+        # drop the first quad (5 indices including the -1) mid-compile
+        ifs.coordIndex = ifs.coordIndex[5:]
+        stale = self.scheduler.complete( pending )
+        assert len( stale.indexData ) == 600
+        assert self.mode.cache.getData( ifs, key='topology' ) is None
+        renderer = self.scheduler.complete( self._submit( ifs ))
+        assert len( renderer.indexData ) == 594
+        assert self.mode.cache.getData( ifs ) is renderer
+        assert self.mode.cache.getData( ifs, key='topology' ).renderer is renderer
+    def test_failure( self ):
+        ifs = self._ifs()
+        def fail():
+            raise ValueError( 'broken' )
+        holder = self.mode.cache.holder( ifs, None )
+        pending = self.scheduler.submit( holder, fail, lambda prepared,current: prepared )
+        try:
+            pending.future.result()
+        except ValueError:
+            pass
+        assert pending.render( mode=self.mode ) == 0
+        assert pending.failed
+        assert holder.data is pending
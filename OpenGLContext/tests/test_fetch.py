@@ -0,0 +1,212 @@
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.loaders import loader
+from vrml import protofunctions
+from OpenGLContext.tests.support import setupPass, wait
+from io import BytesIO
+import threading, weakref, tempfile, shutil, os
+import unittest
+
+class Server( object ):
+    """Stand-in for a file server, a _Loader over a dictionary of files
+
+    Requests block until gate is set, so tests can queue requests
+    behind the one being served.
+    """
+    def __init__( self, files ):
+        self.files = files
+        self.requests = []
+        self.gate = threading.Event()
+    def __call__( self, url, baseURL=None ):
+        self.gate.wait( 5 )
+        self.requests.append( url )
+        for u in url:
+            if u in self.files:
+                return u, u, BytesIO( self.files[u] ), None
+        raise IOError( """Unable to download url %s"""%( url, ))
+
+class Context( object ):
+    """Context stand-in counting redraw requests"""
+    def __init__( self ):
+        self.redraws = 0
+    def triggerRedraw( self, force=0 ):
+        self.redraws += 1
+
+class TestFetchService( unittest.TestCase ):
+    """Shared, prioritized background fetching"""
+    def setUp( self ):
+        self.server = Server( {
+            'http://test/a.wrl': b'a',
+            'http://test/b.png': b'b',
+            'http://test/c.png': b'c',
+            'http://test/d.png': b'd',
+        })
+        self.fetcher = loader.FetchService( self.server, workers=1 )
+    def tearDown( self ):
+        self.server.gate.set()
+        self.fetcher.shutdown()
+    def test_shared( self ):
+        context = Context()
+        results = []
+        first = self.fetcher.fetch(
+            'a.wrl', baseURL='http://test/index.wrl',
+            callback=results.append, contexts=[weakref.ref( context )],
+        )
+        second = self.fetcher.fetch( ['http://test/a.wrl'], callback=results.append )
+        assert first is second
+        assert (self.fetcher.submitted,self.fetcher.shared) == (1,1)
+        self.server.gate.set()
+        assert first.result( 5 ) == ('http://test/a.wrl','http://test/a.wrl',b'a',None)
+        assert wait( lambda: context.redraws == 1 )
+        assert results == [first,first]
+        assert self.server.requests == [['http://test/a.wrl']]
+        # completed fetches are not shared
+        third = self.fetcher.fetch( 'http://test/a.wrl' )
+        assert third is not first
+        assert third.result( 5 )[2] == b'a'
+    def test_priority( self ):
+        blocker = self.fetcher.fetch( 'http://test/a.wrl' )
+        assert wait( lambda: blocker.running() )
+        background = self.fetcher.fetch(
+            'http://test/b.png', priority=loader.priority( loader.PRIORITY_BACKGROUND ),
+        )
+        default = self.fetcher.fetch( 'http://test/c.png' )
+        far = self.fetcher.fetch(
+            'http://test/d.png', priority=loader.priority( loader.PRIORITY_VISIBLE, 10 ),
+        )
+        # re-requesting at a higher priority promotes a queued request
+        self.fetcher.fetch(
+            'http://test/b.png', priority=loader.priority( loader.PRIORITY_VISIBLE, 5 ),
+        )
+        self.server.gate.set()
+        for request in (blocker,background,default,far):
+            request.result( 5 )
+        assert self.server.requests == [
+            ['http://test/a.wrl'],['http://test/b.png'],
+            ['http://test/d.png'],['http://test/c.png'],
+        ], self.server.requests
+    def test_failure( self ):
+        self.server.gate.set()
+        request = self.fetcher.fetch( ['missing.png','other.png'], baseURL='http://test/' )
+        self.assertRaises( IOError, request.result, 5 )
+        assert wait( lambda: self.fetcher.completed == 1 )
+        assert not self.fetcher.pending
+    def test_cancel( self ):
+        """Cancelled requests are not shared with later fetches"""
+        blocker = self.fetcher.fetch( 'http://test/a.wrl' )
+        assert wait( lambda: blocker.running() )
+        cancelled = self.fetcher.fetch( 'http://test/b.png' )
+        assert cancelled.cancel()
+        again = self.fetcher.fetch( 'http://test/b.png' )
+        assert again is not cancelled
+        self.server.gate.set()
+        assert again.result( 5 )[2] == b'b'
+        # cancelled after the queue was run
+        cancelled = self.fetcher.fetch( 'http://test/c.png' )
+        cancelled.cancel()
+        assert wait( lambda: ('http://test/c.png',) not in self.fetcher.pending )
+        third = self.fetcher.fetch( 'http://test/c.png' )
+        assert third is not cancelled and third.result( 5 )[2] == b'c'
+        assert self.server.requests.count( ['http://test/b.png'] ) == 1
+    def test_workers( self ):
+        fetcher = loader.FetchService( self.server, workers=2 )
+        try:
+            requests = [
+                fetcher.fetch( 'http://test/%s'%(name,))
+                for name in ('a.wrl','b.png','c.png','d.png')
+            ]
+            self.server.gate.set()
+            for request in requests:
+                request.result( 5 )
+            assert len( fetcher.threads ) == 2
+        finally:
+            fetcher.shutdown()
+    def test_visible( self ):
+        """Rendered shapes' pending textures are fetched first"""
+        blocker = self.fetcher.fetch( 'http://test/a.wrl' )
+        textures = []
+        children = []
+        for i,name in enumerate( ('b.png','c.png','d.png') ):
+            texture = ImageTexture()
+            texture.fetchRequest = self.fetcher.fetch( 'http://test/%s'%(name,))
+            textures.append( texture )
+            children.append( Transform(
+                translation = (0,0,-5*(3-i)),
+                children = [Shape(
+                    geometry = Box(),
+                    appearance = Appearance( texture = texture ),
+                )],
+            ))
+        flat = setupPass( sceneGraph( children = children ))
+        flat.context = Context()
+        flat.prioritizeFetches( flat.frameRenderSet( flat.getModelView() )[0], self.fetcher )
+        self.server.gate.set()
+        blocker.result( 5 )
+        for texture in textures:
+            texture.fetchRequest.result( 5 )
+        assert self.server.requests[1:] == [
+            ['http://test/d.png'],['http://test/c.png'],['http://test/b.png'],
+        ], self.server.requests
+
+class TestNodeFetches( unittest.TestCase ):
+    """Inline and ImageTexture loading through the shared Fetcher"""
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+    def _write( self, name, data ):
+        filename = os.path.join( self.directory, name )
+        with open( filename, 'wb' ) as handle:
+            handle.write( data )
+        return filename
+    def test_inline( self ):
+        filename = self._write( 'scene.wrl', b'#VRML V2.0 utf8\nTransform { children [ Shape { geometry Box {} } ] }\n' )
+        inline = Inline( url=[filename] )
+        inline.fetchRequest.result( 5 )
+        assert wait( lambda: inline.scenegraph is not None )
+        assert len( inline.renderedChildren() ) == 1
+    def test_texture( self ):
+        from PIL import Image
+        data = BytesIO()
+        Image.new( 'RGB', (4,2), (0,255,0) ).save( data, 'PNG' )
+        filename = self._write( 'texture.png', data.getvalue() )
+        first = ImageTexture( url=[filename] )
+        second = ImageTexture( url=[filename] )
+        first.fetchRequest.result( 5 )
+        assert wait( lambda: first.image.size == (4,2) and second.image.size == (4,2) )
+        assert first.image.info['filename'] == filename
+    def test_missing( self ):
+        inline = Inline( url=[os.path.join( self.directory, 'missing.wrl' )] )
+        self.assertRaises( IOError, inline.fetchRequest.result, 5 )
+        assert inline.scenegraph is None
+    def test_shader( self ):
+        """Shader sources load without contexts, all contexts are redrawn"""
+        from OpenGLContext import context
+        assert not context.Context.allContexts
+        first = self._write( 'first.frag', b'void first() {}' )
+        second = self._write( 'second.frag', b'void second() {}' )
+        shader = GLSLShader( url=[first,second] )
+        for request in shader.fetchRequests:
+            request.result( 5 )
+        assert wait( lambda: shader.source == ['void first() {}\nvoid second() {}'] )
+        contexts = [Context(),Context()]
+        url = protofunctions.getField( shader, 'url' )
+        for request in url.loadBackground( shader, [first], [weakref.ref( c ) for c in contexts] ):
+            request.result( 5 )
+        assert wait( lambda: [c.redraws for c in contexts] == [1,1] )
+        assert shader.source == ['void first() {}']
+    def test_stale( self ):
+        """Superseded and cancelled fetches are ignored"""
+        texture = ImageTexture()
+        inline = Inline()
+        stale = loader.FetchRequest( ('stale.png',), loader.priority() )
+        stale.set_result( ('stale.png','stale.png',b'not an image',None) )
+        cancelled = loader.FetchRequest( ('cancelled.png',), loader.priority() )
+        cancelled.cancel()
+        for node in (texture,inline):
+            node.fetchRequest = cancelled
+            node.onFetched( stale )
+            node.onFetched( cancelled )
+        assert texture.image is None and inline.scenegraph is None
+
+if __name__ == "__main__":
+    unittest.main()
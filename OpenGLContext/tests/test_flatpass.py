@@ -0,0 +1,223 @@
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.framecounter import FrameCounter
+from OpenGLContext.tests.support import buildScene, setupPass, Context
+from OpenGLContext.contextdefinition import ContextDefinition
+from OpenGLContext.passes import flatcore, oit
+from OpenGLContext.move import viewplatform
+import unittest
+
+class TestRenderSetReuse( unittest.TestCase ):
+    """Tests for frame-coherent rendering-set reuse"""
+    def setUp( self ):
+        self.scene = buildScene( 50, spread=10 )
+        self.material = Material()
+        self.scene.children[0].translation = (0,0,0)
+        self.scene.children[0].children[0].appearance = Appearance(
+            material = self.material,
+        )
+        self.flat = setupPass( self.scene )
+        self.flat.context = Context()
+        self.flat.context.frameCounter = FrameCounter()
+    def _frame( self ):
+        return self.flat.frameRenderSet( self.flat.getModelView() )[0]
+    def _assertRebuilt( self, change ):
+        first = self._frame()
+        assert self._frame() is first
+        change()
+        self.flat.setViewPlatform( self.flat.viewPlatform )
+        self.flat.calculateFrustum()
+        second = self._frame()
+        assert second is not first
+        self.flat.USE_RENDER_SET_REUSE = False
+        expected = self.flat.renderSet( self.flat.getModelView() )
+        assert [r[-1] for r in second] == [r[-1] for r in expected]
+        return second
+    def test_reuse( self ):
+        first = self._frame()
+        for i in range( 3 ):
+            assert self._frame() is first
+        counter = self.flat.context.frameCounter
+        assert counter.renderSets == 4
+        assert counter.reuseRate() == .75, counter.reuseRate()
+        assert self.flat.renderSetReuses == 3
+    def test_view_change( self ):
+        self._assertRebuilt(
+            lambda: self.flat.viewPlatform.setPosition( (0,0,-20) )
+        )
+    def test_transform_change( self ):
+        def change():
+            self.scene.children[1].translation = (0,0,-5)
+        self._assertRebuilt( change )
+    def test_geometry_change( self ):
+        def change():
+            self.scene.children[1].children[0].geometry.size = (50,50,50)
+        self._assertRebuilt( change )
+    def test_appearance_change( self ):
+        def change():
+            self.material.transparency = .5
+        result = self._assertRebuilt( change )
+        assert [r for r in result if r[0][0]]
+    def test_structure_change( self ):
+        def change():
+            self.scene.children.append( Shape( geometry = Box() ))
+        result = self._assertRebuilt( change )
+        assert len(result) == len(self.flat.renderSet( self.flat.getModelView() ))
+
+class TestTransparencyMode( unittest.TestCase ):
+    """Choice between sorted and weighted blended transparency"""
+    def setUp( self ):
+        self.scene = buildScene( 20, spread=10 )
+        for transform in self.scene.children[::2]:
+            transform.children[0].appearance = Appearance(
+                material = Material( transparency=.5 ),
+            )
+        vp = viewplatform.ViewPlatform()
+        vp.setPosition( (0,0,30) )
+        self.flat = flatcore.FlatPass( self.scene, [] )
+        self.flat.setViewPlatform( vp )
+        self.flat.viewport = (0,0,300,300)
+        self.flat.calculateFrustum()
+        self.context = Context()
+        self.context.contextDefinition = ContextDefinition( transparencyMode='weighted' )
+        self.available = oit.WeightedTransparency.available
+    def tearDown( self ):
+        oit.WeightedTransparency.available = self.available
+    def _transparent( self ):
+        self.flat.context = self.context
+        toRender = self.flat.frameRenderSet( self.flat.getModelView() )[0]
+        return [record for record in toRender if record[0][0]]
+    def test_fallback( self ):
+        """Without OpenGL 3 support we fall back to sorting"""
+        assert self.flat.chooseTransparency( self.context ) is None
+        assert self.flat.sortTransparent
+        # the decision is the pass', the definition is unchanged
+        assert self.context.contextDefinition.transparencyMode == 'weighted'
+        assert self.flat.transparencyFallback == 'weighted'
+        oit.WeightedTransparency.available = staticmethod( lambda: True )
+        assert self.flat.chooseTransparency( self.context ) is None
+        distances = [record[0][2] for record in self._transparent()]
+        assert len(distances) == 10
+        assert distances == sorted( distances ) and len(set( distances )) == 10
+    def test_weighted( self ):
+        oit.WeightedTransparency.available = staticmethod( lambda: True )
+        sorted = self._transparent()
+        assert self.flat.chooseTransparency( self.context ) is not None
+        assert not self.flat.sortTransparent
+        unsorted = self._transparent()
+        assert unsorted is not sorted
+        assert [record[0][2] for record in unsorted] == [0.0]*10
+        self.context.contextDefinition.transparencyMode = 'sorted'
+        assert self.flat.chooseTransparency( self.context ) is None
+        assert self.flat.sortTransparent
+    def test_unusable( self ):
+        """Targets which can't be set up fall back to sorting"""
+        oit.WeightedTransparency.available = staticmethod( lambda: True )
+        target = self.flat.chooseTransparency( self.context )
+        unsorted = self._transparent()
+        def begin( viewport ):
+            raise RuntimeError( 'Unsupported depth buffer format' )
+        target.begin = begin
+        rendered = []
+        self.flat.renderTransparent = rendered.append
+        self.flat.renderTransparentWeighted( unsorted )
+        assert rendered == [unsorted]
+        assert self.flat.weightedTransparency is None and self.flat.sortTransparent
+        assert self.flat.chooseTransparency( self.context ) is None
+        assert self._transparent() is not unsorted
+        assert self.context.contextDefinition.transparencyMode == 'weighted'
+
+class TestWeightedTransparency( unittest.TestCase ):
+    """Framebuffer set-up and restoration (with GL calls recorded rather than made)"""
+    def setUp( self ):
+        self.calls = []
+        self.integers = {
+            oit.GL_READ_FRAMEBUFFER_BINDING: 7,
+            oit.GL_DRAW_FRAMEBUFFER_BINDING: 7,
+            oit.GL_DRAW_BUFFER: oit.GL_COLOR_ATTACHMENT0,
+        }
+        self.attachments = {
+            (oit.GL_DEPTH_ATTACHMENT,oit.GL_FRAMEBUFFER_ATTACHMENT_OBJECT_TYPE): oit.GL_RENDERBUFFER,
+            (oit.GL_DEPTH_ATTACHMENT,oit.GL_FRAMEBUFFER_ATTACHMENT_DEPTH_SIZE): 24,
+            (oit.GL_DEPTH_ATTACHMENT,oit.GL_FRAMEBUFFER_ATTACHMENT_COMPONENT_TYPE): oit.GL_UNSIGNED_NORMALIZED,
+            (oit.GL_STENCIL_ATTACHMENT,oit.GL_FRAMEBUFFER_ATTACHMENT_OBJECT_TYPE): oit.GL_RENDERBUFFER,
+            (oit.GL_STENCIL_ATTACHMENT,oit.GL_FRAMEBUFFER_ATTACHMENT_STENCIL_SIZE): 8,
+        }
+        results = {
+            'glGenFramebuffers': lambda *args: 21,
+            'glGenTextures': lambda *args: [22,23],
+            'glGenRenderbuffers': lambda *args: 24,
+            'glCheckFramebufferStatus': lambda *args: oit.GL_FRAMEBUFFER_COMPLETE,
+            'glGetIntegerv': lambda name: self.integers[name],
+            'glGetFramebufferAttachmentParameteriv': lambda target,attachment,name: self.attachments.get( (attachment,name), oit.GL_NONE ),
+        }
+        self.originals = {}
+        for name in dir( oit ):
+            if name.startswith( 'gl' ) and name != 'glVersion' and callable( getattr( oit, name )):
+                self.originals[name] = getattr( oit, name )
+                setattr( oit, name, self._recorder( name, results.get( name )))
+        self.singlePass = oit.WeightedTransparency.singlePass
+        oit.WeightedTransparency.singlePass = staticmethod( lambda: False )
+        self.target = oit.WeightedTransparency()
+    def tearDown( self ):
+        for name,function in self.originals.items():
+            setattr( oit, name, function )
+        oit.WeightedTransparency.singlePass = self.singlePass
+    def _recorder( self, name, result ):
+        def record( *args ):
+            self.calls.append( (name,) + args )
+            if result is not None:
+                return result( *args )
+        return record
+    def _called( self, name ):
+        return [call[1:] for call in self.calls if call[0] == name]
+    def test_restore( self ):
+        assert self.target.begin( (0,0,300,200) ) == 2
+        assert self._called( 'glRenderbufferStorage' ) == [
+            (oit.GL_RENDERBUFFER,oit.GL_DEPTH24_STENCIL8,300,200),
+        ]
+        assert self._called( 'glFramebufferRenderbuffer' )[0][1] == oit.GL_DEPTH_STENCIL_ATTACHMENT
+        # depth comes from the framebuffer being drawn to
+        blit = [call[0] for call in self.calls].index( 'glBlitFramebuffer' )
+        assert self.calls[blit-2:blit] == [
+            ('glBindFramebuffer',oit.GL_READ_FRAMEBUFFER,7),
+            ('glBindFramebuffer',oit.GL_DRAW_FRAMEBUFFER,21),
+        ]
+        self.target.selectTarget( 1 )
+        del self.calls[:]
+        self.target.end()
+        assert self.calls[:3] == [
+            ('glBindFramebuffer',oit.GL_READ_FRAMEBUFFER,7),
+            ('glBindFramebuffer',oit.GL_DRAW_FRAMEBUFFER,7),
+            ('glDrawBuffer',oit.GL_COLOR_ATTACHMENT0),
+        ]
+    def test_default_framebuffer( self ):
+        """The default framebuffer's depth format is matched"""
+        self.integers.update( {
+            oit.GL_READ_FRAMEBUFFER_BINDING: 0,
+            oit.GL_DRAW_FRAMEBUFFER_BINDING: 0,
+            oit.GL_DRAW_BUFFER: oit.GL_BACK,
+        })
+        self.attachments = {
+            (oit.GL_DEPTH,oit.GL_FRAMEBUFFER_ATTACHMENT_OBJECT_TYPE): oit.GL_FRAMEBUFFER_DEFAULT,
+            (oit.GL_DEPTH,oit.GL_FRAMEBUFFER_ATTACHMENT_DEPTH_SIZE): 32,
+            (oit.GL_DEPTH,oit.GL_FRAMEBUFFER_ATTACHMENT_COMPONENT_TYPE): oit.GL_FLOAT,
+        }
+        self.target.begin( (0,0,300,200) )
+        assert self._called( 'glRenderbufferStorage' )[0][1] == oit.GL_DEPTH_COMPONENT32F
+        assert self._called( 'glFramebufferRenderbuffer' )[0][1] == oit.GL_DEPTH_ATTACHMENT
+        self.target.end()
+        assert self._called( 'glDrawBuffer' )[-1] == (oit.GL_BACK,)
+        # re-created when the depth format changes
+        self.attachments[(oit.GL_DEPTH,oit.GL_FRAMEBUFFER_ATTACHMENT_DEPTH_SIZE)] = 24
+        self.attachments[(oit.GL_DEPTH,oit.GL_FRAMEBUFFER_ATTACHMENT_COMPONENT_TYPE)] = oit.GL_UNSIGNED_NORMALIZED
+        self.target.begin( (0,0,300,200) )
+        assert self._called( 'glRenderbufferStorage' )[-1][1] == oit.GL_DEPTH_COMPONENT24
+    def test_unsupported( self ):
+        """Unknown depth formats are refused before changing any state"""
+        self.attachments[(oit.GL_DEPTH_ATTACHMENT,oit.GL_FRAMEBUFFER_ATTACHMENT_DEPTH_SIZE)] = 8
+        self.assertRaises( RuntimeError, self.target.begin, (0,0,300,200) )
+        assert not self._called( 'glBindFramebuffer' )
+        assert self.target.framebuffer is None
+
+if __name__ == "__main__":
+    unittest.main()
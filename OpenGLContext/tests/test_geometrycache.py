@@ -0,0 +1,88 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import indexedfaceset
+from OpenGLContext import geometrycache
+from OpenGLContext.tests.support import grid, CacheMode
+import os, shutil, tempfile, time
+import unittest
+
+class TestGeometryCache( unittest.TestCase ):
+    """On-disk cache of prepared IndexedFaceSet arrays"""
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.cache = geometrycache.GeometryCache( self.directory )
+        points,indices = grid( 8 )
+        self.ifs = IndexedFaceSet(
+            coord=Coordinate( point=points ), coordIndex=indices, creaseAngle=1.5,
+            color=Color( color=[(1,0,0),(0,1,0)] ), colorIndex=[i%2 for i in range(64)],
+            colorPerVertex=False,
+        )
+    def tearDown( self ):
+        shutil.rmtree( self.directory, ignore_errors=True )
+    def _compiler( self ):
+        compiler = indexedfaceset.ArrayGeometryCompiler( self.ifs )
+        compiler.GEOMETRY_CACHE = self.cache
+        return compiler
+    def test_round_trip( self ):
+        key = self.cache.key( ('a',arange(5)), ('flag',True) )
+        assert self.cache.load( key ) is None
+        self.cache.store( key, {'values':arange(5,dtype='f'),'missing':None} )
+        loaded = self.cache.load( key )
+        assert not loaded['values'].flags.owndata
+        assert not loaded['values'].flags.writeable
+        assert allclose( loaded['values'], arange(5) )
+        assert loaded['missing'] is None
+        assert (self.cache.hits,self.cache.misses,self.cache.stores) == (1,1,1)
+        assert key != self.cache.key( ('a',arange(5)), ('flag',False) )
+        assert key != self.cache.key( ('a',arange(5,dtype='f')), ('flag',True) )
+    def test_compile( self ):
+        expected = indexedfaceset.ArrayGeometryCompiler( self.ifs ).compile()
+        self._compiler().compile()
+        assert self.cache.stores == 1
+        cached = self._compiler().compile()
+        assert self.cache.hits == 1
+        assert not cached.vertexData.flags.writeable
+        assert getattr( cached.vertices, 'data', cached.vertices ) is cached.vertexData
+        for attribute in ('vertexData','indexData','normals','colours'):
+            assert allclose(
+                asarray( getattr( cached, attribute )),
+                asarray( getattr( expected, attribute )),
+            ), attribute
+        assert cached.expandedBytes == expected.expandedBytes
+        self.ifs.creaseAngle = 0.5
+        self._compiler().compile()
+        assert self.cache.stores == 2
+    def test_point_update( self ):
+        """Read-only cached arrays are replaced rather than written"""
+        self._compiler().compile()
+        mode = CacheMode()
+        compiler = self._compiler()
+        cached = compiler( mode=mode )
+        assert self.cache.hits == 1
+        points = asarray( self.ifs.coord.point ).copy()
+        points[:,1] += 1.0
+        self.ifs.coord.point = points
+        updated = self._compiler()( mode=mode )
+        assert updated is not cached
+        assert allclose( asarray( updated.vertices )[:,1], asarray( cached.vertexData )[:,1] + 1.0 )
+    def test_evict( self ):
+        for i in range( 4 ):
+            self.cache.store( 'entry%s'%(i,), {'values':zeros( 1000, 'f' )} )
+            os.utime( self.cache.path( 'entry%s'%(i,) ), (i,i) )
+        self.cache.load( 'entry0' )
+        size = self.cache.size()
+        assert self.cache.evict( size//2 ) <= size//2
+        assert self.cache.evictions == 2
+        assert self.cache.load( 'entry0' ) is not None
+        assert self.cache.load( 'entry3' ) is not None
+        self.cache.clear()
+        assert self.cache.entries() == []
+    def test_warm( self ):
+        shape = Shape( geometry=self.ifs )
+        scene = sceneGraph( children=[
+            Transform( children=[shape] ), Transform( children=[shape] ),
+            Shape( geometry=IndexedFaceSet() ),
+        ])
+        assert list( geometrycache.indexedFaceSets( scene ))[0] is self.ifs
+        assert geometrycache.warm( scene, self.cache ) == (1,1)
+        assert geometrycache.warm( scene, self.cache ) == (1,0)
@@ -0,0 +1,336 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import indexedfaceset, arraygeometry
+from OpenGLContext.tests.support import grid, CacheMode
+import random
+import unittest
+
+def polygonSoup( count=150, seed=1, line=False ):
+    """Mixed polygons, (points, coordIndex) including the awkward cases
+
+    line -- whether to include 2-vertex polygons, which tessellate
+        passes through (unaligning the triangles which follow)
+    """
+    rng = random.Random( seed )
+    points,indices = [],[]
+    for i in range( count ):
+        kind = rng.choice( [
+            'triangle','quad','pentagon','concave','nonplanar',
+            'collinear','empty',
+        ] + ['line']*line )
+        x,y = rng.uniform(-10,10),rng.uniform(-10,10)
+        if kind == 'triangle':
+            polygon = [(x,y,0),(x+1,y,0),(x,y+1,0)]
+        elif kind == 'quad':
+            polygon = [(x,y,1),(x+1,y,1),(x+1,y+1,1),(x,y+1,1)]
+        elif kind == 'pentagon':
+            polygon = [(x+cos(a),y+sin(a),2) for a in arange(5)*2*pi/5]
+        elif kind == 'concave':
+            polygon = [(x,y,0),(x+2,y,0),(x+2,y+2,0),(x+1,y+.5,0),(x,y+2,0)]
+        elif kind == 'nonplanar':
+            polygon = [(x,y,0),(x+1,y,0),(x+1,y+1,.5),(x,y+1,0)]
+        elif kind == 'collinear':
+            polygon = [(x,y,0),(x+1,y,0),(x+2,y,0)]
+        elif kind == 'line':
+            polygon = [(x,y,0),(x+1,y,0)]
+        else:
+            polygon = []
+        base = len(points)
+        points.extend( polygon )
+        indices.extend( list(range( base, base+len(polygon) )) + [-1] )
+    return points, indices
+
+class TestIFSTessellation( unittest.TestCase ):
+    """Vectorised tessellation matches the per-vertex tessellation"""
+    def _compare( self, ifs ):
+        compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+        expected = compiler.vertexArrays( compiler.tessellate() )
+        found = compiler.triangleArrays()
+        assert found is not None
+        for key in ('point','coordIndex','color','normal','textureCoordinate'):
+            if expected[key] is None:
+                assert found[key] is None, key
+            else:
+                assert asarray( found[key] ).shape == asarray( expected[key] ).shape, key
+                assert allclose( found[key], expected[key] ), key
+        return compiler
+    def test_plain( self ):
+        points,indices = polygonSoup()
+        self._compare( IndexedFaceSet(
+            coord = Coordinate( point=points ), coordIndex = indices,
+        ))
+    def test_per_vertex_values( self ):
+        points,indices = polygonSoup( seed=2 )
+        rng = random.Random( 2 )
+        count = len(points)
+        self._compare( IndexedFaceSet(
+            coord = Coordinate( point=points ), coordIndex = indices,
+            color = Color( color=[(rng.random(),0,0) for i in range(count)] ),
+            normal = Normal( vector=[(0,0,1)]*count ),
+            texCoord = TextureCoordinate( point=[(rng.random(),0) for i in range(count)] ),
+        ))
+    def test_indexed_values( self ):
+        """Separate value indices, per-face colours and normals"""
+        points,indices = polygonSoup( seed=3 )
+        rng = random.Random( 3 )
+        faces = indices.count( -1 )
+        self._compare( IndexedFaceSet(
+            coord = Coordinate( point=points ), coordIndex = indices,
+            color = Color( color=[(0,rng.random(),0) for i in range(7)] ),
+            colorIndex = [rng.randrange(7) for i in range(faces)],
+            colorPerVertex = False,
+            normal = Normal( vector=[(0,1,0),(0,0,1)] ),
+            normalIndex = [i%2 for i in range(faces)],
+            normalPerVertex = False,
+            texCoord = TextureCoordinate( point=[(.5,.5),(0,1),(1,0)] ),
+            texCoordIndex = [(i%3 if i >= 0 else -1) for i in indices],
+        ))
+    def test_malformed( self ):
+        """Out-of-range indices use the per-vertex path"""
+        ifs = IndexedFaceSet(
+            coord = Coordinate( point=[(0,0,0),(1,0,0),(0,1,0)] ),
+            coordIndex = [0,1,2,-1],
+            color = Color( color=[(1,0,0)] ),
+            colorIndex = [0,-1],
+            colorPerVertex = True,
+        )
+        compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+        assert compiler.triangleArrays() is None
+        ifs.coordIndex = [0,1,5,-1]
+        ifs.color = None
+        assert compiler.triangleArrays() is None
+    def test_short_polygons( self ):
+        """Polygons with fewer than 3 vertices are dropped"""
+        points,indices = polygonSoup( seed=5, line=True )
+        ifs = IndexedFaceSet( coord = Coordinate( point=points ), coordIndex = indices )
+        arrays = indexedfaceset.ArrayGeometryCompiler( ifs ).triangleArrays()
+        assert len(arrays['point']) % 3 == 0
+        for triangle in reshape( arrays['coordIndex'], (-1,3) ):
+            # each triangle comes from a single polygon
+            positions = [indices.index( i ) for i in triangle]
+            between = indices[min(positions):max(positions)]
+            assert -1 not in between, triangle
+    def test_compile( self ):
+        """Compiled geometry (including generated normals) is unchanged"""
+        points,indices = polygonSoup( seed=4 )
+        ifs = IndexedFaceSet(
+            coord = Coordinate( point=points ), coordIndex = indices,
+            creaseAngle = .5,
+        )
+        compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+        fast = compiler.compile()
+        compiler.USE_ARRAY_TESSELLATION = False
+        slow = compiler.compile()
+        assert allclose( fast.vertices, slow.vertices )
+        assert allclose( fast.normals, slow.normals )
+
+def referenceNormals( vertexArray, coordIndices, creaseAngle ):
+    """Pairwise (per-corner) crease-angle smoothing, the original algorithm"""
+    from OpenGLContext import triangleutilities
+    faceNormals = triangleutilities.normalPerFace( vertexArray )
+    faceNormals = repeat( faceNormals, 3, 0 )
+    vertexNormals = array( faceNormals )
+    counts = ones( (len(vertexNormals),1), 'f' )
+    items = {}
+    for index,coordIndex in enumerate( coordIndices ):
+        items.setdefault( coordIndex, [] ).append( index )
+    for vertexSet in items.values():
+        for index,i in enumerate( vertexSet ):
+            for j in vertexSet[index+1:]:
+                cosine = min( (1.0,dot( faceNormals[i], faceNormals[j] )) )
+                if arccos( cosine ) < creaseAngle:
+                    vertexNormals[i] += faceNormals[j]
+                    vertexNormals[j] += faceNormals[i]
+                    counts[i] += 1
+                    counts[j] += 1
+    return vertexNormals / counts
+
+def cone( segments=64, seed=1 ):
+    """Cone with a high-valence tip and jittered base, (points, coordIndex)"""
+    rng = random.Random( seed )
+    points = [(0,1,0),(0,0,0)] + [
+        (cos(a),rng.uniform(-.1,.1),sin(a))
+        for a in arange( segments )*2*pi/segments
+    ]
+    indices = []
+    for i in range( segments ):
+        a,b = 2+i, 2+(i+1)%segments
+        indices.extend( (0,b,a,-1, 1,a,b,-1) )
+    return points, indices
+
+class TestCreaseNormals( unittest.TestCase ):
+    """Vectorised crease-angle normals match pairwise smoothing"""
+    def _check( self, points, indices, creaseAngles ):
+        ifs = IndexedFaceSet( coord=Coordinate( point=points ), coordIndex=indices )
+        arrays = indexedfaceset.ArrayGeometryCompiler( ifs ).triangleArrays()
+        coordIndices = arrays['coordIndex'].tolist()
+        for creaseAngle in creaseAngles:
+            expected = referenceNormals( arrays['point'], coordIndices, creaseAngle )
+            found = indexedfaceset.build_normalPerVertex(
+                None, creaseAngle, arrays['point'], arrays['coordIndex'],
+            )
+            assert found.shape == expected.shape
+            assert allclose( found, expected, atol=1e-5 ), creaseAngle
+    def test_cone( self ):
+        points,indices = cone()
+        self._check( points, indices, (0, .1, .5, 1.2, pi/2, 3.0, 3.5) )
+    def test_soup( self ):
+        points,indices = polygonSoup( seed=6 )
+        self._check( points, indices, (.5, 2.0) )
+    def test_chunked( self ):
+        """Groups larger than NORMAL_CHUNK are compared in row blocks"""
+        points,indices = cone( 200 )
+        chunk = indexedfaceset.NORMAL_CHUNK
+        indexedfaceset.NORMAL_CHUNK = 1000
+        try:
+            self._check( points, indices, (.3,) )
+        finally:
+            indexedfaceset.NORMAL_CHUNK = chunk
+
+    def test_fan( self ):
+        """High-valence fans compare only their distinct normals"""
+        segments = 200
+        points = [(0,0,0)] + [
+            (cos(a),sin(a),0) for a in arange( segments )*2*pi/segments
+        ] + [(0,0,-1)]
+        # large planar polygon (fan-tessellated) capping a cone
+        indices = list( range( 1, segments+1 )) + [-1]
+        for i in range( segments ):
+            indices.extend( (segments+1, 1+(i+1)%segments, 1+i, -1) )
+        sizes = []
+        smoothGroups = indexedfaceset._smoothGroups
+        def record( normals, *args ):
+            sizes.append( normals.shape[1] )
+            return smoothGroups( normals, *args )
+        indexedfaceset._smoothGroups = record
+        try:
+            self._check( points, indices, (.5,) )
+        finally:
+            indexedfaceset._smoothGroups = smoothGroups
+        # rim vertices merge their polygon corners into one normal
+        assert max( sizes ) == segments, sizes
+        assert sorted( set( sizes ))[:1] == [3], sizes
+    def test_degenerate( self ):
+        """Zero-area and non-finite faces don't affect their neighbours"""
+        vertexArray = array( [
+            (0,0,0),(1,0,0),(0,1,0),
+            (0,0,0),(0,1,0),(0,0,1),
+            # zero-area and non-finite faces sharing vertex 0
+            (0,0,0),(2,0,0),(3,0,0),
+            (0,0,0),(nan,0,0),(0,0,1),
+        ], 'f' )
+        coordIndices = array( [0,1,2, 0,2,3, 0,1,4, 0,5,3], 'i' )
+        for creaseAngle in (2.0,3.5):
+            found = indexedfaceset.build_normalPerVertex(
+                None, creaseAngle, vertexArray, coordIndices,
+            )
+            assert isfinite( found ).all(), found
+            expected = referenceNormals( vertexArray[:6], coordIndices[:6], creaseAngle )
+            assert allclose( found[:6], expected, atol=1e-5 ), creaseAngle
+            assert not found[6:].any()
+            assert allclose( found[0], (.5,0,.5) )
+
+class TestWelding( unittest.TestCase ):
+    """Indexed (vertex-welded) ArrayGeometry output"""
+    def _compile( self, ifs, indexed=True ):
+        compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+        compiler.USE_INDEXED_ARRAYS = indexed
+        return compiler.compile()
+    def test_smooth( self ):
+        points,indices = grid()
+        ifs = IndexedFaceSet(
+            coord=Coordinate( point=points ), coordIndex=indices, creaseAngle=1.5,
+        )
+        welded = self._compile( ifs )
+        expanded = self._compile( ifs, indexed=False )
+        assert isinstance( welded, arraygeometry.IndexedArrayGeometry )
+        assert not isinstance( expanded, arraygeometry.IndexedArrayGeometry )
+        assert len(welded.vertexData) == len(points), len(welded.vertexData)
+        assert welded.indexData.dtype == dtype( 'H' )
+        for attribute in ('vertices','normals'):
+            compact = asarray( getattr( welded, attribute ))
+            assert allclose(
+                compact[welded.indexData], getattr( expanded, attribute ),
+            ), attribute
+        assert welded.expandedBytes == sum([
+            asarray( getattr( expanded, attribute )).nbytes
+            for attribute in ('vertices','normals')
+        ])
+        assert welded.savedBytes > welded.expandedBytes/2, welded.savedBytes
+    def test_crease( self ):
+        """Corners across a crease keep their own normals"""
+        ifs = IndexedFaceSet(
+            coord = Coordinate( point=[
+                (x,y,z) for x in (0,1) for y in (0,1) for z in (0,1)
+            ]),
+            coordIndex = [
+                0,1,3,2,-1, 4,6,7,5,-1, 0,4,5,1,-1,
+                2,3,7,6,-1, 0,2,6,4,-1, 1,5,7,3,-1,
+            ],
+            creaseAngle = .5,
+        )
+        welded = self._compile( ifs )
+        assert len(welded.vertexData) == 24, len(welded.vertexData)
+        assert len(welded.indexData) == 36
+    def test_large( self ):
+        """32-bit indices once 16 bits can't address the vertices"""
+        count = 70000
+        vertices = arange( count*3, dtype='f' ).reshape( (-1,3) )
+        ag = arraygeometry.IndexedArrayGeometry(
+            vertices, indices=arange( count )[::-1],
+        )
+        assert ag.indexType == arraygeometry.GL_UNSIGNED_INT
+        assert ag.indexData.dtype == dtype( 'I' )
+
+class TestIncrementalUpdate( unittest.TestCase ):
+    """Point-only changes update the compiled geometry in place"""
+    def setUp( self ):
+        points,indices = grid( 6 )
+        self.ifs = IndexedFaceSet(
+            coord=Coordinate( point=points ), coordIndex=indices, creaseAngle=1.5,
+        )
+        self.mode = CacheMode()
+        self.renderer = self._compile()
+    def _compile( self ):
+        return indexedfaceset.ArrayGeometryCompiler( self.ifs )( mode=self.mode )
+    def _fresh( self ):
+        compiler = indexedfaceset.ArrayGeometryCompiler( self.ifs )
+        compiler.USE_INCREMENTAL_UPDATES = False
+        return compiler.compile()
+    def _check( self, renderer ):
+        expected = self._fresh()
+        for attribute in ('vertices','normals'):
+            found = asarray( getattr( renderer, attribute ))[renderer.indexData]
+            assert allclose(
+                found, asarray( getattr( expected, attribute ))[expected.indexData],
+                atol=1e-6,
+            ), attribute
+    def test_points( self ):
+        points = asarray( self.ifs.coord.point ).copy()
+        points[:,1] *= 2.0
+        self.ifs.coord.point = points
+        assert self.mode.cache.getData( self.ifs ) is None
+        assert self.mode.cache.getData( self.ifs, key='topology' ) is not None
+        renderer = self._compile()
+        assert renderer is self.renderer
+        assert self.mode.cache.getData( self.ifs ) is renderer
+        self._check( renderer )
+    def test_reweld( self ):
+        """Moving a point onto a crease rebuilds from the cached arrays"""
+        points = asarray( self.ifs.coord.point ).copy()
+        points[8,1] += 5.0
+        self.ifs.coord.point = points
+        renderer = self._compile()
+        assert renderer is not self.renderer
+        assert self.mode.cache.getData( self.ifs, key='topology' ).renderer is renderer
+        self._check( renderer )
+    def test_indices( self ):
+        """Index changes discard the cached topology"""
+        self.ifs.coordIndex = self.ifs.coordIndex[:-5]
+        assert self.mode.cache.getData( self.ifs, key='topology' ) is None
+        renderer = self._compile()
+        assert renderer is not self.renderer
+        assert len(renderer.indexData) == len(self.renderer.indexData) - 6
+    def test_point_count( self ):
+        self.ifs.coord.point = list(self.ifs.coord.point) + [(0,0,0)]
+        assert self._compile() is not self.renderer
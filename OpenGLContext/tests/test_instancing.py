@@ -0,0 +1,281 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.passes import instancing
+from OpenGLContext.scenegraph import shaders, shape
+from OpenGLContext.tests.support import setupPass, CacheMode
+import random
+import unittest
+
+class InstancedShape( Shape ):
+    """Shape which records instanced draws rather than doing them"""
+    drawn = None
+    def RenderInstanced( self, mode=None, matrices=None ):
+        self.drawn = matrices
+        return True
+
+class RecordingObject( GLSLObject ):
+    """GLSLObject with fixed attribute locations and no compilation"""
+    LOCATIONS = {'vertex':0, instancing.INSTANCE_ATTRIBUTE:4}
+    def render( self, mode, shader=None ):
+        return True,True,True,'token'
+    def renderPost( self, textureToken=None, mode=None ):
+        pass
+    def getLocation( self, mode, name, uniform=True ):
+        return self.LOCATIONS.get( name, -1 )
+
+class RecordingAttribute( ShaderAttribute ):
+    def render( self, shader, mode ):
+        return 'attribute'
+    def renderPost( self, mode, shader, token=None ):
+        pass
+
+class RecordingVBO( object ):
+    """Stand-in for OpenGL.arrays.vbo.VBO"""
+    def __init__( self, data, usage=None ):
+        self.data = data
+    def set_array( self, data ):
+        self.data = data
+    def bind( self ):
+        pass
+    def unbind( self ):
+        pass
+    def __add__( self, offset ):
+        return ('offset',offset)
+
+class _VBOModule( object ):
+    VBO = RecordingVBO
+
+class TestInstancing( unittest.TestCase ):
+    """Tests for grouping of repeated (DEF/USE) geometry"""
+    def setUp( self ):
+        rng = random.Random( 5 )
+        self.tree = Shape(
+            appearance = Appearance( material=Material( diffuseColor=(0,1,0) )),
+            geometry = Box(),
+        )
+        # same geometry, different appearance, must not join the tree group
+        self.rock = Shape(
+            appearance = Appearance( material=Material( diffuseColor=(.5,.5,.5) )),
+            geometry = self.tree.geometry,
+        )
+        children = []
+        def place( shape ):
+            children.append( Transform(
+                translation = [rng.uniform(-5,5),rng.uniform(-5,5),rng.uniform(-40,0)],
+                children = [shape],
+            ))
+        self.tree = InstancedShape(
+            appearance = self.tree.appearance, geometry = self.tree.geometry,
+        )
+        self.rock = InstancedShape(
+            appearance = self.rock.appearance, geometry = self.rock.geometry,
+        )
+        for i in range( 30 ):
+            place( self.tree )
+        for i in range( 5 ):
+            place( self.rock )
+        self.unique = [Shape( geometry=Box( size=(1,2,1) )) for i in range(10)]
+        for shape in self.unique:
+            place( shape )
+        self.ghost = InstancedShape(
+            appearance = Appearance( material=Material( transparency=.5 )),
+            geometry = self.tree.geometry,
+        )
+        for i in range( 3 ):
+            place( self.ghost )
+        self.flat = setupPass( sceneGraph( children=children ))
+        self.toRender = self.flat.renderSet( self.flat.getModelView() )
+    def _groups( self, items ):
+        return [item for item in items if isinstance( item, instancing.InstanceGroup )]
+    def test_batch( self ):
+        batcher = instancing.InstanceBatcher()
+        items = batcher.batch( self.toRender, self.flat )
+        groups = self._groups( items )
+        assert len(groups) == 2, groups
+        assert batcher.groups == 2
+        assert batcher.instances == 35, batcher.instances
+        byNode = dict([(group.node,group) for group in groups])
+        assert len(byNode[self.tree]) == 30
+        assert len(byNode[self.rock]) == 5
+        for group in groups:
+            matrices = group.matrices()
+            assert matrices.shape == (len(group),4,4)
+            for matrix,record in zip( matrices, group.records ):
+                assert allclose( matrix, record[1] )
+        # every record appears exactly once, uniques and transparent ungrouped
+        flattened = []
+        for item in items:
+            if isinstance( item, instancing.InstanceGroup ):
+                flattened.extend( item.records )
+            else:
+                assert item[-1][-1] in self.unique or item[0][0], item
+                flattened.append( item )
+        assert sorted( map( id, flattened )) == sorted( map( id, self.toRender ))
+    def test_min_instances( self ):
+        batcher = instancing.InstanceBatcher()
+        batcher.MIN_INSTANCES = 6
+        groups = self._groups( batcher.batch( self.toRender, self.flat ))
+        assert [group.node for group in groups] == [self.tree]
+    def test_fallback( self ):
+        """Without USE_INSTANCING records are yielded in order"""
+        opaque = self.flat.opaqueQueue( self.toRender )
+        self.flat.USE_INSTANCING = False
+        assert list( self.flat.renderInstanced( opaque )) == opaque
+    def test_not_drawn( self ):
+        """Groups whose leaf declines to draw them are yielded in order"""
+        opaque = self.flat.opaqueQueue( self.toRender )
+        for shape in (self.tree,self.rock):
+            shape.RenderInstanced = lambda mode=None, matrices=None: False
+        assert list( self.flat.renderInstanced( opaque )) == opaque
+    def test_render_instanced( self ):
+        """Leaves with RenderInstanced draw whole groups in one call"""
+        instanced = InstancedShape( geometry=Box() )
+        children = [
+            Transform( translation=(i,0,0), children=[instanced] )
+            for i in range( 4 )
+        ] + [Transform( translation=(0,1,0), children=[self.unique[0]] )]
+        flat = setupPass( sceneGraph( children=children ))
+        toRender = flat.opaqueQueue( flat.renderSet( flat.getModelView() ))
+        remaining = list( flat.renderInstanced( toRender ))
+        assert [record[-1][-1] for record in remaining] == [self.unique[0]]
+        assert instanced.drawn.shape == (4,4,4)
+        translations = sorted( instanced.drawn[:,3,0] - flat.getModelView()[3,0] )
+        assert allclose( translations, [0,1,2,3], atol=1e-5 ), translations
+
+class TestShaderGeometryInstanced( unittest.TestCase ):
+    """ShaderGeometry.RenderInstanced (with GL calls recorded rather than made)"""
+    GL_NAMES = (
+        'glVertexAttribPointer','glEnableVertexAttribArray',
+        'glVertexAttribDivisor','glDisableVertexAttribArray',
+        'glDrawArraysInstanced','glDrawArrays','glBindBuffer',
+    )
+    def setUp( self ):
+        self.calls = []
+        for name in self.GL_NAMES + ('vbo',):
+            self.addCleanup( setattr, shaders, name, getattr( shaders, name ))
+        for name in self.GL_NAMES:
+            setattr( shaders, name, self._recorder( name ))
+        shaders.vbo = _VBOModule
+        self.mode = CacheMode()
+        self.geometry = ShaderGeometry(
+            appearance = Shader( objects=[RecordingObject()] ),
+            attributes = [RecordingAttribute( name='vertex' )],
+            indices = [0,1,2, 2,1,3],
+        )
+        self.matrices = array( [identity(4)]*3, 'f' )
+        self.matrices[:,3,0] = [0,1,2]
+        self._available( True )
+    def _available( self, available=True ):
+        original = instancing.instancingAvailable
+        instancing.instancingAvailable = lambda: available
+        self.addCleanup( setattr, instancing, 'instancingAvailable', original )
+    def _recorder( self, name ):
+        def record( *args ):
+            self.calls.append( (name,) + args )
+        return record
+    def test_render_instanced( self ):
+        assert self.geometry.RenderInstanced( self.mode, self.matrices )
+        buffer = self.mode.cache.getData( self.geometry, 'instances' )
+        assert buffer.data is self.matrices
+        pointers = [call for call in self.calls if call[0] == 'glVertexAttribPointer']
+        assert [call[1] for call in pointers] == [4,5,6,7]
+        assert [call[-1] for call in pointers] == [('offset',i*16) for i in range(4)]
+        assert [call[1:] for call in self.calls if call[0] == 'glVertexAttribDivisor'] == [
+            (4,1),(5,1),(6,1),(7,1),(4,0),(5,0),(6,0),(7,0),
+        ]
+        draws = [call for call in self.calls if call[0].startswith( 'glDrawArrays' )]
+        assert draws == [('glDrawArraysInstanced',shaders.GL_TRIANGLES,0,6,3)], draws
+        # the per-instance buffer is re-used for following frames
+        del self.calls[:]
+        matrices = self.matrices[:2]
+        assert self.geometry.RenderInstanced( self.mode, matrices )
+        assert self.mode.cache.getData( self.geometry, 'instances' ) is buffer
+        assert buffer.data is matrices
+        assert ('glDrawArraysInstanced',shaders.GL_TRIANGLES,0,6,2) in self.calls
+    def test_no_attribute( self ):
+        """Shaders without the per-instance attribute fall back"""
+        self.geometry.appearance.objects[0].LOCATIONS = {'vertex':0}
+        assert not self.geometry.RenderInstanced( self.mode, self.matrices )
+        assert not self.calls
+    def test_unavailable( self ):
+        """Contexts without instanced drawing fall back"""
+        self._available( False )
+        assert not self.geometry.RenderInstanced( self.mode, self.matrices )
+        assert not self.calls
+
+class RecordingAppearance( Appearance ):
+    """Appearance which counts its (fixed-function) setups"""
+    setups = 0
+    alpha = 1.0
+    def render( self, mode=None ):
+        self.setups += 1
+        return True,False,self.alpha,None
+
+class RecordingBox( Box ):
+    """Box which records the matrix current for each draw"""
+    def render( self, lit=1, textured=0, transparent=0, visible=1, mode=None ):
+        self.drawn.append( mode.matrix )
+
+class TestShapeInstanced( unittest.TestCase ):
+    """DEF/USE'd fixed-function Shapes drawn as groups (GL calls recorded)"""
+    GL_NAMES = (
+        'glPushAttrib','glPopAttrib','glEnable','glDisable',
+        'glColor3f','glMatrixMode','glLoadMatrixf',
+    )
+    def setUp( self ):
+        self.calls = []
+        for name in self.GL_NAMES:
+            self.addCleanup( setattr, shape, name, getattr( shape, name ))
+            setattr( shape, name, self._recorder( name ))
+        self.geometry = RecordingBox()
+        self.geometry.drawn = []
+        self.appearance = RecordingAppearance()
+        self.tree = Shape( appearance=self.appearance, geometry=self.geometry )
+        self.unique = Shape( geometry=Box( size=(1,2,1) ))
+        children = [
+            Transform( translation=(i,0,-i), children=[self.tree] )
+            for i in range( 5 )
+        ] + [Transform( children=[self.unique] )]
+        self.flat = setupPass( sceneGraph( children=children ))
+        self.opaque = self.flat.opaqueQueue(
+            self.flat.renderSet( self.flat.getModelView() )
+        )
+    def _recorder( self, name ):
+        def record( *args ):
+            self.calls.append( (name,) + args )
+        return record
+    def test_group( self ):
+        """Appearance is set up once for the whole group"""
+        remaining = list( self.flat.renderInstanced( self.opaque ))
+        assert [record[-1][-1] for record in remaining] == [self.unique]
+        assert self.appearance.setups == 1
+        trees = [record for record in self.opaque if record[-1][-1] is self.tree]
+        loaded = [call[1] for call in self.calls if call[0] == 'glLoadMatrixf']
+        assert len(loaded) == len(self.geometry.drawn) == 5
+        for matrix,drawn,record in zip( loaded, self.geometry.drawn, trees ):
+            assert allclose( matrix, record[1] )
+            assert allclose( drawn, record[1] )
+        assert [call[0] for call in self.calls].count( 'glPushAttrib' ) == 1
+        assert [call[0] for call in self.calls].count( 'glPopAttrib' ) == 1
+    def test_individual( self ):
+        """Individual rendering repeats the setup for every instance"""
+        for record in self.opaque:
+            if record[-1][-1] is self.tree:
+                self.flat.matrix = record[1]
+                self.tree.Render( mode=self.flat )
+        assert self.appearance.setups == 5
+        assert [call[0] for call in self.calls].count( 'glPushAttrib' ) == 5
+    def test_transparent( self ):
+        """Transparent appearances decline to draw the group"""
+        self.appearance.alpha = .5
+        matrices = array( [identity(4)]*2, 'f' )
+        assert not self.tree.RenderInstanced( mode=self.flat, matrices=matrices )
+        assert not self.geometry.drawn
+    def test_not_visible( self ):
+        self.flat.visible = False
+        matrices = array( [identity(4)]*2, 'f' )
+        assert not self.tree.RenderInstanced( mode=self.flat, matrices=matrices )
+        assert not self.calls
+
+if __name__ == "__main__":
+    unittest.main()
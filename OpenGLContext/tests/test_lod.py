@@ -0,0 +1,89 @@
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.tests.support import setupPass
+from vrml.vrml97 import nodetypes
+import unittest
+
+class TestLOD( unittest.TestCase ):
+    """Range-based LOD level selection"""
+    def setUp( self ):
+        self.levels = [
+            Shape( geometry = Box() ),
+            Shape( geometry = Sphere() ),
+            Shape( geometry = Cone() ),
+        ]
+        self.lod = LOD( level = self.levels, range = [10,20], center = (0,0,-5) )
+    def test_levelIndex( self ):
+        for distance,expected in [(0,0),(9.9,0),(10,1),(19,1),(20,2),(1000,2)]:
+            self.lod.activeLevel = 0
+            assert self.lod.levelIndex( distance ) == expected, (distance,expected)
+    def test_extra_ranges( self ):
+        self.lod.level = self.levels[:2]
+        assert self.lod.levelIndex( 100 ) == 1
+        self.lod.level = []
+        assert self.lod.levelIndex( 100 ) is None
+        assert self.lod.renderedChildren() == []
+    def test_hysteresis( self ):
+        assert self.lod.levelIndex( 25, 2 ) == 2
+        assert self.lod.levelIndex( 19.5, 2 ) == 2
+        assert self.lod.levelIndex( 18.9, 2 ) == 1
+        assert self.lod.levelIndex( 11, 1 ) == 1
+        assert self.lod.levelIndex( 0, 1 ) == 0
+        assert self.lod.renderedChildren() == [self.levels[0]]
+    def test_flat_paths( self ):
+        scene = sceneGraph( children = [
+            Transform( translation = (0,0,5), children = [self.lod] ),
+        ])
+        flat = setupPass( scene, (0,0,0) )
+        def frame( position ):
+            flat.viewPlatform.setPosition( position )
+            flat.setViewPlatform( flat.viewPlatform )
+            flat.calculateFrustum()
+            generation = flat.generation
+            toRender = flat.frameRenderSet( flat.getModelView() )[0]
+            paths = flat.paths[nodetypes.Rendering]
+            assert len(paths) == 1, paths
+            return paths[0][-1], generation != flat.generation, toRender
+        node,changed,toRender = frame( (0,0,0) )
+        assert node is self.levels[0]
+        # transformed into the LOD's space, distance 15
+        node,changed,toRender = frame( (0,0,15) )
+        assert node is self.levels[1] and changed
+        assert [record[-1][-1] for record in toRender] == [self.levels[1]]
+        node,changed,toRender = frame( (0,0,15.5) )
+        assert node is self.levels[1] and not changed
+        node,changed,toRender = frame( (0,0,100) )
+        assert node is self.levels[2]
+        flat.USE_LOD_SELECTION = False
+        node,changed,toRender = frame( (0,0,0) )
+        assert node is self.levels[2]
+    def test_shared( self ):
+        """A DEF/USE'd LOD keeps a level for each of its paths"""
+        scene = sceneGraph( children = [
+            Transform( translation = (0,0,-10), children = [self.lod] ),
+            Transform( translation = (0,0,-20), children = [self.lod] ),
+        ])
+        flat = setupPass( scene, (0,0,0) )
+        def frame( z ):
+            flat.viewPlatform.setPosition( (0,0,z) )
+            flat.setViewPlatform( flat.viewPlatform )
+            flat.calculateFrustum()
+            flat.frameRenderSet( flat.getModelView() )
+            return sorted(
+                [self.levels.index( path[-1] ) for path in flat.paths[nodetypes.Rendering]]
+            ), flat.generation
+        # distances 15 and 25
+        assert frame( 0 )[0] == [1,2]
+        levels,generation = frame( 0 )
+        assert levels == [1,2]
+        # distances 11 and 21, both within their level's range
+        levels,next = frame( -4 )
+        assert levels == [1,2] and next == generation
+        # distances 9.6 and 19.6, the hysteresis holds each level
+        assert frame( -5.4 )[0] == [1,2]
+        # distances 8.5 and 18.5
+        assert frame( -6.5 )[0] == [0,1]
+        # the node's own level is untouched by per-path selection
+        assert self.lod.activeLevel == 0 and self.lod.renderedChildren() == [self.levels[0]]
+
+if __name__ == "__main__":
+    unittest.main()
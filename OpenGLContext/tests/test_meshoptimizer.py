@@ -0,0 +1,90 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import indexedfaceset, meshoptimizer
+from OpenGLContext.tests.support import grid, CacheMode
+import random
+import unittest
+
+def gridTriangles( side=40, seed=None ):
+    """Triangulated grid, (indices, vertices), optionally shuffled"""
+    a = (arange( side )[:,newaxis]*(side+1) + arange( side )).ravel()
+    triangles = concatenate( (
+        stack( (a,a+1,a+side+2), axis=-1 ), stack( (a,a+side+2,a+side+1), axis=-1 ),
+    ))
+    if seed is not None:
+        order = list( range( len(triangles) ))
+        random.Random( seed ).shuffle( order )
+        triangles = triangles[order]
+    xs,zs = meshgrid( arange( side+1, dtype='f' ), arange( side+1, dtype='f' ))
+    vertices = stack( (xs.ravel(),sin( xs.ravel()*.2 ),zs.ravel()), axis=-1 )
+    return triangles.ravel().astype( 'I' ), vertices
+
+def triangleSet( indices ):
+    """Rotation-independent set of triangles (retaining winding)"""
+    result = []
+    for triangle in reshape( indices, (-1,3) ).tolist():
+        start = triangle.index( min( triangle ))
+        result.append( tuple( triangle[start:] + triangle[:start] ))
+    return sorted( result )
+
+class TestMeshOptimizer( unittest.TestCase ):
+    """Vertex-cache, overdraw and vertex-fetch re-ordering"""
+    def test_acmr( self ):
+        assert meshoptimizer.acmr( [0,1,2] ) == 3.0
+        assert meshoptimizer.acmr( [0,1,2, 2,1,3] ) == 2.0
+        assert meshoptimizer.acmr( [0,1,2]*2 ) == 1.5
+        assert meshoptimizer.acmr( [0,1,2, 3,4,5, 0,1,2], cacheSize=3 ) == 3.0
+    def test_vertex_cache( self ):
+        indices,vertices = gridTriangles( seed=2 )
+        optimized,order = meshoptimizer.optimizeVertexCache( indices )
+        assert triangleSet( optimized ) == triangleSet( indices )
+        assert (reshape( indices, (-1,3) )[order].ravel() == optimized).all()
+        before,after = meshoptimizer.acmr( indices ), meshoptimizer.acmr( optimized )
+        assert before > 2.5, before
+        assert after < 0.8, after
+    def test_overdraw( self ):
+        indices,vertices = gridTriangles( 60, seed=3 )
+        cached,order = meshoptimizer.optimizeVertexCache( indices )
+        starts = meshoptimizer.clusters( cached )
+        assert starts[0] == 0 and starts[-1] == len(indices)//3
+        assert len(starts) > 3
+        optimized,order = meshoptimizer.optimizeOverdraw( cached, vertices )
+        assert (reshape( cached, (-1,3) )[order].ravel() == optimized).all()
+        assert triangleSet( optimized ) == triangleSet( indices )
+        assert meshoptimizer.acmr( optimized ) < meshoptimizer.acmr( cached ) * 1.1
+    def test_vertex_fetch( self ):
+        indices,vertices = gridTriangles( seed=4 )
+        normals = vertices * 2
+        remapped,(newVertices,newNormals,missing) = meshoptimizer.optimizeVertexFetch(
+            indices, vertices, normals, None,
+        )
+        assert missing is None
+        assert allclose( newVertices[remapped], vertices[indices] )
+        assert allclose( newNormals[remapped], normals[indices] )
+        values,first = unique( remapped, return_index=True )
+        assert (values == arange( len(newVertices) )).all()
+        assert (diff( first ) > 0).all()
+    def test_compile( self ):
+        points,indices = grid( 20 )
+        ifs = IndexedFaceSet(
+            coord=Coordinate( point=points ), coordIndex=indices, creaseAngle=1.5,
+        )
+        plain = indexedfaceset.ArrayGeometryCompiler( ifs ).compile()
+        compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+        compiler.OPTIMIZE_MESH = True
+        mode = CacheMode()
+        optimized = compiler( mode=mode )
+        assert meshoptimizer.acmr( optimized.indexData ) < meshoptimizer.acmr( plain.indexData )
+        def triangles( ag ):
+            return sorted([
+                tuple( sorted( map( tuple, corners.round( 4 ).tolist() )))
+                for corners in reshape( ag.vertexData[ag.indexData], (-1,3,3) )
+            ])
+        assert triangles( optimized ) == triangles( plain )
+        # incremental updates line up with the re-ordered triangles
+        ifs.coord.point = asarray( ifs.coord.point ) * 2.0
+        compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+        compiler.OPTIMIZE_MESH = True
+        assert compiler( mode=mode ) is optimized
+        expected = indexedfaceset.ArrayGeometryCompiler( ifs ).compile()
+        assert triangles( optimized ) == triangles( expected )
@@ -0,0 +1,88 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.loaders import mmscene
+from vrml import node
+from OpenGLContext.tests.support import wait
+import unittest, tempfile, os, shutil
+
+def bigScene():
+    coord = Coordinate( DEF='Shared', point=arange( 3*2000, dtype='f' ).reshape( (-1,3) ))
+    return sceneGraph( children = [
+        Transform( DEF='First', translation=(1,2,3), children = [
+            Shape(
+                geometry = IndexedFaceSet(
+                    coord=coord, coordIndex=arange( 4000 ) % 2000, creaseAngle=.5,
+                ),
+                appearance = Appearance( material=Material( diffuseColor=(1,0,0) )),
+            ),
+        ]),
+        Transform( children = [
+            Shape( geometry = PointSet( coord=coord )),
+        ]),
+    ])
+
+class TestMMScene( unittest.TestCase ):
+    """Round trips through the memory-mapped scene format"""
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join( self.directory, 'test.mmscene' )
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+    def check( self, scene ):
+        first,second = scene.children
+        assert first.DEF == 'First' and allclose( first.translation, (1,2,3) )
+        geometry = first.children[0].geometry
+        assert second.children[0].geometry.coord is geometry.coord
+        assert geometry.coord.point.shape == (2000,3)
+        assert geometry.coord.point[-1].tolist() == [5997,5998,5999]
+        assert geometry.coordIndex[2001] == 1 and geometry.creaseAngle == .5
+        assert first.children[0].appearance.material.diffuseColor.tolist() == [1,0,0]
+        assert scene.getDEF( 'Shared' ) is geometry.coord
+        return geometry
+    def test_loads( self ):
+        self.check( mmscene.loads( mmscene.dumps( bigScene() )))
+    def test_mapped( self ):
+        mmscene.dump( bigScene(), self.filename )
+        with open( self.filename, 'rb' ) as handle:
+            header,start = mmscene.readHeader( handle )
+        assert start % mmscene.ALIGNMENT == 0
+        assert [len(shape) for dtype,shape,offset in header['arrays']] == [2,1]
+        scene = mmscene.load( self.filename )
+        point = self.check( scene ).coord.point
+        # a view of the mapping, not a copy
+        base = point
+        while not isinstance( base, memmap ) and base.base is not None:
+            base = base.base
+        assert isinstance( base, memmap )
+        assert point.ctypes.data % mmscene.ALIGNMENT == 0
+        # copy-on-write, the file is not altered
+        point[0] = (9,9,9)
+        assert mmscene.load( self.filename ).children[0].children[0].geometry.coord.point[0].tolist() == [0,1,2]
+    def test_prototype( self ):
+        from vrml.vrml97 import basenodes
+        from vrml import fieldtypes
+        Custom = node.prototype( 'Custom', [fieldtypes.SFFloat( 'size', 1, 1.0 )] )
+        scene = sceneGraph( children=[Transform( children=[Custom()] )] )
+        self.assertRaises( ValueError, mmscene.dumps, scene )
+    def test_loaded_texture( self ):
+        """Images loaded from a texture's url are loaded again, not stored"""
+        from PIL import Image
+        filename = os.path.join( self.directory, 'texture.png' )
+        Image.new( 'RGB', (4,2), (0,255,0) ).save( filename )
+        texture = ImageTexture( url=[filename] )
+        scene = sceneGraph( children = [
+            Shape( geometry=Box(), appearance=Appearance( texture=texture )),
+        ])
+        texture.fetchRequest.result( 5 )
+        assert wait( lambda: texture.image is not None and texture.image.size == (4,2) )
+        loaded = mmscene.loads( mmscene.dumps( scene )).children[0].appearance.texture
+        assert loaded.url == [filename]
+        loaded.fetchRequest.result( 5 )
+        assert wait( lambda: loaded.image is not None and loaded.image.size == (4,2) )
+    def test_handler( self ):
+        mmscene.dump( bigScene(), self.filename )
+        from OpenGLContext.loaders.loader import Loader
+        self.check( Loader.load( self.filename ))
+
+if __name__ == "__main__":
+    unittest.main()
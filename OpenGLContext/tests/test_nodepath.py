@@ -0,0 +1,62 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import nodepath
+from vrml.vrml97 import nodepath as vrmlnodepath, nodetypes
+from OpenGLContext.passes import _flat
+import unittest
+
+class TestNodePath( unittest.TestCase ):
+    """Tests for the hierarchical world-matrix cache"""
+    def setUp( self ):
+        self.inner = Transform(
+            translation=(0,1,0), rotation=(0,0,1,.5), scale=(2,1,1),
+            children=[Shape(geometry=Box())],
+        )
+        self.outer = Transform(
+            translation=(1,0,0), rotation=(0,1,0,.3),
+            children=[self.inner],
+        )
+        self.other = Transform(
+            translation=(5,0,0),
+            children=[Shape(geometry=Sphere())],
+        )
+        self.sg = sceneGraph( children=[self.outer, self.other] )
+        self.flat = _flat.FlatPass( self.sg, [] )
+        self.paths = self.flat.paths[ nodetypes.Rendering ]
+    def _check( self, path ):
+        for inverse in (False,True):
+            expected = vrmlnodepath.NodePath( list(path) ).transformMatrix(
+                inverse=inverse
+            )
+            found = path.transformMatrix( inverse=inverse )
+            assert allclose( found, expected, atol=1e-5 ), (found,expected)
+    def test_matches( self ):
+        for path in self.paths:
+            self._check( path )
+    def test_direct_path( self ):
+        path = nodepath.NodePath( [self.sg, self.outer, self.inner] )
+        self._check( path )
+    def test_static_hits( self ):
+        """Repeated requests for a static scene do no matrix work"""
+        for path in self.paths:
+            path.transformMatrix()
+        nodepath.WORLD_MATRICES.reset()
+        for path in self.paths:
+            path.transformMatrix()
+        hits,misses,invalidations = nodepath.WORLD_MATRICES.summary()
+        assert hits == len(self.paths), hits
+        assert misses == 0, misses
+    def test_invalidate_subtree( self ):
+        """Changing a transform recomputes only its subtree"""
+        for path in self.paths:
+            path.transformMatrix()
+        nodepath.WORLD_MATRICES.reset()
+        self.inner.translation = (0,3,0)
+        hits,misses,invalidations = nodepath.WORLD_MATRICES.summary()
+        # the inner transform's path and the Shape path below it
+        assert invalidations == 2, invalidations
+        for path in self.paths:
+            self._check( path )
+        self.outer.rotation = (1,0,0,1)
+        for path in self.paths:
+            self._check( path )
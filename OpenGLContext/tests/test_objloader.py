@@ -0,0 +1,136 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.loaders import obj
+import unittest, random
+
+SAMPLE = b'''# test
+v 0 0 0
+v 1 0 0
+
+v 0 1 0
+  v 1 1 1
+vt 0 0
+vt 1 0 0
+vn 0 0 1
+o A
+f 1/1/1 2/1/1 3/1/1
+# comment
+f 1/2/1 2/1/1 3/1/1 4/2/1
+f -3 -2 -1
+usemtl red
+f 1//1 2//1 3//1
+f 1/1 2/2 3/1
+o B
+f 4 3 2
+f 1/1 2//1 3
+'''
+
+def shapes( sg ):
+    """Summarize the parsed shapes as (DEF,coordIndex,texCoordIndex,normalIndex)"""
+    result = []
+    for transform in sg.children:
+        for shape in transform.children:
+            geometry = shape.geometry
+            result.append( (transform.DEF,) + tuple([
+                list( getattr( geometry, name ))
+                for name in ('coordIndex','texCoordIndex','normalIndex')
+            ]))
+    return result
+
+class TestOBJParser( unittest.TestCase ):
+    """Bulk (chunked) OBJ parsing"""
+    def parse( self, data, chunkSize=obj.OBJHandler.CHUNK_SIZE ):
+        handler = obj.OBJHandler()
+        handler.CHUNK_SIZE = chunkSize
+        success,sg = handler.parse( data, 'file:///tmp/test.obj' )
+        assert success
+        return sg
+    def test_sample( self ):
+        expected = [
+            ('A', [1,2,3,-1, 1,2,3,4,-1, 2,3,4,-1],
+                [1,1,1,-1, 2,1,1,2,-1, 0,0,0,-1],
+                [1,1,1,-1, 1,1,1,1,-1, 0,0,0,-1]),
+            ('A', [1,2,3,-1, 1,2,3,-1], [0,0,0,-1, 1,2,1,-1], [1,1,1,-1, 0,0,0,-1]),
+            ('B', [4,3,2,-1, 1,2,3,-1], [0,0,0,-1, 1,0,0,-1], [0,0,0,-1, 0,1,0,-1]),
+        ]
+        for chunkSize in (7,40,1<<20):
+            sg = self.parse( SAMPLE, chunkSize )
+            assert shapes( sg ) == expected, chunkSize
+            geometry = sg.children[0].children[0].geometry
+            assert geometry.coord.point.tolist() == [[0,0,0],[0,0,0],[1,0,0],[0,1,0],[1,1,1]]
+            assert geometry.texCoord.texCoord.tolist() == [[0,0],[0,0],[1,0]]
+            assert geometry.normal.normal.tolist() == [[0,0,0],[0,0,1]]
+    def test_text( self ):
+        assert shapes( self.parse( SAMPLE.decode( 'ascii' ).replace( '\n','\r\n' ))) == shapes(
+            self.parse( SAMPLE )
+        )
+    def test_chunks( self ):
+        """Large random files parse identically whatever the chunking"""
+        rng = random.Random( 1 )
+        lines = []
+        for i in range( 200 ):
+            lines.append( 'v %s %s %s'%tuple([rng.uniform(-10,10) for j in range(3)]) )
+            lines.append( 'vt %s %s'%(rng.random(),rng.random()) )
+            if i > 3:
+                face = [rng.randint( -4, i ) or 1 for j in range( rng.randint( 3, 5 ))]
+                lines.append( 'f ' + ' '.join( ['%s/%s'%(v,v) for v in face] ))
+        data = ('\n'.join( lines ) + '\n').encode( 'ascii' )
+        whole = self.parse( data )
+        for chunkSize in (64,1000):
+            chunked = self.parse( data, chunkSize )
+            assert shapes( chunked ) == shapes( whole )
+            assert allclose(
+                chunked.children[0].children[0].geometry.coord.point,
+                whole.children[0].children[0].geometry.coord.point,
+            )
+        coordIndex = array( shapes( whole )[0][1] )
+        assert coordIndex.min() == -1 and coordIndex.max() <= 200
+        assert (coordIndex != 0).all()
+    def test_readChunks( self ):
+        chunks = list( obj.readChunks( b'a\nbb\nccc', 3 ))
+        assert all( [chunk.endswith( b'\n' ) for chunk in chunks] )
+        assert b''.join( chunks ) == b'a\nbb\nccc\n'
+
+class TestIndexedPolygons( unittest.TestCase ):
+    """OBJ import as per-material IndexedPolygons slices"""
+    def setUp( self ):
+        self.handler = obj.OBJHandler()
+        self.handler.INDEXED_POLYGONS = True
+    def geometries( self, data ):
+        success,sg = self.handler.parse( data, 'file:///tmp/test.obj' )
+        return [
+            shape.geometry for transform in sg.children for shape in transform.children
+        ]
+    def test_sample( self ):
+        geometries = self.geometries( SAMPLE )
+        assert [len(geometry.index) for geometry in geometries] == [12,6,6]
+        first = geometries[0]
+        for geometry in geometries:
+            assert geometry.coord is first.coord and geometry.normal is first.normal
+            assert geometry.texCoord is first.texCoord
+            assert geometry.polygonSides == 3
+        # each distinct v/t/n triple is a vertex of its own slice
+        points = first.coord.point
+        assert len(points) == len(first.normal.vector) == len(first.texCoord.point)
+        assert first.index.tolist() == [0,3,5, 1,3,5, 1,5,7, 2,4,6]
+        assert geometries[1].index.min() == first.index.max() + 1
+        # quad fan-triangulated: 1/2/1 2/1/1 3/1/1 4/2/1
+        quad = first.index[3:9]
+        assert points[quad].tolist() == [[0,0,0],[1,0,0],[0,1,0],[0,0,0],[0,1,0],[1,1,1]]
+        assert first.texCoord.point[quad[0]].tolist() == [1,0]
+        assert first.normal.vector[quad[0]].tolist() == [0,0,1]
+    def test_bounds( self ):
+        """Slices sharing the coordinates still get tight bounding volumes"""
+        geometries = self.geometries(
+            b'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 5 5 5\nv 6 5 5\nv 5 6 5\n'
+            b'f 1 2 3\nusemtl other\nf 4 5 6\n'
+        )
+        assert len(geometries) == 2
+        assert geometries[0].coord is geometries[1].coord
+        assert allclose( geometries[0].boundingVolume( None ).center, (.5,.5,0) )
+        assert allclose( geometries[1].boundingVolume( None ).center, (5.5,5.5,5) )
+        # no vn records, smooth normals are generated
+        assert allclose( geometries[1].normal.vector, [(0,0,1)]*6 )
+        assert not geometries[1].texCoord
+
+if __name__ == "__main__":
+    unittest.main()
@@ -43,3 +43,58 @@ class TestPolygonSort( unittest.TestCase ):
             self.viewPort,
         )
         assert allclose( d[0], expected), (d,expected)
+
+class TestIncrementalSorter( unittest.TestCase ):
+    """Frame-coherent transparent polygon ordering"""
+    def setUp( self ):
+        self.vp = viewplatform.ViewPlatform()
+        self.vp.setPosition( (0,0,10) )
+        self.projection = self.vp.viewMatrix().astype('d')
+        points = (arange( 200*3*3, dtype='f' ) * 0.618 % 1.0).reshape( (-1,3) ) * 4 - 2
+        self.elements = arange( len(points) )[::-1]
+        self.centers = points[self.elements].reshape( (-1,3,3) ).mean( axis=1 )
+        self.sorter = IncrementalSorter( self.centers, self.elements )
+    def _check( self, modelView ):
+        keys = distances( self.centers, modelView, self.projection )
+        expected = self.elements.reshape( (-1,3) )[argsort( keys, kind='stable' )].ravel()
+        assert (keys[self.sorter.order][1:] >= keys[self.sorter.order][:-1]).all()
+        assert (self.sorter.indices == expected).all()
+    def _view( self, position, orientation=(0,1,0,0) ):
+        self.vp.setPosition( position )
+        self.vp.setOrientation( orientation )
+        return self.vp.modelMatrix().astype('d')
+    def test_sort( self ):
+        modelView = self._view( (0,0,10) )
+        assert self.sorter.sort( modelView, self.projection )
+        assert self.sorter.indices.dtype == dtype( 'H' )
+        self._check( modelView )
+        # turning the viewer repairs the previous order
+        modelView = self._view( (1,.5,9), (0,1,0,.2) )
+        assert self.sorter.sort( modelView, self.projection )
+        assert self.sorter.repairs == 1
+        self._check( modelView )
+    def test_skip( self ):
+        modelView = self._view( (0,0,10) )
+        self.sorter.sort( modelView, self.projection )
+        indices = self.sorter.indices
+        assert not self.sorter.sort( modelView + 1e-7, self.projection )
+        assert self.sorter.skips == 1 and self.sorter.indices is indices
+        # moves which don't change the order don't re-upload
+        assert not self.sorter.sort( self._view( (0,0,10.001) ), self.projection )
+        assert self.sorter.indices is indices and self.sorter.repairs == 0
+    def test_projection( self ):
+        """Projection changes (e.g. the far plane) don't alter the order"""
+        modelView = self._view( (0,0,10) )
+        self.sorter.sort( modelView, self.projection )
+        far = self.vp.viewMatrix( 1000 ).astype('d')
+        assert not self.sorter.sort( modelView, far )
+        assert self.sorter.skips == 1
+        self.projection = far
+        self._check( modelView )
+    def test_setCenters( self ):
+        modelView = self._view( (0,0,10) )
+        self.sorter.sort( modelView, self.projection )
+        self.centers = self.centers * (1,1,-1)
+        self.sorter.setCenters( self.centers )
+        assert self.sorter.sort( modelView, self.projection )
+        self._check( modelView )
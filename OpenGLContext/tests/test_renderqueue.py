@@ -0,0 +1,105 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.passes import renderqueue
+from OpenGLContext.tests.support import setupPass
+import random
+import unittest
+
+class TestRenderQueue( unittest.TestCase ):
+    """Tests for state-sorting of opaque render records"""
+    def setUp( self ):
+        rng = random.Random( 3 )
+        self.materials = [Material( diffuseColor=(i*.2,0,0) ) for i in range(3)]
+        self.programs = [Shader( objects=[GLSLObject()] ) for i in range(2)]
+        appearances = [
+            Appearance( material=material ) for material in self.materials
+        ] + self.programs
+        children = []
+        for i in range( 200 ):
+            children.append( Transform(
+                translation = [rng.uniform(-5,5),rng.uniform(-5,5),rng.uniform(-40,0)],
+                children = [Shape(
+                    appearance = rng.choice( appearances ),
+                    geometry = Box(),
+                )],
+            ))
+        children.append( Shape(
+            appearance = Appearance( material=Material( transparency=.5 )),
+            geometry = Box(),
+        ))
+        self.flat = setupPass( sceneGraph( children=children ))
+        self.toRender = self.flat.renderSet( self.flat.getModelView() )
+    def test_buckets( self ):
+        """Buckets are contiguous and front-to-back internally"""
+        queue = renderqueue.RenderQueue()
+        ordered = queue.opaque( self.toRender, self.flat )
+        opaque = [record for record in self.toRender if not record[0][0]]
+        assert len(ordered) == len(opaque) == len(self.toRender) - 1
+        seen = {}
+        previous = None
+        for record in ordered:
+            key = renderqueue.stateKey( record[-1], self.flat )
+            if key != previous:
+                assert key not in seen, key
+                seen[key] = []
+                previous = key
+            seen[key].append( record[0][2] )
+        assert len(seen) == 5, len(seen)
+        for distances in seen.values():
+            assert distances == sorted( distances )
+        counters = queue.counters
+        assert counters.programSwitches == 2, counters
+        # three materials, then back to no-material for shader programs
+        assert counters.materialChanges <= 4, counters
+        assert counters.total() < queue.unsortedCounters.total()
+    def test_disabled( self ):
+        self.flat.USE_STATE_SORTING = False
+        ordered = self.flat.opaqueQueue( self.toRender )
+        assert ordered == self.toRender[:len(ordered)]
+    def test_batch_sort_keys( self ):
+        """Batched sort keys match the per-shape sortKey results"""
+        self.flat.USE_BATCH_SORT_KEYS = False
+        unbatched = self.flat.renderSet( self.flat.getModelView() )
+        assert [r[-1] for r in self.toRender] == [r[-1] for r in unbatched]
+        for record,other in zip( self.toRender, unbatched ):
+            assert record[0][:2] == other[0][:2]
+            distance,expected = record[0][2],other[0][2]
+            assert distance == expected or abs( distance - expected ) < 1e-6
+            assert allclose( record[1], other[1] )
+    def _greatestDepth( self, toRender ):
+        """Per-record (unbatched) calculation of the farthest depth"""
+        maxDepth = 0
+        for (key,mv,tm,bv,path) in toRender:
+            maxDepth = min( maxDepth, min( dot( bv.getPoints(), mv )[:,2] ))
+        return maxDepth
+    def test_greatest_depth( self ):
+        # nearer than the background, clamped
+        assert self._greatestDepth( self.toRender ) > -101
+        assert allclose( self.flat.greatestDepth( self.toRender ), 101*1.01 )
+        # beyond the background, the farthest point is picked
+        flat = setupPass( sceneGraph( children=[
+            Transform( translation=(0,0,z), children=[Shape( geometry=Box() )] )
+            for z in (-150,-300,-200)
+        ]))
+        toRender = flat.renderSet( flat.getModelView() )
+        farthest = self._greatestDepth( toRender )
+        assert -312 < farthest < -310, farthest
+        assert allclose( flat.greatestDepth( toRender ), -farthest*1.01 )
+        for record in (toRender[-1],toRender[0]):
+            assert allclose(
+                flat.greatestDepth( [record] ),
+                -self._greatestDepth( [record] )*1.01,
+            )
+    def test_counters( self ):
+        counters = renderqueue.StateCounters([
+            (None,(1,2),5),
+            (None,(1,3),5),
+            (7,(),5),
+            (7,(),6),
+        ])
+        assert counters.programSwitches == 1
+        assert counters.textureBinds == 3
+        assert counters.materialChanges == 2
+
+if __name__ == "__main__":
+    unittest.main()
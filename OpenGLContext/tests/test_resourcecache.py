@@ -0,0 +1,197 @@
+from OpenGLContext.loaders import loader, resourcecache
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+import threading, tempfile, shutil, os, hashlib
+import unittest
+
+class Handler( BaseHTTPRequestHandler ):
+    """Serves server.files, {path: (data, validators)}, honouring validators"""
+    def do_GET( self ):
+        self.server.requests.append( (self.path, dict( self.headers.items())) )
+        if self.path not in self.server.files:
+            self.send_error( 404 )
+            return
+        data,validators = self.server.files[self.path]
+        etag = validators.get( 'ETag' )
+        modified = validators.get( 'Last-Modified' )
+        if (
+            (etag and self.headers.get( 'If-None-Match' ) == etag) or
+            (modified and self.headers.get( 'If-Modified-Since' ) == modified)
+        ):
+            self.send_response( 304 )
+            self.end_headers()
+            return
+        self.send_response( 200 )
+        for key,value in validators.items():
+            self.send_header( key, value )
+        self.send_header( 'Content-Length', str( len( data )))
+        self.end_headers()
+        self.wfile.write( data )
+    def log_message( self, *args ):
+        pass
+
+class TestResourceCache( unittest.TestCase ):
+    """Downloads through the Loader's cache from a local HTTP server"""
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.server = HTTPServer( ('127.0.0.1',0), Handler )
+        self.server.files = {
+            '/shader.vert': (b'void main() {}', {'ETag':'"v1"'}),
+            '/copy.vert': (b'void main() {}', {'ETag':'"v1"'}),
+            '/texture.png': (b'png'*10, {'Last-Modified':'Sat, 17 Oct 2026 12:00:00 GMT'}),
+            '/plain.txt': (b'plain', {}),
+            '/other.vert': (b'o'*10, {'ETag':'"o1"'}),
+        }
+        self.server.requests = []
+        self.thread = threading.Thread( target=self.server.serve_forever )
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%s'%( self.server.server_address[1], )
+        self.loader = self._loader()
+    def tearDown( self ):
+        self.server.shutdown()
+        self.server.server_close()
+        # don't save our indices into the removed directory at exit
+        for cache in list( resourcecache._unsaved ):
+            if cache.directory == self.directory:
+                resourcecache._unsaved.discard( cache )
+        shutil.rmtree( self.directory )
+    def _loader( self ):
+        return loader._Loader( resourcecache.ResourceCache( self.directory ))
+    def _get( self, path, target=None ):
+        resolved,filename,file,headers = (target or self.loader)( self.base+path )
+        return filename, file.read()
+    def test_etag( self ):
+        filename,data = self._get( '/shader.vert' )
+        assert data == b'void main() {}'
+        assert os.path.basename( filename ) == hashlib.sha1( data ).hexdigest()
+        assert self._get( '/shader.vert' ) == (filename,data)
+        cache = self.loader.cache
+        assert (cache.misses,cache.hits) == (1,1)
+        assert self.server.requests[1][1].get( 'If-None-Match' ) == '"v1"'
+        # second read of the (small) object came from memory
+        assert cache.memoryHits == 1
+        # persists across loaders (once the index is flushed)
+        cache.flush()
+        other = self._loader()
+        assert self._get( '/shader.vert', other ) == (filename,data)
+        assert other.cache.stats()['hits'] == 1
+        # changed on the server
+        self.server.files['/shader.vert'] = (b'void main() { }', {'ETag':'"v2"'})
+        filename,data = self._get( '/shader.vert' )
+        assert data == b'void main() { }'
+        assert cache.misses == 2
+    def test_batched_saves( self ):
+        """Index changes are written in batches rather than per download"""
+        cache = self.loader.cache
+        cache.SAVE_UPDATES = 3
+        index = cache.path( cache.INDEX )
+        self._get( '/shader.vert' )
+        self._get( '/shader.vert' )
+        assert cache.dirty == 2 and not os.path.exists( index )
+        assert cache in resourcecache._unsaved
+        self._get( '/texture.png' )
+        assert cache.dirty == 0 and os.path.exists( index )
+        assert cache not in resourcecache._unsaved
+        self._get( '/texture.png' )
+        assert self._loader().cache.lookup( self.base+'/texture.png' )['accessed'] < (
+            cache.lookup( self.base+'/texture.png' )['accessed']
+        )
+        resourcecache._flushAll()
+        assert cache.dirty == 0
+        assert self._loader().cache.lookup( self.base+'/texture.png' ) == (
+            cache.lookup( self.base+'/texture.png' )
+        )
+    def test_save_interval( self ):
+        cache = self.loader.cache
+        self._get( '/shader.vert' )
+        assert cache.dirty == 1
+        cache.saved -= cache.SAVE_INTERVAL
+        self._get( '/shader.vert' )
+        assert cache.dirty == 0
+        assert os.path.exists( cache.path( cache.INDEX ))
+    def test_last_modified( self ):
+        data = self._get( '/texture.png' )[1]
+        assert self._get( '/texture.png' )[1] == data
+        assert self.loader.cache.hits == 1
+        assert 'If-Modified-Since' in self.server.requests[1][1]
+    def test_unvalidated( self ):
+        """Resources without validators are always downloaded"""
+        self._get( '/plain.txt' )
+        assert self._get( '/plain.txt' )[1] == b'plain'
+        assert (self.loader.cache.misses,self.loader.cache.hits) == (2,0)
+        assert 'If-None-Match' not in self.server.requests[1][1]
+    def test_content_addressed( self ):
+        first = self._get( '/shader.vert' )
+        second = self._get( '/copy.vert' )
+        assert first == second
+        stats = self.loader.cache.stats()
+        assert stats['objects'] == 1 and stats['bytes'] == len( first[1] )
+    def test_missing( self ):
+        self.assertRaises( IOError, self.loader, self.base+'/missing.png' )
+        assert self.loader.cache.misses == 0
+    def test_evict( self ):
+        cache = self.loader.cache
+        cache.MAX_BYTES = 40
+        shader = self._get( '/shader.vert' )[0]
+        texture = self._get( '/texture.png' )[0]
+        # texture (30 bytes) plus shader (14 bytes) exceeds the cap
+        assert not os.path.exists( shader )
+        assert os.path.exists( texture )
+        assert cache.evictions == 1
+        assert cache.lookup( self.base+'/shader.vert' ) is None
+        assert cache.stats()['bytes'] == 30
+    def test_lru( self ):
+        cache = self.loader.cache
+        cache.MAX_BYTES = 50
+        shader = self._get( '/shader.vert' )[0]
+        texture = self._get( '/texture.png' )[0]
+        # use the shader again, leaving the texture least-recently used
+        self._get( '/shader.vert' )
+        self._get( '/other.vert' )
+        assert cache.evictions == 1
+        assert os.path.exists( shader ) and not os.path.exists( texture )
+        assert cache.stats()['bytes'] == 24
+
+class TestMemoryTier( unittest.TestCase ):
+    """Local files held in memory, validated by mtime and size"""
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+        self.cache = resourcecache.ResourceCache( os.path.join( self.directory, 'cache' ))
+        self.loader = loader._Loader( self.cache )
+    def tearDown( self ):
+        shutil.rmtree( self.directory )
+    def _write( self, name, data ):
+        filename = os.path.join( self.directory, name )
+        with open( filename, 'wb' ) as handle:
+            handle.write( data )
+        return filename
+    def test_memory( self ):
+        filename = self._write( 'shader.frag', b'void main() {}' )
+        for i in range( 3 ):
+            assert self.loader( filename )[2].read() == b'void main() {}'
+        assert (self.cache.memoryMisses,self.cache.memoryHits) == (1,2)
+        self._write( 'shader.frag', b'void main() { discard; }' )
+        assert self.loader( filename )[2].read() == b'void main() { discard; }'
+        assert self.cache.memoryMisses == 2
+        assert self.cache.memoryUsed == 24
+        # nothing is stored on disk for local files
+        assert not os.path.exists( self.cache.directory )
+    def test_limits( self ):
+        self.cache.MEMORY_ITEM_BYTES = 10
+        self.cache.MEMORY_BYTES = 16
+        large = self._write( 'large', b'x'*11 )
+        assert self.loader( large )[2].read() == b'x'*11
+        assert self.cache.memoryUsed == 0
+        first = self._write( 'first', b'a'*8 )
+        second = self._write( 'second', b'b'*8 )
+        self.loader( first )
+        self.loader( second )
+        self.loader( first )
+        self.loader( self._write( 'third', b'c'*8 ))
+        assert sorted( self.cache.memory ) == sorted( [first,os.path.join( self.directory, 'third' )] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import simplify
+from OpenGLContext import geometrycache
+from OpenGLContext.tests.support import grid
+import shutil, tempfile
+import unittest
+
+def sphere( side=24 ):
+    """Closed UV-sphere IndexedFaceSet of unit radius"""
+    theta,phi = meshgrid(
+        linspace( 0, pi, side+1 ), linspace( 0, 2*pi, side+1 )[:-1], indexing='ij',
+    )
+    points = stack(
+        (sin( theta )*cos( phi ), cos( theta ), sin( theta )*sin( phi )), axis=-1,
+    ).reshape( (-1,3) )
+    # weld the poles so that the mesh is closed
+    points[:side] = (0,1,0)
+    points[-side:] = (0,-1,0)
+    indices = []
+    for row in range( side ):
+        for column in range( side ):
+            a = row*side+column
+            b = row*side+(column+1)%side
+            indices.extend( (a,a+side,b+side,b,-1) )
+    ifs = IndexedFaceSet( coord=Coordinate( point=points ), coordIndex=indices )
+    mesh = simplify.faceSetMesh( ifs )
+    return ifs, mesh
+
+class TestSimplify( unittest.TestCase ):
+    """Quadric-error-metric edge-collapse simplification"""
+    def test_quadrics( self ):
+        vertices = array( [(0,0,0),(1,0,0),(0,1,0)], 'd' )
+        Q = simplify.quadrics( [(0,1,2)], vertices, borderWeight=0 )
+        point = array( [.3,.3,2.0,1.0] )
+        assert allclose( dot( dot( point, Q[0] ), point ), 4.0 )
+        bordered = simplify.quadrics( [(0,1,2)], vertices )
+        assert dot( dot( point, bordered[0] ), point ) > 4.0
+    def test_sphere( self ):
+        ifs,(indices,(points,colors,normals,textures)) = sphere()
+        triangles = len(indices)//3
+        reduced,(newPoints,),error = simplify.simplify(
+            indices, points, targetCount=triangles//10,
+        )
+        assert len(reduced)//3 <= triangles//10
+        assert reduced.max() < len(newPoints)
+        radii = sqrt( sum( newPoints**2, axis=-1 ))
+        assert allclose( radii, 1.0, atol=.1 ), (radii.min(),radii.max())
+        assert 0 < error < .5, error
+        # no degenerate triangles
+        corners = newPoints[reshape( reduced, (-1,3) )]
+        areas = sqrt( sum( cross( corners[:,1]-corners[:,0], corners[:,2]-corners[:,0] )**2, axis=-1 ))
+        assert areas.min() > 0
+    def test_max_error( self ):
+        ifs,(indices,(points,colors,normals,textures)) = sphere()
+        reduced,arrays,error = simplify.simplify(
+            indices, points, targetCount=0, maxError=.01,
+        )
+        assert error <= .01
+        assert len(reduced) < len(indices)
+        assert len(reduced) > len(indices)//10
+    def test_plane( self ):
+        """A flat grid reduces to few triangles without error, keeping its outline"""
+        points,coordIndex = grid( 10 )
+        points = array( points, 'f' )
+        points[:,1] = 0
+        ifs = IndexedFaceSet( coord=Coordinate( point=points ), coordIndex=coordIndex )
+        indices,(vertices,colors,normals,textures) = simplify.faceSetMesh( ifs )
+        textures = vertices[:,::2] / 10.0
+        reduced,(newVertices,newTextures),error = simplify.simplify(
+            indices, vertices, textures, targetCount=2,
+        )
+        assert len(reduced)//3 < 20, len(reduced)
+        assert error < 1e-3, error
+        assert allclose( newVertices.min( axis=0 ), (0,0,0) )
+        assert allclose( newVertices.max( axis=0 ), (10,0,10) )
+        corners = newVertices[reshape( reduced, (-1,3) )]
+        area = sqrt( sum( cross( corners[:,1]-corners[:,0], corners[:,2]-corners[:,0] )**2, axis=-1 )).sum()/2
+        assert allclose( area, 100.0, atol=1e-3 ), area
+        # attributes follow the collapsed positions
+        assert allclose( newTextures, newVertices[:,::2]/10.0, atol=1e-5 )
+    def test_simplifiedFaceSet( self ):
+        ifs,mesh = sphere()
+        ifs.color = Color( color=[(1,0,0),(0,0,1)] )
+        ifs.colorIndex = [i%2 for i in range( len(ifs.coordIndex)//5 )]
+        ifs.colorPerVertex = False
+        result,error = simplify.simplifiedFaceSet( ifs, .25 )
+        assert simplify.triangleCount( result ) <= simplify.triangleCount( ifs )//4
+        coordIndex = asarray( result.coordIndex )
+        assert (coordIndex[3::4] == -1).all()
+        assert len(result.color.color) == len(result.coord.point)
+        colors = asarray( result.color.color )
+        assert ((colors >= 0) & (colors <= 1)).all()
+        assert not len(result.colorIndex)
+        assert result.colorPerVertex
+
+class TestAutoLOD( unittest.TestCase ):
+    """Generation of LOD levels for heavy Shapes"""
+    def setUp( self ):
+        self.directory = tempfile.mkdtemp()
+    def tearDown( self ):
+        shutil.rmtree( self.directory, ignore_errors=True )
+    def test_buildLOD( self ):
+        ifs,mesh = sphere()
+        shape = Shape( appearance=Appearance(), geometry=ifs )
+        lod = simplify.buildLOD( shape, ratios=(.5,.2) )
+        assert lod.level[0] is shape
+        counts = [simplify.triangleCount( level.geometry ) for level in lod.level]
+        assert counts[1] <= counts[0]//2 and counts[2] <= counts[0]//5, counts
+        assert [level.appearance for level in lod.level] == [shape.appearance]*3
+        assert len(lod.range) == 2
+        assert 0 < lod.range[0] <= lod.range[1]
+        assert allclose( lod.center, (0,0,0), atol=1e-6 )
+    def test_autoLOD( self ):
+        ifs,mesh = sphere()
+        heavy = Shape( geometry=ifs )
+        light = Shape( geometry=IndexedFaceSet(
+            coord=Coordinate( point=[(0,0,0),(1,0,0),(0,1,0)] ), coordIndex=[0,1,2,-1],
+        ))
+        authored = LOD( level=[heavy, light], range=[10] )
+        scene = sceneGraph( children=[
+            Transform( children=[heavy, light] ), heavy, authored,
+        ])
+        assert simplify.autoLOD( scene, minimumTriangles=100, ratios=(.5,) ) == 1
+        replaced = scene.children[0].children[0]
+        assert isinstance( replaced, LOD ) and replaced.level[0] is heavy
+        assert scene.children[1] is replaced
+        assert scene.children[0].children[1] is light
+        assert authored.level[0] is heavy
+    def test_cache( self ):
+        ifs,mesh = sphere()
+        cache = geometrycache.GeometryCache( self.directory )
+        result,error = simplify.simplifiedFaceSet( ifs, .5, cache=cache )
+        assert (cache.misses,cache.stores) == (1,1)
+        loaded,loadedError = simplify.simplifiedFaceSet( ifs, .5, cache=cache )
+        assert cache.hits == 1
+        assert error == loadedError
+        assert allclose( loaded.coord.point, result.coord.point )
+        assert (asarray( loaded.coordIndex ) == asarray( result.coordIndex )).all()
+        simplify.simplifiedFaceSet( ifs, .25, cache=cache )
+        assert cache.stores == 2
+
+if __name__ == "__main__":
+    unittest.main()
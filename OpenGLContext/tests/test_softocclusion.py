@@ -0,0 +1,143 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.passes import softocclusion
+from OpenGLContext.tests.support import setupPass
+import random
+import unittest
+
+def cityBlock( wall=True, seed=4 ):
+    """Wall at z=0 hiding a block of buildings, with a few in view
+
+    returns (scene, hidden shapes, visible shapes)
+    """
+    rng = random.Random( seed )
+    children = []
+    hidden,visible = [],[]
+    def building( position, collection ):
+        shape = Shape( geometry = Box(
+            size = (rng.uniform(.5,2),rng.uniform(.5,4),rng.uniform(.5,2)),
+        ))
+        children.append( Transform( translation=position, children=[shape] ))
+        collection.append( shape )
+    for i in range( 100 ):
+        building(
+            (rng.uniform(-10,10),rng.uniform(-5,3),rng.uniform(-40,-3)),
+            hidden,
+        )
+    for i in range( 5 ):
+        # in front of the wall, and beside it, spaced so they can't
+        # hide each other
+        building( (i*6-12,0,5), visible )
+        building( (22,i*4-8,-10), visible )
+    if wall:
+        children.append( Transform(
+            translation = (0,0,0),
+            children = [Shape( geometry = Box( size=(30,16,1) ))],
+        ))
+    return sceneGraph( children=children ), hidden, visible
+
+EYE = array( (0,0,30), 'd' )
+
+def boxes( scene ):
+    """(shape, lower, upper) for each (translated) Box in scene"""
+    result = []
+    for transform in scene.children:
+        shape = transform.children[0]
+        half = asarray( shape.geometry.size, 'd' )/2.0
+        center = asarray( transform.translation, 'd' )
+        result.append( (shape, center-half, center+half) )
+    return result
+
+def rayVisible( lower, upper, others, samples=6 ):
+    """Ray-cast from EYE to sample points on the box, any unobstructed?"""
+    lowers = array( [other[1] for other in others], 'd' )
+    uppers = array( [other[2] for other in others], 'd' )
+    steps = (arange( samples )+.5)/samples
+    for axis in range( 3 ):
+        a,b = [i for i in range(3) if i != axis]
+        for value in (lower[axis],upper[axis]):
+            for u in steps:
+                for v in steps:
+                    point = empty( 3, 'd' )
+                    point[axis] = value
+                    point[a] = lower[a] + u*(upper[a]-lower[a])
+                    point[b] = lower[b] + v*(upper[b]-lower[b])
+                    direction = point - EYE
+                    with errstate( divide='ignore', invalid='ignore' ):
+                        t0 = (lowers - EYE)/direction
+                        t1 = (uppers - EYE)/direction
+                    near = nanmax( minimum( t0, t1 ), axis=1 )
+                    far = nanmin( maximum( t0, t1 ), axis=1 )
+                    if not ((near <= far) & (far > 0) & (near < 1-1e-6)).any():
+                        return True
+    return False
+
+class TestSoftwareOcclusion( unittest.TestCase ):
+    """CPU-only tests of the software occlusion culler"""
+    def _filtered( self, scene ):
+        flat = setupPass( scene, position=tuple(EYE) )
+        flat.USE_SOFTWARE_OCCLUSION = True
+        toRender = flat.renderSet( flat.getModelView() )
+        result = flat.occlusionFilter( toRender )
+        kept = set([id(record[-1][-1]) for record in result])
+        self._checkConservative( scene, toRender, kept )
+        return flat, toRender, kept
+    def _checkConservative( self, scene, toRender, kept ):
+        """Everything culled really is hidden (by ray-casting)"""
+        allBoxes = boxes( scene )
+        rendered = set([id(record[-1][-1]) for record in toRender])
+        for shape,lower,upper in allBoxes:
+            if id(shape) in rendered and id(shape) not in kept:
+                others = [other for other in allBoxes if other[0] is not shape]
+                assert not rayVisible( lower, upper, others ), (lower,upper)
+    def test_wall( self ):
+        scene,hidden,visible = cityBlock()
+        flat,toRender,kept = self._filtered( scene )
+        culler = flat.softwareOcclusion
+        assert culler.occluders >= 1, culler.occluders
+        for shape in visible:
+            assert id(shape) in kept
+        wall = scene.children[-1].children[0]
+        assert id(wall) in kept
+        hiddenKept = [shape for shape in hidden if id(shape) in kept]
+        assert len(hiddenKept) < len(hidden)*.1, len(hiddenKept)
+    def test_no_wall( self ):
+        """Buildings may hide each other, but only when really hidden"""
+        scene,hidden,visible = cityBlock( wall=False )
+        flat,toRender,kept = self._filtered( scene )
+        for shape in visible:
+            assert id(shape) in kept
+    def test_non_occluder( self ):
+        """Geometry without exact polygons never occludes"""
+        scene,hidden,visible = cityBlock()
+        wall = scene.children.pop()
+        scene.children.append( Transform( children=[
+            Shape( geometry = Sphere( radius=20 )),
+        ]))
+        flat = setupPass( scene, position=tuple(EYE) )
+        flat.USE_SOFTWARE_OCCLUSION = True
+        flat.softwareOcclusion.MIN_OCCLUDER_AREA = .5
+        toRender = flat.renderSet( flat.getModelView() )
+        assert flat.occlusionFilter( toRender ) == toRender
+        assert flat.softwareOcclusion.occluders == 0
+    def test_partial_cover( self ):
+        """Objects only partly behind the wall remain visible"""
+        scene,hidden,visible = cityBlock()
+        straddle = Shape( geometry=Box( size=(4,1,1) ))
+        scene.children.append( Transform(
+            translation=(17,0,-5), children=[straddle],
+        ))
+        flat,toRender,kept = self._filtered( scene )
+        assert id(straddle) in kept
+    def test_pyramid( self ):
+        culler = softocclusion.SoftwareOcclusion()
+        depth = ones( (5,6), 'f' )
+        depth[:4,:4] = .5
+        pyramid = culler.buildPyramid( depth )
+        assert pyramid[-1].shape == (1,1)
+        assert pyramid[1][0,0] == .5 and pyramid[1][0,1] == .5
+        assert pyramid[1][2,0] == 1.0
+        assert pyramid[-1][0,0] == 1.0
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import streambuffer, indexedpolygons, vertexformat
+from OpenGLContext.tests.support import CacheMode
+from OpenGL.arrays import vbo
+import unittest
+
+class TestStreamBuffer( unittest.TestCase ):
+    """Ring-buffered uploads (with GL calls recorded rather than made)"""
+    def setUp( self ):
+        self.calls = []
+        self.originals = {}
+        for name in ('glBindBuffer','glBufferData','glBufferSubData'):
+            self.originals[name] = getattr( streambuffer, name )
+            setattr( streambuffer, name, self._recorder( name ))
+        self.buffer = streambuffer.StreamBuffer( zeros( (10,3), 'f' ))
+        self.buffer.buffers = [11,12,13]
+    def tearDown( self ):
+        for name,function in self.originals.items():
+            setattr( streambuffer, name, function )
+    def _recorder( self, name ):
+        def record( *args ):
+            self.calls.append( (name,) + args )
+        return record
+    def _upload( self, data ):
+        self.buffer.update( data )
+        del self.calls[:]
+        self.buffer.bind()
+        return [call[:2] if call[0] == 'glBindBuffer' else call[:1] for call in self.calls]
+    def test_ring( self ):
+        self.buffer.bind()
+        assert self.buffer.allocations == 1
+        data = ones( (10,3), 'f' )
+        assert self._upload( data ) == [('glBindBuffer',streambuffer.GL_ARRAY_BUFFER),('glBufferData',)]
+        assert self.calls[0][2] == 12
+        self._upload( data )
+        assert self.buffer.current == 2 and self.buffer.allocations == 3
+        # back to the first buffer, its storage is re-used
+        assert self._upload( data ) == [
+            ('glBindBuffer',streambuffer.GL_ARRAY_BUFFER),('glBufferData',),('glBufferSubData',),
+        ]
+        assert self.calls[1][3] is None
+        assert (self.buffer.current,self.buffer.allocations,self.buffer.uploads) == (0,3,4)
+        # smaller data fits, larger needs new storage
+        self._upload( data[:5] )
+        assert self.buffer.allocations == 3
+        self._upload( ones( (20,3), 'f' ))
+        assert self.buffer.allocations == 4
+        assert self.buffer.capacities == [120,120,240]
+    def test_usage( self ):
+        """Static until the first update, then streamed"""
+        self.buffer.bind()
+        assert self.calls[-1][4] == streambuffer.GL_STATIC_DRAW
+        data = ones( (10,3), 'f' )
+        self._upload( data )
+        assert self.calls[-1][4] == streambuffer.GL_STREAM_DRAW
+        # the first buffer's storage is re-specified as streamed
+        self._upload( data )
+        self._upload( data )
+        assert self.calls[1][0] == 'glBufferData' and self.calls[1][3] is None
+        assert self.calls[1][4] == streambuffer.GL_STREAM_DRAW
+    def test_unused_update( self ):
+        """Updates which were never drawn don't advance the ring"""
+        self.buffer.bind()
+        self.buffer.update( ones( (10,3), 'f' ))
+        self.buffer.update( ones( (10,3), 'f' )*2 )
+        assert self.buffer.current == 1
+        self.buffer.bind()
+        assert self.buffer.uploads == 2
+
+class TestIndexedPolygonsVBOs( unittest.TestCase ):
+    """Per-attribute invalidation of IndexedPolygons' buffers"""
+    def setUp( self ):
+        self.get_implementation = vbo.get_implementation
+        vbo.get_implementation = lambda: True
+        self.node = IndexedPolygons(
+            coord = Coordinate( point=[(0,0,0),(1,0,0),(0,1,0),(1,1,0)] ),
+            normal = Normal( vector=[(0,0,1)]*4 ),
+            index = [0,1,2, 1,3,2],
+        )
+        self.mode = CacheMode()
+    def tearDown( self ):
+        vbo.get_implementation = self.get_implementation
+    def test_points( self ):
+        vbos = self.node.get_vbos( self.mode )
+        coord,normal = vbos.coord,vbos.normal
+        normals = normal.data
+        assert vbos.color is None and vbos.indices is None
+        self.node.coord.point = asarray( self.node.coord.point )*2
+        assert self.node.get_vbos( self.mode ) is vbos
+        assert vbos.coord is coord and vbos.normal is normal
+        assert allclose( coord.data[1], (2,0,0) )
+        assert normal.data is normals
+        self.node.color = Color( color=[(1,0,0)]*4 )
+        assert self.node.get_vbos( self.mode ).color is not None
+        assert normal.data is normals and coord.data[1][0] == 2
+    def test_indices( self ):
+        self.node.VERTEX_FORMAT = vertexformat.VertexFormat()
+        vbos = self.node.get_vbos( self.mode )
+        assert vbos.indexType == vertexformat.GL_UNSIGNED_SHORT
+        assert vbos.indices.data.tolist() == [0,1,2,1,3,2]
+        assert vbos.formats['normal'].glType == vertexformat.GL_INT_2_10_10_10_REV
+        coords = vbos.coord.data
+        self.node.index = [0,1,2]
+        assert self.node.get_vbos( self.mode ).indices.data.tolist() == [0,1,2]
+        assert vbos.coord.data is coords
+    def test_shared( self ):
+        """Nodes sharing a Coordinate share its buffer"""
+        other = IndexedPolygons( coord=self.node.coord, index=[1,3,2] )
+        vbos = self.node.get_vbos( self.mode )
+        coord = vbos.coord
+        assert other.get_vbos( self.mode ).coord is coord
+        self.node.coord.point = asarray( self.node.coord.point )*3
+        assert other.get_vbos( self.mode ).coord is coord
+        assert self.node.get_vbos( self.mode ).coord is coord
+        assert coord.data[1][0] == 3
+        assert other.get_vbos( self.mode ).normal is None
+
+if __name__ == "__main__":
+    unittest.main()
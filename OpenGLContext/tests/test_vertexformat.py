@@ -0,0 +1,134 @@
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import vertexformat, arraygeometry, indexedfaceset
+from OpenGLContext.tests.support import grid, CacheMode
+from OpenGL.GL import *
+import unittest
+
+class TestPacking( unittest.TestCase ):
+    """Quantization of the individual vertex attributes"""
+    def setUp( self ):
+        self.normals = vertexformat.unitNormals(
+            arange( 3*100, dtype='f' ).reshape( (-1,3) ) % 7 - 3,
+        )
+    def test_2101010( self ):
+        packed = vertexformat.packNormals2101010( self.normals )
+        assert packed.dtype == dtype( 'I' ) and packed.shape == (100,)
+        unpacked = vertexformat.unpackNormals2101010( packed )
+        assert allclose( unpacked, self.normals, atol=1.0/511 )
+        extremes = array( [(1,0,0),(-1,0,0),(0,-1,0),(0,0,1)], 'f' )
+        assert allclose( vertexformat.unpackNormals2101010(
+            vertexformat.packNormals2101010( extremes )
+        ), extremes )
+    def test_byte_normals( self ):
+        packed = vertexformat.packNormalsByte( self.normals )
+        assert packed.dtype == dtype( 'b' ) and packed.shape == (100,4)
+        assert allclose( packed[:,:3]/127.0, self.normals, atol=1.0/127 )
+    def test_colours( self ):
+        packed = vertexformat.packColours( [(0,.5,1),(2,-1,.25)] )
+        assert packed.tolist() == [[0,128,255,255],[255,0,64,255]]
+    def test_textures( self ):
+        coordinates = array( [(0,0),(4,1),(-2,.5),(1,1)], 'd' )
+        shorts,offset,scale = vertexformat.packTextures( coordinates )
+        assert shorts.dtype == dtype( 'h' )
+        assert allclose( offset + shorts*scale, coordinates, atol=6.0/65534 )
+        assert abs( shorts ).max() == 32767
+    def test_positions( self ):
+        positions = array( [(0,0,0),(1,2,3),(.5,.25,-1)], 'f' )
+        half = vertexformat.packPositions( positions, 1e-3 )
+        assert half.dtype == dtype( 'e' ) and half.shape == (3,4)
+        assert allclose( half[:,:3], positions ) and (half[:,3] == 1).all()
+        # far from the origin half floats lose the detail
+        assert vertexformat.packPositions( positions + 5000, 1e-3 ) is None
+        assert vertexformat.packPositions( positions * 1e6, 1e-3 ) is None
+    def test_indexArray( self ):
+        indices,glType = vertexformat.indexArray( [0,1,2], 3 )
+        assert indices.dtype == dtype( 'H' ) and glType == GL_UNSIGNED_SHORT
+        indices,glType = vertexformat.indexArray( [0,1,65536], 65537 )
+        assert indices.dtype == dtype( 'I' ) and glType == GL_UNSIGNED_INT
+    def test_format( self ):
+        self.assertRaises( ValueError, vertexformat.VertexFormat, normals='half' )
+        format = vertexformat.VertexFormat( normals='float', colours='float' )
+        assert format.packNormals( self.normals ) is None
+        assert format.packColours( self.normals ) is None
+        packed = format.packTextures( self.normals[:,:2] )
+        assert (packed.size,packed.glType,packed.stride) == (2,GL_SHORT,4)
+        assert packed.offset is not None
+
+class TestArrayGeometry( unittest.TestCase ):
+    """ArrayGeometry packing with a VertexFormat"""
+    FORMAT = vertexformat.VertexFormat( positions='half' )
+    def _geometry( self, format=FORMAT ):
+        points,coordIndex = grid( 8 )
+        ifs = IndexedFaceSet(
+            coord=Coordinate( point=points ), coordIndex=coordIndex,
+            texCoord=TextureCoordinate( point=[(x/8.0,z/8.0) for (x,y,z) in points] ),
+            color=Color( color=[(x/8.0,0,1) for (x,y,z) in points] ),
+            creaseAngle=1.5,
+        )
+        compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+        compiler.VERTEX_FORMAT = format
+        return compiler.compile()
+    def test_packed( self ):
+        plain = self._geometry( None )
+        packed = self._geometry()
+        assert packed.vertexFormat is self.FORMAT
+        assert sorted( packed.formats ) == ['colours','normals','textures','vertices']
+        usage = packed.memoryUsage()
+        plainUsage = plain.memoryUsage()
+        assert usage['normals'] == plainUsage['normals']//3
+        assert usage['textures'] == plainUsage['textures']//2
+        assert usage['vertices'] == plainUsage['vertices']*2//3
+        assert usage['indices'] == plainUsage['indices']
+        assert packed.compactBytes < plain.compactBytes*2//3
+        # float data is kept for sorting
+        assert allclose( packed.vertexData, plain.vertexData )
+        assert packed.indexType == GL_UNSIGNED_SHORT
+    def test_updateArrays( self ):
+        geometry = self._geometry()
+        vertices = asarray( geometry.vertexData )[geometry.indexData] * 2
+        assert geometry.updateArrays( vertices )
+        stored = asarray( getattr( geometry.vertices, 'data', geometry.vertices ))
+        assert stored.dtype == dtype( 'e' )
+        assert allclose( stored[:,:3], geometry.vertexData, atol=1e-2 )
+        # no longer representable as half floats
+        assert not geometry.updateArrays( vertices + 10000 )
+    def test_memoryReport( self ):
+        points,coordIndex = grid( 4 )
+        ifs = IndexedFaceSet( coord=Coordinate( point=points ), coordIndex=coordIndex )
+        ifs.DEF = 'Grid'
+        scene = sceneGraph( children=[Transform( children=[Shape( geometry=ifs )])] )
+        mode = CacheMode()
+        renderer = indexedfaceset.ArrayGeometryCompiler( ifs )( mode=mode )
+        report = vertexformat.memoryReport( scene, mode.cache )
+        assert [target for target,usage in report] == [ifs]
+        usage = report[0][1]
+        assert usage['vertices'] == len(renderer.vertexData)*12
+        lines = vertexformat.formatReport( report )
+        assert 'IndexedFaceSet Grid' in lines[0]
+        assert lines[-1].split() == [str( sum( list( usage.values() ))),'total']
+
+class TestQuadric( unittest.TestCase ):
+    """Interleaved packing of Quadric vertices"""
+    def test_packVertices( self ):
+        from OpenGLContext.scenegraph import quadrics
+        sphere = Sphere( radius=2.0 )
+        sphere.VERTEX_FORMAT = vertexformat.VertexFormat( positions='half' )
+        coords,indices = sphere.compileArrays()
+        packed,layout = sphere.packVertices( coords )
+        # 8 bytes half position, 4 short texCoord, 4 byte 2101010 normal
+        assert layout.stride == 16 and packed.shape == (len(coords),16)
+        assert layout.attributes['coord'] == (4,GL_HALF_FLOAT,0)
+        assert layout.attributes['texCoord'] == (2,GL_SHORT,8)
+        assert layout.attributes['normal'] == (4,GL_INT_2_10_10_10_REV,12)
+        positions = packed[:,:8].copy().view( 'e' )
+        assert allclose( positions[:,:3], coords[:,:3], atol=2e-3 )
+        textures = layout.textures
+        decoded = textures.offset + packed[:,8:12].copy().view( 'h' )*textures.scale
+        assert allclose( decoded, coords[:,3:5], atol=1e-4 )
+        normals = vertexformat.unpackNormals2101010( packed[:,12:16].copy().view( 'I' )[:,0] )
+        assert allclose( normals, vertexformat.unitNormals( coords[:,5:8] ), atol=2.0/511 )
+        assert quadrics.FLOAT_LAYOUT.stride == coords.strides[0]
+
+if __name__ == "__main__":
+    unittest.main()
@@ -79,6 +79,9 @@ used to maintain and extend PyOpenGL.
                 'oglc-vrml=OpenGLContext.bin.vrml_view:main',
                 'oglc-profile=OpenGLContext.bin.profile_view:main',
                 'oglc-visual=OpenGLContext.bin.visualshell:main',
+                'oglc-geometry-cache=OpenGLContext.bin.geometrycache:main',
+                'oglc-simplify=OpenGLContext.bin.simplify:main',
+                'oglc-vrml2mmscene=OpenGLContext.loaders.vrml2mmscene:main',
             ],
         },
         # non python files of examples      
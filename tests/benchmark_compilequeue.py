@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+'''CPU benchmark of frame times with inline and background IFS compilation
+
+Simulates the first frames of a world containing many large
+IndexedFaceSet height-fields (no OpenGL context is required, the
+draw itself is skipped).  Each frame "renders" every mesh: inline
+compilation compiles every mesh within the first frame, while a
+compilequeue.CompileScheduler prepares them on worker threads and
+finishes at most UPLOAD_BUDGET bytes per frame.  Reports the
+worst and mean frame times and the number of frames until every
+mesh was available.
+
+    benchmark_compilequeue.py [meshCount] [meshSide] [frameInterval]
+'''
+from __future__ import print_function
+import sys, time
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import indexedfaceset
+from OpenGLContext import compilequeue
+from vrml import cache
+
+class Context( object ):
+    compileScheduler = None
+    def triggerRedraw( self, force=0 ):
+        pass
+
+class Mode( object ):
+    def __init__( self, context ):
+        self.context = context
+        self.cache = cache.Cache()
+
+def buildMesh( side, seed ):
+    """Smooth (non-planar) height-field of side*side quads"""
+    xs,zs = meshgrid( arange( side+1, dtype='f' ), arange( side+1, dtype='f' ))
+    heights = sin( xs*.3 + seed ) * cos( zs*.2 )
+    points = stack( (xs.ravel(),heights.ravel(),zs.ravel()), axis=-1 )
+    a = (arange( side )[:,newaxis]*(side+1) + arange( side )).ravel()
+    indices = stack( (a,a+1,a+side+2,a+side+1,-ones_like(a)), axis=-1 )
+    return IndexedFaceSet(
+        coord = Coordinate( point = points ),
+        coordIndex = indices.ravel(),
+        creaseAngle = 1.0,
+    )
+
+def frames( meshes, mode, interval ):
+    """Render frames until every mesh is ready, return frame times"""
+    times = []
+    while True:
+        t = time.time()
+        if mode.context.compileScheduler:
+            mode.context.compileScheduler.startFrame()
+        ready = 0
+        for mesh in meshes:
+            renderer = mode.cache.getData( mesh )
+            if renderer is None:
+                renderer = mesh.compile( mode=mode )
+            if isinstance( renderer, compilequeue.PendingRender ):
+                renderer = mode.context.compileScheduler.complete( renderer )
+            if renderer is not None:
+                ready += 1
+        times.append( time.time()-t )
+        if ready == len(meshes):
+            return times
+        time.sleep( max( (0,interval - times[-1]) ))
+
+def report( name, times ):
+    print( '%s: %s frames, worst %0.1fms, mean %0.1fms'%(
+        name, len(times), max(times)*1000, sum(times)/len(times)*1000,
+    ))
+
+def main():
+    count = int( (sys.argv[1:2] or [16])[0] )
+    side = int( (sys.argv[2:3] or [150])[0] )
+    interval = float( (sys.argv[3:4] or [1/60.])[0] )
+    print( 'Meshes: %s of %s quads'%( count, side*side ))
+    context = Context()
+    report( 'Inline', frames(
+        [buildMesh( side, i ) for i in range( count )], Mode( context ), interval
+    ))
+    context.compileScheduler = compilequeue.CompileScheduler()
+    try:
+        report( 'Background', frames(
+            [buildMesh( side, i ) for i in range( count )], Mode( context ), interval
+        ))
+    finally:
+        context.compileScheduler.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+'''CPU benchmark comparing batched and per-object frustum culling
+
+Builds a (non-rendered) scene of randomly placed Box Shapes,
+then times FlatPass.frustumVisibilityFilter using the batched
+(boundingvolume.visibleMask) and per-object (BoundingBox.visible)
+paths, then times the full FlatPass.renderSet with and without
+the hierarchical culling tree (passes.aabbtree).  No OpenGL
+context is required.
+
+    benchmark_frustumcull.py [shapeCount] [iterations]
+'''
+from __future__ import print_function
+import sys, time, random
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import boundingvolume
+from OpenGLContext.passes import _flat
+from OpenGLContext.move import viewplatform
+
+def buildScene( count, spread=200.0, seed=1 ):
+    """Create a scene with count randomly placed/rotated boxes"""
+    rng = random.Random( seed )
+    children = []
+    for i in range( count ):
+        children.append( Transform(
+            translation = [rng.uniform(-spread,spread) for j in range(3)],
+            rotation = (0,1,0,rng.uniform(0,6.28)),
+            children = [
+                Shape( geometry = Box(
+                    size = [rng.uniform(.1,4) for j in range(3)],
+                )),
+            ],
+        ))
+    return sceneGraph( children = children )
+
+def setupPass( scene ):
+    """Create a FlatPass for the scene without a rendering context"""
+    vp = viewplatform.ViewPlatform()
+    vp.setPosition( (0,0,10) )
+    flat = _flat.FlatPass( scene, [] )
+    flat.setViewPlatform( vp )
+    flat.viewport = (0,0,300,300)
+    flat.calculateFrustum()
+    return flat
+
+def records( flat ):
+    """Produce un-culled render records for the flat pass"""
+    matrix = flat.getModelView()
+    result = []
+    for path in flat.paths.get( _flat.nodetypes.Rendering, ()):
+        tmatrix = path.transformMatrix()
+        result.append( (
+            None, _flat.dot( tmatrix, matrix ), tmatrix,
+            path[-1].boundingVolume( flat ), path,
+        ))
+    return result
+
+def timeFilter( flat, toFilter, iterations ):
+    t = time.time()
+    for i in range( iterations ):
+        result = flat.frustumVisibilityFilter( toFilter )
+    return (time.time()-t)/iterations, result
+
+def timeRenderSet( flat, iterations ):
+    matrix = flat.getModelView()
+    flat.renderSet( matrix ) # build/refit tree, warm caches
+    t = time.time()
+    for i in range( iterations ):
+        result = flat.renderSet( matrix )
+    return (time.time()-t)/iterations, result
+
+def main():
+    count = int( (sys.argv[1:2] or [20000])[0] )
+    iterations = int( (sys.argv[2:3] or [5])[0] )
+    flat = setupPass( buildScene( count ) )
+    toFilter = records( flat )
+    print( 'Shapes: %s frustcullaccel: %s'%(
+        len(toFilter), bool(boundingvolume.frustcullaccel),
+    ))
+    flat.USE_BATCH_CULLING = False
+    perObject,expected = timeFilter( flat, toFilter, iterations )
+    flat.USE_BATCH_CULLING = True
+    batched,result = timeFilter( flat, toFilter, iterations )
+    assert [r[-1] for r in result] == [r[-1] for r in expected]
+    print( 'Visible: %s'%( len(result), ))
+    print( 'Per-object: %0.2fms'%( perObject*1000, ))
+    print( 'Batched:    %0.2fms (%0.1fx)'%( batched*1000, perObject/(batched or 1e-9) ))
+    flat.USE_CULLING_TREE = False
+    flatSet,expected = timeRenderSet( flat, iterations )
+    flat.USE_CULLING_TREE = True
+    treeSet,result = timeRenderSet( flat, iterations )
+    assert [r[-1] for r in result] == [r[-1] for r in expected]
+    tree = flat.cullingTree()
+    print( 'renderSet (flat list): %0.2fms'%( flatSet*1000, ))
+    print( 'renderSet (AABB tree): %0.2fms (%0.1fx, depth %s, %s nodes tested)'%(
+        treeSet*1000, flatSet/(treeSet or 1e-9), tree.depth(), tree.tested,
+    ))
+
+if __name__ == "__main__":
+    main()
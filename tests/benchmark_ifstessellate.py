@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+'''CPU benchmark comparing vectorised and per-vertex IFS tessellation
+
+Builds a (non-rendered) IndexedFaceSet height-field grid of quads
+(with every fifth row split into triangles and a concave notch
+polygon per row) carrying colours and texture coordinates, then
+times ArrayGeometryCompiler.compile with the per-vertex
+(Vertex/Polygon/GLU) path and with the NumPy triangleArrays fast
+path, checking that both produce the same arrays.  No OpenGL
+context is required.
+
+    benchmark_ifstessellate.py [faceCount] [iterations]
+'''
+from __future__ import print_function
+import sys, time
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import indexedfaceset
+
+def buildMesh( faces ):
+    """Create an IndexedFaceSet grid with roughly faces polygons"""
+    side = max( (2,int(sqrt( faces ))) )
+    xs,zs = meshgrid( arange( side+1, dtype='f' ), arange( side+1, dtype='f' ))
+    heights = sin( xs*.3 ) * cos( zs*.2 )
+    points = stack( (xs.ravel(),zeros(xs.size,'f'),zs.ravel()), axis=-1 )
+    # planar quads, height is applied per-row so quads remain planar
+    points[:,1] = repeat( heights[:,0], side+1 )
+    indices = []
+    for row in range( side ):
+        for column in range( side ):
+            a = row*(side+1)+column
+            b,c,d = a+1, a+side+2, a+side+1
+            if row % 5 == 0:
+                indices.extend( (a,b,c,-1,a,c,d,-1) )
+            else:
+                indices.extend( (a,b,c,d,-1) )
+    # one concave polygon per row, which must go to the tessellator
+    notch = len(points)
+    extra = []
+    for row in range( side ):
+        base = notch + len(extra)
+        extra.extend( [(-3,row,0),(-1,row,0),(-1,row,2),(-2,row,.5),(-3,row,2)] )
+        indices.extend( list(range( base, base+5 )) + [-1] )
+    points = concatenate( (points, array( extra, 'f' )) )
+    return IndexedFaceSet(
+        coord = Coordinate( point = points ),
+        coordIndex = indices,
+        color = Color( color = points / (side+1) ),
+        texCoord = TextureCoordinate( point = points[:,::2] / (side+1) ),
+        normalPerVertex = False,
+    )
+
+def timeCompile( ifs, fast, iterations ):
+    compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+    compiler.USE_ARRAY_TESSELLATION = fast
+    t = time.time()
+    for i in range( iterations ):
+        result = compiler.compile( mode=None )
+    return (time.time()-t)/iterations, result
+
+def main():
+    count = int( (sys.argv[1:2] or [50000])[0] )
+    iterations = int( (sys.argv[2:3] or [1])[0] )
+    t = time.time()
+    ifs = buildMesh( count )
+    print( 'Polygons: %s indices: %s (built in %0.2fs)'%(
+        sum( asarray( ifs.coordIndex ) < 0 ), len(ifs.coordIndex ), time.time()-t,
+    ))
+    perVertex,expected = timeCompile( ifs, False, iterations )
+    vectorised,result = timeCompile( ifs, True, iterations )
+    for attribute in ('vertices','colours','normals','textures'):
+        assert allclose(
+            getattr( result, attribute ), getattr( expected, attribute )
+        ), attribute
+    print( 'Triangles: %s'%( len(result.vertices)//3, ))
+    print( 'Per-vertex: %0.2fs'%( perVertex, ))
+    print( 'Vectorised: %0.2fs (%0.1fx)'%( vectorised, perVertex/(vectorised or 1e-9) ))
+
+if __name__ == "__main__":
+    main()
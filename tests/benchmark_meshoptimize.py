@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+'''CPU benchmark of post-transform vertex-cache efficiency (ACMR)
+
+Compiles IndexedFaceSets with and without the ArrayGeometryCompiler
+OPTIMIZE_MESH stage and reports the average cache misses per
+triangle (ACMR, for FIFO caches of 16 and 32 entries) of the
+resulting index buffers, along with the time taken to optimize.
+No OpenGL context is required.
+
+    benchmark_meshoptimize.py [gridSide]
+'''
+from __future__ import print_function
+from OpenGLContext.arrays import *
+import sys, time, random
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import indexedfaceset, meshoptimizer
+
+def gridMesh( side, shuffle=False ):
+    """Smooth height-field of side*side quads (optionally shuffled order)"""
+    xs,zs = meshgrid( arange( side+1, dtype='f' ), arange( side+1, dtype='f' ))
+    points = stack( (xs.ravel(),(sin( xs*.3 )*cos( zs*.2 )).ravel(),zs.ravel()), axis=-1 )
+    a = (arange( side )[:,newaxis]*(side+1) + arange( side )).ravel()
+    quads = stack( (a,a+1,a+side+2,a+side+1,-ones_like(a)), axis=-1 )
+    if shuffle:
+        order = list( range( len(quads) ))
+        random.Random( 1 ).shuffle( order )
+        quads = quads[order]
+    return IndexedFaceSet(
+        coord = Coordinate( point = points ),
+        coordIndex = quads.ravel(),
+        creaseAngle = 1.0,
+    )
+
+def sphereMesh( segments ):
+    """UV-sphere built as triangle fans at the poles and quads elsewhere"""
+    coords,indices = Sphere.sphere( pi/segments )
+    return IndexedFaceSet(
+        coord = Coordinate( point = coords[:,:3] ),
+        coordIndex = insert( indices.astype('i'), arange( 3, len(indices)+1, 3 ), -1 ),
+        creaseAngle = 3.2,
+    )
+
+def compile( ifs, optimize ):
+    compiler = indexedfaceset.ArrayGeometryCompiler( ifs )
+    compiler.OPTIMIZE_MESH = optimize
+    t = time.time()
+    result = compiler.compile()
+    return result, time.time()-t
+
+def main():
+    side = int( (sys.argv[1:2] or [150])[0] )
+    meshes = [
+        ('grid (row order)', gridMesh( side )),
+        ('grid (shuffled)', gridMesh( side, True )),
+        ('sphere', sphereMesh( side )),
+    ]
+    for name,ifs in meshes:
+        plain,plainTime = compile( ifs, False )
+        optimized,optimizedTime = compile( ifs, True )
+        print( '%s: %s triangles, compile %0.2fs -> %0.2fs'%(
+            name, len(plain.indexData)//3, plainTime, optimizedTime,
+        ))
+        for cacheSize in (16,32):
+            print( '    ACMR(%s): %0.3f -> %0.3f'%(
+                cacheSize,
+                meshoptimizer.acmr( plain.indexData, cacheSize ),
+                meshoptimizer.acmr( optimized.indexData, cacheSize ),
+            ))
+
+if __name__ == "__main__":
+    main()
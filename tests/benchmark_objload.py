@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+'''Throughput benchmark of the OBJ loader
+
+Writes a synthetic OBJ file (a grid of v/vt/vn records with v/t/n
+quad faces) of roughly the requested size and reports the parse
+throughput in MB/s of the chunked, bulk OBJHandler parse (creating
+IndexedFaceSets, and IndexedPolygons with INDEXED_POLYGONS) and of a
+per-line split()/float()/int() loop (the approach of the previous
+OBJ parser) for comparison.  No OpenGL context is required.
+
+    benchmark_objload.py [megabytes]
+'''
+from __future__ import print_function
+import sys, os, time, tempfile
+from OpenGLContext.loaders import obj
+
+def writeGrid( filename, megabytes ):
+    """Write a grid-mesh OBJ of roughly megabytes size"""
+    # roughly 160 bytes of records per grid vertex
+    side = int( (megabytes * 1024 * 1024 / 160.0) ** .5 ) + 2
+    with open( filename, 'w' ) as handle:
+        handle.write( '# synthetic grid %sx%s\no grid\n'%(side,side) )
+        for z in range( side ):
+            handle.write( ''.join([
+                'v %.6f %.6f %.6f\n'%(x*.1,((x*z)%7)*.01,z*.1) for x in range( side )
+            ]))
+        for z in range( side ):
+            handle.write( ''.join([
+                'vt %.6f %.6f\n'%(x/float(side),z/float(side)) for x in range( side )
+            ]))
+        handle.write( 'vn 0 1 0\n' )
+        for z in range( side-1 ):
+            rows = []
+            for x in range( side-1 ):
+                a = z*side + x + 1
+                rows.append( 'f %d/%d/1 %d/%d/1 %d/%d/1 %d/%d/1\n'%(
+                    a,a, a+1,a+1, a+side+1,a+side+1, a+side,a+side,
+                ))
+            handle.write( ''.join( rows ))
+    return side
+
+def perLine( filename ):
+    """Python per-line parse of the records (no scenegraph)"""
+    vertices, indices = [], []
+    with open( filename ) as handle:
+        for line in handle:
+            values = line.split()
+            if not values:
+                continue
+            if values[0] in ('v','vn','vt'):
+                vertices.append( [float(x) for x in values[1:]] )
+            elif values[0] == 'f':
+                for v in values[1:]:
+                    indices.append( [int(x or 0) for x in v.split( '/' )] )
+    return vertices, indices
+
+def bulk( filename, polygons=False ):
+    """OBJHandler parse, reading the file in chunks"""
+    handler = obj.OBJHandler()
+    handler.INDEXED_POLYGONS = polygons
+    with open( filename, 'rb' ) as handle:
+        return handler.parse( handler.getData( filename, filename, handle ), filename )
+
+def main():
+    megabytes = float( (sys.argv[1:2] or [64])[0] )
+    fd,filename = tempfile.mkstemp( suffix='.obj' )
+    os.close( fd )
+    try:
+        side = writeGrid( filename, megabytes )
+        size = os.path.getsize( filename ) / (1024.0*1024.0)
+        print( 'OBJ grid %sx%s: %.1fMB'%(side,side,size) )
+        for name,function in (
+            ('per-line',perLine),
+            ('bulk',bulk),
+            ('polygons',lambda filename: bulk( filename, True )),
+        ):
+            t = time.time()
+            function( filename )
+            elapsed = time.time() - t
+            print( '%-9s %7.2fs %8.1fMB/s'%(name,elapsed,size/elapsed) )
+    finally:
+        os.remove( filename )
+
+if __name__ == "__main__":
+    main()
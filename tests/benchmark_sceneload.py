@@ -0,0 +1,86 @@
+#! /usr/bin/env python
+'''Cold-start benchmark of the mmscene format against gzpickle
+
+Builds a scene of shapes with large coordinate/index arrays, stores
+it as a memory-mapped scene (loaders.mmscene) and as a gzipped pickle
+of the same node/field table and array data (live scenegraphs hold
+weak references, which gzpickle cannot pickle), then reports the time
+to load each (until the scenegraph is available) and then to
+read every array.  No OpenGL context is required.
+
+Note that the files were just written, so are likely in the
+operating system's page cache, the comparison measures decompression
+and unpickling rather than disk reads.
+
+    benchmark_sceneload.py [shapeCount] [pointsPerShape]
+'''
+from __future__ import print_function
+import sys, os, time, tempfile, shutil
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.loaders import mmscene, gzpickle
+
+def buildScene( count, points ):
+    """Create count shapes each with points coordinates (and twice as many indices)"""
+    children = []
+    for i in range( count ):
+        point = (arange( points*3, dtype='f' ).reshape( (-1,3) ) + i) * .001
+        children.append( Transform(
+            translation = (i,0,0),
+            children = [Shape(
+                geometry = IndexedFaceSet(
+                    coord = Coordinate( point=point ),
+                    coordIndex = (arange( points*2 ) % points).astype( 'i' ),
+                ),
+                appearance = Appearance( material=Material() ),
+            )],
+        ))
+    return sceneGraph( children=children )
+
+def arrays( scene ):
+    """Yield the scene's coordinate and index arrays"""
+    for transform in scene.children:
+        geometry = transform.children[0].geometry
+        yield geometry.coord.point
+        yield geometry.coordIndex
+
+def loadPickle( filename ):
+    header,data = gzpickle.load( filename )
+    return mmscene.Reader( header, frombuffer( data, 'B' )).build()
+
+def main():
+    count = int( (sys.argv[1:2] or [200])[0] )
+    points = int( (sys.argv[2:3] or [20000])[0] )
+    directory = tempfile.mkdtemp()
+    try:
+        scene = buildScene( count, points )
+        mapped = os.path.join( directory, 'scene.mmscene' )
+        pickled = os.path.join( directory, 'scene.pkl.gz' )
+        mmscene.dump( scene, mapped )
+        writer = mmscene.Writer()
+        header = writer.table( scene )
+        data = zeros( writer.size, 'B' )
+        for offset,value in writer.buffers:
+            data[offset:offset+value.nbytes] = frombuffer( value.tobytes(), 'B' )
+        gzpickle.dump( (header,data.tobytes()), pickled )
+        print( 'Shapes: %s points each: %s'%(count,points) )
+        for name,filename,function in (
+            ('gzpickle',pickled,loadPickle),
+            ('mmscene',mapped,mmscene.load),
+        ):
+            t = time.time()
+            loaded = function( filename )
+            loadTime = time.time() - t
+            total = 0.0
+            for array in arrays( loaded ):
+                total += float( array.sum() )
+            touchTime = time.time() - t
+            print( '%-9s %6.1fMB load %8.1fms all arrays read %8.1fms'%(
+                name, os.path.getsize( filename )/(1024.*1024),
+                loadTime*1000, touchTime*1000,
+            ))
+    finally:
+        shutil.rmtree( directory )
+
+if __name__ == "__main__":
+    main()
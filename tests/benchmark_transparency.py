@@ -0,0 +1,112 @@
+#! /usr/bin/env python
+'''CPU benchmark comparing sorted and weighted blended transparency
+
+Builds a (non-rendered) scene of transparent triangle meshes and
+times the CPU work of a frame's transparent rendering as the viewer
+orbits the scene:
+
+    full -- per-frame shape sort plus a full per-triangle argsort
+        (the original ArrayGeometry.drawTransparent behaviour)
+    sorted -- per-frame shape sort plus polygonsort.IncrementalSorter
+        (the default, sorted, transparency mode)
+    weighted -- weighted blended order-independent transparency
+        (ContextDefinition.transparencyMode='weighted'), which needs
+        neither sort
+
+The GL work (and the extra composite pass of the weighted mode) is
+not included.  No OpenGL context is required.
+
+    benchmark_transparency.py [shapeCount] [trianglesPerShape] [frames]
+'''
+from __future__ import print_function
+import sys, time
+from math import sin, cos
+from OpenGLContext.arrays import *
+from OpenGLContext.scenegraph.basenodes import *
+from OpenGLContext.scenegraph import polygonsort
+from OpenGLContext.passes import _flat
+from OpenGLContext.move import viewplatform
+from OpenGLContext import triangleutilities
+import random
+
+def buildScene( count, triangles, spread=20.0, seed=1 ):
+    """Create count transparent shapes, each with a random triangle soup
+
+    returns scene, {id(shape): (N*3,3) vertex array}
+    """
+    rng = random.Random( seed )
+    children = []
+    meshes = {}
+    for i in range( count ):
+        vertices = array( [
+            [rng.uniform(-1,1) for j in range(3)]
+            for k in range( triangles*3 )
+        ], 'f' )
+        shape = Shape(
+            geometry = Box(),
+            appearance = Appearance( material = Material( transparency=.5 )),
+        )
+        meshes[id(shape)] = vertices
+        children.append( Transform(
+            translation = [rng.uniform(-spread,spread) for j in range(3)],
+            children = [shape],
+        ))
+    return sceneGraph( children = children ), meshes
+
+def setupPass( scene ):
+    """Create a FlatPass for the scene without a rendering context"""
+    vp = viewplatform.ViewPlatform()
+    flat = _flat.FlatPass( scene, [] )
+    flat.viewport = (0,0,300,300)
+    return flat, vp
+
+def timeFrames( flat, vp, meshes, frames, mode ):
+    """Time frames of the transparent path in mode (full, sorted or weighted)"""
+    flat.sortTransparent = mode != 'weighted'
+    sorters = {}
+    centers = dict([
+        (key, triangleutilities.centers( mesh )) for key,mesh in meshes.items()
+    ])
+    t = time.time()
+    for frame in range( frames ):
+        angle = frame * .01
+        vp.setPosition( (sin( angle )*60, 0, cos( angle )*60) )
+        vp.setOrientation( (0,1,0,angle) )
+        flat.setViewPlatform( vp )
+        flat.calculateFrustum()
+        toRender = flat.renderSet( flat.getModelView() )
+        projection = flat.getProjection()
+        for key,mvmatrix,tmatrix,bvolume,path in toRender:
+            if not key[0] or mode == 'weighted':
+                continue
+            mesh = id(path[-1])
+            if mode == 'full':
+                polygonsort.indices( polygonsort.distances(
+                    centers[mesh], modelView=mvmatrix, projection=projection,
+                    viewport=flat.viewport,
+                ))
+            else:
+                sorter = sorters.get( mesh )
+                if sorter is None:
+                    sorter = sorters[mesh] = polygonsort.IncrementalSorter(
+                        centers[mesh], arange( len(meshes[mesh]) ),
+                    )
+                sorter.sort( mvmatrix, projection, flat.viewport )
+    return (time.time()-t)/frames
+
+def main():
+    count = int( (sys.argv[1:2] or [50])[0] )
+    triangles = int( (sys.argv[2:3] or [5000])[0] )
+    frames = int( (sys.argv[3:4] or [20])[0] )
+    scene, meshes = buildScene( count, triangles )
+    flat, vp = setupPass( scene )
+    print( 'Transparent shapes: %s triangles each: %s frames: %s'%(
+        count, triangles, frames,
+    ))
+    for mode in ('full','sorted','weighted'):
+        print( '%-9s %8.2fms/frame'%(
+            mode, timeFrames( flat, vp, meshes, frames, mode )*1000,
+        ))
+
+if __name__ == "__main__":
+    main()